@@ -0,0 +1,91 @@
+# Per-point cost of alert rule evaluation with 10,000 rules over a 10,000 computer fleet: one
+# rule per computer on its own series, with and without a few rules on every computer, for the
+# simulation's batches and for ingest-style batches of random points with their own timestamps.
+# Run from backend/: python -m benchmarks.alerts
+import time
+
+import numpy as np
+
+from models.alert_rule import AlertRule
+from models.metric_batch import MetricBatch
+from services.alert_engine import AlertEngine
+from services.fleet_simulator import FleetSimulator, fleet_computer_ids
+
+FLEET_SIZE = 10_000
+RULES = 10_000
+TICKS = 50
+INGEST_BATCHES = 50
+INGEST_POINTS = 5_000
+
+
+def make_rules(batch: MetricBatch, fleet_wide: int) -> list:
+    # Per computer rules on fidelity and error rate around the computer's current value, so that
+    # a good share of them fires and resolves as values move
+    values = batch.values.reshape(len(batch.metric_names), len(batch.computer_ids))
+    fidelity = values[batch.metric_names.index("qubit_fidelity")]
+    error = values[batch.metric_names.index("gate_error_rate")]
+    rules = []
+    for rule_id in range(RULES - fleet_wide):
+        computer = rule_id % len(batch.computer_ids)
+        if rule_id < len(batch.computer_ids):
+            rule = dict(metric_name="qubit_fidelity", operator="<", threshold=float(fidelity[computer]), for_samples=3)
+        else:
+            rule = dict(metric_name="gate_error_rate", operator=">", threshold=float(error[computer]), hysteresis=0.01)
+        rules.append(AlertRule(id=rule_id, name=f"rule {rule_id}", computer_id=batch.computer_ids[computer], **rule))
+    for rule_id in range(RULES - fleet_wide, RULES):
+        rules.append(AlertRule(id=rule_id, name=f"fleet rule {rule_id}", metric_name="temperature", operator=">",
+                               threshold=20.0 + rule_id % 10))
+    return rules
+
+
+def ingest_batches(batch: MetricBatch) -> list:
+    rng = np.random.default_rng(0)
+    batches = []
+    for index in range(INGEST_BATCHES):
+        rows = rng.integers(0, len(batch.values), INGEST_POINTS)
+        timestamps = batch.timestamp_ns + index * 1_000_000_000 + rng.integers(0, 1_000_000_000, INGEST_POINTS)
+        batches.append(MetricBatch.from_rows(
+            batch.computer_ids, batch.metric_names, batch.computer_index[rows], batch.metric_index[rows],
+            batch.values[rows] * rng.normal(1.0, 0.01, INGEST_POINTS), timestamps
+        ))
+    return batches
+
+
+def run(fleet_wide: int) -> None:
+    fleet = FleetSimulator(fleet_computer_ids(FLEET_SIZE))
+    batches = [fleet.generate_all_metrics() for _ in range(TICKS)]
+    engine = AlertEngine(cooldown_seconds=0)
+    started = time.perf_counter()
+    engine.replace(make_rules(batches[0], fleet_wide))
+    compiled = time.perf_counter() - started
+
+    # The first batch pairs its series with their rules, which is paid once per batch shape
+    started = time.perf_counter()
+    engine.observe(batches[0])
+    paired = time.perf_counter() - started
+    started = time.perf_counter_ns()
+    for batch in batches[1:]:
+        engine.observe(batch)
+    elapsed = time.perf_counter_ns() - started
+    points = sum(len(batch) for batch in batches[1:])
+
+    ingest = ingest_batches(batches[-1])
+    started = time.perf_counter_ns()
+    for batch in ingest:
+        engine.observe(batch)
+    ingest_elapsed = time.perf_counter_ns() - started
+
+    stats = engine.stats()
+    print(f"  {RULES} rules, {fleet_wide:>2} on every computer: compiled in {compiled * 1000:.0f} ms, "
+          f"first batch {paired * 1000:.0f} ms, {stats['instances']} instances")
+    print(f"    simulation {elapsed / points:7.1f} ns/point  {elapsed / (TICKS - 1) / 1e6:7.3f} ms/tick  "
+          f"{points / elapsed * 1e9:12,.0f} points/s")
+    print(f"    ingest     {ingest_elapsed / (INGEST_BATCHES * INGEST_POINTS):7.1f} ns/point  "
+          f"{INGEST_BATCHES * INGEST_POINTS / ingest_elapsed * 1e9:12,.0f} points/s")
+    print(f"    {stats['evaluated_pairs']:,} pairs evaluated, {stats['fired']} fired, {stats['resolved']} resolved")
+
+
+if __name__ == "__main__":
+    print(f"{FLEET_SIZE} computers, {TICKS} simulation ticks, {INGEST_BATCHES} ingest batches of {INGEST_POINTS} points")
+    for fleet_wide in (0, 10):
+        run(fleet_wide)
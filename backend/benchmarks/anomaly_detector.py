@@ -0,0 +1,33 @@
+# Per-point cost of the anomaly detector at fleet scale.
+# Run from backend/: python -m benchmarks.anomaly_detector
+import time
+
+from services.anomaly_detector import AnomalyDetector
+from services.fleet_simulator import FleetSimulator, fleet_computer_ids
+
+TICKS = 200
+
+
+def run(fleet_size: int) -> None:
+    fleet = FleetSimulator(fleet_computer_ids(fleet_size))
+    batches = [fleet.generate_all_metrics() for _ in range(TICKS)]
+    detector = AnomalyDetector(max_series=fleet_size * len(batches[0].metric_names))
+
+    # The first batch builds the row lookup, which is paid once per batch shape
+    detector.observe(batches[0])
+    started = time.perf_counter_ns()
+    for batch in batches[1:]:
+        detector.observe(batch)
+    elapsed = time.perf_counter_ns() - started
+
+    points = sum(len(batch) for batch in batches[1:])
+    stats = detector.stats()
+    print(f"{fleet_size:>7} computers  {elapsed / points:8.1f} ns/point  "
+          f"{elapsed / (TICKS - 1) / 1e6:8.3f} ms/tick  "
+          f"{stats['spikes']} spikes, {stats['shifts']} shifts  "
+          f"{stats['state_bytes'] / 1024 / 1024:.1f} MiB state")
+
+
+if __name__ == "__main__":
+    for fleet_size in (100, 1_000, 10_000):
+        run(fleet_size)
@@ -0,0 +1,69 @@
+# Login latency and /auth/me throughput against a running API.
+# Run from backend/: python -m benchmarks.auth --url http://localhost:8000
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def request(url: str, body: dict = None, token: str = None) -> dict:
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, data, headers)) as response:
+        return json.loads(response.read())
+
+
+def timed(function, *args) -> float:
+    started = time.perf_counter()
+    try:
+        function(*args)
+    except urllib.error.HTTPError as e:
+        return -e.code
+    return time.perf_counter() - started
+
+
+def percentiles(latencies) -> str:
+    ok = np.array([latency for latency in latencies if latency >= 0]) * 1000
+    failed = len(latencies) - len(ok)
+    if not len(ok):
+        return f"all {failed} failed"
+    return f"p50 {np.percentile(ok, 50):7.1f} ms  p99 {np.percentile(ok, 99):7.1f} ms  failed {failed}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--me", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    api = args.url.rstrip("/") + "/api"
+
+    name = uuid.uuid4().hex[:12]
+    credentials = {"email": f"{name}@example.com", "password": "benchmark-password"}
+    token = request(f"{api}/auth/register", {**credentials, "name": name, "username": name})["token"]
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        # Logins, with health checks alongside to show whether other routes keep up
+        logins = [pool.submit(timed, request, f"{api}/auth/login", credentials) for _ in range(args.logins)]
+        checks = []
+        while not all(login.done() for login in logins):
+            checks.append(timed(request, f"{args.url.rstrip('/')}/"))
+        print(f"login       x{args.logins:<6} {percentiles([login.result() for login in logins])}")
+        print(f"  GET / during logins x{len(checks):<4} {percentiles(checks)}")
+
+        started = time.perf_counter()
+        me = list(pool.map(lambda _: timed(request, f"{api}/auth/me", None, token), range(args.me)))
+        elapsed = time.perf_counter() - started
+        print(f"/auth/me    x{args.me:<6} {percentiles(me)}  {args.me / elapsed:8.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# User lookups at increasing concurrency, sync sessions in worker threads against async sessions
+# on the event loop. Uses DATABASE_URL when set, a throwaway SQLite file otherwise.
+# Run from backend/: python -m benchmarks.database
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from models.user import Base, User
+from services.postgres_db import async_url, engine_options
+from services.user_service import get_user_by_username, get_user_by_username_async
+
+USERS = 1000
+LOOKUPS = 4000
+
+
+async def loop_lag(stop: asyncio.Event, lags: list) -> None:
+    # How late the event loop wakes a 1 ms sleeper while the lookups run
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def run(mode: str, lookup, concurrency: int) -> None:
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with slots:
+            started = time.perf_counter()
+            user = await lookup(f"user{i % USERS}")
+            latencies.append(time.perf_counter() - started)
+            assert user is not None
+
+    stop = asyncio.Event()
+    lags = []
+    lagger = asyncio.create_task(loop_lag(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(LOOKUPS)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lagger
+
+    latencies = np.array(latencies) * 1000
+    print(f"{mode:>5} x{concurrency:<4} {LOOKUPS / elapsed:9.1f} lookups/s  "
+          f"p50 {np.percentile(latencies, 50):7.2f} ms  p99 {np.percentile(latencies, 99):7.2f} ms  "
+          f"loop lag p99 {np.percentile(np.array(lags) * 1000, 99):6.2f} ms")
+
+
+async def main():
+    url = os.getenv("DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp()}/benchmark.db"
+    print(f"database: {url.split('@')[-1]}")
+
+    engine = create_engine(url, **engine_options(url, False))
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.query(User).filter(User.username.like("user%")).delete(synchronize_session=False)
+        db.add_all(
+            User(email=f"user{i}@example.com", username=f"user{i}", hashed_password="x")
+            for i in range(USERS)
+        )
+        db.commit()
+
+    async_engine = create_async_engine(async_url(url), **engine_options(url, True))
+    AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def sync_lookup(username: str):
+        def load():
+            with Session() as db:
+                return get_user_by_username(db, username)
+        return await asyncio.to_thread(load)
+
+    async def async_lookup(username: str):
+        async with AsyncSession() as db:
+            return await get_user_by_username_async(db, username)
+
+    for concurrency in (1, 8, 32, 128):
+        await run("sync", sync_lookup, concurrency)
+        await run("async", async_lookup, concurrency)
+
+    await async_engine.dispose()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
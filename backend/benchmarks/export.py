@@ -0,0 +1,58 @@
+# Rows/sec and peak memory of GET /api/export's encoding loop, reading from the fake InfluxDB's
+# query endpoint (benchmarks.fake_influxdb), which runs in the same process and shares the CPU.
+# Each export runs twice, timed and then under tracemalloc for its peak memory, which should
+# not grow with the range.
+# Run from backend/: python -m benchmarks.export
+import time
+import tracemalloc
+
+from benchmarks.fake_influxdb import FakeInfluxDB
+from models.metric import METRIC_NAMES
+from services.fleet_simulator import fleet_computer_ids
+from services.influxdb_service import InfluxDBService
+from services.metrics_export import MetricsExport, MetricsExportService
+
+NS_PER_HOUR = 3600 * 10 ** 9
+START_NS = 1_735_689_600 * 10 ** 9
+
+
+def export_all(exports: MetricsExportService, computer_ids, hours: int, export_format: str) -> MetricsExport:
+    export = exports.create(computer_ids, list(METRIC_NAMES), START_NS, START_NS + hours * NS_PER_HOUR, export_format)
+    try:
+        export.start()
+        while export.next_chunk() is not None:
+            pass
+    finally:
+        exports.release(export)
+    return export
+
+
+def run(exports: MetricsExportService, computer_ids, hours: int, export_format: str) -> None:
+    started = time.perf_counter()
+    export = export_all(exports, computer_ids, hours, export_format)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    export_all(exports, computer_ids, hours, export_format)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"  {export_format:<8} {hours:3d} h  {export.rows:10,d} rows  {export.rows / elapsed:9.0f} rows/s"
+        f"  {export.bytes / export.rows:6.2f} bytes/row  peak {peak / 2 ** 20:7.1f} MiB"
+    )
+
+
+def main():
+    computer_ids = fleet_computer_ids(10)
+    with FakeInfluxDB(query_interval_ms=1000) as fake:
+        service = InfluxDBService(fake.url, "benchmark", "benchmark", "benchmark")
+        exports = MetricsExportService(service, batch_rows=100_000, window_seconds=3600)
+        print(f"{len(computer_ids)} computers, {len(METRIC_NAMES)} metrics, one point per second")
+        for hours in (1, 4):
+            for export_format in ("arrow", "parquet"):
+                run(exports, computer_ids, hours, export_format)
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# Stand-in for InfluxDB's write endpoint. POST /api/v2/write is answered with 204 after
+# the body (gzip or plain) has been read and its lines counted; /ping and /health answer
+# too. latency_ms holds every write back that long, as a slow server would.
+# POST /api/v2/query answers the raw queries of InfluxDBService.query_rows with one value
+# every query_interval_ms per series in the queried range, streamed as annotated CSV.
+# Run from backend/: python -m benchmarks.fake_influxdb --port 8086
+import argparse
+import gzip
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional
+
+CSV_HEADER = (
+    b"#datatype,string,long,dateTime:RFC3339,double,string,string\r\n"
+    b"#group,false,false,false,false,true,true\r\n"
+    b"#default,_result,,,,,\r\n"
+    b",result,table,_time,_value,_measurement,computer_id\r\n"
+)
+
+# Computers answered for queries that do not filter by computer
+DEFAULT_QUERY_COMPUTERS = ["qc-001", "qc-002", "qc-003"]
+
+
+class FakeInfluxDB:
+    def __init__(
+            self,
+            host: str = "127.0.0.1",
+            port: int = 0,
+            latency_ms: float = 0.0,
+            query_interval_ms: float = 1000.0
+    ):
+        self.latency = latency_ms / 1000.0
+        self.query_interval_ns = int(query_interval_ms * 1_000_000)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+        self.reset()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeInfluxDB":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests = 0
+            self.lines = 0
+            self.wire_bytes = 0
+            self.body_bytes = 0
+            self.queries = 0
+            self.query_rows = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "lines": self.lines,
+                "wire_bytes": self.wire_bytes,
+                "body_bytes": self.body_bytes,
+                "queries": self.queries,
+                "query_rows": self.query_rows
+            }
+
+    def record(self, wire_bytes: int, body: bytes) -> None:
+        lines = body.count(b"\n") + (1 if body and not body.endswith(b"\n") else 0)
+        with self._lock:
+            self.requests += 1
+            self.lines += lines
+            self.wire_bytes += wire_bytes
+            self.body_bytes += len(body)
+
+    def query_csv(self, query: str) -> Iterator[bytes]:
+        # Table per series, rows every query_interval_ns from the first aligned time in range
+        start_ns, stop_ns = (int(value) for value in re.findall(r"time\(v: (-?\d+)\)", query)[:2])
+        metric_names = re.findall(r'r\._measurement == "([^"]+)"', query)
+        computer_ids = re.findall(r'r\.computer_id == "([^"]+)"', query) or DEFAULT_QUERY_COMPUTERS
+        interval = self.query_interval_ns
+        first_ns = -(-start_ns // interval) * interval
+        timestamps = [
+            datetime.fromtimestamp(timestamp_ns / 1e9, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            for timestamp_ns in range(first_ns, stop_ns, interval)
+        ]
+
+        with self._lock:
+            self.queries += 1
+        yield CSV_HEADER
+        table = 0
+        for metric_name in metric_names:
+            for computer_id in computer_ids:
+                suffix = f",{metric_name},{computer_id}\r\n"
+                prefix = f",,{table},"
+                rows: List[str] = [f"{prefix}{timestamp},{index * 0.5}{suffix}" for index, timestamp in enumerate(timestamps)]
+                table += 1
+                with self._lock:
+                    self.query_rows += len(rows)
+                yield "".join(rows).encode()
+        yield b"\r\n"
+
+    def __enter__(self) -> "FakeInfluxDB":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def _handler_for(server: FakeInfluxDB):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so clients reuse their pooled connections as they would with InfluxDB
+        protocol_version = "HTTP/1.1"
+
+        def handle(self):
+            try:
+                super().handle()
+            except ConnectionResetError:
+                pass
+
+        def do_POST(self):
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.startswith("/api/v2/query"):
+                self._stream(server.query_csv(json.loads(data)["query"]))
+                return
+            if not self.path.startswith("/api/v2/write"):
+                self._reply(404)
+                return
+
+            body = gzip.decompress(data) if self.headers.get("Content-Encoding") == "gzip" else data
+            server.record(len(data), body)
+            if server.latency:
+                time.sleep(server.latency)
+            self._reply(204)
+
+        def do_GET(self):
+            if self.path.startswith("/ping"):
+                self._reply(204)
+            elif self.path.startswith("/health"):
+                self._reply(200, b'{"name":"influxdb","status":"pass"}')
+            else:
+                self._reply(404)
+
+        def _reply(self, status: int, body: bytes = b"") -> None:
+            self.send_response(status)
+            if body:
+                self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self, chunks: Iterator[bytes]) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for chunk in chunks:
+                    if chunk:
+                        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # The client closed the response early
+                self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--query-interval-ms", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    fake = FakeInfluxDB(args.host, args.port, args.latency_ms, args.query_interval_ms)
+    print(f"Fake InfluxDB listening on {fake.url}")
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        print(fake.stats())
@@ -0,0 +1,78 @@
+# Requests/sec of the fleet listing and simulation status, served the old way (response_model
+# validation and JSONResponse on every request) against the cached bodies, with and without
+# If-None-Match. In process through httpx's ASGI transport, so only the app is measured.
+# Run from backend/: python -m benchmarks.fleet_endpoints
+# (set DATABASE_URL=sqlite:///./benchmark.db if asyncpg is not installed; the database is not used)
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Union
+
+import httpx
+from fastapi import FastAPI
+
+from models.quantum_computer import QuantumComputer
+from routers import quantum_computers, simulation
+from services.fleet_registry import FleetRegistry, seed_record
+from services.fleet_simulator import FleetSimulator, fleet_computer_ids
+from services.hot_tier import HotTierStore
+
+REQUESTS = 2000
+
+
+def build_app(fleet_size: int) -> FastAPI:
+    registry = FleetRegistry()
+    registry.replace([seed_record(computer_id) for computer_id in fleet_computer_ids(fleet_size)])
+    hot_tier = HotTierStore()
+    fleet = FleetSimulator(registry.computer_ids(), profiles=list(registry.profiles().values()))
+    hot_tier.append(fleet.generate_all_metrics(datetime.now(timezone.utc)))
+    quantum_computers.set_fleet_registry(registry)
+    quantum_computers.set_hot_tier(hot_tier)
+
+    app = FastAPI()
+    app.include_router(quantum_computers.router, prefix="/api")
+    app.include_router(simulation.router, prefix="/api")
+
+    # The handlers as they were before the response cache
+    @app.get("/before/quantum-computers", response_model=List[QuantumComputer])
+    async def before_quantum_computers(limit: int = 100):
+        computers, _, _ = registry.page(None, limit)
+        return [quantum_computers.with_live_status(computer) for computer in computers]
+
+    @app.get("/before/status")
+    async def before_status() -> Dict[str, Union[bool, int]]:
+        return {"running": simulation.simulation_state["running"], "errors": simulation.simulation_state["errors"]}
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, label: str, url: str, conditional: bool = False) -> None:
+    headers = {}
+    if conditional:
+        headers["If-None-Match"] = (await client.get(url)).headers["ETag"]
+
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        response = await client.get(url, headers=headers)
+        assert response.status_code == (304 if conditional else 200), response.status_code
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<28} {REQUESTS / elapsed:9.0f} req/s  {len(response.content):8d} bytes")
+
+
+async def main():
+    for fleet_size, limit in ((3, 100), (1000, 100), (1000, 1000)):
+        app = build_app(fleet_size)
+        print(f"{fleet_size} computers, limit {limit}")
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            await measure(client, "list before", f"/before/quantum-computers?limit={limit}")
+            await measure(client, "list cached", f"/api/quantum-computers?limit={limit}")
+            await measure(client, "list cached, 304", f"/api/quantum-computers?limit={limit}", conditional=True)
+            if fleet_size == 3:
+                await measure(client, "status before", "/before/status")
+                await measure(client, "status cached", "/api/simulation/status")
+                await measure(client, "status cached, 304", "/api/simulation/status", conditional=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,120 @@
+# Points/sec of POST /api/metrics/ingest per body format: parsing and validating alone, then
+# parsed, published over the full write path (hot tier, stream hub, anomaly detector, rollups,
+# fleet summary) and flushed to the fake InfluxDB (benchmarks.fake_influxdb), which shares the CPU.
+# Run from backend/: python -m benchmarks.ingest
+import asyncio
+import time
+
+import msgpack
+import orjson
+
+from benchmarks.fake_influxdb import FakeInfluxDB
+from models.metric import METRIC_NAMES
+from services.anomaly_detector import AnomalyDetector
+from services.fleet_registry import FleetRegistry, seed_record
+from services.fleet_summary import FleetSummary
+from services.fleet_simulator import fleet_computer_ids
+from services.hot_tier import HotTierStore
+from services.influxdb_service import InfluxDBService
+from services.metric_ingest import MetricIngestService
+from services.rollups import RollupEngine
+from services.stream_hub import StreamHub
+from services.write_path import MetricsWritePath
+from services.write_pipeline import MetricWritePipeline
+
+COMPUTERS = 1000
+SAMPLES = 17
+START_MS = 1_735_689_600_000
+
+
+def points():
+    # One sample per second for every computer and metric, 102,000 points
+    for sample in range(SAMPLES):
+        timestamp_ms = START_MS + sample * 1000
+        for computer_id in fleet_computer_ids(COMPUTERS):
+            for offset, metric_name in enumerate(METRIC_NAMES):
+                yield computer_id, metric_name, 0.5 + (sample * 7 + offset) % 13 / 100, timestamp_ms
+
+
+def bodies() -> dict:
+    rows = list(points())
+    line_protocol = "\n".join(
+        f"{metric_name},computer_id={computer_id} value={value} {timestamp_ms}"
+        for computer_id, metric_name, value, timestamp_ms in rows
+    ).encode()
+    ndjson = b"\n".join(
+        orjson.dumps({"computer_id": computer_id, "metric_name": metric_name, "value": value, "timestamp": timestamp_ms})
+        for computer_id, metric_name, value, timestamp_ms in rows
+    )
+    columnar = msgpack.packb({
+        "computer_id": [row[0] for row in rows],
+        "metric_name": [row[1] for row in rows],
+        "value": [row[2] for row in rows],
+        "timestamp": [row[3] for row in rows]
+    })
+    return {"line_protocol": line_protocol, "ndjson": ndjson, "msgpack": columnar}
+
+
+def new_service() -> MetricIngestService:
+    registry = FleetRegistry()
+    registry.replace([seed_record(computer_id) for computer_id in fleet_computer_ids(COMPUTERS)])
+    # Timestamps are in the past, so any now_ns accepts them; no rate limit
+    return MetricIngestService(registry, rate_points_per_second=0)
+
+
+def bench_parse(service: MetricIngestService, ingest_format: str, body: bytes, repeats: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        batch, report = service.parse(body, ingest_format, "ms")
+        best = min(best, time.perf_counter() - started)
+    assert report["rejected"] == 0, report
+    return len(batch) / best
+
+
+async def bench_write_path(fake: FakeInfluxDB, service: MetricIngestService, ingest_format: str, body: bytes) -> float:
+    # Like the router: parse in a worker thread, publish in pipeline-sized slices, then wait
+    # until every point reached InfluxDB
+    influxdb_service = InfluxDBService(fake.url, "benchmark", "benchmark", "benchmark", write_mode="line_protocol")
+    pipeline = MetricWritePipeline(influxdb_service, max_queue_points=200_000, batch_size=5_000, linger_ms=50)
+    series = COMPUTERS * len(METRIC_NAMES)
+    write_path = MetricsWritePath(
+        pipeline,
+        HotTierStore(max_series=series),
+        StreamHub(),
+        AnomalyDetector(max_series=series),
+        RollupEngine(max_series=series),
+        FleetSummary(max_computers=COMPUTERS)
+    )
+    pipeline.start()
+    write_path.start()
+
+    started = time.perf_counter()
+    batch, _ = await asyncio.to_thread(service.parse, body, ingest_format, "ms")
+    for start in range(0, len(batch), pipeline.batch_size):
+        await write_path.publish(batch.slice(start, start + pipeline.batch_size))
+        await asyncio.sleep(0)
+    await pipeline.close()
+    elapsed = time.perf_counter() - started
+
+    await write_path.close()
+    influxdb_service.close()
+    assert pipeline.flushed_points == len(batch), pipeline.flushed_points
+    return len(batch) / elapsed
+
+
+def main():
+    service = new_service()
+    print(f"{COMPUTERS} computers, {len(METRIC_NAMES)} metrics, {SAMPLES} samples per request")
+    with FakeInfluxDB() as fake:
+        for ingest_format, body in bodies().items():
+            parse_rate = bench_parse(service, ingest_format, body)
+            write_rate = asyncio.run(bench_write_path(fake, service, ingest_format, body))
+            print(
+                f"  {ingest_format:<14} {len(body) / 2 ** 20:6.1f} MiB  parse {parse_rate:10.0f} points/s"
+                f"  end to end {write_rate:10.0f} points/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# Cost and write volume of per-qubit telemetry: stepping the float32 state of every qubit and
+# coupler, and encoding one tick as packed lines (one per computer) or as per-qubit series, for
+# the three seeded profiles (127, 433 and 1000 qubits) and for 100 computers of 1000 qubits.
+# Run from backend/: python -m benchmarks.qubit_telemetry
+import time
+
+from services.qubit_telemetry import QubitTelemetry
+from services.simulator import COMPUTER_PROFILES
+
+TICKS = 20
+
+
+def run(label: str, computer_ids: list, profiles: list) -> None:
+    telemetry = QubitTelemetry(computer_ids, seed=0, profiles=profiles)
+    timestamp_ns = time.time_ns()
+
+    started = time.perf_counter()
+    for _ in range(TICKS):
+        values = telemetry.step()
+    step_ms = (time.perf_counter() - started) / TICKS * 1000
+
+    timings = {}
+    sizes = {}
+    for mode, encode in (("packed", telemetry.encode_packed), ("series", telemetry.encode_series)):
+        data = encode(values, timestamp_ns)
+        started = time.perf_counter()
+        for _ in range(TICKS):
+            data = encode(values, timestamp_ns)
+        timings[mode] = (time.perf_counter() - started) / TICKS * 1000
+        sizes[mode] = len(data)
+
+    stats = telemetry.stats()
+    print(f"{label}: {stats['qubits']:,} qubits, {stats['couplers']:,} couplers, state {stats['state_bytes'] / 1024:,.0f} KiB")
+    print(f"  step    {step_ms:8.2f} ms/tick")
+    for mode in ("packed", "series"):
+        lines = len(computer_ids) if mode == "packed" else stats["qubits"] * 3 + stats["couplers"]
+        print(f"  {mode:<7} {timings[mode]:8.2f} ms/tick  {sizes[mode] / 1024:10,.1f} KiB/tick  {lines:>9,} lines/tick")
+    print(f"  packed writes {sizes['series'] / sizes['packed']:.1f}x fewer bytes")
+
+
+if __name__ == "__main__":
+    run("3 profiles", list(COMPUTER_PROFILES), list(COMPUTER_PROFILES.values()))
+    large = [f"qc-{i:03d}" for i in range(1, 101)]
+    run("100 x 1000 qubits", large, [COMPUTER_PROFILES["qc-003"]] * len(large))
@@ -0,0 +1,68 @@
+# Fairness of the shared session scheduler under overload: a few large sessions and many small
+# ones asking for more than SESSION_MAX_POINTS_PER_SECOND together, run in real time. Reports the
+# rate each kind of session asked for and got, and what a scheduler tick costs. Batches are
+# counted instead of written, so this measures the scheduler and the simulation only.
+# Run from backend/: python -m benchmarks.simulation_sessions
+import asyncio
+import time
+
+from services.fleet_simulator import fleet_computer_ids
+from services.simulation_sessions import SimulationSessions
+
+MAX_POINTS_PER_SECOND = 100_000
+SECONDS = 10.0
+LARGE_SESSIONS = 3
+LARGE_COMPUTERS = 10_000
+SMALL_SESSIONS = 30
+SMALL_COMPUTERS = 20
+
+
+class CountingWritePath:
+    def __init__(self):
+        self.points = 0
+
+    async def publish_session(self, batch) -> None:
+        self.points += len(batch)
+
+    def forget_session(self, session_id: str) -> None:
+        pass
+
+
+async def main() -> None:
+    sessions = SimulationSessions(
+        CountingWritePath(),
+        max_points_per_second=MAX_POINTS_PER_SECOND,
+        max_computers_per_user=LARGE_COMPUTERS
+    )
+    large = [
+        sessions.create(f"large-{index}", "large", fleet_computer_ids(LARGE_COMPUTERS), 1.0, index)
+        for index in range(LARGE_SESSIONS)
+    ]
+    small = [
+        sessions.create(f"small-{index}", "small", fleet_computer_ids(SMALL_COMPUTERS), 0.5, index)
+        for index in range(SMALL_SESSIONS)
+    ]
+    demand = sum(session.points_per_second for session in large + small)
+    print(f"{LARGE_SESSIONS} sessions of {LARGE_COMPUTERS} computers every 1s and {SMALL_SESSIONS} of "
+          f"{SMALL_COMPUTERS} every 0.5s: {demand:,.0f} points/s asked, {MAX_POINTS_PER_SECOND:,} allowed")
+
+    started = time.perf_counter()
+    sessions.start()
+    await asyncio.sleep(SECONDS)
+    await sessions.close()
+    elapsed = time.perf_counter() - started
+
+    for label, group in (("large", large), ("small", small)):
+        asked = sum(session.points_per_second for session in group)
+        got = sum(session.points for session in group) / elapsed
+        ticks = [session.ticks for session in group]
+        print(f"  {label}: asked {asked:10,.0f} points/s  got {got:10,.0f} points/s ({got / asked:6.1%})  "
+              f"ticks per session {min(ticks)}-{max(ticks)}, {sum(session.deferred_ticks for session in group)} deferred")
+
+    stats = sessions.stats()
+    print(f"  {stats['ticks']} scheduler ticks, {stats['points'] / elapsed:,.0f} points/s in all, "
+          f"last tick {stats['last_tick_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
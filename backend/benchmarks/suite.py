@@ -0,0 +1,281 @@
+# Benchmark suite for the write path: simulation throughput at 3/1k/100k computers,
+# serialization and writes against a local fake InfluxDB (benchmarks.fake_influxdb), and
+# event loop lag while the simulation runs. Results are saved as JSON; --baseline compares
+# against an earlier run and exits with 1 when a metric got worse by more than --tolerance.
+# Run from backend/: python -m benchmarks.suite [--quick] [--baseline results/old.json]
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.fake_influxdb import FakeInfluxDB
+from services.anomaly_detector import AnomalyDetector
+from services.fleet_summary import FleetSummary
+from services.fleet_simulator import FleetSimulator, fleet_computer_ids
+from services.hot_tier import HotTierStore
+from services.influxdb_service import InfluxDBService
+from services.line_protocol import LineProtocolEncoder
+from services.rollups import RollupEngine
+from services.scheduler import SimulationScheduler
+from services.simulator import QuantumSimulator
+from services.stream_hub import StreamHub
+from services.write_path import MetricsWritePath
+from services.write_pipeline import MetricWritePipeline
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+# Work per measurement is sized to take roughly this long
+TARGET_SECONDS = 1.0
+QUICK_TARGET_SECONDS = 0.2
+
+# Latencies that moved by less than this are noise, whatever the relative change
+MIN_MS_CHANGE = 1.0
+
+
+def timed(function: Callable[[], None], target_seconds: float, max_repeats: int = 10_000) -> tuple:
+    # Repeats function until target_seconds have passed, returns (repeats, seconds)
+    repeats = 0
+    started = time.perf_counter()
+    while True:
+        function()
+        repeats += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= target_seconds or repeats >= max_repeats:
+            return repeats, elapsed
+
+
+def bench_simulation(sizes: List[int], target_seconds: float) -> Dict[str, dict]:
+    results = {}
+    for size in sizes:
+        computer_ids = fleet_computer_ids(size)
+        rng = random.Random(0)
+        simulators = [QuantumSimulator(computer_id, rng) for computer_id in computer_ids]
+
+        def quantum_tick():
+            for simulator in simulators:
+                simulator.generate_all_metrics()
+
+        repeats, elapsed = timed(quantum_tick, target_seconds)
+        results[f"simulation/quantum_simulator/{size}"] = {
+            "metrics_per_second": repeats * size * 6 / elapsed,
+            "ms_per_tick": elapsed * 1000 / repeats
+        }
+
+        fleet = FleetSimulator(computer_ids, seed=0)
+        repeats, elapsed = timed(fleet.generate_all_metrics, target_seconds)
+        results[f"simulation/fleet_simulator/{size}"] = {
+            "metrics_per_second": repeats * size * 6 / elapsed,
+            "ms_per_tick": elapsed * 1000 / repeats
+        }
+    return results
+
+
+def bench_serialization(sizes: List[int], target_seconds: float) -> Dict[str, dict]:
+    results = {}
+    for size in sizes:
+        batch = FleetSimulator(fleet_computer_ids(size), seed=0).generate_all_metrics()
+        encoder = LineProtocolEncoder()
+        payload = encoder.encode_batches([batch])
+        repeats, elapsed = timed(lambda: encoder.encode_batches([batch]), target_seconds)
+        results[f"serialization/line_protocol/{size}"] = {
+            "points_per_second": repeats * len(batch) / elapsed,
+            "bytes_per_second": repeats * len(payload) / elapsed
+        }
+
+        if size <= 10_000:
+            metrics = batch.to_metrics()
+            payload = "\n".join(InfluxDBService.to_point(metric).to_line_protocol() for metric in metrics)
+
+            def points():
+                "\n".join(InfluxDBService.to_point(metric).to_line_protocol() for metric in metrics)
+
+            repeats, elapsed = timed(points, target_seconds)
+            results[f"serialization/point/{size}"] = {
+                "points_per_second": repeats * len(batch) / elapsed,
+                "bytes_per_second": repeats * len(payload.encode()) / elapsed
+            }
+    return results
+
+
+def bench_writes(fake: FakeInfluxDB, sizes: List[int], target_seconds: float) -> Dict[str, dict]:
+    results = {}
+    variants = (("line_protocol", False), ("line_protocol", True), ("point", False))
+    for size in sizes:
+        batch = FleetSimulator(fleet_computer_ids(size), seed=0).generate_all_metrics()
+        for write_mode, gzip in variants:
+            if write_mode == "point" and size > 10_000:
+                continue
+            service = InfluxDBService(fake.url, "benchmark", "benchmark", "benchmark", write_mode=write_mode, gzip=gzip)
+            service.write_metrics(batch)
+            fake.reset()
+            repeats, elapsed = timed(lambda: service.write_metrics(batch), target_seconds)
+            stats = fake.stats()
+            service.close()
+            assert stats["lines"] == repeats * len(batch), stats
+
+            name = write_mode + ("_gzip" if gzip else "")
+            results[f"writes/{name}/{size}"] = {
+                "points_per_second": stats["lines"] / elapsed,
+                "bytes_per_second": stats["wire_bytes"] / elapsed,
+                "ms_per_request": elapsed * 1000 / repeats
+            }
+    return results
+
+
+async def simulation_lag(fake: FakeInfluxDB, size: int, interval: float, seconds: float) -> dict:
+    # The simulation loop of routers.simulation over the full write path, with a 1 ms sleeper
+    # on the same event loop recording how late it wakes up
+    service = InfluxDBService(fake.url, "benchmark", "benchmark", "benchmark", write_mode="line_protocol")
+    pipeline = MetricWritePipeline(service, max_queue_points=max(100_000, size * 12), batch_size=5_000)
+    series = size * 6
+    write_path = MetricsWritePath(
+        pipeline,
+        HotTierStore(max_series=series),
+        StreamHub(),
+        AnomalyDetector(max_series=series),
+        RollupEngine(max_series=series),
+        FleetSummary(max_computers=size)
+    )
+    scheduler = SimulationScheduler(fleet_computer_ids(size), interval)
+    pipeline.start()
+    write_path.start()
+
+    running = True
+    lags = []
+
+    async def simulate():
+        while running:
+            for batch in scheduler.due_batches():
+                await write_path.publish(batch)
+            await scheduler.wait_next_tick()
+
+    async def sleeper():
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - started - 0.001)
+
+    tasks = [asyncio.create_task(simulate()), asyncio.create_task(sleeper())]
+    await asyncio.sleep(seconds)
+    running = False
+    await asyncio.gather(*tasks)
+    await write_path.close()
+    await pipeline.close()
+    service.close()
+
+    lags = np.array(lags) * 1000
+    stats = scheduler.stats()
+    return {
+        "loop_lag_p50_ms": float(np.percentile(lags, 50)),
+        "loop_lag_p99_ms": float(np.percentile(lags, 99)),
+        "loop_lag_max_ms": float(lags.max()),
+        "points_per_second": pipeline.flushed_points / seconds,
+        "late_ticks": stats["late_ticks"]
+    }
+
+
+def bench_event_loop(fake: FakeInfluxDB, sizes: List[int], seconds: float) -> Dict[str, dict]:
+    return {
+        f"event_loop/simulation/{size}": asyncio.run(simulation_lag(fake, size, 1.0, seconds))
+        for size in sizes
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def lower_is_better(metric: str) -> bool:
+    return metric.endswith("_ms") or metric == "late_ticks"
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    # Prints every metric both runs have and returns the ones that got worse beyond tolerance
+    regressions = []
+    for name, metrics in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        for metric, value in metrics.items():
+            if metric not in before or not before[metric]:
+                continue
+            change = value / before[metric] - 1
+            worse = change > tolerance if lower_is_better(metric) else change < -tolerance
+            if metric.endswith("_ms") and abs(value - before[metric]) < MIN_MS_CHANGE:
+                worse = False
+            flag = "  REGRESSION" if worse else ""
+            print(f"{name + ' ' + metric:<62} {before[metric]:14.2f} -> {value:14.2f} {change:+8.1%}{flag}")
+            if worse:
+                regressions.append(f"{name} {metric}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quick", action="store_true", help="smaller fleets and shorter runs")
+    parser.add_argument("--output", help=f"result file, default {RESULTS_DIR}/<time>.json")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative change, default 0.10")
+    args = parser.parse_args()
+
+    target_seconds = QUICK_TARGET_SECONDS if args.quick else TARGET_SECONDS
+    simulation_sizes = [3, 1_000] if args.quick else [3, 1_000, 100_000]
+    write_sizes = [1_000] if args.quick else [1_000, 100_000]
+    lag_sizes = [1_000] if args.quick else [1_000, 10_000]
+    lag_seconds = 3.0 if args.quick else 10.0
+
+    results = {}
+    with FakeInfluxDB() as fake:
+        for section, run in (
+                ("simulation", lambda: bench_simulation(simulation_sizes, target_seconds)),
+                ("serialization", lambda: bench_serialization(write_sizes, target_seconds)),
+                ("writes", lambda: bench_writes(fake, write_sizes, target_seconds)),
+                ("event loop", lambda: bench_event_loop(fake, lag_sizes, lag_seconds))
+        ):
+            print(f"Running {section} benchmarks...")
+            for name, metrics in run().items():
+                results[name] = metrics
+                print(f"  {name:<40} " + "  ".join(f"{metric} {value:,.2f}" for metric, value in metrics.items()))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick
+        },
+        "results": results
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(json.load(file), report, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,38 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from services.influxdb_service import InfluxDBService
-from services.postgres_db import init_db
-from routers import quantum_computers, simulation, auth
-from routers.simulation import set_influxdb_service, cleanup
+from services.write_pipeline import MetricWritePipeline
+from services.metrics_history import MetricsHistoryService
+from services.metrics_export import MetricsExportService
+from services.metric_ingest import MetricIngestService
+from services.hot_tier import HotTierStore
+from services.write_path import MetricsWritePath
+from services.stream_hub import StreamHub
+from services.anomaly_detector import AnomalyDetector
+from services.rollups import RollupEngine
+from services.fleet_summary import FleetSummary
+from services.alert_engine import AlertEngine
+from services.alert_rules import AlertRuleStore
+from services.backfill import BackfillService
+from services.sharded_simulation import ShardedSimulation, shard_spool_dirs
+from services.simulation_sessions import SimulationSessions
+from services.fleet_registry import FleetRegistry
+from services.postgres_db import init_db_async
+from services.auth_service import password_hasher, token_cache
+from services.instrumentation import metrics
+from services.request_metrics import RequestMetricsMiddleware
+from routers import quantum_computers, simulation, auth, stream, anomalies, database, export, ingest, fleet, alerts
+from routers import metrics as metrics_router
+from routers.simulation import set_write_path, set_backfill_service, set_sharded_simulation, simulation_intervals, cleanup
+from routers.simulation import set_fleet_registry as set_simulation_fleet_registry, simulation_fleet_size
+from routers.simulation import set_simulation_sessions
+from routers.quantum_computers import set_metrics_history_service, set_hot_tier, set_fleet_registry
+from routers.stream import set_stream_hub
+from routers.anomalies import set_anomaly_detector
+from routers.fleet import set_fleet_summary
+from routers.alerts import set_alert_rule_store, set_fleet_registry as set_alerts_fleet_registry
+from routers.export import set_metrics_export_service, set_fleet_registry as set_export_fleet_registry
+from routers.ingest import set_metric_ingest_service, set_write_path as set_ingest_write_path
 import os
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
@@ -11,24 +40,199 @@ import os
 
 load_dotenv()
 
-influxdb_service = InfluxDBService(
+# Shared with the simulation worker processes, which open their own clients and pipelines
+influxdb_settings = dict(
     url=os.getenv("INFLUXDB_URL", "http://localhost:8086"),
     token=os.getenv("INFLUXDB_TOKEN", "token"),
     org=os.getenv("INFLUXDB_ORG", "lrz"),
-    bucket=os.getenv("INFLUXDB_BUCKET", "quantum_metrics")
+    bucket=os.getenv("INFLUXDB_BUCKET", "quantum_metrics"),
+    write_mode=os.getenv("INFLUXDB_WRITE_MODE", "line_protocol"),
+    gzip=os.getenv("INFLUXDB_GZIP", "false").lower() == "true",
+    rollup_bucket=os.getenv("INFLUXDB_ROLLUP_BUCKET", "quantum_metrics_rollups") or None
 )
+
+write_pipeline_settings = dict(
+    max_queue_points=int(os.getenv("WRITE_QUEUE_MAX_POINTS", "100000")),
+    batch_size=int(os.getenv("WRITE_BATCH_SIZE", "5000")),
+    linger_ms=float(os.getenv("WRITE_LINGER_MS", "200")),
+    backpressure=os.getenv("WRITE_BACKPRESSURE", "block"),
+    spool_dir=os.getenv("WRITE_SPOOL_DIR"),
+    spool_max_bytes=int(os.getenv("WRITE_SPOOL_MAX_MB", "1024")) * 1024 * 1024,
+    spool_retention_seconds=float(os.getenv("WRITE_SPOOL_RETENTION_HOURS", "168")) * 3600,
+    replay_concurrency=int(os.getenv("WRITE_REPLAY_CONCURRENCY", "4"))
+)
+
+influxdb_service = InfluxDBService(**influxdb_settings)
 print(f"InfluxDB service created")
 
+write_pipeline = MetricWritePipeline(influxdb_service, **write_pipeline_settings)
+
+hot_tier = HotTierStore(
+    capacity=int(os.getenv("HOT_TIER_CAPACITY", "60")),
+    max_series=int(os.getenv("HOT_TIER_MAX_SERIES", "100000"))
+)
+
+stream_hub = StreamHub(
+    max_subscribers=int(os.getenv("STREAM_MAX_SUBSCRIBERS", "10000")),
+    max_pending_per_subscriber=int(os.getenv("STREAM_MAX_PENDING", "4096"))
+)
+
+# ANOMALY_DETECTION=false skips the detector stage on the write path
+anomaly_detector = AnomalyDetector(
+    max_series=int(os.getenv("ANOMALY_MAX_SERIES", "100000")),
+    alpha=float(os.getenv("ANOMALY_ALPHA", "0.2")),
+    threshold=float(os.getenv("ANOMALY_THRESHOLD", "6")),
+    cusum_h=float(os.getenv("ANOMALY_CUSUM_H", "20")),
+    max_anomalies=int(os.getenv("ANOMALY_RETAINED", "10000"))
+) if os.getenv("ANOMALY_DETECTION", "true").lower() == "true" else None
+
+rollup_grace_seconds = float(os.getenv("ROLLUP_GRACE_SECONDS", "30"))
+rollup_engine = RollupEngine(
+    grace_seconds=rollup_grace_seconds,
+    max_series=int(os.getenv("ROLLUP_MAX_SERIES", "100000")),
+    max_open_windows=int(os.getenv("ROLLUP_MAX_OPEN_WINDOWS", "4"))
+) if influxdb_service.rollup_bucket else None
+
+fleet_summary = FleetSummary(max_computers=int(os.getenv("FLEET_SUMMARY_MAX_COMPUTERS", "100000")))
+
+alert_engine = AlertEngine(
+    max_instances=int(os.getenv("ALERT_MAX_INSTANCES", "1000000")),
+    cooldown_seconds=float(os.getenv("ALERT_COOLDOWN_SECONDS", "300")),
+    max_events=int(os.getenv("ALERT_EVENTS_RETAINED", "10000"))
+)
+alert_rule_store = AlertRuleStore(alert_engine)
+
+write_path = MetricsWritePath(
+    write_pipeline, hot_tier, stream_hub, anomaly_detector, rollup_engine, fleet_summary, alert_engine,
+    max_qubit_writes=int(os.getenv("QUBIT_TELEMETRY_MAX_WRITES", "2"))
+)
+
+# SIMULATION_WORKERS=0 keeps the simulation in the API process
+simulation_workers = int(os.getenv("SIMULATION_WORKERS", "0"))
+sharded_simulation = ShardedSimulation(
+    write_path,
+    influxdb_settings,
+    write_pipeline_settings,
+    simulation_workers,
+    *simulation_intervals()
+) if simulation_workers > 0 else None
+
+# Per-user simulation scenarios, all on one shared scheduler
+simulation_sessions = SimulationSessions(
+    write_path,
+    tick_seconds=float(os.getenv("SESSION_TICK_SECONDS", "0.1")),
+    max_points_per_second=float(os.getenv("SESSION_MAX_POINTS_PER_SECOND", "500000")),
+    max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", "100")),
+    max_computers=int(os.getenv("SESSION_MAX_COMPUTERS", "100000")),
+    max_sessions_per_user=int(os.getenv("SESSION_MAX_PER_USER", "5")),
+    max_computers_per_user=int(os.getenv("SESSION_MAX_COMPUTERS_PER_USER", "10000"))
+)
+
+metrics_history_service = MetricsHistoryService(
+    influxdb_service,
+    bucket_seconds=int(os.getenv("HISTORY_BUCKET_SECONDS", "60")),
+    rollup_grace_seconds=rollup_grace_seconds
+)
+
+metrics_export_service = MetricsExportService(
+    influxdb_service,
+    batch_rows=int(os.getenv("EXPORT_BATCH_ROWS", "100000")),
+    window_seconds=int(float(os.getenv("EXPORT_WINDOW_HOURS", "6")) * 3600),
+    max_exports=int(os.getenv("EXPORT_MAX_CONCURRENT", "4"))
+)
+
+fleet_registry = FleetRegistry()
+
+metric_ingest_service = MetricIngestService(
+    fleet_registry,
+    max_body_bytes=int(os.getenv("INGEST_MAX_BODY_MB", "64")) * 1024 * 1024,
+    max_future_seconds=float(os.getenv("INGEST_MAX_FUTURE_SECONDS", "300")),
+    rate_points_per_second=float(os.getenv("INGEST_RATE_POINTS_PER_SECOND", "200000")),
+    burst_points=float(os.getenv("INGEST_BURST_POINTS", "1000000"))
+)
+
+backfill_service = BackfillService(
+    influxdb_service,
+    workers=int(os.getenv("BACKFILL_WORKERS", "0")) or None,
+    chunk_ticks=int(os.getenv("BACKFILL_CHUNK_TICKS", "10000")),
+    max_points=int(os.getenv("BACKFILL_MAX_POINTS", "1000000000"))
+)
+
+# Read from the services whenever /metrics is scraped
+metrics.gauge_callback("write_queue_points", "Points waiting in the write pipeline", lambda: write_pipeline.queue_depth)
+metrics.counter_callback(
+    "write_pipeline_points", "Points the write pipeline flushed, dropped, spilled or replayed",
+    lambda: {
+        ("flushed",): write_pipeline.flushed_points,
+        ("dropped",): write_pipeline.dropped_points,
+        ("spilled",): write_pipeline.spilled_points,
+        ("replayed",): write_pipeline.replayed_points
+    },
+    ("outcome",)
+)
+metrics.counter_callback("write_pipeline_failed_batches", "Batches the write pipeline failed to write", lambda: write_pipeline.failed_batches)
+metrics.gauge_callback("hot_tier_series", "Series held in the hot tier", lambda: hot_tier.stats()["series"])
+metrics.gauge_callback("stream_subscribers", "Connected live stream subscribers", lambda: stream_hub.subscriber_count)
+metrics.gauge_callback("fleet_computers", "Computers in the fleet registry", lambda: fleet_registry.size)
+metrics.counter_callback("fleet_summary_rebuilds", "Fleet leaderboards rebuilt from every computer", lambda: fleet_summary.rebuilds)
+metrics.gauge_callback("alert_rules", "Enabled alert rules", lambda: alert_engine.rules)
+metrics.gauge_callback("alerts_firing", "Alert rule instances firing", lambda: alert_engine.firing)
+metrics.counter_callback(
+    "alert_notifications", "Alert notifications by state, and firings held back by the cooldown",
+    lambda: {("firing",): alert_engine.fired, ("resolved",): alert_engine.resolved, ("suppressed",): alert_engine.suppressed},
+    ("state",)
+)
+metrics.gauge_callback("simulation_sessions", "Simulation sessions running", lambda: len(simulation_sessions.list()))
+metrics.gauge_callback("exports_active", "Metric exports in progress", lambda: metrics_export_service.active)
+metrics.gauge_callback("password_hash_pending", "Password checks waiting for or running in the pool", lambda: password_hasher.pending)
+metrics.counter_callback(
+    "token_cache_lookups", "Token cache lookups by result",
+    lambda: {("hit",): token_cache.hits, ("miss",): token_cache.misses},
+    ("result",)
+)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Starting up...")
-    init_db()
-    set_influxdb_service(influxdb_service)
+    await init_db_async()
+    await fleet_registry.load(simulation_fleet_size())
+    await alert_rule_store.load()
+    password_hasher.start()
+    if influxdb_service.rollup_bucket:
+        try:
+            influxdb_service.ensure_rollup_bucket()
+        except Exception as e:
+            print(f"Could not check rollup bucket '{influxdb_service.rollup_bucket}': {e}")
+    write_pipeline.start()
+    # Spools of simulation workers from an earlier run, whatever SIMULATION_WORKERS is now
+    await write_pipeline.adopt_spools(shard_spool_dirs(write_pipeline_settings["spool_dir"]))
+    write_path.start()
+    simulation_sessions.start()
+    set_write_path(write_path)
+    set_simulation_sessions(simulation_sessions)
+    set_backfill_service(backfill_service)
+    set_sharded_simulation(sharded_simulation)
+    set_metrics_history_service(metrics_history_service)
+    set_hot_tier(hot_tier)
+    set_fleet_registry(fleet_registry)
+    set_simulation_fleet_registry(fleet_registry)
+    set_metrics_export_service(metrics_export_service)
+    set_export_fleet_registry(fleet_registry)
+    set_metric_ingest_service(metric_ingest_service)
+    set_ingest_write_path(write_path)
+    set_stream_hub(stream_hub)
+    set_anomaly_detector(anomaly_detector)
+    set_fleet_summary(fleet_summary)
+    set_alert_rule_store(alert_rule_store)
+    set_alerts_fleet_registry(fleet_registry)
     yield
     print("Shutting down...")
     await cleanup()
+    await write_path.close()
+    await write_pipeline.close()
     influxdb_service.close()
+    password_hasher.shutdown()
     print("Cleanup complete")
 
 
@@ -45,11 +249,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Content-Disposition", "Retry-After"],
 )
+app.add_middleware(RequestMetricsMiddleware)
 
 app.include_router(quantum_computers.router, prefix="/api")
 app.include_router(simulation.router, prefix="/api")
 app.include_router(auth.router, prefix="/api")
+app.include_router(stream.router, prefix="/api")
+app.include_router(anomalies.router, prefix="/api")
+app.include_router(database.router, prefix="/api")
+app.include_router(export.router, prefix="/api")
+app.include_router(ingest.router, prefix="/api")
+app.include_router(fleet.router, prefix="/api")
+app.include_router(alerts.router, prefix="/api")
+app.include_router(metrics_router.router)
 
 
 @app.get("/")
@@ -1,4 +1,5 @@
 from .quantum_computer import QuantumComputer
-from .metric import Metric
+from .metric import Metric, METRIC_NAMES, METRIC_UNITS
+from .metric_batch import MetricBatch
 
-__all__ = ["QuantumComputer", "Metric"]
\ No newline at end of file
+__all__ = ["QuantumComputer", "Metric", "MetricBatch", "METRIC_NAMES", "METRIC_UNITS"]
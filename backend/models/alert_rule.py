@@ -0,0 +1,44 @@
+from pydantic import BaseModel
+from sqlalchemy import Boolean, Float, Index, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
+from typing import Optional
+from .user import Base
+
+ALERT_OPERATORS = (">", ">=", "<", "<=")
+
+ALERT_SEVERITIES = ("info", "warning", "critical")
+
+# A threshold on one metric, for one computer or (computer_id None) for all of them. It fires
+# once the condition held for for_samples consecutive points and for_seconds, and resolves once
+# the value is back past the threshold by hysteresis.
+class AlertRule(BaseModel):
+    id: int
+    name: str
+    computer_id: Optional[str] = None
+    metric_name: str
+    operator: str
+    threshold: float
+    for_samples: int = 1
+    for_seconds: float = 0.0
+    hysteresis: float = 0.0
+    severity: str = "warning"
+    enabled: bool = True
+
+class AlertRuleRecord(Base):
+    __tablename__ = "alert_rules"
+    __table_args__ = (Index("ix_alert_rules_computer_metric", "computer_id", "metric_name"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(200), nullable=False)
+    computer_id: Mapped[Optional[str]] = mapped_column(String(64))
+    metric_name: Mapped[str] = mapped_column(String(50), nullable=False)
+    operator: Mapped[str] = mapped_column(String(2), nullable=False)
+    threshold: Mapped[float] = mapped_column(Float, nullable=False)
+    for_samples: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
+    for_seconds: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    hysteresis: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    severity: Mapped[str] = mapped_column(String(20), nullable=False, default="warning")
+    enabled: Mapped[bool] = mapped_column(Boolean, nullable=False, default=True)
+
+    def __repr__(self):
+        return f"<AlertRuleRecord(id={self.id}, name='{self.name}')>"
@@ -2,6 +2,25 @@ from datetime import datetime, timezone
 
 from pydantic import BaseModel, Field
 
+METRIC_NAMES = (
+    "temperature",
+    "qubit_fidelity",
+    "gate_error_rate",
+    "coherence_time",
+    "quantum_volume",
+    "performance_score"
+)
+
+METRIC_UNITS = {
+    "temperature": "mK",
+    "qubit_fidelity": "%",
+    "gate_error_rate": "%",
+    "coherence_time": "μs",
+    "quantum_volume": "QV",
+    "performance_score": "score"
+}
+
+
 class Metric(BaseModel):
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     computer_id: str
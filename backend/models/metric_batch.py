@@ -0,0 +1,240 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .metric import Metric, METRIC_NAMES, METRIC_UNITS
+
+EPOCH = datetime.fromtimestamp(0, tz=timezone.utc)
+
+METRIC_NAME_UNITS = tuple(METRIC_UNITS[name] for name in METRIC_NAMES)
+
+MAX_CACHED_SHAPES = 32
+
+
+def to_timestamp_ns(timestamp: datetime) -> int:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 9 + delta.microseconds * 1000
+
+
+def from_timestamp_ns(timestamp_ns: int) -> datetime:
+    return EPOCH + timedelta(microseconds=timestamp_ns // 1000)
+
+
+# Columnar set of metric values sharing one timestamp. Computer ids and metric names are
+# stored once in lookup tables and rows reference them by index, units are looked up per
+# metric name. Producers that emit the same shape every tick can pass the same tables and
+# index arrays each time, so a batch costs one float64 array plus the object itself.
+# Batches from outside (ingested telemetry) carry one timestamp per row in timestamps_ns, with
+# timestamp_ns the newest of them, and are marked one_off so consumers do not cache their shape.
+# Batches of a simulation session carry its id, which is written as the session tag.
+class MetricBatch:
+    __slots__ = (
+        "timestamp",
+        "timestamp_ns",
+        "computer_ids",
+        "metric_names",
+        "units",
+        "computer_index",
+        "metric_index",
+        "values",
+        "timestamps_ns",
+        "one_off",
+        "session_id"
+    )
+
+    def __init__(
+            self,
+            timestamp: datetime,
+            computer_ids: Sequence[str],
+            metric_names: Sequence[str],
+            units: Sequence[str],
+            computer_index: np.ndarray,
+            metric_index: np.ndarray,
+            values: np.ndarray,
+            timestamps_ns: Optional[np.ndarray] = None,
+            one_off: bool = False,
+            session_id: Optional[str] = None
+    ):
+        self.timestamp = timestamp
+        self.timestamp_ns = to_timestamp_ns(timestamp) if timestamps_ns is None else int(timestamps_ns.max())
+        self.computer_ids = computer_ids
+        self.metric_names = metric_names
+        self.units = units
+        self.computer_index = computer_index
+        self.metric_index = metric_index
+        self.values = values
+        self.timestamps_ns = timestamps_ns
+        self.one_off = one_off
+        self.session_id = session_id
+
+    @classmethod
+    def from_columns(
+            cls,
+            timestamp: datetime,
+            computer_ids: Sequence[str],
+            columns,
+            metric_names: Sequence[str] = METRIC_NAMES,
+            units: Optional[Sequence[str]] = None
+    ) -> "MetricBatch":
+        # columns[m][c] is the value of metric_names[m] for computer_ids[c]
+        values = np.asarray(columns, dtype=np.float64).reshape(-1)
+        computer_index, metric_index = column_indexes(len(computer_ids), len(metric_names))
+        if units is None:
+            units = METRIC_NAME_UNITS if metric_names is METRIC_NAMES else tuple(METRIC_UNITS[name] for name in metric_names)
+        return cls(timestamp, computer_ids, metric_names, units, computer_index, metric_index, values)
+
+    @classmethod
+    def from_metrics(cls, metrics: Sequence[Metric]) -> "MetricBatch":
+        if not metrics:
+            raise ValueError("Cannot build a MetricBatch from an empty list of metrics")
+
+        timestamp = metrics[0].timestamp
+        computer_ids: List[str] = []
+        metric_names: List[str] = []
+        units: List[str] = []
+        computer_lookup = {}
+        metric_lookup = {}
+        computer_index = np.empty(len(metrics), dtype=np.int32)
+        metric_index = np.empty(len(metrics), dtype=np.int32)
+        values = np.empty(len(metrics), dtype=np.float64)
+
+        for row, metric in enumerate(metrics):
+            if metric.timestamp != timestamp:
+                raise ValueError("All metrics in a MetricBatch must share one timestamp")
+            if metric.computer_id not in computer_lookup:
+                computer_lookup[metric.computer_id] = len(computer_ids)
+                computer_ids.append(metric.computer_id)
+            if metric.metric_name not in metric_lookup:
+                metric_lookup[metric.metric_name] = len(metric_names)
+                metric_names.append(metric.metric_name)
+                units.append(metric.unit)
+            computer_index[row] = computer_lookup[metric.computer_id]
+            metric_index[row] = metric_lookup[metric.metric_name]
+            values[row] = metric.value
+
+        return cls(timestamp, computer_ids, metric_names, units, computer_index, metric_index, values)
+
+    @classmethod
+    def from_rows(
+            cls,
+            computer_ids: Sequence[str],
+            metric_names: Sequence[str],
+            computer_index: np.ndarray,
+            metric_index: np.ndarray,
+            values: np.ndarray,
+            timestamps_ns: np.ndarray
+    ) -> "MetricBatch":
+        # Rows with timestamps of their own; must not be empty
+        units = tuple(METRIC_UNITS[name] for name in metric_names)
+        timestamp = from_timestamp_ns(int(timestamps_ns.max()))
+        return cls(timestamp, computer_ids, metric_names, units, computer_index, metric_index, values, timestamps_ns, True)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def slice(self, start: int, stop: int) -> "MetricBatch":
+        # Rows start:stop as views, sharing the lookup tables
+        timestamps_ns = self.timestamps_ns[start:stop] if self.timestamps_ns is not None else None
+        timestamp = self.timestamp if timestamps_ns is None else from_timestamp_ns(int(timestamps_ns.max()))
+        return MetricBatch(
+            timestamp,
+            self.computer_ids,
+            self.metric_names,
+            self.units,
+            self.computer_index[start:stop],
+            self.metric_index[start:stop],
+            self.values[start:stop],
+            timestamps_ns,
+            True,
+            self.session_id
+        )
+
+    @property
+    def shape(self) -> tuple:
+        # The objects producers pass again every tick, see ShapeCache
+        return self.computer_ids, self.metric_names, self.computer_index, self.metric_index
+
+    def series_rows(self, row_for, shapes: Optional["ShapeCache"] = None) -> Tuple[np.ndarray, bool]:
+        # Row of each point in a consumer's series table, looking up row_for(computer_id, metric_name)
+        # once per distinct series, and whether no series occurs twice. With a shape cache, batches
+        # of a known shape reuse the rows looked up over the whole computer x metric table.
+        if shapes is not None and not self.one_off:
+            cached = shapes.get(self.shape)
+            if cached is not None:
+                return cached
+            table = np.array([
+                [row_for(computer_id, metric_name) for computer_id in self.computer_ids]
+                for metric_name in self.metric_names
+            ], dtype=np.int64).reshape(len(self.metric_names), len(self.computer_ids))
+            rows = table[self.metric_index, self.computer_index]
+            accepted = rows[rows >= 0]
+            return shapes.put(self.shape, (rows, len(np.unique(accepted)) == len(accepted)))
+
+        # One-off batches only look up the series that occur
+        computers = len(self.computer_ids)
+        pairs = self.metric_index.astype(np.int64) * computers + self.computer_index
+        distinct, inverse = np.unique(pairs, return_inverse=True)
+        table = np.array(
+            [row_for(self.computer_ids[pair % computers], self.metric_names[pair // computers]) for pair in distinct.tolist()],
+            dtype=np.int64
+        )
+        rows = table[inverse.reshape(-1)] if len(table) else np.empty(0, dtype=np.int64)
+        accepted = rows[rows >= 0]
+        return rows, len(np.unique(accepted)) == len(accepted)
+
+    def metric(self, row: int) -> Metric:
+        metric_index = self.metric_index[row]
+        timestamp = self.timestamp if self.timestamps_ns is None else from_timestamp_ns(int(self.timestamps_ns[row]))
+        return Metric.model_construct(
+            timestamp=timestamp,
+            computer_id=self.computer_ids[self.computer_index[row]],
+            metric_name=self.metric_names[metric_index],
+            value=float(self.values[row]),
+            unit=self.units[metric_index]
+        )
+
+    def to_metrics(self) -> List[Metric]:
+        return [self.metric(row) for row in range(len(self.values))]
+
+
+# What a consumer derives from a batch shape, kept for the last max_shapes shapes. Producers reuse
+# their lookup tables and index arrays every tick, so shapes are told apart by the ids of those
+# objects; an entry holds the objects themselves, so their ids cannot be reused while it is cached.
+class ShapeCache:
+    def __init__(self, max_shapes: int = MAX_CACHED_SHAPES):
+        self.max_shapes = max_shapes
+        self._entries: Dict[tuple, tuple] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, shape: tuple):
+        entry = self._entries.get(tuple(map(id, shape)))
+        return entry[1] if entry is not None else None
+
+    def put(self, shape: tuple, value):
+        shape_id = tuple(map(id, shape))
+        if shape_id not in self._entries and len(self._entries) >= self.max_shapes:
+            del self._entries[next(iter(self._entries))]
+        self._entries[shape_id] = (shape, value)
+        return value
+
+
+def column_indexes(computer_count: int, metric_count: int):
+    computer_index = np.tile(np.arange(computer_count, dtype=np.int32), metric_count)
+    metric_index = np.repeat(np.arange(metric_count, dtype=np.int32), computer_count)
+    return computer_index, metric_index
+
+
+def group_repeats(rows: np.ndarray, timestamps_ns) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # For batches holding some series more than once: the order that puts the rows of each series
+    # together, oldest first (in arrival order on equal timestamps), and for every row in that
+    # order its position within its series and the number of rows of its series
+    order = np.lexsort((np.broadcast_to(timestamps_ns, rows.shape), rows))
+    grouped = rows[order]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]]) if len(grouped) else np.empty(0, dtype=np.int64)
+    sizes = np.diff(np.r_[starts, len(grouped)])
+    return order, np.arange(len(grouped)) - np.repeat(starts, sizes), np.repeat(sizes, sizes)
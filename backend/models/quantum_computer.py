@@ -1,5 +1,8 @@
 from pydantic import BaseModel
+from sqlalchemy import Float, Integer, String
+from sqlalchemy.orm import Mapped, mapped_column
 from typing import Optional
+from .user import Base
 
 class QuantumComputer(BaseModel):
     id: str
@@ -7,4 +10,30 @@ class QuantumComputer(BaseModel):
     qubits: int
     location: str
     status: str
-    temp_mk: Optional[float] = None
\ No newline at end of file
+    temperature_mk: Optional[float] = None
+    performance_score: Optional[float] = None
+
+# Fields of a simulation profile, stored next to the computer they describe
+PROFILE_FIELDS = (
+    "qubits", "age_factor", "base_temp", "temp_stability",
+    "base_fidelity", "base_error", "base_coherence", "base_qv"
+)
+
+class QuantumComputerRecord(Base):
+    __tablename__ = "quantum_computers"
+
+    id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    name: Mapped[str] = mapped_column(String(100), nullable=False)
+    qubits: Mapped[int] = mapped_column(Integer, nullable=False)
+    location: Mapped[str] = mapped_column(String(100), index=True, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), index=True, nullable=False)
+    age_factor: Mapped[float] = mapped_column(Float, nullable=False)
+    base_temp: Mapped[float] = mapped_column(Float, nullable=False)
+    temp_stability: Mapped[float] = mapped_column(Float, nullable=False)
+    base_fidelity: Mapped[float] = mapped_column(Float, nullable=False)
+    base_error: Mapped[float] = mapped_column(Float, nullable=False)
+    base_coherence: Mapped[float] = mapped_column(Float, nullable=False)
+    base_qv: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<QuantumComputerRecord(id='{self.id}', status='{self.status}')>"
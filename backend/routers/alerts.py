@@ -0,0 +1,137 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field
+from models.alert_rule import AlertRule
+from models.metric import METRIC_NAMES
+from models.metric_batch import to_timestamp_ns
+from routers.auth import get_current_user
+from services.alert_engine import MAX_FOR_SECONDS, STREAK_LIMIT, AlertEngine
+from services.alert_rules import AlertRuleStore
+from services.fleet_registry import FleetRegistry
+from services.response_cache import ResponseCache
+from datetime import datetime
+from typing import List, Optional
+
+router = APIRouter(
+    prefix="/alerts",
+    tags=["alerts"]
+)
+
+alert_rule_store: Optional[AlertRuleStore] = None
+alert_engine: Optional[AlertEngine] = None
+fleet_registry: Optional[FleetRegistry] = None
+response_cache = ResponseCache(max_entries=64)
+
+class AlertRuleRequest(BaseModel):
+    name: str = Field(..., min_length=1, max_length=200)
+    computer_id: Optional[str] = None
+    metric_name: str
+    operator: str = Field(..., pattern="^(>|>=|<|<=)$")
+    threshold: float = Field(..., allow_inf_nan=False)
+    for_samples: int = Field(1, ge=1, le=STREAK_LIMIT)
+    for_seconds: float = Field(0.0, ge=0, le=MAX_FOR_SECONDS)
+    hysteresis: float = Field(0.0, ge=0, allow_inf_nan=False)
+    severity: str = Field("warning", pattern="^(info|warning|critical)$")
+    enabled: bool = True
+
+def set_alert_rule_store(store: AlertRuleStore):
+    global alert_rule_store, alert_engine
+    alert_rule_store = store
+    alert_engine = store.engine
+    response_cache.clear()
+
+def set_fleet_registry(registry: FleetRegistry):
+    global fleet_registry
+    fleet_registry = registry
+
+def require_store() -> AlertRuleStore:
+    if alert_rule_store is None:
+        raise HTTPException(status_code=500, detail="Alert rules have not been initialized.")
+    return alert_rule_store
+
+# Rules are shared by the whole fleet: changing one silences or raises alerts for everyone
+def require_superuser(current_user: dict = Depends(get_current_user)) -> dict:
+    if not current_user["user"].is_superuser:
+        raise HTTPException(status_code=403, detail="Only superusers can change alert rules.")
+    return current_user
+
+def validate_rule(request: AlertRuleRequest) -> dict:
+    if request.metric_name not in METRIC_NAMES:
+        raise HTTPException(status_code=404, detail=f"Unknown metric '{request.metric_name}'.")
+    if request.computer_id is not None and fleet_registry is not None and fleet_registry.get(request.computer_id) is None:
+        raise HTTPException(status_code=404, detail=f"Quantum computer with ID {request.computer_id} not found.")
+    return request.model_dump()
+
+@router.get("/rules", response_model=List[AlertRule])
+async def get_alert_rules(request: Request, computer_id: Optional[str] = None, metric_name: Optional[str] = None):
+    store = require_store()
+    return response_cache.respond(
+        request, ("rules", computer_id, metric_name), store.version,
+        lambda: ([rule.model_dump() for rule in store.list(computer_id, metric_name)], {})
+    )
+
+@router.post("/rules", response_model=AlertRule, status_code=201)
+async def create_alert_rule(request: AlertRuleRequest, current_user: dict = Depends(require_superuser)):
+    try:
+        return await require_store().create(validate_rule(request))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/rules/{rule_id}", response_model=AlertRule)
+async def get_alert_rule(rule_id: int):
+    rule = require_store().get(rule_id)
+    if rule is None:
+        raise HTTPException(status_code=404, detail=f"Alert rule {rule_id} not found.")
+    return rule
+
+@router.put("/rules/{rule_id}", response_model=AlertRule)
+async def update_alert_rule(rule_id: int, request: AlertRuleRequest, current_user: dict = Depends(require_superuser)):
+    try:
+        rule = await require_store().update(rule_id, validate_rule(request))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if rule is None:
+        raise HTTPException(status_code=404, detail=f"Alert rule {rule_id} not found.")
+    return rule
+
+@router.delete("/rules/{rule_id}", status_code=204)
+async def delete_alert_rule(rule_id: int, current_user: dict = Depends(require_superuser)):
+    if not await require_store().delete(rule_id):
+        raise HTTPException(status_code=404, detail=f"Alert rule {rule_id} not found.")
+    return Response(status_code=204)
+
+# Instances of rules that are firing right now
+@router.get("/active")
+async def get_active_alerts(computer_id: Optional[str] = None, metric_name: Optional[str] = None):
+    require_store()
+    return alert_engine.active(computer_id, metric_name)
+
+# Notifications, newest first: one when an alert starts firing and one when it resolves
+@router.get("/events")
+async def get_alert_events(
+        computer_id: Optional[str] = None,
+        rule_id: Optional[int] = None,
+        since: Optional[datetime] = None,
+        limit: int = Query(100, ge=1, le=1000)
+):
+    require_store()
+    since_ns = to_timestamp_ns(since) if since is not None else None
+    return [
+        {
+            "timestamp": timestamp_ns // 1_000_000,
+            "rule_id": event_rule_id,
+            "rule_name": rule_name,
+            "severity": severity,
+            "computer_id": event_computer_id,
+            "metric_name": metric_name,
+            "state": state,
+            "value": value,
+            "threshold": threshold
+        }
+        for timestamp_ns, event_rule_id, rule_name, severity, event_computer_id, metric_name, state, value, threshold
+        in alert_engine.recent(computer_id, rule_id, since_ns, limit)
+    ]
+
+@router.get("/stats")
+async def get_alert_stats():
+    require_store()
+    return alert_engine.stats()
@@ -0,0 +1,47 @@
+from fastapi import APIRouter, HTTPException, Query
+from models.metric_batch import to_timestamp_ns
+from services.anomaly_detector import AnomalyDetector
+from datetime import datetime
+from typing import Optional
+
+router = APIRouter(
+    prefix="/anomalies",
+    tags=["anomalies"]
+)
+
+anomaly_detector: Optional[AnomalyDetector] = None
+
+def set_anomaly_detector(detector: AnomalyDetector):
+    global anomaly_detector
+    anomaly_detector = detector
+
+@router.get("")
+async def get_anomalies(
+        computer_id: Optional[str] = None,
+        metric_name: Optional[str] = None,
+        since: Optional[datetime] = None,
+        limit: int = Query(100, ge=1, le=1000)
+):
+    if anomaly_detector is None:
+        raise HTTPException(status_code=500, detail="Anomaly detection is not enabled.")
+
+    since_ns = to_timestamp_ns(since) if since is not None else None
+    anomalies = anomaly_detector.recent(computer_id, metric_name, since_ns, limit)
+    return [
+        {
+            "timestamp": timestamp_ns // 1_000_000,
+            "computer_id": computer_id,
+            "metric_name": metric_name,
+            "detector": detector,
+            "value": value,
+            "expected": expected,
+            "score": round(score, 3)
+        }
+        for timestamp_ns, computer_id, metric_name, detector, value, expected, score in anomalies
+    ]
+
+@router.get("/stats")
+async def get_anomaly_stats():
+    if anomaly_detector is None:
+        raise HTTPException(status_code=500, detail="Anomaly detection is not enabled.")
+    return anomaly_detector.stats()
@@ -1,9 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from datetime import timedelta
-from services.postgres_db import get_db
-from services.user_service import create_user, authenticate_user, get_user_by_username
-from services.auth_service import create_access_token, decode_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from datetime import datetime, timedelta, timezone
+from services.user_service import create_user_async, authenticate_user_async, get_user_snapshot_async
+from services.auth_service import create_access_token, decode_access_token_claims, token_cache, ACCESS_TOKEN_EXPIRE_MINUTES
 from schemas.user_schemas import UserCreate, UserLogin, UserResponse, Token
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
@@ -31,7 +29,7 @@ class AuthResponse(BaseModel):
 
 
 @router.post("/register", response_model=AuthResponse, status_code=status.HTTP_201_CREATED)
-def register(request: RegisterRequest, db: Session = Depends(get_db)):
+async def register(request: RegisterRequest):
     try:
         user_create = UserCreate(
             email=request.email,
@@ -40,7 +38,7 @@ def register(request: RegisterRequest, db: Session = Depends(get_db)):
             full_name=request.name
         )
 
-        db_user = create_user(db, user_create)
+        db_user = await create_user_async(user_create)
 
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
@@ -55,11 +53,16 @@ def register(request: RegisterRequest, db: Session = Depends(get_db)):
 
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 
 @router.post("/login", response_model=AuthResponse)
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = authenticate_user(db, request.email, request.password)
+async def login(request: LoginRequest):
+    try:
+        user = await authenticate_user_async(request.email, request.password)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
     if not user:
         raise HTTPException(
@@ -81,28 +84,41 @@ def login(request: LoginRequest, db: Session = Depends(get_db)):
 
 
 @router.get("/me", response_model=AuthResponse)
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    username = decode_access_token(token)
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    # Verified tokens are served from the token cache without decoding or a database round trip
+    cached = token_cache.get(token)
 
-    if username is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    if cached is None:
+        claims = decode_access_token_claims(token)
+
+        if claims is None or claims.get("sub") is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        user = await get_user_snapshot_async(claims["sub"])
+
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
 
-    user = get_user_by_username(db, username)
+        expires_at = datetime.fromtimestamp(claims["exp"], tz=timezone.utc)
+        cached = (user, expires_at)
+        token_cache.put(token, user.id, cached, expires_at)
 
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
+    user, expires_at = cached
 
+    # The token is only renewed once less than half of its lifetime is left
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username},
-        expires_delta=access_token_expires
-    )
+    access_token = token
+    if expires_at - datetime.now(timezone.utc) < access_token_expires / 2:
+        access_token = create_access_token(
+            data={"sub": user.username},
+            expires_delta=access_token_expires
+        )
 
     return {
         "user": user,
         "token": access_token
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from services.postgres_db import pool_stats
+
+router = APIRouter(
+    prefix="/database",
+    tags=["database"]
+)
+
+@router.get("/pool")
+async def get_pool_stats():
+    return pool_stats()
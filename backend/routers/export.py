@@ -0,0 +1,105 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from models.metric import METRIC_NAMES
+from models.metric_batch import to_timestamp_ns
+from routers.auth import get_current_user, oauth2_scheme
+from routers.simulation import find_session
+from services.fleet_registry import FleetRegistry
+from services.metrics_export import EXPORT_FORMATS, MetricsExportService
+from datetime import datetime, timezone
+from typing import Optional
+import asyncio
+
+router = APIRouter(
+    prefix="/export",
+    tags=["export"]
+)
+
+# Longer lists make for unwieldy Flux filters; leaving out computers exports all of them
+MAX_EXPORT_COMPUTERS = 1000
+
+metrics_export_service: Optional[MetricsExportService] = None
+fleet_registry: Optional[FleetRegistry] = None
+
+def set_metrics_export_service(service: MetricsExportService):
+    global metrics_export_service
+    metrics_export_service = service
+
+def set_fleet_registry(registry: FleetRegistry):
+    global fleet_registry
+    fleet_registry = registry
+
+def parse_list(value: Optional[str]):
+    if not value:
+        return None
+    return list(dict.fromkeys(item.strip() for item in value.split(",") if item.strip())) or None
+
+@router.get("")
+async def export_metrics(
+        request: Request,
+        start: datetime,
+        end: Optional[datetime] = None,
+        computers: Optional[str] = None,
+        metrics: Optional[str] = None,
+        session: Optional[str] = None,
+        format: str = Query("arrow", pattern="^(arrow|parquet)$")
+):
+    if metrics_export_service is None or fleet_registry is None:
+        raise HTTPException(status_code=500, detail="Metrics export service has not been initialized.")
+
+    if session is not None:
+        # Fleet data is open to everyone, a session's only to its owner
+        find_session(session, await get_current_user(await oauth2_scheme(request)))
+
+    computer_ids = parse_list(computers)
+    if computer_ids is not None:
+        if len(computer_ids) > MAX_EXPORT_COMPUTERS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {MAX_EXPORT_COMPUTERS} computers per export, leave out computers to export all."
+            )
+        unknown = [computer_id for computer_id in computer_ids if fleet_registry.get(computer_id) is None]
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Unknown quantum computers: {', '.join(unknown[:10])}")
+
+    metric_names = parse_list(metrics) or list(METRIC_NAMES)
+    unknown = [metric_name for metric_name in metric_names if metric_name not in METRIC_NAMES]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown metrics: {', '.join(unknown)}")
+
+    end = end or datetime.now(timezone.utc)
+    start_ns, end_ns = to_timestamp_ns(start), to_timestamp_ns(end)
+    if start_ns >= end_ns:
+        raise HTTPException(status_code=400, detail="start must be before end.")
+
+    try:
+        export = metrics_export_service.create(computer_ids, metric_names, start_ns, end_ns, format, session)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    try:
+        await asyncio.to_thread(export.start)
+    except Exception as e:
+        metrics_export_service.release(export)
+        print(f"Error starting export: {e}")
+        raise HTTPException(status_code=502, detail=f"Could not query InfluxDB: {e}")
+
+    async def chunks():
+        # Runs until the last chunk or until the client goes away, which cancels the pending
+        # read; release() then closes the query as soon as the worker thread lets go of it
+        try:
+            while True:
+                chunk = await asyncio.to_thread(export.next_chunk)
+                if chunk is None:
+                    break
+                if chunk:
+                    yield chunk
+        finally:
+            metrics_export_service.release(export)
+
+    filename = f"quantum_metrics_{start_ns // 1_000_000_000}_{end_ns // 1_000_000_000}.{EXPORT_FORMATS[format][1]}"
+    return StreamingResponse(
+        chunks(),
+        media_type=export.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"}
+    )
@@ -0,0 +1,46 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from services.fleet_summary import FleetSummary
+from services.response_cache import ResponseCache
+from typing import Optional
+
+router = APIRouter(
+    prefix="/fleet",
+    tags=["fleet"]
+)
+
+fleet_summary: Optional[FleetSummary] = None
+response_cache = ResponseCache(max_entries=64)
+
+def set_fleet_summary(summary: FleetSummary):
+    global fleet_summary
+    fleet_summary = summary
+    response_cache.clear()
+
+# The k worst and best computers per metric by their latest value, with fleet-wide mean and
+# p50/p90/p99 (from a sketch, within 1%). Rebuilt only when new points arrived since.
+@router.get("/summary")
+async def get_fleet_summary(
+        request: Request,
+        k: int = Query(10, ge=1, le=100),
+        metrics: Optional[str] = None
+):
+    if fleet_summary is None:
+        raise HTTPException(status_code=500, detail="Fleet summary has not been initialized.")
+
+    metric_names = None
+    if metrics:
+        metric_names = tuple(dict.fromkeys(item.strip() for item in metrics.split(",") if item.strip()))
+        unknown = [metric_name for metric_name in metric_names if metric_name not in fleet_summary.metric_names]
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Unknown metrics: {', '.join(unknown)}")
+
+    return response_cache.respond(
+        request, ("summary", k, metric_names), fleet_summary.version,
+        lambda: (fleet_summary.summary(k, metric_names), {})
+    )
+
+@router.get("/summary/stats")
+async def get_fleet_summary_stats():
+    if fleet_summary is None:
+        raise HTTPException(status_code=500, detail="Fleet summary has not been initialized.")
+    return fleet_summary.stats()
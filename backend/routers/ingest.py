@@ -0,0 +1,88 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from routers.auth import get_current_user
+from services.metric_ingest import CONTENT_TYPES, INGEST_THROTTLED, IngestError, MetricIngestService
+from services.write_path import MetricsWritePath
+from typing import Optional
+import asyncio
+import math
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["ingest"]
+)
+
+metric_ingest_service: Optional[MetricIngestService] = None
+write_path: Optional[MetricsWritePath] = None
+
+def set_metric_ingest_service(service: MetricIngestService):
+    global metric_ingest_service
+    metric_ingest_service = service
+
+def set_write_path(path: MetricsWritePath):
+    global write_path
+    write_path = path
+
+async def read_body(request: Request, max_bytes: int) -> bytes:
+    if int(request.headers.get("content-length") or 0) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Request body is larger than {max_bytes} bytes.")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Request body is larger than {max_bytes} bytes.")
+    return bytes(body)
+
+@router.post("/ingest")
+async def ingest_metrics(
+        request: Request,
+        format: Optional[str] = Query(None, pattern="^(line_protocol|ndjson|msgpack)$"),
+        precision: str = Query("ns", pattern="^(ns|us|ms|s)$"),
+        current_user: dict = Depends(get_current_user)
+):
+    # Line protocol (text/plain), NDJSON (application/x-ndjson) or msgpack (application/msgpack),
+    # or whatever format says. Points of unknown computers or metrics are rejected, the rest kept.
+    if metric_ingest_service is None or write_path is None:
+        raise HTTPException(status_code=500, detail="Metric ingest has not been initialized.")
+
+    if format is None:
+        content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+        format = CONTENT_TYPES.get(content_type)
+        if format is None:
+            raise HTTPException(
+                status_code=415,
+                detail=f"Unsupported Content-Type '{content_type}', expected one of {', '.join(CONTENT_TYPES)}."
+            )
+
+    # Rate limited per signed-in user, so a fresh address or header buys no fresh budget
+    source = current_user["user"].username
+    rate_limiter = metric_ingest_service.rate_limiter
+    retry_after = rate_limiter.retry_after(source)
+    if retry_after > 0:
+        INGEST_THROTTLED.inc()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit of {rate_limiter.rate:g} points/s exceeded for user '{source}'.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+    body = await read_body(request, metric_ingest_service.max_body_bytes)
+    try:
+        batch, report = await asyncio.to_thread(
+            metric_ingest_service.parse, body, format, precision, request.headers.get("content-encoding")
+        )
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if batch is None:
+        raise HTTPException(status_code=400, detail=report)
+
+    rate_limiter.consume(source, len(batch))
+    # In slices the size of a pipeline batch, letting other tasks run in between
+    slice_size = write_path.write_pipeline.batch_size
+    for start in range(0, len(batch), slice_size):
+        try:
+            await write_path.publish(batch.slice(start, start + slice_size))
+        except RuntimeError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        await asyncio.sleep(0)
+    return report
@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from services.instrumentation import CONTENT_TYPE, metrics
+
+router = APIRouter(tags=["metrics"])
+
+# Prometheus text format, scraped from /metrics next to the API rather than under /api
+@router.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
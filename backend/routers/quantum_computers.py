@@ -1,49 +1,149 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request
 from models.quantum_computer import QuantumComputer
-from typing import List
+from services.fleet_registry import FleetRegistry
+from models.metric import METRIC_NAMES, METRIC_UNITS
+from services.metrics_history import MetricsHistoryService
+from services.hot_tier import HotTierStore
+from services.response_cache import ResponseCache
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
 
 router = APIRouter(
     prefix="/quantum-computers",
     tags=["quantum-computers"]
 )
 
-# Mock computers
-QUANTUM_COMPUTERS = [
-    QuantumComputer(
-        id="qc-001",
-        name="Quantum Nexus Alpha",
-        qubits=127,
-        location="Boston Data Center",
-        status="online",
-        temperature_mk=15.3
-    ),
-    QuantumComputer(
-        id="qc-002",
-        name="Quantum Nexus Beta",
-        qubits=433,
-        location="San Francisco Lab",
-        status="online",
-        temperature_mk=12.8
-    ),
-    QuantumComputer(
-        id="qc-003",
-        name="Quantum Nexus Gamma",
-        qubits=1000,
-        location="Tokyo Research Facility",
-        status="maintenance",
-        temperature_mk=None
-    )
-]
+metrics_history_service: Optional[MetricsHistoryService] = None
+hot_tier: Optional[HotTierStore] = None
+fleet_registry: Optional[FleetRegistry] = None
+response_cache = ResponseCache()
+
+def set_metrics_history_service(service: MetricsHistoryService):
+    global metrics_history_service
+    metrics_history_service = service
+
+def set_hot_tier(store: HotTierStore):
+    global hot_tier
+    hot_tier = store
+    response_cache.clear()
+
+def set_fleet_registry(registry: FleetRegistry):
+    global fleet_registry
+    fleet_registry = registry
+    response_cache.clear()
+
+def with_live_status(computer: QuantumComputer) -> QuantumComputer:
+    if hot_tier is None:
+        return computer
+
+    temperature = hot_tier.latest(computer.id, "temperature")
+    score = hot_tier.latest(computer.id, "performance_score")
+    if temperature is None and score is None:
+        return computer
+
+    return computer.model_copy(update={
+        "temperature_mk": temperature[1] if temperature else computer.temperature_mk,
+        "performance_score": score[1] if score else computer.performance_score
+    })
+
+def fleet_version() -> tuple:
+    # Listings change with the registry and with the live values merged into them
+    return fleet_registry.version, hot_tier.version if hot_tier is not None else 0
+
+def find_quantum_computer(computer_id: str) -> QuantumComputer:
+    if fleet_registry is None:
+        raise HTTPException(status_code=500, detail="Fleet registry has not been initialized.")
+
+    computer = fleet_registry.get(computer_id)
+    if computer is None:
+        raise HTTPException(status_code=404, detail=f"Quantum computer with ID {computer_id} not found.")
+    return computer
 
+# Pages through the fleet in id order. The next page starts after the X-Next-Cursor header of
+# this one, which is absent on the last page.
 @router.get("", response_model=List[QuantumComputer])
-async def get_all_quantum_computers():
-    # TODO: replace with actual retrieval from real database
-    return QUANTUM_COMPUTERS
+async def get_all_quantum_computers(
+        request: Request,
+        cursor: Optional[str] = None,
+        limit: int = Query(100, ge=1, le=1000),
+        status: Optional[str] = None,
+        location: Optional[str] = None
+):
+    if fleet_registry is None:
+        raise HTTPException(status_code=500, detail="Fleet registry has not been initialized.")
+
+    def build():
+        computers, next_cursor, total = fleet_registry.page(cursor, limit, status, location)
+        headers = {"X-Total-Count": str(total)}
+        if next_cursor is not None:
+            headers["X-Next-Cursor"] = next_cursor
+        return [with_live_status(computer).model_dump() for computer in computers], headers
+
+    return response_cache.respond(request, ("list", cursor, limit, status, location), fleet_version(), build)
 
 @router.get("/{computer_id}", response_model=QuantumComputer)
-async def get_quantum_computer(computer_id: str):
-    for computer in QUANTUM_COMPUTERS:
-        if computer.id == computer_id:
-            return computer
+async def get_quantum_computer(request: Request, computer_id: str):
+    computer = find_quantum_computer(computer_id)
+    return response_cache.respond(
+        request, ("computer", computer_id), fleet_version(), lambda: (with_live_status(computer).model_dump(), {})
+    )
+
+@router.get("/{computer_id}/live")
+async def get_live_metrics(computer_id: str):
+    find_quantum_computer(computer_id)
+    if hot_tier is None:
+        raise HTTPException(status_code=500, detail="Hot tier has not been initialized.")
+
+    return {
+        "computer_id": computer_id,
+        "metrics": {
+            metric_name: {
+                "timestamp": timestamp_ns // 1_000_000,
+                "value": value,
+                "unit": METRIC_UNITS.get(metric_name)
+            }
+            for metric_name, (timestamp_ns, value) in hot_tier.latest_for_computer(computer_id).items()
+        }
+    }
+
+@router.get("/{computer_id}/metrics/{metric_name}/recent")
+async def get_recent_metrics(computer_id: str, metric_name: str, samples: int = Query(60, ge=1)):
+    find_quantum_computer(computer_id)
+    if hot_tier is None:
+        raise HTTPException(status_code=500, detail="Hot tier has not been initialized.")
+
+    timestamps, values = hot_tier.window(computer_id, metric_name, samples)
+    return {
+        "computer_id": computer_id,
+        "metric_name": metric_name,
+        "unit": METRIC_UNITS.get(metric_name),
+        "timestamps": (timestamps // 1_000_000).tolist(),
+        "values": values.tolist()
+    }
+
+@router.get("/{computer_id}/metrics/{metric_name}")
+async def get_metric_history(
+        computer_id: str,
+        metric_name: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        points: int = Query(500, ge=3, le=10000)
+):
+    find_quantum_computer(computer_id)
+
+    if metric_name not in METRIC_NAMES:
+        raise HTTPException(status_code=404, detail=f"Unknown metric '{metric_name}'.")
+    if metrics_history_service is None:
+        raise HTTPException(status_code=500, detail="Metrics history service has not been initialized.")
+
+    # Naive times are UTC, as everywhere else in the API
+    if start is not None and start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end is not None and end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end.")
 
-    raise HTTPException(status_code=404, detail=f"Quantum computer with ID {computer_id} not found.")
\ No newline at end of file
+    return await metrics_history_service.get_history(computer_id, metric_name, start, end, points)
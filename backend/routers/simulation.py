@@ -1,8 +1,20 @@
-from fastapi import APIRouter, HTTPException
-from services.simulator import QuantumSimulator
-from services.influxdb_service import InfluxDBService
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from pydantic import BaseModel, Field
+from routers.auth import get_current_user
+from services.backfill import BackfillService
+from services.fleet_registry import FleetRegistry
+from services.instrumentation import metrics
+from services.qubit_telemetry import QUBIT_TELEMETRY_MODES, QubitTelemetry
+from services.response_cache import ResponseCache
+from services.scheduler import SimulationScheduler, parse_intervals
+from services.sharded_simulation import ShardedSimulation
+from services.simulation_sessions import SessionLimitError, SimulationSession, SimulationSessions
+from services.write_path import MetricsWritePath
 import asyncio
-from typing import Dict, Optional
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
 
 router = APIRouter(
     prefix="/simulation",
@@ -11,53 +23,195 @@ router = APIRouter(
 
 simulation_state = {
     "running": False,
-    "task": None
+    "task": None,
+    "scheduler": None,
+    "errors": 0,
+    "qubit_task": None,
+    "qubits": None
 }
 
-influxdb_service: Optional[InfluxDBService] = None
+TICK_SECONDS = metrics.histogram("simulation_tick_duration_seconds", "Generating and publishing the batches due in one tick")
+TICK_LATENESS_SECONDS = metrics.histogram("simulation_tick_lateness_seconds", "How late ticks started against their schedule")
+SIMULATED_POINTS = metrics.counter("simulation_points", "Points produced by the in-process simulation")
+SIMULATION_ERRORS = metrics.counter("simulation_errors", "Simulation ticks that failed")
+QUBIT_TICK_SECONDS = metrics.histogram("qubit_telemetry_tick_duration_seconds", "Stepping and encoding per-qubit telemetry for one tick")
+QUBIT_BYTES = metrics.counter("qubit_telemetry_bytes", "Line protocol bytes of per-qubit telemetry")
+QUBIT_SKIPPED = metrics.counter("qubit_telemetry_skipped_ticks", "Qubit telemetry ticks not written because earlier ticks were still being written")
 
-def set_influxdb_service(service: InfluxDBService):
-    global influxdb_service
-    influxdb_service = service
-    print("InfluxDB Service has been set.")
+write_path: Optional[MetricsWritePath] = None
+backfill_service: Optional[BackfillService] = None
+sharded_simulation: Optional[ShardedSimulation] = None
+fleet_registry: Optional[FleetRegistry] = None
+simulation_sessions: Optional[SimulationSessions] = None
+response_cache = ResponseCache(max_entries=1)
+
+class BackfillRequest(BaseModel):
+    start: datetime
+    end: datetime
+    interval_seconds: float = Field(5.0, gt=0)
+    seed: int = 0
+    computer_ids: Optional[List[str]] = None
+    fleet_size: Optional[int] = Field(None, ge=1)
+
+# More simulation workers than CPUs only adds processes competing for them
+MAX_SIMULATION_WORKERS = os.cpu_count() or 1
+
+class WorkersRequest(BaseModel):
+    workers: int = Field(..., ge=1, le=MAX_SIMULATION_WORKERS)
+
+class SessionRequest(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    computer_ids: Optional[List[str]] = None
+    fleet_size: Optional[int] = Field(None, ge=1)
+    seed: Optional[int] = None
+    interval_seconds: float = Field(5.0, gt=0)
+
+def set_write_path(path: MetricsWritePath):
+    global write_path
+    write_path = path
+    print("Write path has been set.")
+
+def set_backfill_service(service: BackfillService):
+    global backfill_service
+    backfill_service = service
+    print("Backfill service has been set.")
+
+def set_sharded_simulation(simulation: Optional[ShardedSimulation]):
+    global sharded_simulation
+    sharded_simulation = simulation
+    if simulation is not None:
+        print(f"Sharded simulation has been set ({simulation.workers} workers).")
+
+def set_fleet_registry(registry: FleetRegistry):
+    global fleet_registry
+    fleet_registry = registry
+    print("Fleet registry has been set.")
+
+def set_simulation_sessions(sessions: SimulationSessions):
+    global simulation_sessions
+    simulation_sessions = sessions
+    print("Simulation sessions have been set.")
+
+# Computers the registry creates on first start; the simulation covers every registered computer
+def simulation_fleet_size() -> int:
+    return int(os.getenv("SIMULATION_FLEET_SIZE", "3"))
+
+def simulation_intervals() -> Tuple[float, Dict[str, float]]:
+    return float(os.getenv("SIMULATION_INTERVAL", "5")), parse_intervals(os.getenv("SIMULATION_INTERVALS"))
+
+# Per-qubit telemetry next to the device-level metrics: "off", "packed" (one line per computer and
+# tick) or "series" (one series per qubit and coupler)
+def qubit_telemetry_settings() -> Tuple[str, float]:
+    mode = os.getenv("QUBIT_TELEMETRY", "off")
+    if mode != "off" and mode not in QUBIT_TELEMETRY_MODES:
+        raise ValueError(f"QUBIT_TELEMETRY must be 'off' or one of {QUBIT_TELEMETRY_MODES}, got '{mode}'")
+    return mode, float(os.getenv("QUBIT_TELEMETRY_INTERVAL", "1"))
+
+async def qubit_telemetry_loop(telemetry: QubitTelemetry, interval: float):
+    print(f"Qubit telemetry started ({telemetry.mode}, {telemetry.qubits} qubits).")
+    start = time.monotonic()
+    tick = 0
+
+    while simulation_state["running"]:
+        try:
+            started = time.perf_counter()
+            written = await write_path.publish_qubits(telemetry, time.time_ns())
+            if written is None:
+                QUBIT_SKIPPED.inc()
+            else:
+                QUBIT_BYTES.inc(written)
+            QUBIT_TICK_SECONDS.observe(time.perf_counter() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error in qubit telemetry loop: {e}")
+            simulation_state["errors"] += 1
+            SIMULATION_ERRORS.inc()
+
+        # Fixed cadence from the start; ticks that could not keep up are skipped
+        tick = max(tick + 1, int((time.monotonic() - start) / interval))
+        await asyncio.sleep(max(0.0, start + tick * interval - time.monotonic()))
+
+async def stop_qubit_telemetry():
+    task = simulation_state["qubit_task"]
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            print("Qubit telemetry stopped.")
+        simulation_state["qubit_task"] = None
 
 async def simulation_loop():
-    computer_ids = ["qc-001", "qc-002", "qc-003"]
-    simulators = {
-        comp_id: QuantumSimulator(comp_id)
-        for comp_id in computer_ids
-    }
+    default_interval, intervals = simulation_intervals()
+    scheduler = SimulationScheduler(fleet_registry.computer_ids(), default_interval, intervals, fleet_registry.profiles())
+    simulation_state["scheduler"] = scheduler
 
     print("Simulation Started.")
 
     try:
         while simulation_state["running"]:
             try:
-                for comp_id, simulator in simulators.items():
-                    metrics = simulator.generate_all_metrics()
-                    influxdb_service.write_metrics(metrics)
-
-                await asyncio.sleep(5)
+                started = time.perf_counter()
+                points = 0
+                for batch in scheduler.due_batches():
+                    await write_path.publish(batch)
+                    points += len(batch)
+                TICK_SECONDS.observe(time.perf_counter() - started)
+                TICK_LATENESS_SECONDS.observe(scheduler.last_lateness)
+                SIMULATED_POINTS.inc(points)
 
             except asyncio.CancelledError:
                 print("Simulation loop cancelled.")
                 raise
             except Exception as e:
+                # Failed writes are spooled or dropped by the write pipeline, so a single
+                # bad tick is reported and the simulation keeps producing
                 print(f"Error in simulation loop: {e}")
-                simulation_state["running"] = False
-                break
+                simulation_state["errors"] += 1
+                SIMULATION_ERRORS.inc()
+
+            await scheduler.wait_next_tick()
     finally:
         print("Simulation stopped.")
 
+# The fleet simulation and backfills write into everyone's history, so only superusers run them
+def require_superuser(current_user: dict = Depends(get_current_user)) -> dict:
+    if not current_user["user"].is_superuser:
+        raise HTTPException(status_code=403, detail="Only superusers can control the shared simulation and backfills.")
+    return current_user
+
 @router.post("/start")
-async def start_simulation():
+async def start_simulation(current_user: dict = Depends(require_superuser)):
     if simulation_state["running"]:
         raise HTTPException(status_code=400, detail="Simulation already running.")
-    if influxdb_service is None:
-        raise HTTPException(status_code=500, detail="Influx DB has not been initialized.")
+    if write_path is None:
+        raise HTTPException(status_code=500, detail="Write path has not been initialized.")
+    if fleet_registry is None:
+        raise HTTPException(status_code=500, detail="Fleet registry has not been initialized.")
 
+    try:
+        qubit_mode, qubit_interval = qubit_telemetry_settings()
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    # Set before the workers start, so a second request cannot start them as well
     simulation_state["running"] = True
-    simulation_state["task"] = asyncio.create_task(simulation_loop())
+    if sharded_simulation is not None:
+        try:
+            await sharded_simulation.start(fleet_registry.computer_ids(), fleet_registry.profiles())
+        except Exception as e:
+            simulation_state["running"] = False
+            print(f"Error starting the sharded simulation: {e}")
+            raise HTTPException(status_code=500, detail=f"Could not start the simulation workers: {e}")
+    else:
+        simulation_state["task"] = asyncio.create_task(simulation_loop())
+    if qubit_mode != "off":
+        computer_ids = fleet_registry.computer_ids()
+        profiles = fleet_registry.profiles(computer_ids)
+        telemetry = QubitTelemetry(computer_ids, profiles=[profiles[computer_id] for computer_id in computer_ids], mode=qubit_mode)
+        simulation_state["qubits"] = telemetry
+        simulation_state["qubit_task"] = asyncio.create_task(qubit_telemetry_loop(telemetry, qubit_interval))
 
     return {
         "status": "started",
@@ -65,13 +219,17 @@ async def start_simulation():
     }
 
 @router.post("/stop")
-async def stop_simulation():
+async def stop_simulation(current_user: dict = Depends(require_superuser)):
     print("Attempting to stop simulation.")
     if not simulation_state["running"]:
         raise HTTPException(status_code=400, detail="Simulation cannot be stopped as it is not running.")
 
     simulation_state["running"] = False
 
+    if sharded_simulation is not None:
+        await sharded_simulation.stop()
+    await stop_qubit_telemetry()
+
     if simulation_state["task"]:
         print("Cancelling simulation task...")
         simulation_state["task"].cancel()
@@ -88,16 +246,184 @@ async def stop_simulation():
         "message": "Simulation stopped successfully"
     }
 
-@router.get("/status")
-async def get_simulation_status() -> Dict[str, bool]:
+@router.get("/status", response_model=Dict[str, Union[bool, int]])
+async def get_simulation_status(request: Request):
+    status = {
+        "running": simulation_state["running"],
+        "errors": simulation_state["errors"]
+    }
+    return response_cache.respond(request, "status", tuple(status.values()), lambda: (status, {}))
+
+@router.get("/schedule")
+async def get_simulation_schedule():
+    if sharded_simulation is not None:
+        return sharded_simulation.status()
+    if simulation_state["scheduler"] is None:
+        raise HTTPException(status_code=404, detail="The simulation has not been started.")
+    return simulation_state["scheduler"].stats()
+
+@router.get("/qubits")
+async def get_qubit_telemetry_stats():
+    if simulation_state["qubits"] is None:
+        raise HTTPException(status_code=404, detail="Qubit telemetry has not been started (QUBIT_TELEMETRY is off).")
     return {
-        "running": simulation_state["running"]
+        **simulation_state["qubits"].stats(),
+        "writes_in_flight": write_path.qubit_writes,
+        "skipped_ticks": write_path.skipped_qubit_ticks
     }
 
+@router.get("/qubits/{computer_id}")
+async def get_qubit_telemetry(computer_id: str):
+    if simulation_state["qubits"] is None:
+        raise HTTPException(status_code=404, detail="Qubit telemetry has not been started (QUBIT_TELEMETRY is off).")
+    device = simulation_state["qubits"].device(computer_id)
+    if device is None:
+        raise HTTPException(status_code=404, detail=f"No qubit telemetry for quantum computer {computer_id} yet.")
+    return device
+
+@router.get("/workers")
+async def get_simulation_workers():
+    if sharded_simulation is None:
+        raise HTTPException(status_code=404, detail="The simulation runs in the API process (SIMULATION_WORKERS=0).")
+    return sharded_simulation.status()
+
+@router.post("/workers")
+async def rebalance_simulation_workers(request: WorkersRequest, current_user: dict = Depends(require_superuser)):
+    if sharded_simulation is None:
+        raise HTTPException(status_code=404, detail="The simulation runs in the API process (SIMULATION_WORKERS=0).")
+    await sharded_simulation.rebalance(request.workers)
+    return sharded_simulation.status()
+
+def require_sessions() -> SimulationSessions:
+    if simulation_sessions is None:
+        raise HTTPException(status_code=500, detail="Simulation sessions have not been initialized.")
+    return simulation_sessions
+
+# Sessions are visible to their owner, and to superusers
+def find_session(session_id: str, current_user: dict) -> SimulationSession:
+    user = current_user["user"]
+    session = require_sessions().get(session_id)
+    if session is None or (session.owner != user.username and not user.is_superuser):
+        raise HTTPException(status_code=404, detail=f"Simulation session {session_id} not found.")
+    return session
+
+@router.post("/sessions", status_code=201)
+async def create_simulation_session(request: SessionRequest, current_user: dict = Depends(get_current_user)):
+    sessions = require_sessions()
+    if fleet_registry is None:
+        raise HTTPException(status_code=500, detail="Fleet registry has not been initialized.")
+
+    computer_ids = request.computer_ids or fleet_registry.computer_ids()[:request.fleet_size]
+    unknown = [computer_id for computer_id in computer_ids if fleet_registry.get(computer_id) is None]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown quantum computers: {unknown[:10]}")
+    profiles = fleet_registry.profiles(computer_ids)
+
+    try:
+        session = sessions.create(
+            current_user["user"].username,
+            request.name,
+            computer_ids,
+            request.interval_seconds,
+            request.seed,
+            [profiles[computer_id] for computer_id in computer_ids]
+        )
+    except SessionLimitError as e:
+        raise HTTPException(status_code=429 if e.per_user else 503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return session.info()
+
+@router.get("/sessions")
+async def get_simulation_sessions(current_user: dict = Depends(get_current_user)):
+    user = current_user["user"]
+    return [session.info() for session in require_sessions().list(None if user.is_superuser else user.username)]
+
+@router.get("/sessions/stats")
+async def get_simulation_session_stats(current_user: dict = Depends(get_current_user)):
+    return require_sessions().stats()
+
+@router.get("/sessions/{session_id}")
+async def get_simulation_session(session_id: str, current_user: dict = Depends(get_current_user)):
+    return find_session(session_id, current_user).info()
+
+@router.delete("/sessions/{session_id}", status_code=204)
+async def stop_simulation_session(session_id: str, current_user: dict = Depends(get_current_user)):
+    require_sessions().remove(find_session(session_id, current_user).id)
+    return Response(status_code=204)
+
+@router.get("/pipeline")
+async def get_write_pipeline_stats():
+    if write_path is None:
+        raise HTTPException(status_code=500, detail="Write path has not been initialized.")
+    return write_path.write_pipeline.stats()
+
+@router.get("/rollups")
+async def get_rollup_stats():
+    if write_path is None:
+        raise HTTPException(status_code=500, detail="Write path has not been initialized.")
+    if write_path.rollup_engine is None:
+        raise HTTPException(status_code=404, detail="Rollups are disabled (INFLUXDB_ROLLUP_BUCKET is empty).")
+    return {**write_path.rollup_engine.stats(), "failed_rollups": write_path.failed_rollups}
+
+@router.post("/backfill")
+async def start_backfill(request: BackfillRequest, current_user: dict = Depends(require_superuser)):
+    if backfill_service is None:
+        raise HTTPException(status_code=500, detail="Backfill service has not been initialized.")
+    if fleet_registry is None:
+        raise HTTPException(status_code=500, detail="Fleet registry has not been initialized.")
+
+    computer_ids = request.computer_ids or fleet_registry.computer_ids()[:request.fleet_size]
+    unknown = [computer_id for computer_id in computer_ids if fleet_registry.get(computer_id) is None]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown quantum computers: {unknown[:10]}")
+
+    try:
+        job = backfill_service.start(
+            computer_ids,
+            request.start,
+            request.end,
+            request.interval_seconds,
+            request.seed,
+            fleet_registry.profiles(computer_ids)
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    return job.progress()
+
+@router.get("/backfill")
+async def get_backfill_progress():
+    if backfill_service is None:
+        raise HTTPException(status_code=500, detail="Backfill service has not been initialized.")
+    if backfill_service.job is None:
+        raise HTTPException(status_code=404, detail="No backfill has been started.")
+    return backfill_service.job.progress()
+
+@router.post("/backfill/cancel")
+async def cancel_backfill(current_user: dict = Depends(require_superuser)):
+    if backfill_service is None:
+        raise HTTPException(status_code=500, detail="Backfill service has not been initialized.")
+    if not await backfill_service.cancel():
+        raise HTTPException(status_code=400, detail="No backfill is running.")
+    return backfill_service.job.progress()
+
 async def cleanup():
+    if backfill_service is not None:
+        await backfill_service.cancel()
+
+    if simulation_sessions is not None:
+        await simulation_sessions.close()
+
     if simulation_state["running"]:
         print("Stopping simulation...")
         simulation_state["running"] = False
+        if sharded_simulation is not None:
+            await sharded_simulation.stop()
+        await stop_qubit_telemetry()
         if simulation_state["task"] is not None:
             simulation_state["task"].cancel()
             try:
@@ -0,0 +1,62 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from services.stream_hub import StreamHub
+import asyncio
+from typing import Optional
+
+router = APIRouter(
+    prefix="/stream",
+    tags=["stream"]
+)
+
+KEEPALIVE_SECONDS = 15
+
+stream_hub: Optional[StreamHub] = None
+
+def set_stream_hub(hub: StreamHub):
+    global stream_hub
+    stream_hub = hub
+
+def parse_list(value: Optional[str]):
+    if not value:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+@router.get("")
+async def stream_metrics(computers: Optional[str] = None, metrics: Optional[str] = None):
+    if stream_hub is None:
+        raise HTTPException(status_code=500, detail="Stream hub has not been initialized.")
+
+    if stream_hub.subscriber_count >= stream_hub.max_subscribers:
+        raise HTTPException(status_code=503, detail="Too many stream subscribers.")
+    computer_ids, metric_names = parse_list(computers), parse_list(metrics)
+
+    async def events():
+        # Subscribed only once the body is iterated: a client gone before then never starts the
+        # generator, so its finally would not run and the subscriber would be left behind
+        try:
+            subscriber = stream_hub.subscribe(computer_ids, metric_names)
+        except RuntimeError:
+            # Filled up since the check above
+            return
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber.next_frame(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            stream_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/stats")
+async def get_stream_stats():
+    if stream_hub is None:
+        raise HTTPException(status_code=500, detail="Stream hub has not been initialized.")
+    return stream_hub.stats()
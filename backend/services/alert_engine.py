@@ -0,0 +1,398 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from models.alert_rule import ALERT_OPERATORS, AlertRule
+from models.metric_batch import MetricBatch, ShapeCache, group_repeats
+from services.line_protocol import escape_measurement, escape_tag, format_float
+
+ALERT_MEASUREMENT = "alert"
+
+NS_PER_SECOND = 1_000_000_000
+
+STREAK_LIMIT = np.iinfo(np.int32).max
+
+# Longest for_seconds a rule may ask for
+MAX_FOR_SECONDS = 30 * 86400
+
+FIRING = 1
+RESOLVED = 2
+
+# (timestamp_ns, rule_id, rule_name, severity, computer_id, metric_name, state, value, threshold)
+AlertEvent = Tuple[int, int, str, str, str, str, str, float, float]
+
+
+def _grown(array: np.ndarray, size: int, fill) -> np.ndarray:
+    # The array with at least size entries, doubling so that appends stay amortized O(1)
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, 2 * len(array), 64), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def compile_rule(rule: AlertRule) -> Tuple[float, float, bool, float, int, int]:
+    # The rule's row of parameters (sign, bound, strict, hysteresis, for_samples, for_ns), or
+    # ValueError if it cannot be evaluated
+    if rule.operator not in ALERT_OPERATORS:
+        raise ValueError(f"Unknown operator '{rule.operator}'")
+    if not np.isfinite(rule.threshold) or not np.isfinite(rule.hysteresis) or rule.hysteresis < 0:
+        raise ValueError("threshold and hysteresis must be finite, hysteresis not negative")
+    if not 1 <= rule.for_samples <= STREAK_LIMIT:
+        raise ValueError(f"for_samples must be between 1 and {STREAK_LIMIT}")
+    if not 0 <= rule.for_seconds <= MAX_FOR_SECONDS:
+        raise ValueError(f"for_seconds must be between 0 and {MAX_FOR_SECONDS}")
+
+    sign = 1.0 if rule.operator in (">", ">=") else -1.0
+    return (
+        sign, sign * rule.threshold, rule.operator in (">", "<"), rule.hysteresis,
+        rule.for_samples, int(rule.for_seconds * NS_PER_SECOND)
+    )
+
+
+# Evaluates threshold alert rules against every written point. Rules are compiled into rows of
+# per-rule parameter arrays, with the comparison turned into a sign and a bound so that every
+# operator reads sign * value > bound (or >=), and indexed by (computer_id, metric_name), with
+# None for rules on all computers. Each batch shape is paired once with the rules of its series;
+# a batch then costs a fixed number of vectorized operations over its (point, rule) pairs and
+# points without rules cost nothing. State lives per (rule, computer) instance in a few compact
+# arrays. Notifications are deduplicated: one event when an instance starts firing and one when
+# it resolves, and an instance firing again within cooldown_seconds of resolving is only
+# reported if it is still firing once the cooldown is over.
+class AlertEngine:
+    def __init__(self, max_instances: int = 1_000_000, cooldown_seconds: float = 300.0, max_events: int = 10_000):
+        self.max_instances = max_instances
+        self.cooldown_ns = int(cooldown_seconds * NS_PER_SECOND)
+
+        self._rules: List[Optional[AlertRule]] = []
+        self._slots: Dict[int, int] = {}
+        self._free_slots: List[int] = []
+        self._index: Dict[Tuple[Optional[str], str], List[int]] = {}
+        self._sign = np.zeros(0, dtype=np.float64)
+        self._bound = np.zeros(0, dtype=np.float64)
+        self._strict = np.zeros(0, dtype=bool)
+        self._hysteresis = np.zeros(0, dtype=np.float64)
+        self._for_samples = np.zeros(0, dtype=np.int32)
+        self._for_ns = np.zeros(0, dtype=np.int64)
+
+        self._instances: Dict[Tuple[int, str], int] = {}
+        self._slot_instances: Dict[int, List[int]] = {}
+        self._free_instances: List[int] = []
+        self._instance_computers: List[Optional[str]] = []
+        self._instance_slot = np.zeros(0, dtype=np.int32)
+        self._streak = np.zeros(0, dtype=np.int32)
+        self._since_ns = np.zeros(0, dtype=np.int64)
+        self._resolved_ns = np.zeros(0, dtype=np.int64)
+        self._value = np.zeros(0, dtype=np.float64)
+        self._firing = np.zeros(0, dtype=bool)
+        self._notified = np.zeros(0, dtype=bool)
+
+        self._shapes = ShapeCache()
+        self._series_pairs: Dict[Tuple[str, str], Tuple[List[int], List[int]]] = {}
+        self.version = 0
+
+        self.events: Deque[AlertEvent] = deque(maxlen=max_events)
+        self.observed_points = 0
+        self.evaluated_pairs = 0
+        self.dropped_pairs = 0
+        self.fired = 0
+        self.resolved = 0
+        self.suppressed = 0
+        self.last_batch_ns_per_point = 0.0
+
+    @property
+    def rules(self) -> int:
+        return len(self._slots)
+
+    @property
+    def firing(self) -> int:
+        return int(self._firing.sum())
+
+    def replace(self, rules: Iterable[AlertRule]) -> None:
+        for rule_id in list(self._slots):
+            self.remove(rule_id)
+        for rule in rules:
+            self.upsert(rule)
+
+    def upsert(self, rule: AlertRule) -> None:
+        # A changed rule starts over without state; disabled rules are not evaluated at all.
+        # Raises ValueError, leaving the engine as it was, for rules compile_rule refuses.
+        parameters = compile_rule(rule)
+        self.remove(rule.id)
+        if not rule.enabled:
+            return
+
+        slot = self._free_slots.pop() if self._free_slots else len(self._rules)
+        if slot == len(self._rules):
+            self._rules.append(None)
+            size = len(self._rules)
+            self._sign = _grown(self._sign, size, 0.0)
+            self._bound = _grown(self._bound, size, 0.0)
+            self._strict = _grown(self._strict, size, False)
+            self._hysteresis = _grown(self._hysteresis, size, 0.0)
+            self._for_samples = _grown(self._for_samples, size, 1)
+            self._for_ns = _grown(self._for_ns, size, 0)
+
+        self._rules[slot] = rule
+        self._slots[rule.id] = slot
+        (
+            self._sign[slot], self._bound[slot], self._strict[slot], self._hysteresis[slot],
+            self._for_samples[slot], self._for_ns[slot]
+        ) = parameters
+        self._index.setdefault((rule.computer_id, rule.metric_name), []).append(slot)
+        self._series_pairs.clear()
+        self.version += 1
+
+    def remove(self, rule_id: int) -> None:
+        slot = self._slots.pop(rule_id, None)
+        if slot is None:
+            return
+        rule = self._rules[slot]
+        key = (rule.computer_id, rule.metric_name)
+        self._index[key].remove(slot)
+        if not self._index[key]:
+            del self._index[key]
+
+        for instance in self._slot_instances.pop(slot, []):
+            del self._instances[(slot, self._instance_computers[instance])]
+            self._instance_computers[instance] = None
+            self._firing[instance] = False
+            self._notified[instance] = False
+            self._free_instances.append(instance)
+        self._rules[slot] = None
+        self._free_slots.append(slot)
+        self._series_pairs.clear()
+        self.version += 1
+
+    def observe(self, batch: MetricBatch) -> List[AlertEvent]:
+        started = time.perf_counter_ns()
+        self.observed_points += len(batch.values)
+        points, instances, slots, unique = self._pairs_for(batch)
+        if not len(points):
+            return []
+
+        values = batch.values[points]
+        if batch.timestamps_ns is None:
+            timestamps = np.full(len(points), batch.timestamp_ns, dtype=np.int64)
+        else:
+            timestamps = batch.timestamps_ns[points]
+
+        if unique:
+            notify = self._evaluate(instances, slots, values, timestamps)
+        else:
+            # Like the anomaly detector: the first point of every instance together, then the
+            # second, and so on, oldest first
+            order, position, _ = group_repeats(instances, timestamps)
+            rounds = order[np.argsort(position, kind="stable")]
+            bounds = np.searchsorted(np.sort(position), np.arange(1, int(position.max()) + 2))
+            notify = np.zeros(len(points), dtype=np.int8)
+            for start, stop in zip(np.r_[0, bounds[:-1]].tolist(), bounds.tolist()):
+                chosen = rounds[start:stop]
+                notify[chosen] = self._evaluate(instances[chosen], slots[chosen], values[chosen], timestamps[chosen])
+
+        found = []
+        for pair in np.flatnonzero(notify).tolist():
+            rule = self._rules[slots[pair]]
+            state = "firing" if notify[pair] == FIRING else "resolved"
+            found.append((
+                int(timestamps[pair]), rule.id, rule.name, rule.severity,
+                self._instance_computers[instances[pair]], rule.metric_name, state, float(values[pair]), rule.threshold
+            ))
+        self.events.extend(found)
+
+        self.evaluated_pairs += len(points)
+        self.last_batch_ns_per_point = (time.perf_counter_ns() - started) / len(batch.values)
+        return found
+
+    def active(self, computer_id: Optional[str] = None, metric_name: Optional[str] = None) -> List[dict]:
+        found = []
+        for instance in np.flatnonzero(self._firing).tolist():
+            rule = self._rules[self._instance_slot[instance]]
+            instance_computer = self._instance_computers[instance]
+            if computer_id is not None and instance_computer != computer_id:
+                continue
+            if metric_name is not None and rule.metric_name != metric_name:
+                continue
+            found.append({
+                "rule_id": rule.id,
+                "rule_name": rule.name,
+                "severity": rule.severity,
+                "computer_id": instance_computer,
+                "metric_name": rule.metric_name,
+                "operator": rule.operator,
+                "threshold": rule.threshold,
+                "value": float(self._value[instance]),
+                "since": int(self._since_ns[instance]) // 1_000_000,
+                "notified": bool(self._notified[instance])
+            })
+        return found
+
+    def recent(
+            self,
+            computer_id: Optional[str] = None,
+            rule_id: Optional[int] = None,
+            since_ns: Optional[int] = None,
+            limit: int = 100
+    ) -> List[AlertEvent]:
+        found = []
+        for event in reversed(self.events):
+            # Kept in arrival order, which ingested points with their own timestamps need not follow
+            if since_ns is not None and event[0] < since_ns:
+                continue
+            if computer_id is not None and event[4] != computer_id:
+                continue
+            if rule_id is not None and event[1] != rule_id:
+                continue
+            found.append(event)
+            if len(found) >= limit:
+                break
+        return found
+
+    def encode(self, events: List[AlertEvent]) -> bytes:
+        lines = []
+        for timestamp_ns, rule_id, _, severity, computer_id, metric_name, state, value, threshold in events:
+            lines.append(
+                f"{escape_measurement(ALERT_MEASUREMENT)},computer_id={escape_tag(computer_id)},"
+                f"metric_name={escape_tag(metric_name)},rule_id={rule_id},severity={escape_tag(severity)},"
+                f"state={state} threshold={format_float(threshold)},value={format_float(value)} {timestamp_ns}"
+            )
+        return "\n".join(lines).encode()
+
+    def stats(self) -> dict:
+        return {
+            "rules": self.rules,
+            "instances": len(self._instances),
+            "max_instances": self.max_instances,
+            "firing": self.firing,
+            "observed_points": self.observed_points,
+            "evaluated_pairs": self.evaluated_pairs,
+            "dropped_pairs": self.dropped_pairs,
+            "fired": self.fired,
+            "resolved": self.resolved,
+            "suppressed": self.suppressed,
+            "last_batch_ns_per_point": round(self.last_batch_ns_per_point, 1)
+        }
+
+    def _evaluate(self, instances: np.ndarray, slots: np.ndarray, values: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        # Instances must be unique; returns FIRING or RESOLVED for the pairs to notify, 0 for the rest
+        signed = self._sign[slots] * values
+        bound = self._bound[slots]
+        breach = np.where(self._strict[slots], signed > bound, signed >= bound)
+
+        streak = self._streak[instances]
+        since = np.where(breach & (streak == 0), timestamps, self._since_ns[instances])
+        streak = np.where(breach, np.minimum(streak + 1, STREAK_LIMIT), 0)
+        held = breach & (streak >= self._for_samples[slots]) & (timestamps - since >= self._for_ns[slots])
+
+        was_firing = self._firing[instances]
+        resolved_ns = self._resolved_ns[instances]
+        resolve = was_firing & ~breach & (signed <= bound - self._hysteresis[slots])
+        firing = (was_firing | held) & ~resolve
+
+        notified = self._notified[instances]
+        notify_fire = firing & ~notified & (timestamps - resolved_ns >= self.cooldown_ns)
+        notify_resolve = resolve & notified
+        self.suppressed += int(np.count_nonzero(held & ~was_firing & ~notify_fire))
+        self.fired += int(np.count_nonzero(notify_fire))
+        self.resolved += int(np.count_nonzero(notify_resolve))
+
+        self._streak[instances] = streak
+        self._since_ns[instances] = since
+        self._value[instances] = values
+        self._firing[instances] = firing
+        self._notified[instances] = (notified | notify_fire) & ~resolve
+        self._resolved_ns[instances] = np.where(resolve, timestamps, resolved_ns)
+        return np.where(notify_fire, FIRING, np.where(notify_resolve, RESOLVED, 0)).astype(np.int8)
+
+    def _pairs_for(self, batch: MetricBatch) -> tuple:
+        if not self._index:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty, True
+        if batch.one_off:
+            return self._build_pairs(batch)
+
+        # Built once per batch shape and rule set
+        cached = self._shapes.get(batch.shape)
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        return self._shapes.put(batch.shape, (self.version, self._build_pairs(batch)))[1]
+
+    def _build_pairs(self, batch: MetricBatch) -> tuple:
+        # Every (point, rule) pair of the batch as arrays of point index, instance and rule slot
+        computers = len(batch.computer_ids)
+        series = batch.metric_index.astype(np.int64) * computers + batch.computer_index
+        distinct, inverse = np.unique(series, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        positions, lengths, instances, slots = [], [], [], []
+        series_pairs = self._series_pairs
+        for position, pair in enumerate(distinct.tolist()):
+            key = (batch.computer_ids[pair % computers], batch.metric_names[pair // computers])
+            found = series_pairs.get(key)
+            if found is None:
+                found = series_pairs[key] = self._pairs_of_series(*key)
+            if found[0]:
+                positions.append(position)
+                lengths.append(len(found[0]))
+                instances.extend(found[0])
+                slots.extend(found[1])
+
+        if not positions:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty, True
+
+        # Every pair applies to all points of its series, usually exactly one
+        positions = np.repeat(np.array(positions, dtype=np.int64), lengths)
+        counts = np.bincount(inverse, minlength=len(distinct))
+        points_by_series = np.argsort(inverse, kind="stable")
+        first = np.cumsum(counts) - counts
+        repeats = counts[positions]
+        offsets = np.arange(int(repeats.sum())) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        points = points_by_series[np.repeat(first[positions], repeats) + offsets]
+        instances = np.repeat(np.array(instances, dtype=np.int64), repeats)
+        slots = np.repeat(np.array(slots, dtype=np.int64), repeats)
+        return points, instances, slots, bool((repeats == 1).all())
+
+    def _pairs_of_series(self, computer_id: str, metric_name: str) -> Tuple[List[int], List[int]]:
+        # Instances and rule slots of one series, kept until the rules change
+        instances, slots = [], []
+        for slot in self._index.get((computer_id, metric_name), []) + self._index.get((None, metric_name), []):
+            instance = self._instance_for(slot, computer_id)
+            if instance < 0:
+                self.dropped_pairs += 1
+                continue
+            instances.append(instance)
+            slots.append(slot)
+        return instances, slots
+
+    def _instance_for(self, slot: int, computer_id: str) -> int:
+        instance = self._instances.get((slot, computer_id))
+        if instance is not None:
+            return instance
+
+        if self._free_instances:
+            instance = self._free_instances.pop()
+            self._instance_computers[instance] = computer_id
+        else:
+            if len(self._instance_computers) >= self.max_instances:
+                return -1
+            instance = len(self._instance_computers)
+            self._instance_computers.append(computer_id)
+            size = len(self._instance_computers)
+            self._instance_slot = _grown(self._instance_slot, size, 0)
+            self._streak = _grown(self._streak, size, 0)
+            self._since_ns = _grown(self._since_ns, size, 0)
+            self._resolved_ns = _grown(self._resolved_ns, size, np.iinfo(np.int64).min // 2)
+            self._value = _grown(self._value, size, 0.0)
+            self._firing = _grown(self._firing, size, False)
+            self._notified = _grown(self._notified, size, False)
+
+        self._instance_slot[instance] = slot
+        self._streak[instance] = 0
+        self._since_ns[instance] = 0
+        self._resolved_ns[instance] = np.iinfo(np.int64).min // 2
+        self._instances[(slot, computer_id)] = instance
+        self._slot_instances.setdefault(slot, []).append(instance)
+        return instance
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from models.alert_rule import AlertRule, AlertRuleRecord
+from services.alert_engine import AlertEngine, compile_rule
+from services.postgres_db import DATABASE_MODE, async_session_scope, session_scope
+
+RULE_FIELDS = tuple(name for name in AlertRule.model_fields if name != "id")
+
+
+def _to_rule(record: AlertRuleRecord) -> AlertRule:
+    return AlertRule(id=record.id, **{field: getattr(record, field) for field in RULE_FIELDS})
+
+
+# The alert_rules table, loaded once into memory. Every change is checked with compile_rule
+# (ValueError if the engine cannot evaluate it), written to the database and then handed to the
+# engine, so the engine always evaluates what is stored.
+class AlertRuleStore:
+    def __init__(self, engine: AlertEngine):
+        self.engine = engine
+        self._rules: Dict[int, AlertRule] = {}
+        self.version = 0
+
+    async def load(self) -> None:
+        records = await self._run(lambda db: list(db.scalars(select(AlertRuleRecord))))
+        self._rules = {}
+        for record in records:
+            rule = _to_rule(record)
+            try:
+                compile_rule(rule)
+            except ValueError as e:
+                print(f"Skipping alert rule {rule.id} ('{rule.name}'): {e}")
+                continue
+            self._rules[rule.id] = rule
+        self.engine.replace(self._rules.values())
+        self.version += 1
+        print(f"Alert rules loaded: {len(self._rules)} ({self.engine.rules} enabled).")
+
+    def list(self, computer_id: Optional[str] = None, metric_name: Optional[str] = None) -> List[AlertRule]:
+        return [
+            rule for rule in self._rules.values()
+            if (computer_id is None or rule.computer_id == computer_id)
+            and (metric_name is None or rule.metric_name == metric_name)
+        ]
+
+    def get(self, rule_id: int) -> Optional[AlertRule]:
+        return self._rules.get(rule_id)
+
+    async def create(self, fields: dict) -> AlertRule:
+        compile_rule(AlertRule(id=0, **fields))
+
+        def create(db: Session) -> AlertRuleRecord:
+            record = AlertRuleRecord(**fields)
+            db.add(record)
+            db.commit()
+            db.refresh(record)
+            return record
+
+        return self._apply(_to_rule(await self._run(create)))
+
+    async def update(self, rule_id: int, fields: dict) -> Optional[AlertRule]:
+        compile_rule(AlertRule(id=rule_id, **fields))
+
+        def change(db: Session) -> int:
+            result = db.execute(update(AlertRuleRecord).where(AlertRuleRecord.id == rule_id).values(**fields))
+            db.commit()
+            return result.rowcount
+
+        if not await self._run(change):
+            return None
+        return self._apply(AlertRule(id=rule_id, **fields))
+
+    async def delete(self, rule_id: int) -> bool:
+        def remove(db: Session) -> int:
+            result = db.execute(delete(AlertRuleRecord).where(AlertRuleRecord.id == rule_id))
+            db.commit()
+            return result.rowcount
+
+        if not await self._run(remove):
+            return False
+        self._rules.pop(rule_id, None)
+        self.engine.remove(rule_id)
+        self.version += 1
+        return True
+
+    def _apply(self, rule: AlertRule) -> AlertRule:
+        self._rules[rule.id] = rule
+        self.engine.upsert(rule)
+        self.version += 1
+        return rule
+
+    @staticmethod
+    async def _run(function):
+        # function(db) with a sync session, in a worker thread or through the async engine
+        if DATABASE_MODE == "sync":
+            def run():
+                with session_scope() as db:
+                    return function(db)
+
+            return await asyncio.to_thread(run)
+
+        async with async_session_scope() as db:
+            return await db.run_sync(function)
@@ -0,0 +1,197 @@
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models.metric_batch import MetricBatch, ShapeCache, group_repeats
+from services.line_protocol import escape_measurement, escape_tag, format_float
+
+ANOMALY_MEASUREMENT = "anomaly"
+
+# (timestamp_ns, computer_id, metric_name, detector, value, expected, score)
+Anomaly = Tuple[int, str, str, str, float, float, float]
+
+
+# Online anomaly detection over every (computer_id, metric_name) series. Each series keeps an
+# EWMA mean/variance, a sign-step median with an EWMA absolute deviation (for a robust z-score)
+# and two-sided CUSUM sums in preallocated arrays, so a batch is scored with a fixed number of
+# vectorized operations and no history. A robust z-score above `threshold` is reported as a
+# "spike", a CUSUM sum above `cusum_h` as a "shift" (slow drifts such as fidelity decay).
+class AnomalyDetector:
+    def __init__(
+            self,
+            max_series: int = 100_000,
+            alpha: float = 0.2,
+            threshold: float = 6.0,
+            cusum_k: float = 0.5,
+            cusum_h: float = 20.0,
+            warmup: int = 30,
+            max_anomalies: int = 10_000
+    ):
+        self.max_series = max_series
+        self.alpha = alpha
+        self.threshold = threshold
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.warmup = warmup
+
+        self._series: Dict[Tuple[str, str], int] = {}
+        self._shapes = ShapeCache()
+        self._count = np.zeros(max_series, dtype=np.int64)
+        self._mean = np.zeros(max_series, dtype=np.float64)
+        self._var = np.zeros(max_series, dtype=np.float64)
+        self._median = np.zeros(max_series, dtype=np.float64)
+        self._deviation = np.zeros(max_series, dtype=np.float64)
+        self._cusum_high = np.zeros(max_series, dtype=np.float64)
+        self._cusum_low = np.zeros(max_series, dtype=np.float64)
+
+        self.anomalies: Deque[Anomaly] = deque(maxlen=max_anomalies)
+        self.observed_points = 0
+        self.rejected_points = 0
+        self.spikes = 0
+        self.shifts = 0
+        self.last_batch_ns_per_point = 0.0
+
+    def observe(self, batch: MetricBatch) -> List[Anomaly]:
+        started = time.perf_counter_ns()
+        rows, unique = batch.series_rows(self._row_for, self._shapes)
+        values = batch.values
+
+        accepted = rows >= 0
+        if not accepted.all():
+            self.rejected_points += int((~accepted).sum())
+
+        timestamps = batch.timestamps_ns
+        if unique:
+            flagged = self._observe(np.flatnonzero(accepted), rows[accepted], values[accepted])
+        else:
+            # Repeated series in one batch have to be scored one after the other: the first row
+            # of every series together, then the second, and so on, oldest first
+            indexes = np.flatnonzero(accepted)
+            order, position, _ = group_repeats(rows[indexes], batch.timestamp_ns if timestamps is None else timestamps[indexes])
+            rounds = np.argsort(position, kind="stable")
+            indexes = indexes[order][rounds]
+            bounds = np.searchsorted(position[rounds], np.arange(1, int(position.max(initial=-1)) + 2))
+            flagged = []
+            for start, stop in zip(np.r_[0, bounds[:-1]].tolist(), bounds.tolist()):
+                chosen = indexes[start:stop]
+                flagged += self._observe(chosen, rows[chosen], values[chosen])
+
+        found = []
+        for index, detector, expected, score in flagged:
+            found.append((
+                batch.timestamp_ns if timestamps is None else int(timestamps[index]),
+                batch.computer_ids[batch.computer_index[index]],
+                batch.metric_names[batch.metric_index[index]],
+                detector,
+                float(values[index]),
+                expected,
+                score
+            ))
+        self.anomalies.extend(found)
+
+        self.observed_points += len(values)
+        if len(values):
+            self.last_batch_ns_per_point = (time.perf_counter_ns() - started) / len(values)
+        return found
+
+    def recent(
+            self,
+            computer_id: Optional[str] = None,
+            metric_name: Optional[str] = None,
+            since_ns: Optional[int] = None,
+            limit: int = 100
+    ) -> List[Anomaly]:
+        found = []
+        for anomaly in reversed(self.anomalies):
+            # Kept in arrival order, which ingested points with their own timestamps need not follow
+            if since_ns is not None and anomaly[0] < since_ns:
+                continue
+            if computer_id is not None and anomaly[1] != computer_id:
+                continue
+            if metric_name is not None and anomaly[2] != metric_name:
+                continue
+            found.append(anomaly)
+            if len(found) >= limit:
+                break
+        return found
+
+    def encode(self, anomalies: List[Anomaly]) -> bytes:
+        lines = []
+        for timestamp_ns, computer_id, metric_name, detector, value, expected, score in anomalies:
+            lines.append(
+                f"{escape_measurement(ANOMALY_MEASUREMENT)},computer_id={escape_tag(computer_id)},"
+                f"detector={escape_tag(detector)},metric_name={escape_tag(metric_name)} "
+                f"expected={format_float(expected)},score={format_float(score)},value={format_float(value)} "
+                f"{timestamp_ns}"
+            )
+        return "\n".join(lines).encode()
+
+    def stats(self) -> dict:
+        return {
+            "series": len(self._series),
+            "max_series": self.max_series,
+            "observed_points": self.observed_points,
+            "rejected_points": self.rejected_points,
+            "spikes": self.spikes,
+            "shifts": self.shifts,
+            "retained_anomalies": len(self.anomalies),
+            "last_batch_ns_per_point": round(self.last_batch_ns_per_point, 1),
+            "state_bytes": 7 * 8 * self.max_series
+        }
+
+    def _observe(self, indexes: np.ndarray, rows: np.ndarray, x: np.ndarray) -> List[Tuple[int, str, float, float]]:
+        count = self._count[rows]
+        mean = self._mean[rows]
+        median = self._median[rows]
+        first = count == 0
+        warm = count >= self.warmup
+
+        # Floors keep near-constant series from dividing by zero
+        floor = 1e-6 + 1e-4 * np.abs(mean)
+        std = np.maximum(np.sqrt(self._var[rows]), floor)
+        spread = np.maximum(1.4826 * self._deviation[rows], floor)
+
+        z = (x - mean) / std
+        robust_z = (x - median) / spread
+
+        # Capped so that one spike cannot trip the CUSUM as well
+        step = np.clip(z, -self.threshold, self.threshold)
+        high = np.where(warm, np.maximum(0.0, self._cusum_high[rows] + step - self.cusum_k), 0.0)
+        low = np.where(warm, np.maximum(0.0, self._cusum_low[rows] - step - self.cusum_k), 0.0)
+
+        spike = warm & (np.abs(robust_z) > self.threshold)
+        shift = warm & ~spike & ((high > self.cusum_h) | (low > self.cusum_h))
+
+        # Outliers only move the estimates as far as the threshold
+        clipped = np.where(warm, np.clip(x, mean - self.threshold * std, mean + self.threshold * std), x)
+        delta = clipped - mean
+        self._mean[rows] = np.where(first, x, mean + self.alpha * delta)
+        self._var[rows] = np.where(first, 0.0, (1 - self.alpha) * (self._var[rows] + self.alpha * delta * delta))
+        deviation = np.minimum(np.abs(x - median), self.threshold * spread)
+        self._median[rows] = np.where(first, x, median + self.alpha * spread * np.sign(x - median))
+        self._deviation[rows] = np.where(first, 0.0, self._deviation[rows] + self.alpha * (deviation - self._deviation[rows]))
+        self._cusum_high[rows] = np.where(shift, 0.0, high)
+        self._cusum_low[rows] = np.where(shift, 0.0, low)
+        self._count[rows] = count + 1
+
+        flagged = []
+        for i in np.flatnonzero(spike | shift).tolist():
+            if spike[i]:
+                self.spikes += 1
+                flagged.append((int(indexes[i]), "spike", float(median[i]), float(robust_z[i])))
+            else:
+                self.shifts += 1
+                score = float(high[i]) if high[i] > self.cusum_h else -float(low[i])
+                flagged.append((int(indexes[i]), "shift", float(mean[i]), score))
+        return flagged
+
+    def _row_for(self, computer_id: str, metric_name: str) -> int:
+        row = self._series.get((computer_id, metric_name))
+        if row is None:
+            if len(self._series) >= self.max_series:
+                return -1
+            row = len(self._series)
+            self._series[(computer_id, metric_name)] = row
+        return row
@@ -1,8 +1,16 @@
+import asyncio
+import multiprocessing
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Dict, Optional, Set, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+from services.instrumentation import metrics
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
@@ -10,6 +18,11 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+PASSWORD_SECONDS = metrics.histogram(
+    "password_hash_duration_seconds", "bcrypt hashing and verification, including the wait for a worker", ("operation",)
+)
+PASSWORD_REJECTED = metrics.counter("password_hash_rejected", "Password checks turned away because too many were pending")
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -33,10 +46,158 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
-def decode_access_token(token: str) -> Optional[str]:
+def decode_access_token_claims(token: str) -> Optional[dict]:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        return username
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        return None
\ No newline at end of file
+        return None
+
+
+def decode_access_token(token: str) -> Optional[str]:
+    payload = decode_access_token_claims(token)
+    if payload is None:
+        return None
+    username: str = payload.get("sub")
+    return username
+
+
+# bcrypt is deliberately slow and holds the GIL for most of it, so hashing and verification
+# run in a small process pool of their own instead of the threads that serve the other routes.
+# At most max_pending operations wait for it; beyond that callers are turned away.
+class PasswordHasher:
+    def __init__(self, workers: int = 2, max_pending: int = 64):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        if self._executor is None:
+            # Spawned workers, forking a process that runs the event loop and client threads is not safe
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_password_hash, password)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self._executor is not None,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+    async def _run(self, operation: str, function, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            PASSWORD_REJECTED.inc()
+            raise RuntimeError("Too many password checks in progress.")
+
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            if self._executor is None:
+                return await asyncio.to_thread(function, *args)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+            except BrokenProcessPool:
+                # A worker died; the next call gets a fresh pool
+                print("Password hashing pool broke, restarting it.")
+                self.shutdown()
+                self.start()
+                raise
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            PASSWORD_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+
+# Bounded LRU of verified tokens to a snapshot of their user. Entries live until the token
+# expires or ttl_seconds pass, whichever is first, and every token of a user is dropped as soon
+# as that user changes.
+class TokenCache:
+    def __init__(self, max_entries: int = 10_000, ttl_seconds: float = 60.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, int, object]]" = OrderedDict()
+        self._user_tokens: Dict[int, Set[str]] = {}
+        # Invalidation comes from SQLAlchemy events, which fire on worker threads
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._remove(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, token: str, user_id: int, snapshot, expires_at: datetime) -> None:
+        token_seconds = (expires_at - datetime.now(timezone.utc)).total_seconds()
+        lifetime = min(self.ttl_seconds, token_seconds)
+        if lifetime <= 0:
+            return
+
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (time.monotonic() + lifetime, user_id, snapshot)
+            self._user_tokens.setdefault(user_id, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            tokens = self._user_tokens.pop(user_id, set())
+            for token in tokens:
+                self._entries.pop(token, None)
+            self.invalidations += len(tokens)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations
+        }
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._user_tokens.get(entry[1])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._user_tokens[entry[1]]
+
+
+password_hasher = PasswordHasher(
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+)
+
+token_cache = TokenCache(
+    max_entries=int(os.getenv("TOKEN_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "60"))
+)
@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models.metric import METRIC_NAMES, METRIC_UNITS
+from models.metric_batch import to_timestamp_ns
+from services.fleet_simulator import FleetSimulator, random_state
+from services.influxdb_service import InfluxDBService
+from services.line_protocol import LineProtocolEncoder
+from services.rollups import EMPTY_AGGREGATE, ROLLUP_TIERS, aggregate_windows, encode_rollups, merge_aggregates
+
+NS_PER_SECOND = 10 ** 9
+
+SEED_BLOCK_TICKS = 1000
+
+# Each worker process encodes with its own encoder
+_encoder = LineProtocolEncoder()
+
+
+def derive_seed(seed: int, *parts) -> int:
+    # Stable across processes and interpreter runs, unlike hash()
+    digest = hashlib.blake2b(repr((seed,) + parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def generate_chunk(
+        computer_id: str,
+        seed: int,
+        start_ns: int,
+        interval_ns: int,
+        first_tick: int,
+        ticks: int,
+        total_ticks: int = 0,
+        rollups: bool = False,
+        profile: Optional[dict] = None
+) -> Tuple[bytes, bytes, list]:
+    # Every computer draws its fixed offsets from its own seed and the noise of each block of
+    # SEED_BLOCK_TICKS from a seed derived from the block position, so chunks can be generated
+    # independently and the output is the same for any worker count or chunk size
+    simulator = FleetSimulator(
+        [computer_id], seed=derive_seed(seed, computer_id), profiles=[profile] if profile else None
+    )
+    simulator.iteration_count[:] = first_tick
+
+    blocks = []
+    for block_start in range(first_tick, first_tick + ticks, SEED_BLOCK_TICKS):
+        simulator.rng = random_state(derive_seed(seed, computer_id, block_start // SEED_BLOCK_TICKS))
+        blocks.append(simulator.run(min(SEED_BLOCK_TICKS, first_tick + ticks - block_start)))
+
+    timestamps = start_ns + (first_tick + np.arange(ticks, dtype=np.int64)) * interval_ns
+    payload = []
+    rollup_payload = []
+    edges = []
+    for metric_name in METRIC_NAMES:
+        values = np.concatenate([block[metric_name] for block in blocks])
+        payload.append(_encoder.encode_series(computer_id, metric_name, METRIC_UNITS[metric_name], timestamps, values))
+        if not rollups:
+            continue
+
+        for tier, seconds in ROLLUP_TIERS.items():
+            window_ns = seconds * NS_PER_SECOND
+            window_starts, aggregates = aggregate_windows(timestamps, values, window_ns)
+            complete = np.ones(len(window_starts), dtype=bool)
+
+            # Only the first and last window can have ticks in other chunks, those are merged by the job
+            for window_start in {int(timestamps[0] - timestamps[0] % window_ns), int(timestamps[-1] - timestamps[-1] % window_ns)}:
+                first, last = window_ticks(window_start, window_ns, start_ns, interval_ns, total_ticks)
+                if first >= first_tick and last <= first_tick + ticks:
+                    continue
+                position = np.flatnonzero(window_starts == window_start)
+                if len(position):
+                    complete[position] = False
+                    aggregate = aggregates[position[0]]
+                else:
+                    aggregate = EMPTY_AGGREGATE
+                in_chunk = min(last, first_tick + ticks) - max(first, first_tick)
+                edges.append((metric_name, tier, window_start, aggregate, in_chunk))
+
+            rollup_payload.append(encode_rollups(computer_id, metric_name, tier, window_starts[complete], aggregates[complete]))
+
+    return b"".join(payload), b"".join(rollup_payload), edges
+
+
+def window_ticks(window_start_ns: int, window_ns: int, start_ns: int, interval_ns: int, total_ticks: int) -> Tuple[int, int]:
+    # [first, last) tick indexes of a backfill whose timestamps fall into the window
+    first = max(0, -(-(window_start_ns - start_ns) // interval_ns))
+    last = min(total_ticks, -(-(window_start_ns + window_ns - start_ns) // interval_ns))
+    return first, last
+
+
+# Generates simulated history between start and end with synthetic timestamps, as fast as the
+# workers allow. Chunks of chunk_ticks samples per computer are simulated and encoded to line
+# protocol in a process pool and written to InfluxDB in bulk; at most two chunks per worker are
+# in flight, so memory stays bounded however long the range is.
+class BackfillJob:
+    def __init__(
+            self,
+            influxdb_service: InfluxDBService,
+            computer_ids: List[str],
+            start: datetime,
+            end: datetime,
+            interval_seconds: float,
+            seed: int,
+            workers: int,
+            chunk_ticks: int = 10_000,
+            write_concurrency: int = 2,
+            profiles: Optional[Dict[str, dict]] = None
+    ):
+        self.start_ns = to_timestamp_ns(start)
+        self.end_ns = to_timestamp_ns(end)
+        self.interval_ns = int(interval_seconds * NS_PER_SECOND)
+        if self.end_ns <= self.start_ns:
+            raise ValueError("Backfill end must be after start")
+        if self.interval_ns <= 0:
+            raise ValueError("Backfill interval must be positive")
+        if not computer_ids:
+            raise ValueError("Backfill needs at least one computer")
+
+        self.influxdb_service = influxdb_service
+        self.computer_ids = list(computer_ids)
+        self.profiles = profiles or {}
+        self.start = start
+        self.end = end
+        self.interval_seconds = interval_seconds
+        self.seed = seed
+        self.workers = workers
+        # Chunks have to start on a seed block boundary
+        self.chunk_ticks = max(1, -(-chunk_ticks // SEED_BLOCK_TICKS)) * SEED_BLOCK_TICKS
+        self.write_concurrency = write_concurrency
+
+        self.total_ticks = -(-(self.end_ns - self.start_ns) // self.interval_ns)
+        self.rollups = influxdb_service.rollup_bucket is not None
+        self._partial_windows: Dict[tuple, Tuple[np.ndarray, int]] = {}
+        self.total_points = self.total_ticks * len(self.computer_ids) * len(METRIC_NAMES)
+        self.written_points = 0
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def start_task(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def cancel(self) -> None:
+        if not self.running:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def run(self) -> None:
+        self.status = "running"
+        self.started_at = time.monotonic()
+        print(f"Backfill started: {len(self.computer_ids)} computers, {self.total_points} points")
+
+        # Spawned workers, forking a process that runs the event loop and client threads is not safe
+        executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(2 * self.workers)
+        writes = asyncio.Semaphore(self.write_concurrency)
+        tasks = set()
+        failures = []
+
+        async def process(computer_id: str, first_tick: int, ticks: int):
+            try:
+                payload, rollups, edges = await loop.run_in_executor(
+                    executor, generate_chunk,
+                    computer_id, self.seed, self.start_ns, self.interval_ns, first_tick, ticks,
+                    self.total_ticks, self.rollups, self.profiles.get(computer_id)
+                )
+                rollups += self._merge_edges(computer_id, edges)
+                async with writes:
+                    await asyncio.to_thread(self.influxdb_service.write_line_protocol, payload)
+                    if rollups:
+                        await asyncio.to_thread(self.influxdb_service.write_rollups, rollups)
+                self.written_points += ticks * len(METRIC_NAMES)
+            except Exception as e:
+                failures.append(e)
+            finally:
+                in_flight.release()
+
+        try:
+            # Time-major, so the whole fleet advances through the range together
+            for first_tick in range(0, self.total_ticks, self.chunk_ticks):
+                ticks = min(self.chunk_ticks, self.total_ticks - first_tick)
+                for computer_id in self.computer_ids:
+                    await in_flight.acquire()
+                    if failures:
+                        raise failures[0]
+                    task = asyncio.create_task(process(computer_id, first_tick, ticks))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks)
+            if failures:
+                raise failures[0]
+            self.status = "completed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            raise
+        except Exception as e:
+            print(f"Backfill failed: {e}")
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.finished_at = time.monotonic()
+            print(f"Backfill {self.status}: {self.written_points}/{self.total_points} points written")
+
+    def _merge_edges(self, computer_id: str, edges: list) -> bytes:
+        # Rollup windows split across chunks are written once every chunk with ticks in them is in
+        finished = []
+        for metric_name, tier, window_start, aggregate, ticks in edges:
+            key = (computer_id, metric_name, tier, window_start)
+            partial = self._partial_windows.pop(key, None)
+            if partial is not None:
+                aggregate, ticks = merge_aggregates(partial[0], aggregate), partial[1] + ticks
+
+            first, last = window_ticks(
+                window_start, ROLLUP_TIERS[tier] * NS_PER_SECOND, self.start_ns, self.interval_ns, self.total_ticks
+            )
+            if ticks < last - first:
+                self._partial_windows[key] = (aggregate, ticks)
+                continue
+            finished.append(encode_rollups(computer_id, metric_name, tier, np.array([window_start]), aggregate[None, :]))
+        return b"".join(finished)
+
+    def progress(self) -> dict:
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        rate = self.written_points / elapsed if elapsed > 0 else 0.0
+        remaining = self.total_points - self.written_points
+
+        return {
+            "status": self.status,
+            "computers": len(self.computer_ids),
+            "start": self.start,
+            "end": self.end,
+            "interval_seconds": self.interval_seconds,
+            "seed": self.seed,
+            "total_points": self.total_points,
+            "written_points": self.written_points,
+            "progress": self.written_points / self.total_points,
+            "elapsed_seconds": round(elapsed, 3),
+            "points_per_second": round(rate, 1),
+            "eta_seconds": round(remaining / rate, 1) if rate > 0 and self.running else None,
+            "error": self.error
+        }
+
+
+# Runs one backfill at a time, of at most max_points points, and keeps the last one around for
+# progress queries
+class BackfillService:
+    def __init__(
+            self,
+            influxdb_service: InfluxDBService,
+            workers: Optional[int] = None,
+            chunk_ticks: int = 10_000,
+            max_points: int = 1_000_000_000
+    ):
+        self.influxdb_service = influxdb_service
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_ticks = chunk_ticks
+        self.max_points = max_points
+        self.job: Optional[BackfillJob] = None
+
+    def start(
+            self,
+            computer_ids: List[str],
+            start: datetime,
+            end: datetime,
+            interval_seconds: float,
+            seed: int,
+            profiles: Optional[Dict[str, dict]] = None
+    ) -> BackfillJob:
+        if self.job is not None and self.job.running:
+            raise RuntimeError("A backfill is already running.")
+
+        job = BackfillJob(
+            self.influxdb_service,
+            computer_ids,
+            start,
+            end,
+            interval_seconds,
+            seed,
+            workers=self.workers,
+            chunk_ticks=self.chunk_ticks,
+            profiles=profiles
+        )
+        if job.total_points > self.max_points:
+            raise ValueError(f"Backfill of {job.total_points} points is larger than the limit of {self.max_points} points")
+        job.start_task()
+        self.job = job
+        return job
+
+    async def cancel(self) -> bool:
+        if self.job is None or not self.job.running:
+            return False
+        await self.job.cancel()
+        return True
@@ -0,0 +1,38 @@
+from typing import Tuple
+
+import numpy as np
+
+
+def lttb(timestamps: np.ndarray, values: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, for every bucket
+    # in between, the point forming the largest triangle with the previously selected point
+    # and the average of the next bucket.
+    size = len(values)
+    if threshold >= size or threshold < 3:
+        return timestamps, values
+
+    x = timestamps.astype(np.float64)
+    y = values.astype(np.float64, copy=False)
+
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+
+        next_start = end
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else size
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return timestamps[selected], values[selected]
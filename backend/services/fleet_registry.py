@@ -0,0 +1,132 @@
+import asyncio
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from models.quantum_computer import PROFILE_FIELDS, QuantumComputer, QuantumComputerRecord
+from services.fleet_simulator import fleet_computer_ids
+from services.postgres_db import DATABASE_MODE, async_session_scope, session_scope
+from services.simulator import COMPUTER_PROFILES, DEFAULT_PROFILE_ID
+
+# Computers the table starts out with, as (name, location, status)
+SEED_COMPUTERS = {
+    "qc-001": ("Quantum Nexus Alpha", "Boston Data Center", "online"),
+    "qc-002": ("Quantum Nexus Beta", "San Francisco Lab", "online"),
+    "qc-003": ("Quantum Nexus Gamma", "Tokyo Research Facility", "maintenance")
+}
+
+GENERATED_LOCATION = "Simulation Cluster"
+
+IndexKey = Tuple[Optional[str], Optional[str]]
+
+
+def seed_record(computer_id: str) -> dict:
+    name, location, status = SEED_COMPUTERS.get(
+        computer_id, (f"Simulated Computer {computer_id}", GENERATED_LOCATION, "online")
+    )
+    profile = COMPUTER_PROFILES.get(computer_id, COMPUTER_PROFILES[DEFAULT_PROFILE_ID])
+    return {"id": computer_id, "name": name, "location": location, "status": status, **profile}
+
+
+# The fleet as stored in the quantum_computers table, loaded once into memory. Lookups go
+# through an id index and listings through sorted id lists per (status, location) filter, so
+# a page costs a bisect and a slice however large the fleet is. The cursor of a page is the
+# last id on it.
+class FleetRegistry:
+    def __init__(self):
+        self._computers: Dict[str, QuantumComputer] = {}
+        self._profiles: Dict[str, dict] = {}
+        self._indexes: Dict[IndexKey, List[str]] = {(None, None): []}
+        self.version = 0
+
+    @property
+    def size(self) -> int:
+        return len(self._computers)
+
+    async def load(self, fleet_size: int = 0) -> None:
+        # Creates the seed computers and qc-001..qc-{fleet_size} when they are missing, then reads
+        # the whole table
+        if DATABASE_MODE == "sync":
+            def load():
+                with session_scope() as db:
+                    return self._load_records(db, fleet_size)
+
+            records = await asyncio.to_thread(load)
+        else:
+            async with async_session_scope() as db:
+                records = await db.run_sync(self._load_records, fleet_size)
+
+        self.replace(records)
+        print(f"Fleet registry loaded {self.size} computers.")
+
+    def get(self, computer_id: str) -> Optional[QuantumComputer]:
+        return self._computers.get(computer_id)
+
+    def computer_ids(self) -> List[str]:
+        return list(self._indexes[(None, None)])
+
+    def profiles(self, computer_ids: Optional[Iterable[str]] = None) -> Dict[str, dict]:
+        if computer_ids is None:
+            return dict(self._profiles)
+        return {computer_id: self._profiles[computer_id] for computer_id in computer_ids}
+
+    def page(
+            self,
+            cursor: Optional[str] = None,
+            limit: int = 100,
+            status: Optional[str] = None,
+            location: Optional[str] = None
+    ) -> Tuple[List[QuantumComputer], Optional[str], int]:
+        ids = self._indexes.get((status, location), [])
+        first = bisect_right(ids, cursor) if cursor is not None else 0
+        page_ids = ids[first:first + limit]
+        next_cursor = page_ids[-1] if first + limit < len(ids) else None
+        return [self._computers[computer_id] for computer_id in page_ids], next_cursor, len(ids)
+
+    def stats(self) -> dict:
+        return {
+            "computers": self.size,
+            "statuses": {status: len(ids) for (status, location), ids in self._indexes.items()
+                         if status is not None and location is None},
+            "locations": sum(1 for status, location in self._indexes if status is None and location is not None)
+        }
+
+    @staticmethod
+    def _load_records(db: Session, fleet_size: int) -> List[dict]:
+        table = QuantumComputerRecord.__table__
+        existing = set(db.scalars(select(table.c.id)))
+        wanted = dict.fromkeys(list(SEED_COMPUTERS) + fleet_computer_ids(fleet_size))
+        missing = [seed_record(computer_id) for computer_id in wanted if computer_id not in existing]
+        if missing:
+            db.execute(insert(table), missing)
+            db.commit()
+            print(f"Fleet registry created {len(missing)} computers.")
+
+        return [dict(row) for row in db.execute(select(table)).mappings()]
+
+    def replace(self, records: List[dict]) -> None:
+        # Swaps in a new fleet of quantum_computers rows, as dicts
+        computers = {}
+        profiles = {}
+        indexes: Dict[IndexKey, List[str]] = {(None, None): []}
+        for record in sorted(records, key=lambda r: r["id"]):
+            computer_id, status, location = record["id"], record["status"], record["location"]
+            profiles[computer_id] = {field: record[field] for field in PROFILE_FIELDS}
+            computers[computer_id] = QuantumComputer(
+                id=computer_id,
+                name=record["name"],
+                qubits=record["qubits"],
+                location=location,
+                status=status,
+                # Until live values arrive, computers in service report their base temperature
+                temperature_mk=record["base_temp"] if status != "maintenance" else None
+            )
+            for key in ((None, None), (status, None), (None, location), (status, location)):
+                indexes.setdefault(key, []).append(computer_id)
+
+        self._computers = computers
+        self._profiles = profiles
+        self._indexes = indexes
+        self.version += 1
@@ -0,0 +1,276 @@
+import math
+import random
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from models import MetricBatch, METRIC_NAMES, METRIC_UNITS
+from models.metric_batch import METRIC_NAME_UNITS, column_indexes
+from services.simulator import CALIBRATION_PERIOD, COMPUTER_PROFILES, DEFAULT_PROFILE_ID, metrics_to_generate
+
+# Metrics that draw one noise value each, in draw order
+NOISY_METRICS = METRIC_NAMES[:5]
+
+
+def fleet_computer_ids(size: int) -> List[str]:
+    return [f"qc-{i:03d}" for i in range(1, size + 1)]
+
+
+def random_state(seed: Optional[int]) -> np.random.RandomState:
+    # Both use MT19937 and the same 53-bit float construction, so copying the state that
+    # random.Random(seed) derives gives the exact stream QuantumSimulator would draw from.
+    state = np.random.RandomState()
+    if seed is not None:
+        _, internal_state, _ = random.Random(seed).getstate()
+        keys, position = internal_state[:-1], internal_state[-1]
+        state.set_state(("MT19937", np.array(keys, dtype=np.uint32), position))
+
+    return state
+
+
+# Batched equivalent of one QuantumSimulator per computer. Random draws are consumed in the
+# order a list of QuantumSimulators sharing one random.Random(seed) would consume them
+# (construction first, then computer by computer each tick), so both give the same series.
+class FleetSimulator:
+
+    def __init__(self, computer_ids: List[str], seed: Optional[int] = None, profiles: Optional[List[dict]] = None):
+        self.computer_ids = tuple(computer_ids)
+        self.size = len(self.computer_ids)
+        self._layouts: Dict[Tuple[str, ...], tuple] = {}
+        self.latest: Dict[str, np.ndarray] = {}
+        self.rng = random_state(seed)
+
+        if profiles is None:
+            profiles = [
+                COMPUTER_PROFILES.get(computer_id, COMPUTER_PROFILES[DEFAULT_PROFILE_ID])
+                for computer_id in self.computer_ids
+            ]
+        elif len(profiles) != self.size:
+            raise ValueError(f"Expected {self.size} profiles, got {len(profiles)}")
+
+        self.qubits = np.array([p["qubits"] for p in profiles], dtype=np.int64)
+        self.age_factor = np.array([p["age_factor"] for p in profiles], dtype=np.float64)
+        self.base_temp = np.array([p["base_temp"] for p in profiles], dtype=np.float64)
+        self.temp_stability = np.array([p["temp_stability"] for p in profiles], dtype=np.float64)
+        self.base_fidelity = np.array([p["base_fidelity"] for p in profiles], dtype=np.float64)
+        self.base_error = np.array([p["base_error"] for p in profiles], dtype=np.float64)
+        self.base_coherence = np.array([p["base_coherence"] for p in profiles], dtype=np.float64)
+        self.base_qv = np.array([p["base_qv"] for p in profiles], dtype=np.float64)
+        self.qv_theoretical_max = np.array(
+            [2 ** int(math.log2(p["qubits"])) for p in profiles], dtype=np.float64
+        )
+
+        self.iteration_count = np.zeros(self.size, dtype=np.int64)
+
+        draws = self.rng.random_sample((self.size, 2))
+        self.temp_offset = _uniform(-2, 2, draws[:, 0])
+        self.fidelity_drift = _uniform(-0.3, 0.1, draws[:, 1])
+
+    def export_state(self) -> Dict[str, Tuple[int, float, float]]:
+        # Everything a computer carries from tick to tick, so another simulator can continue
+        # its series when computers move between shards
+        return {
+            computer_id: (iteration, temp_offset, fidelity_drift)
+            for computer_id, iteration, temp_offset, fidelity_drift in zip(
+                self.computer_ids,
+                self.iteration_count.tolist(),
+                self.temp_offset.tolist(),
+                self.fidelity_drift.tolist()
+            )
+        }
+
+    def restore_state(self, states: Dict[str, Tuple[int, float, float]]) -> None:
+        for i, computer_id in enumerate(self.computer_ids):
+            state = states.get(computer_id)
+            if state is not None:
+                self.iteration_count[i], self.temp_offset[i], self.fidelity_drift[i] = state
+
+    def step(self, metric_names: Iterable[str] = METRIC_NAMES) -> Dict[str, np.ndarray]:
+        # Generates the requested metrics, reusing the latest values of everything else they
+        # depend on. Like QuantumSimulator, a computer's iteration advances with its temperature.
+        metric_names = tuple(metric_names)
+        generate = metrics_to_generate(metric_names, self.latest)
+        if "temperature" in generate:
+            self.iteration_count += 1
+
+        values = self._simulate(self.iteration_count, generate)
+        self.latest.update(values)
+        return {name: values[name] for name in metric_names}
+
+    def run(self, ticks: int) -> Dict[str, np.ndarray]:
+        # Advances a single computer by `ticks` iterations in one vectorized pass. Its draws
+        # are laid out tick after tick, so this matches `ticks` consecutive step() calls.
+        if self.size != 1:
+            raise ValueError("run() simulates a single computer over time, use step() for a fleet")
+
+        first = int(self.iteration_count[0]) + 1
+        self.iteration_count += ticks
+        return self._simulate(np.arange(first, first + ticks, dtype=np.int64), METRIC_NAMES)
+
+    def _simulate(self, iteration: np.ndarray, generate: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+        # One noise draw per generated metric and row, plus a leading one for rows whose
+        # temperature has a workload spike
+        noisy = [name for name in NOISY_METRICS if name in generate]
+        spike = (iteration % 80 == 0) & ("temperature" in generate)
+        draw_counts = len(noisy) + spike
+        offsets = np.cumsum(draw_counts) - draw_counts
+        draws = self.rng.random_sample(int(draw_counts.sum()))
+        noise = {name: draws[offsets + spike + i] for i, name in enumerate(noisy)}
+
+        values = dict(self.latest)
+        if "temperature" in generate:
+            values["temperature"] = self._temperature(iteration, spike, draws[offsets], noise["temperature"])
+        if "qubit_fidelity" in generate:
+            values["qubit_fidelity"] = self._qubit_fidelity(iteration, values["temperature"], noise["qubit_fidelity"])
+        if "gate_error_rate" in generate:
+            values["gate_error_rate"] = self._gate_error_rate(
+                iteration, values["temperature"], values["qubit_fidelity"], noise["gate_error_rate"]
+            )
+        if "coherence_time" in generate:
+            values["coherence_time"] = self._coherence_time(
+                iteration, values["temperature"], values["qubit_fidelity"], noise["coherence_time"]
+            )
+        if "quantum_volume" in generate:
+            values["quantum_volume"] = self._quantum_volume(
+                iteration, values["gate_error_rate"], values["qubit_fidelity"], noise["quantum_volume"]
+            )
+        if "performance_score" in generate:
+            values["performance_score"] = self._performance_score(
+                values["qubit_fidelity"],
+                values["gate_error_rate"],
+                values["temperature"],
+                values["coherence_time"],
+                values["quantum_volume"]
+            )
+
+        return {name: values[name] for name in generate}
+
+    def _temperature(self, iteration, spike, spike_draws, noise_draws) -> np.ndarray:
+        daily_cycle = 1.5 * np.sin(iteration * 0.05)
+        workload_spike = np.where(spike, _uniform(3, 8, spike_draws), 0.0)
+        drift = (iteration * 0.01) * (1 - self.temp_stability)
+        noise = _uniform(-0.5, 0.5, noise_draws) * (2 - self.temp_stability)
+
+        temp = self.base_temp + self.temp_offset + daily_cycle + workload_spike + drift + noise
+        return _round(np.clip(temp, 10.0, 30.0), 1)
+
+    def _qubit_fidelity(self, iteration, temperature, noise_draws) -> np.ndarray:
+        temp_penalty = (temperature - self.base_temp) * 0.15
+
+        time_since_calibration = iteration - CALIBRATION_PERIOD * ((iteration - 1) // CALIBRATION_PERIOD)
+        drift_penalty = (time_since_calibration / 100.0) * (1 - self.age_factor)
+        drift_penalty = np.where(time_since_calibration > 120, 0.0, drift_penalty)
+
+        noise = _uniform(-0.1, 0.1, noise_draws)
+
+        fidelity = self.base_fidelity - temp_penalty - drift_penalty + self.fidelity_drift + noise
+        return _round(np.clip(fidelity, 95.0, 99.9), 2)
+
+    def _gate_error_rate(self, iteration, temperature, fidelity, noise_draws) -> np.ndarray:
+        temp_impact = (temperature - self.base_temp) * 0.02
+        fidelity_correlation = (100 - fidelity) * 0.05
+        age_degradation = (1 - self.age_factor) * 0.1
+        calibration_improvement = np.where(iteration % 50 < 5, -0.08, 0.0)
+        noise = _uniform(-0.05, 0.05, noise_draws)
+
+        gate_error_rate = (self.base_error + temp_impact + fidelity_correlation + age_degradation
+                           + calibration_improvement + noise)
+        return _round(np.clip(gate_error_rate, 0.1, 1.5), 3)
+
+    def _coherence_time(self, iteration, temperature, fidelity, noise_draws) -> np.ndarray:
+        temp_factor = 1 - ((temperature - self.base_temp) * 0.03)
+        fidelity_factor = fidelity / 100.0
+        recalibration_boost = np.where(iteration % 100 < 10, 1.15, 1.0)
+        decay_factor = 1 - ((iteration % 100) * 0.001)
+        noise = _uniform(0.95, 1.05, noise_draws)
+
+        coherence_time = (self.base_coherence * temp_factor * fidelity_factor * recalibration_boost
+                          * decay_factor * noise)
+        return _round(np.clip(coherence_time, 30.0, 200.0), 1)
+
+    def _quantum_volume(self, iteration, gate_error, fidelity, noise_draws) -> np.ndarray:
+        error_penalty = (gate_error - self.base_error) * 30
+        fidelity_boost = (fidelity - 97) * 5
+        maintenance_penalty = np.where(iteration % 150 < 20, -self.base_qv * 0.3, 0.0)
+        trend = (iteration * 0.05) * self.age_factor
+        noise = _uniform(-5, 5, noise_draws)
+
+        qv = self.base_qv - error_penalty + fidelity_boost + trend + maintenance_penalty + noise
+        return _round(np.clip(qv, 16, self.qv_theoretical_max), 0)
+
+    def _performance_score(self, fidelity, gate_error, temperature, coherence, quantum_volume) -> np.ndarray:
+        fidelity_score = (fidelity / 100.0) * 30
+        error_score = np.maximum(0, 1 - (gate_error / 2.0)) * 25
+        temp_deviation = np.abs(temperature - self.base_temp)
+        temp_score = np.maximum(0, (1 - temp_deviation / 15.0)) * 15
+        coherence_score = np.minimum(coherence / 200.0, 1.0) * 15
+        qv_score = (quantum_volume / self.qv_theoretical_max) * 15
+
+        total_score = fidelity_score + error_score + temp_score + coherence_score + qv_score
+        return _round(np.clip(total_score, 0, 100), 1)
+
+    def to_batch(self, values: Dict[str, np.ndarray], timestamp: Optional[datetime] = None) -> MetricBatch:
+        if timestamp is None:
+            timestamp = datetime.now(timezone.utc)
+
+        metric_names, units, computer_index, metric_index = self._layout(values)
+        return MetricBatch(
+            timestamp,
+            self.computer_ids,
+            metric_names,
+            units,
+            computer_index,
+            metric_index,
+            np.concatenate([values[name] for name in metric_names])
+        )
+
+    def generate_all_metrics(self, timestamp: Optional[datetime] = None) -> MetricBatch:
+        return self.to_batch(self.step(), timestamp)
+
+    def generate_metrics(self, metric_names: Iterable[str], timestamp: Optional[datetime] = None) -> MetricBatch:
+        return self.to_batch(self.step(metric_names), timestamp)
+
+    def _layout(self, values: Dict[str, np.ndarray]) -> tuple:
+        # Batches with the same metrics share their lookup tables and index arrays, which is
+        # what lets consumers cache per-row work across ticks
+        key = tuple(name for name in METRIC_NAMES if name in values)
+        layout = self._layouts.get(key)
+        if layout is None:
+            if key == METRIC_NAMES:
+                metric_names, units = METRIC_NAMES, METRIC_NAME_UNITS
+            else:
+                metric_names, units = key, tuple(METRIC_UNITS[name] for name in key)
+            layout = (metric_names, units) + column_indexes(self.size, len(metric_names))
+            self._layouts[key] = layout
+        return layout
+
+
+def _uniform(low: float, high: float, draws: np.ndarray) -> np.ndarray:
+    # Same arithmetic as random.uniform, so a shared draw gives a bit-identical value
+    return low + (high - low) * draws
+
+
+def _round(values: np.ndarray, decimals: int) -> np.ndarray:
+    # np.round scales by 10**decimals before rounding, which can land a value exactly on .5
+    # when the true product is just above or below it. Recover the product's rounding error
+    # (Dekker's two-product) and settle those ties the way builtin round() does.
+    scale = 10.0 ** decimals
+    scaled = values * scale
+    rounded = np.rint(scaled)
+
+    value_hi, value_lo = _split(values)
+    scale_hi, scale_lo = _split(scale)
+    error = ((value_hi * scale_hi - scaled) + value_hi * scale_lo + value_lo * scale_hi) + value_lo * scale_lo
+
+    half = scaled - rounded
+    rounded = rounded + np.where((half == 0.5) & (error > 0), 1.0, 0.0) \
+        - np.where((half == -0.5) & (error < 0), 1.0, 0.0)
+
+    return rounded / scale
+
+
+def _split(values):
+    c = 134217729.0 * values
+    hi = c - (c - values)
+    return hi, values - hi
@@ -0,0 +1,274 @@
+import math
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from models.metric import METRIC_NAMES, METRIC_UNITS
+from models.metric_batch import MetricBatch, ShapeCache, group_repeats
+
+# Metrics where a low value is the bad one; for the rest the highest values are the worst
+HIGHER_IS_BETTER = {"qubit_fidelity", "coherence_time", "quantum_volume", "performance_score"}
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Magnitudes the sketch tells apart; anything smaller counts as zero, anything larger as the maximum
+SKETCH_MIN_VALUE = 1e-9
+SKETCH_MAX_VALUE = 1e12
+
+
+# The `size` slots with the highest keys, highest first. Every slot outside the list has a key
+# of at most `bound`, so the entries above the bound are the fleet's true leaders whatever
+# happened to the slots that were not updated; once fewer than `exact` of them are left the
+# list is rebuilt from all slots. The lowest values are the leaders of the negated keys.
+class _Leaders:
+    def __init__(self, size: int, exact: int, capacity: int):
+        self.size = size
+        self.exact = exact
+        self.slots = np.empty(0, dtype=np.int64)
+        self.bound = -np.inf
+        self.rebuilds = 0
+        self._listed = np.zeros(capacity, dtype=bool)
+
+    def update(self, keys: np.ndarray, changed: np.ndarray, present: int) -> None:
+        # keys of all slots, -inf for computers without a value; changed slots are unique
+        candidates = np.concatenate([self.slots, changed[~self._listed[changed]]])
+        candidate_keys = keys[candidates]
+        if len(candidates) > self.size:
+            split = np.argpartition(-candidate_keys, self.size - 1)
+            self.bound = max(self.bound, float(candidate_keys[split[self.size:]].max()))
+            candidates, candidate_keys = candidates[split[:self.size]], candidate_keys[split[:self.size]]
+        self._replace(candidates, candidate_keys)
+
+        if np.count_nonzero(keys[self.slots] >= self.bound) < min(self.exact, present):
+            self.rebuild(keys)
+
+    def rebuild(self, keys: np.ndarray) -> None:
+        self.rebuilds += 1
+        candidates = np.flatnonzero(keys > -np.inf)
+        candidate_keys = keys[candidates]
+        self.bound = -np.inf
+        if len(candidates) > self.size:
+            split = np.argpartition(-candidate_keys, self.size - 1)
+            self.bound = float(candidate_keys[split[self.size:]].max())
+            candidates, candidate_keys = candidates[split[:self.size]], candidate_keys[split[:self.size]]
+        self._replace(candidates, candidate_keys)
+
+    def _replace(self, candidates: np.ndarray, candidate_keys: np.ndarray) -> None:
+        present = candidate_keys > -np.inf
+        candidates, candidate_keys = candidates[present], candidate_keys[present]
+        self._listed[self.slots] = False
+        self.slots = candidates[np.argsort(-candidate_keys, kind="stable")]
+        self._listed[self.slots] = True
+
+
+# Counts of values in logarithmic buckets (as in DDSketch), one row per metric. Every quantile
+# read from it is within `relative_accuracy` of a value that was counted. Buckets are fixed, so
+# a value that is replaced is simply subtracted again.
+class _Sketch:
+    def __init__(self, metrics: int, relative_accuracy: float):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self._min_key = math.ceil(math.log(SKETCH_MIN_VALUE) / self._log_gamma)
+        self.keys = math.ceil(math.log(SKETCH_MAX_VALUE) / self._log_gamma) - self._min_key + 1
+        # Negative magnitudes descending, zero, positive magnitudes ascending
+        self.buckets = 2 * self.keys + 1
+        self.counts = np.zeros(metrics * self.buckets, dtype=np.int64)
+
+    def bucket(self, metric_index: np.ndarray, values: np.ndarray) -> np.ndarray:
+        magnitude = np.abs(values)
+        small = magnitude < SKETCH_MIN_VALUE
+        keys = np.log(np.where(small, 1.0, magnitude))
+        keys /= self._log_gamma
+        np.ceil(keys, out=keys)
+        np.clip(keys - self._min_key, 0, self.keys - 1, out=keys)
+        keys = keys.astype(np.int64)
+        bucket = np.where(small, self.keys, np.where(values > 0, self.keys + 1 + keys, self.keys - 1 - keys))
+        bucket += metric_index * self.buckets
+        return bucket
+
+    def add(self, added: np.ndarray, removed: np.ndarray) -> None:
+        total = len(self.counts)
+        self.counts += np.bincount(added, minlength=total)[:total]
+        if len(removed):
+            self.counts -= np.bincount(removed, minlength=total)[:total]
+
+    def quantiles(self, metric_index: int, quantiles: Sequence[float]) -> List[Optional[float]]:
+        cumulative = np.cumsum(self.counts[metric_index * self.buckets:(metric_index + 1) * self.buckets])
+        total = int(cumulative[-1])
+        if total == 0:
+            return [None] * len(quantiles)
+        found = []
+        for quantile in quantiles:
+            bucket = int(np.searchsorted(cumulative, quantile * (total - 1), side="right"))
+            found.append(self._value(bucket))
+        return found
+
+    def _value(self, bucket: int) -> float:
+        if bucket == self.keys:
+            return 0.0
+        key = (bucket - self.keys - 1 if bucket > self.keys else self.keys - 1 - bucket) + self._min_key
+        value = 2 * self.gamma ** key / (self.gamma + 1)
+        return value if bucket > self.keys else -value
+
+
+# Fleet-wide view of the latest value of every computer per metric, kept up to date from each
+# written batch: the k best and worst computers, the mean and a few quantiles. Batches cost
+# vectorized work in their own size plus the leader lists; reading a summary costs O(k)
+# whatever the fleet size. A point older than a computer's latest one does not replace it.
+class FleetSummary:
+    def __init__(
+            self,
+            metric_names: Sequence[str] = METRIC_NAMES,
+            max_computers: int = 100_000,
+            max_k: int = 100,
+            relative_accuracy: float = 0.01
+    ):
+        self.metric_names = tuple(metric_names)
+        self.max_computers = max_computers
+        self.max_k = max_k
+
+        metrics = len(self.metric_names)
+        self._metrics = {metric_name: index for index, metric_name in enumerate(self.metric_names)}
+        self._slots: Dict[str, int] = {}
+        self._computer_ids: List[str] = []
+        self._shapes = ShapeCache()
+        # One row of max_computers slots per metric, flattened; -inf where a computer has no value.
+        # The negated values are the keys of the lowest leaders.
+        self._latest = np.full(metrics * max_computers, -np.inf, dtype=np.float64)
+        self._negated = np.full(metrics * max_computers, -np.inf, dtype=np.float64)
+        self._timestamps = np.full(metrics * max_computers, np.iinfo(np.int64).min, dtype=np.int64)
+        # Sketch bucket of every latest value, so replacing it needs no second lookup
+        self._buckets = np.zeros(metrics * max_computers, dtype=np.int64)
+        self._sum = np.zeros(metrics, dtype=np.float64)
+        self._count = np.zeros(metrics, dtype=np.int64)
+        self._sketch = _Sketch(metrics, relative_accuracy)
+        # Twice the largest k, so a few leaders falling back do not force a rebuild
+        self._highest = [_Leaders(2 * max_k, max_k, max_computers) for _ in self.metric_names]
+        self._lowest = [_Leaders(2 * max_k, max_k, max_computers) for _ in self.metric_names]
+
+        self.version = 0
+        self.observed_points = 0
+        self.rejected_points = 0
+        self.stale_points = 0
+        self.last_batch_ns_per_point = 0.0
+
+    def observe(self, batch: MetricBatch) -> None:
+        started = time.perf_counter_ns()
+        rows, unique = batch.series_rows(self._row_for, self._shapes)
+        values = batch.values
+        timestamps = batch.timestamps_ns
+
+        accepted = rows >= 0
+        if not accepted.all():
+            self.rejected_points += int((~accepted).sum())
+        indexes = np.flatnonzero(accepted & np.isfinite(values))
+        rows = rows[indexes]
+        timestamps = np.full(len(rows), batch.timestamp_ns, dtype=np.int64) if timestamps is None else timestamps[indexes]
+        if not unique:
+            # Only the newest point of each series counts
+            order, position, size = group_repeats(rows, timestamps)
+            newest = order[position == size - 1]
+            indexes, rows, timestamps = indexes[newest], rows[newest], timestamps[newest]
+
+        current = timestamps >= self._timestamps[rows]
+        if not current.all():
+            self.stale_points += int((~current).sum())
+            indexes, rows, timestamps = indexes[current], rows[current], timestamps[current]
+        self._update(rows, values[indexes], timestamps)
+
+        self.observed_points += len(values)
+        if len(values):
+            self.last_batch_ns_per_point = (time.perf_counter_ns() - started) / len(values)
+
+    def summary(self, k: int = 10, metric_names: Optional[Sequence[str]] = None) -> dict:
+        k = min(k, self.max_k)
+        metrics = {}
+        for metric_name in metric_names or self.metric_names:
+            index = self._metrics[metric_name]
+            count = int(self._count[index])
+            highest = self._leaders(index, self._highest[index], k)
+            lowest = self._leaders(index, self._lowest[index], k)
+            low = lowest[0]["value"] if lowest else None
+            high = highest[0]["value"] if highest else None
+            # A bucket's representative value may lie just outside the values actually seen
+            quantiles = [
+                min(max(value, low), high) if value is not None else None
+                for value in self._sketch.quantiles(index, QUANTILES)
+            ]
+            higher_is_better = metric_name in HIGHER_IS_BETTER
+            metrics[metric_name] = {
+                "unit": METRIC_UNITS.get(metric_name),
+                "computers": count,
+                "mean": float(self._sum[index] / count) if count else None,
+                "min": low,
+                "max": high,
+                **{f"p{round(quantile * 100)}": value for quantile, value in zip(QUANTILES, quantiles)},
+                "higher_is_better": higher_is_better,
+                "worst": lowest if higher_is_better else highest,
+                "best": highest if higher_is_better else lowest
+            }
+        return {"k": k, "version": self.version, "metrics": metrics}
+
+    def stats(self) -> dict:
+        return {
+            "computers": len(self._computer_ids),
+            "max_computers": self.max_computers,
+            "observed_points": self.observed_points,
+            "rejected_points": self.rejected_points,
+            "stale_points": self.stale_points,
+            "rebuilds": self.rebuilds,
+            "last_batch_ns_per_point": round(self.last_batch_ns_per_point, 1)
+        }
+
+    @property
+    def rebuilds(self) -> int:
+        return sum(leaders.rebuilds for leaders in self._highest + self._lowest)
+
+    def _update(self, rows: np.ndarray, values: np.ndarray, timestamps: np.ndarray) -> None:
+        if not len(rows):
+            return
+        self.version += 1
+        metric_index = rows // self.max_computers
+        old = self._latest[rows]
+        known = old > -np.inf
+
+        metrics = len(self.metric_names)
+        self._sum += np.bincount(metric_index, weights=values - np.where(known, old, 0.0), minlength=metrics)
+        self._count += np.bincount(metric_index[~known], minlength=metrics)
+        buckets = self._sketch.bucket(metric_index, values)
+        self._sketch.add(buckets, self._buckets[rows[known]])
+        self._buckets[rows] = buckets
+        self._latest[rows] = values
+        self._negated[rows] = -values
+        self._timestamps[rows] = timestamps
+
+        for index in np.flatnonzero(np.bincount(metric_index, minlength=metrics)).tolist():
+            changed = rows[metric_index == index] - index * self.max_computers
+            row = slice(index * self.max_computers, (index + 1) * self.max_computers)
+            present = int(self._count[index])
+            self._highest[index].update(self._latest[row], changed, present)
+            self._lowest[index].update(self._negated[row], changed, present)
+
+    def _leaders(self, metric_index: int, leaders: _Leaders, k: int) -> List[dict]:
+        offset = metric_index * self.max_computers
+        found = []
+        for slot in leaders.slots[:k].tolist():
+            found.append({
+                "computer_id": self._computer_ids[slot],
+                "value": float(self._latest[offset + slot]),
+                "timestamp": int(self._timestamps[offset + slot]) // 1_000_000
+            })
+        return found
+
+    def _row_for(self, computer_id: str, metric_name: str) -> int:
+        metric_index = self._metrics.get(metric_name)
+        if metric_index is None:
+            return -1
+        slot = self._slots.get(computer_id)
+        if slot is None:
+            if len(self._computer_ids) >= self.max_computers:
+                return -1
+            slot = self._slots[computer_id] = len(self._computer_ids)
+            self._computer_ids.append(computer_id)
+        return metric_index * self.max_computers + slot
@@ -0,0 +1,134 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from models.metric_batch import MetricBatch, ShapeCache, group_repeats
+
+INITIAL_ROWS = 64
+
+
+# Keeps the last `capacity` samples of every (computer_id, metric_name) series in memory.
+# Each series owns one row of a preallocated ring buffer that is twice the capacity wide;
+# every sample is written to slot and slot + capacity, so the most recent n samples are
+# always a contiguous slice and windows are returned as views without copying.
+class HotTierStore:
+    def __init__(self, capacity: int = 60, max_series: int = 100_000):
+        self.capacity = capacity
+        self.max_series = max_series
+
+        self._series: Dict[Tuple[str, str], int] = {}
+        self._computer_series: Dict[str, Dict[str, int]] = {}
+        self._values = np.full((0, 2 * capacity), np.nan, dtype=np.float64)
+        self._timestamps = np.zeros((0, 2 * capacity), dtype=np.int64)
+        self._counts = np.zeros(0, dtype=np.int64)
+
+        self._shapes = ShapeCache()
+        self.rejected_points = 0
+        # Bumped on every append, so readers can tell whether anything changed since they looked
+        self.version = 0
+
+    def append(self, batch: MetricBatch) -> None:
+        self.version += 1
+        series, unique = batch.series_rows(self._row_for, self._shapes)
+        timestamps = batch.timestamp_ns if batch.timestamps_ns is None else batch.timestamps_ns
+        if not unique:
+            self._write_repeated(series, timestamps, batch.values)
+            return
+
+        self._write(series, timestamps, batch.values)
+
+    def latest(self, computer_id: str, metric_name: str) -> Optional[Tuple[int, float]]:
+        row = self._series.get((computer_id, metric_name))
+        if row is None or self._counts[row] == 0:
+            return None
+        slot = (self._counts[row] - 1) % self.capacity
+        return int(self._timestamps[row, slot]), float(self._values[row, slot])
+
+    def latest_for_computer(self, computer_id: str) -> Dict[str, Tuple[int, float]]:
+        latest = {}
+        for metric_name in self._computer_series.get(computer_id, {}):
+            sample = self.latest(computer_id, metric_name)
+            if sample is not None:
+                latest[metric_name] = sample
+        return latest
+
+    def window(self, computer_id: str, metric_name: str, samples: int) -> Tuple[np.ndarray, np.ndarray]:
+        row = self._series.get((computer_id, metric_name))
+        if row is None:
+            return self._timestamps[:0, 0], self._values[:0, 0]
+
+        count = int(self._counts[row])
+        samples = min(samples, count, self.capacity)
+        end = (count - 1) % self.capacity + self.capacity + 1
+        return self._timestamps[row, end - samples:end], self._values[row, end - samples:end]
+
+    def stats(self) -> dict:
+        row_bytes = self._values.itemsize * 2 * self.capacity + self._timestamps.itemsize * 2 * self.capacity + 8
+        return {
+            "series": len(self._series),
+            "capacity": self.capacity,
+            "max_series": self.max_series,
+            "allocated_rows": len(self._counts),
+            "allocated_bytes": self._values.nbytes + self._timestamps.nbytes + self._counts.nbytes,
+            "max_bytes": row_bytes * self.max_series,
+            "rejected_points": self.rejected_points
+        }
+
+    def _write(self, series: np.ndarray, timestamp_ns, values: np.ndarray) -> None:
+        # timestamp_ns is one timestamp for all rows or an array with one per row
+        accepted = series >= 0
+        if not accepted.all():
+            self.rejected_points += int((~accepted).sum())
+            series = series[accepted]
+            values = values[accepted]
+            if np.ndim(timestamp_ns):
+                timestamp_ns = timestamp_ns[accepted]
+
+        slots = self._counts[series] % self.capacity
+        self._values[series, slots] = values
+        self._values[series, slots + self.capacity] = values
+        self._timestamps[series, slots] = timestamp_ns
+        self._timestamps[series, slots + self.capacity] = timestamp_ns
+        self._counts[series] += 1
+
+    def _write_repeated(self, series: np.ndarray, timestamp_ns, values: np.ndarray) -> None:
+        # Repeated series in one batch land in consecutive slots, oldest first; of a series with
+        # more rows than the capacity only the newest are written
+        accepted = series >= 0
+        self.rejected_points += int((~accepted).sum())
+        timestamps = np.broadcast_to(timestamp_ns, series.shape)[accepted]
+        series, values = series[accepted], values[accepted]
+
+        order, position, size = group_repeats(series, timestamps)
+        series, timestamps, values = series[order], timestamps[order], values[order]
+        slots = (self._counts[series] + position) % self.capacity
+        np.add.at(self._counts, series, 1)
+
+        kept = position >= size - self.capacity
+        series, slots, timestamps, values = series[kept], slots[kept], timestamps[kept], values[kept]
+        self._values[series, slots] = values
+        self._values[series, slots + self.capacity] = values
+        self._timestamps[series, slots] = timestamps
+        self._timestamps[series, slots + self.capacity] = timestamps
+
+    def _row_for(self, computer_id: str, metric_name: str) -> int:
+        row = self._series.get((computer_id, metric_name))
+        if row is not None:
+            return row
+
+        row = len(self._series)
+        if row >= self.max_series:
+            return -1
+
+        if row >= len(self._counts):
+            self._grow(min(self.max_series, max(INITIAL_ROWS, 2 * len(self._counts))))
+
+        self._series[(computer_id, metric_name)] = row
+        self._computer_series.setdefault(computer_id, {})[metric_name] = row
+        return row
+
+    def _grow(self, rows: int) -> None:
+        added = rows - len(self._counts)
+        self._values = np.vstack([self._values, np.full((added, 2 * self.capacity), np.nan)])
+        self._timestamps = np.vstack([self._timestamps, np.zeros((added, 2 * self.capacity), dtype=np.int64)])
+        self._counts = np.concatenate([self._counts, np.zeros(added, dtype=np.int64)])
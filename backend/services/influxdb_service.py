@@ -1,35 +1,194 @@
+import time
 import influxdb_client
+import numpy as np
 from influxdb_client.client.write_api import SYNCHRONOUS
 from models.metric import Metric
-from typing import List
+from models.metric_batch import MetricBatch, to_timestamp_ns
+from services.instrumentation import SIZE_BUCKETS, metrics
+from services.line_protocol import LineProtocolEncoder
+from typing import List, Optional, Sequence, Tuple, Union
+
+WRITE_MODES = ("point", "line_protocol")
+
+WRITE_SECONDS = metrics.histogram("influxdb_write_duration_seconds", "InfluxDB write requests", ("bucket",))
+WRITE_POINTS = metrics.histogram("influxdb_write_points", "Points per InfluxDB write request", ("bucket",), SIZE_BUCKETS)
+WRITE_BYTES = metrics.counter("influxdb_write_bytes", "Line protocol bytes sent to InfluxDB", ("bucket",))
+WRITE_FAILURES = metrics.counter("influxdb_write_failures", "Failed InfluxDB write requests", ("bucket", "error"))
+QUERY_SECONDS = metrics.histogram("influxdb_query_duration_seconds", "InfluxDB queries, until the last row is read", ("bucket",))
 
 class InfluxDBService:
-    def __init__(self, url: str, token: str, bucket: str, org: str):
-        self.client = influxdb_client.InfluxDBClient(url, token, org)
+    def __init__(
+            self,
+            url: str,
+            token: str,
+            bucket: str,
+            org: str,
+            write_mode: str = "point",
+            gzip: bool = False,
+            rollup_bucket: Optional[str] = None
+    ):
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode '{write_mode}', expected one of {WRITE_MODES}")
+
+        self.client = influxdb_client.InfluxDBClient(url, token, org=org, enable_gzip=gzip)
         self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
         self.bucket = bucket
+        self.rollup_bucket = rollup_bucket
         self.org = org
+        self.write_mode = write_mode
+        self.encoder = LineProtocolEncoder()
+        self.query_api = self.client.query_api()
 
-    def write_metric(self, metric: Metric) -> None:
-        point = influxdb_client.Point(metric.metric_name) \
+    @staticmethod
+    def to_point(metric: Metric) -> influxdb_client.Point:
+        return influxdb_client.Point(metric.metric_name) \
             .tag("computer_id", metric.computer_id) \
             .field("value", metric.value) \
             .field("unit", metric.unit) \
             .time(metric.timestamp)
 
-        self.write_api.write(bucket=self.bucket, org=self.org, record=point)
+    def write_metric(self, metric: Metric) -> None:
+        self._write(self.bucket, self.to_point(metric), 1)
+
+    def write_metrics(self, metrics: Union[MetricBatch, List[Metric]]) -> None:
+        if isinstance(metrics, MetricBatch):
+            self.write_batches([metrics])
+            return
+
+        if self.write_mode == "line_protocol":
+            self.write_line_protocol(self.encoder.encode(metrics))
+            return
+
+        points = [self.to_point(metric) for metric in metrics]
+        self._write(self.bucket, points, len(points))
+
+    def write_batches(self, batches: List[MetricBatch]) -> None:
+        if self.write_mode == "line_protocol":
+            self.write_line_protocol(self.encoder.encode_batches(batches))
+            return
+
+        points = [self.to_point(metric) for batch in batches for metric in batch.to_metrics()]
+        self._write(self.bucket, points, len(points))
+
+    def write_line_protocol(self, data: Union[str, bytes], bucket: Optional[str] = None) -> None:
+        newline = b"\n" if isinstance(data, bytes) else "\n"
+        lines = data.count(newline) + (1 if data and not data.endswith(newline) else 0)
+        self._write(bucket or self.bucket, data, lines, len(data))
+
+    def _write(self, bucket: str, record, points: int, size: int = 0) -> None:
+        started = time.perf_counter()
+        try:
+            self.write_api.write(bucket=bucket, org=self.org, record=record)
+        except Exception as e:
+            WRITE_FAILURES.labels(bucket, type(e).__name__).inc()
+            raise
+        finally:
+            WRITE_SECONDS.labels(bucket).observe(time.perf_counter() - started)
+        WRITE_POINTS.labels(bucket).observe(points)
+        if size:
+            WRITE_BYTES.labels(bucket).inc(size)
+
+    def write_rollups(self, data: bytes) -> None:
+        self.write_line_protocol(data, self.rollup_bucket)
 
-    def write_metrics(self, metrics: List[Metric]) -> None:
-        points = []
-        for metric in metrics:
-            point = influxdb_client.Point(metric.metric_name) \
-                .tag("computer_id", metric.computer_id) \
-                .field("value", metric.value) \
-                .field("unit", metric.unit) \
-                .time(metric.timestamp)
-            points.append(point)
-        self.write_api.write(bucket=self.bucket, org=self.org, record=points)
+    def ensure_rollup_bucket(self) -> None:
+        buckets_api = self.client.buckets_api()
+        if buckets_api.find_bucket_by_name(self.rollup_bucket) is None:
+            buckets_api.create_bucket(bucket_name=self.rollup_bucket, org=self.org)
+            print(f"Created rollup bucket '{self.rollup_bucket}'")
+
+    def query_series(
+            self,
+            computer_id: str,
+            metric_name: str,
+            start_ns: int,
+            stop_ns: int,
+            tier: Optional[str] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # Raw values of the fleet (leaving out simulation sessions), or the window means of a rollup tier
+        bucket, field = self.bucket, "value"
+        tier_filter = "|> filter(fn: (r) => not exists r.session)"
+        if tier is not None:
+            bucket, field = self.rollup_bucket, "mean"
+            tier_filter = f'|> filter(fn: (r) => r.tier == "{_flux_string(tier)}")'
+
+        query = f'''
+            from(bucket: "{_flux_string(bucket)}")
+                |> range(start: time(v: {int(start_ns)}), stop: time(v: {int(stop_ns)}))
+                |> filter(fn: (r) => r._measurement == "{_flux_string(metric_name)}")
+                |> filter(fn: (r) => r.computer_id == "{_flux_string(computer_id)}")
+                {tier_filter}
+                |> filter(fn: (r) => r._field == "{field}")
+                |> keep(columns: ["_time", "_value"])
+                |> sort(columns: ["_time"])
+        '''
+
+        timestamps = []
+        values = []
+        with QUERY_SECONDS.labels(bucket).time():
+            for record in self.query_api.query_stream(query, org=self.org):
+                timestamps.append(to_timestamp_ns(record.get_time()))
+                values.append(record.get_value())
+
+        return np.array(timestamps, dtype=np.int64), np.array(values, dtype=np.float64)
+
+    def query_rows(
+            self,
+            computer_ids: Optional[Sequence[str]],
+            metric_names: Sequence[str],
+            start_ns: int,
+            stop_ns: int,
+            session_id: Optional[str] = None
+    ) -> "QueryRows":
+        # Raw (timestamp_ns, computer_id, metric_name, value) rows as InfluxDB streams them: series
+        # by series, each in time order. All computers when computer_ids is None. The fleet's
+        # points, or those of one simulation session.
+        computer_filter = ""
+        if computer_ids is not None:
+            computer_filter = "|> filter(fn: (r) => " + " or ".join(
+                f'r.computer_id == "{_flux_string(computer_id)}"' for computer_id in computer_ids
+            ) + ")"
+        metric_filter = " or ".join(f'r._measurement == "{_flux_string(metric_name)}"' for metric_name in metric_names)
+        session_filter = "|> filter(fn: (r) => not exists r.session)"
+        if session_id is not None:
+            session_filter = f'|> filter(fn: (r) => r.session == "{_flux_string(session_id)}")'
+
+        query = f'''
+            from(bucket: "{_flux_string(self.bucket)}")
+                |> range(start: time(v: {int(start_ns)}), stop: time(v: {int(stop_ns)}))
+                |> filter(fn: (r) => {metric_filter})
+                {computer_filter}
+                {session_filter}
+                |> filter(fn: (r) => r._field == "value")
+                |> keep(columns: ["_time", "_value", "_measurement", "computer_id"])
+        '''
+        return QueryRows(self.query_api.query_stream(query, org=self.org))
 
     def close(self) -> None:
         self.client.close()
 
+
+# Iterator over query_rows. The first record is read up front so the parser owns the HTTP
+# response from then on, and close() releases it even if no row was taken yet.
+class QueryRows:
+    def __init__(self, records):
+        self._records = records
+        self._first = next(records, None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Tuple[int, str, str, float]:
+        if self._first is not None:
+            record, self._first = self._first, None
+        else:
+            record = next(self._records)
+        values = record.values
+        return to_timestamp_ns(values["_time"]), values["computer_id"], values["_measurement"], values["_value"]
+
+    def close(self) -> None:
+        self._records.close()
+
+
+def _flux_string(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
@@ -0,0 +1,231 @@
+import math
+import threading
+import time
+from bisect import bisect_right
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 5_000, 10_000, 50_000, 100_000, 500_000, 1_000_000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+# Every thread updates a private list of slots, so observing takes no lock and cannot lose an
+# update to another thread; collecting sums the lists of all threads that ever observed.
+class _Sharded:
+    def __init__(self, slots: int):
+        self._slots = slots
+        self._local = threading.local()
+        self._shards: List[list] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> list:
+        shard = [0] * self._slots
+        self._local.shard = shard
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def _totals(self) -> list:
+        with self._lock:
+            shards = list(self._shards)
+        return [sum(column) for column in zip(*shards)] if shards else [0] * self._slots
+
+
+class Counter(_Sharded):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: Union[int, float] = 1) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[0] += amount
+
+    def value(self) -> float:
+        return self._totals()[0]
+
+
+# Fixed upper bounds; one slot per bucket plus +Inf, then the sum of observed values
+class Histogram(_Sharded):
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(len(self.buckets) + 2)
+
+    def observe(self, value: float) -> None:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[bisect_right(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        # Cumulative bucket counts ending with +Inf, and the sum
+        totals = self._totals()
+        cumulative = []
+        running = 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+# A named metric with fixed label names. Children per label value combination are created on
+# first use and looked up from a dict afterwards.
+class _Family:
+    def __init__(self, name: str, documentation: str, kind: str, label_names: Sequence[str], factory):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self._factory = factory
+        self._children: Dict[LabelValues, object] = {}
+        self._lock = threading.Lock()
+        self._default = None if self.label_names else self.labels()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def inc(self, amount: Union[int, float] = 1) -> None:
+        self._default.inc(amount)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            labels = _labels(self.label_names, values)
+            if self.kind == "counter":
+                lines.append(f"{self.name}_total{_braces(labels)} {_number(child.value())}")
+                continue
+
+            cumulative, total = child.snapshot()
+            for bound, count in zip(child.buckets + (math.inf,), cumulative):
+                bucket_labels = labels + ['le="' + _number(bound) + '"']
+                lines.append(f"{self.name}_bucket{_braces(bucket_labels)} {count}")
+            lines.append(f"{self.name}_sum{_braces(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_braces(labels)} {cumulative[-1]}")
+        return lines
+
+
+# Values read from elsewhere when /metrics is scraped, so they cost nothing in between. The
+# function returns a number, or a dict of label value tuples to numbers.
+class _Callback:
+    def __init__(self, name: str, documentation: str, kind: str, label_names: Sequence[str], function: Callable):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self.function = function
+
+    def render(self) -> List[str]:
+        try:
+            values = self.function()
+        except Exception as e:
+            print(f"Could not collect metric {self.name}: {e}")
+            return []
+        if values is None:
+            return []
+
+        suffix = "_total" if self.kind == "counter" else ""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{suffix}{_braces(_labels(self.label_names, label_values))} {_number(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "quantum_monitor"):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> _Family:
+        return self._add(_Family(self._name(name), documentation, "counter", labels, Counter))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labels: Sequence[str] = (),
+            buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> _Family:
+        return self._add(_Family(self._name(name), documentation, "histogram", labels, lambda: Histogram(buckets)))
+
+    def gauge_callback(self, name: str, documentation: str, function: Callable, labels: Sequence[str] = ()) -> None:
+        self._add(_Callback(self._name(name), documentation, "gauge", labels, function), replace=True)
+
+    def counter_callback(self, name: str, documentation: str, function: Callable, labels: Sequence[str] = ()) -> None:
+        self._add(_Callback(self._name(name), documentation, "counter", labels, function), replace=True)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _name(self, name: str) -> str:
+        return f"{self.prefix}_{name}" if self.prefix else name
+
+    def _add(self, metric, replace: bool = False):
+        if metric.name in self._metrics and not replace:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+
+def _labels(names: Sequence[str], values: LabelValues) -> List[str]:
+    return [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+
+
+def _braces(labels: List[str]) -> str:
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, int) or float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+metrics = MetricsRegistry()
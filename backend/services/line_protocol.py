@@ -0,0 +1,225 @@
+import math
+import threading
+from datetime import datetime
+from itertools import repeat
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from models.metric import Metric
+from models.metric_batch import MetricBatch, ShapeCache, to_timestamp_ns
+
+
+# Same escaping rules influxdb_client.Point applies
+_ESCAPE_MEASUREMENT = str.maketrans({
+    ',': r'\,',
+    ' ': r'\ ',
+    '\n': r'\n',
+    '\t': r'\t',
+    '\r': r'\r',
+})
+
+_ESCAPE_KEY = str.maketrans({
+    ',': r'\,',
+    '=': r'\=',
+    ' ': r'\ ',
+    '\n': r'\n',
+    '\t': r'\t',
+    '\r': r'\r',
+})
+
+_ESCAPE_STRING = str.maketrans({
+    '"': r'\"',
+    '\\': r'\\',
+})
+
+
+def escape_measurement(name: str) -> str:
+    return name.translate(_ESCAPE_MEASUREMENT)
+
+
+def escape_tag(value: str) -> str:
+    escaped = value.translate(_ESCAPE_KEY)
+    if escaped.endswith('\\'):
+        escaped += ' '
+    return escaped
+
+
+def escape_string(value: str) -> str:
+    return value.translate(_ESCAPE_STRING)
+
+
+def format_float(value: float) -> str:
+    text = str(value)
+    if text.endswith('.0'):
+        text = text[:-2]
+    return text
+
+
+# Encodes metrics straight to line protocol, producing the same bytes as
+# influxdb_client.Point(...).tag("computer_id").field("value").field("unit").time(...).
+# Escaped "measurement,computer_id=..." prefixes and unit fields are cached, and lines are
+# assembled in one reusable buffer.
+class LineProtocolEncoder:
+    def __init__(self):
+        self._prefixes: Dict[Tuple[str, str], bytes] = {}
+        self._unit_fields: Dict[str, bytes] = {}
+        self._last_timestamp = None
+        self._last_timestamp_bytes = b""
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._batch_shapes = ShapeCache()
+        self._session_shapes: Dict[str, ShapeCache] = {}
+
+    def series_prefix(self, metric_name: str, computer_id: str, session_id: Optional[str] = None) -> bytes:
+        key = (metric_name, computer_id, session_id)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            tag_value = escape_tag(computer_id)
+            prefix = escape_measurement(metric_name)
+            if tag_value:
+                prefix += f",computer_id={tag_value}"
+            if session_id:
+                prefix += f",session={escape_tag(session_id)}"
+            prefix = (prefix + " ").encode()
+            self._prefixes[key] = prefix
+        return prefix
+
+    def forget_session(self, session_id: str) -> None:
+        # Drops what was cached for a simulation session that has ended
+        with self._lock:
+            self._session_shapes.pop(session_id, None)
+            for key in [key for key in self._prefixes if key[2] == session_id]:
+                del self._prefixes[key]
+
+    def unit_field(self, unit: str) -> bytes:
+        field = self._unit_fields.get(unit)
+        if field is None:
+            field = f'unit="{escape_string(unit)}"'.encode()
+            self._unit_fields[unit] = field
+        return field
+
+    def encode(self, metrics: Iterable[Metric]) -> bytes:
+        with self._lock:
+            buffer = self._buffer
+            buffer.clear()
+
+            for metric in metrics:
+                buffer += self.series_prefix(metric.metric_name, metric.computer_id)
+                buffer += self.unit_field(metric.unit)
+                if math.isfinite(metric.value):
+                    buffer += b",value="
+                    buffer += format_float(metric.value).encode()
+                buffer += self._timestamp(metric.timestamp)
+                buffer += b"\n"
+
+            if not buffer:
+                return b""
+            return memoryview(buffer)[:-1].tobytes()
+
+    def encode_batches(self, batches: Iterable[MetricBatch]) -> bytes:
+        with self._lock:
+            buffer = self._buffer
+            buffer.clear()
+
+            for batch in batches:
+                self._encode_batch(batch, buffer)
+
+            if not buffer:
+                return b""
+            return memoryview(buffer)[:-1].tobytes()
+
+    def encode_series(
+            self,
+            computer_id: str,
+            metric_name: str,
+            unit: str,
+            timestamps_ns: np.ndarray,
+            values: np.ndarray
+    ) -> bytes:
+        # One series over many timestamps, as produced by backfills and bulk imports
+        prefix = (self.series_prefix(metric_name, computer_id) + self.unit_field(unit)).decode()
+        texts = value_texts(values)
+        lines = list(map(
+            "{}{} {}\n".format, repeat(prefix + ",value="), texts, timestamps_ns.tolist()
+        ))
+
+        for row in np.flatnonzero(~np.isfinite(values)).tolist():
+            lines[row] = "%s %d\n" % (prefix, timestamps_ns[row])
+
+        return "".join(lines).encode()
+
+    def _encode_batch(self, batch: MetricBatch, buffer: bytearray) -> None:
+        values = batch.values
+        texts = value_texts(values)
+
+        prefixes = self._row_prefixes(batch)
+        if batch.timestamps_ns is None:
+            suffixes = [" %d\n" % batch.timestamp_ns] * len(values)
+        else:
+            suffixes = list(map(" %d\n".__mod__, batch.timestamps_ns.tolist()))
+        lines = list(map("".join, zip(prefixes, texts, suffixes)))
+
+        for row in np.flatnonzero(~np.isfinite(values)).tolist():
+            lines[row] = prefixes[row][:-len(",value=")] + suffixes[row]
+
+        buffer += "".join(lines).encode()
+
+    def _row_prefixes(self, batch: MetricBatch) -> List[str]:
+        # Producers reuse the same tables and index arrays every tick, so the per-row
+        # "measurement,computer_id=... unit=\"...\",value=" list is only built once per batch shape
+        if batch.one_off:
+            # Only the series that occur, and nothing is cached
+            pairs = list(zip(batch.metric_index.tolist(), batch.computer_index.tolist()))
+            series = {
+                (metric_index, computer_index): (
+                    self.series_prefix(
+                        batch.metric_names[metric_index], batch.computer_ids[computer_index], batch.session_id
+                    )
+                    + self.unit_field(batch.units[metric_index]) + b",value="
+                ).decode()
+                for metric_index, computer_index in set(pairs)
+            }
+            return list(map(series.__getitem__, pairs))
+
+        # Every simulation session keeps one shape of its own, so that many sessions do not push
+        # each other (and the fleet's shapes) out of the shared cache.
+        shape = batch.shape + (batch.units,)
+        if batch.session_id is not None:
+            shapes = self._session_shapes.get(batch.session_id)
+            if shapes is None:
+                shapes = self._session_shapes[batch.session_id] = ShapeCache(1)
+        else:
+            shapes = self._batch_shapes
+        cached = shapes.get(shape)
+        if cached is not None:
+            return cached
+
+        series = [
+            [
+                (self.series_prefix(metric_name, computer_id, batch.session_id) + self.unit_field(unit) + b",value=").decode()
+                for computer_id in batch.computer_ids
+            ]
+            for metric_name, unit in zip(batch.metric_names, batch.units)
+        ]
+        prefixes = [
+            series[metric_index][computer_index]
+            for metric_index, computer_index in zip(batch.metric_index.tolist(), batch.computer_index.tolist())
+        ]
+        return shapes.put(shape, prefixes)
+
+    def _timestamp(self, timestamp: datetime) -> bytes:
+        if timestamp != self._last_timestamp:
+            self._last_timestamp = timestamp
+            self._last_timestamp_bytes = b" %d" % to_timestamp_ns(timestamp)
+        return self._last_timestamp_bytes
+
+
+def value_texts(values: np.ndarray) -> List[str]:
+    texts = list(map(repr, values.tolist()))
+
+    # Same trimming as format_float, applied only to the whole-number rows
+    for row in np.flatnonzero((values == np.trunc(values)) & (np.abs(values) < 1e16)).tolist():
+        texts[row] = texts[row][:-2]
+
+    return texts
@@ -0,0 +1,467 @@
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import msgpack
+import numpy as np
+import orjson
+
+from models.metric import METRIC_NAMES
+from models.metric_batch import MetricBatch, to_timestamp_ns
+from services.fleet_registry import FleetRegistry
+from services.instrumentation import SIZE_BUCKETS, metrics
+
+INGEST_FORMATS = ("line_protocol", "ndjson", "msgpack")
+
+CONTENT_TYPES = {
+    "text/plain": "line_protocol",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack"
+}
+
+# Nanoseconds per unit of the precision parameter, as InfluxDB's write API names them
+PRECISIONS = {"ns": 1, "us": 1_000, "ms": 1_000_000, "s": 1_000_000_000}
+
+# Errors reported back per request, the rest are only counted
+MAX_REPORTED_ERRORS = 10
+
+INGEST_POINTS = metrics.counter("ingest_points", "Points received on the ingest API", ("format", "outcome"))
+INGEST_PARSE_SECONDS = metrics.histogram("ingest_parse_duration_seconds", "Parsing and validating one ingest request", ("format",))
+INGEST_BATCH_POINTS = metrics.histogram("ingest_batch_points", "Points per ingest request", ("format",), SIZE_BUCKETS)
+INGEST_THROTTLED = metrics.counter("ingest_throttled_requests", "Ingest requests refused by the per-source rate limit")
+
+
+class IngestError(ValueError):
+    pass
+
+
+# Columns of the parsed points before validation, values and timestamps as they were sent;
+# timestamps are None where a point had none
+class _Columns:
+    __slots__ = ("computer_ids", "metric_names", "values", "timestamps", "malformed", "errors")
+
+    def __init__(self):
+        self.computer_ids: List[str] = []
+        self.metric_names: List[str] = []
+        self.values: list = []
+        self.timestamps: list = []
+        self.malformed = 0
+        self.errors: List[str] = []
+
+    def error(self, message: str) -> None:
+        self.malformed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+
+# Turns ingest request bodies into MetricBatches with one timestamp per row. Parsing is per
+# line or record, validation is per batch: ids and names are factorized once and checked per
+# distinct value, values and timestamps are converted and range-checked as arrays. Points of
+# unknown computers or metrics, non-finite values and timestamps too far in the future are
+# rejected and counted; the rest of the request is still accepted.
+class MetricIngestService:
+    def __init__(
+            self,
+            fleet_registry: FleetRegistry,
+            max_body_bytes: int = 64 * 1024 * 1024,
+            max_future_seconds: float = 300.0,
+            rate_points_per_second: float = 200_000.0,
+            burst_points: float = 1_000_000.0,
+            max_sources: int = 10_000
+    ):
+        self.fleet_registry = fleet_registry
+        self.max_body_bytes = max_body_bytes
+        self.max_future_ns = int(max_future_seconds * 1_000_000_000)
+        self.rate_limiter = RateLimiter(rate_points_per_second, burst_points, max_sources)
+
+    def parse(
+            self,
+            body: bytes,
+            ingest_format: str,
+            precision: str = "ns",
+            content_encoding: Optional[str] = None,
+            now_ns: Optional[int] = None
+    ) -> Tuple[Optional[MetricBatch], dict]:
+        # Blocking; returns the accepted points (None if there are none) and a report
+        if ingest_format not in INGEST_FORMATS:
+            raise IngestError(f"Unknown format '{ingest_format}', expected one of {INGEST_FORMATS}")
+        if precision not in PRECISIONS:
+            raise IngestError(f"Unknown precision '{precision}', expected one of {tuple(PRECISIONS)}")
+
+        now_ns = now_ns if now_ns is not None else time.time_ns()
+        with INGEST_PARSE_SECONDS.labels(ingest_format).time():
+            if content_encoding == "gzip":
+                body = self._gunzip(body)
+            elif content_encoding not in (None, "", "identity"):
+                raise IngestError(f"Unsupported Content-Encoding '{content_encoding}'")
+
+            if ingest_format == "line_protocol":
+                columns = parse_line_protocol(body)
+            elif ingest_format == "ndjson":
+                columns = parse_ndjson(body)
+            else:
+                columns = parse_msgpack(body)
+            batch, report = self.validate(columns, PRECISIONS[precision], now_ns)
+
+        INGEST_BATCH_POINTS.labels(ingest_format).observe(report["accepted"] + report["rejected"])
+        INGEST_POINTS.labels(ingest_format, "accepted").inc(report["accepted"])
+        INGEST_POINTS.labels(ingest_format, "rejected").inc(report["rejected"])
+        return batch, report
+
+    def validate(self, columns: _Columns, scale: int, now_ns: int) -> Tuple[Optional[MetricBatch], dict]:
+        computer_ids, computer_index = factorize(columns.computer_ids)
+        metric_names, metric_index = factorize(columns.metric_names)
+        known_computers = np.array([self.fleet_registry.get(c) is not None for c in computer_ids], dtype=bool)
+        known_metrics = np.array([m in METRIC_NAMES for m in metric_names], dtype=bool)
+
+        values = to_float_array(columns.values)
+        timestamps, readable = to_timestamp_array(columns.timestamps, scale, now_ns)
+
+        reasons = (
+            ("unknown_computer", ~known_computers[computer_index] if len(computer_ids) else np.zeros(0, dtype=bool)),
+            ("unknown_metric", ~known_metrics[metric_index] if len(metric_names) else np.zeros(0, dtype=bool)),
+            ("invalid_value", ~np.isfinite(values)),
+            ("invalid_timestamp", ~readable | (timestamps > now_ns + self.max_future_ns))
+        )
+        rejected = np.zeros(len(values), dtype=bool)
+        counts: Dict[str, int] = {}
+        if columns.malformed:
+            counts["malformed"] = columns.malformed
+        for reason, mask in reasons:
+            # Each point counts towards the first reason that applies
+            count = int((mask & ~rejected).sum())
+            if count:
+                counts[reason] = count
+            rejected |= mask
+
+        errors = list(columns.errors)
+        unknown = [computer_ids[i] for i in np.flatnonzero(~known_computers)[:MAX_REPORTED_ERRORS].tolist()]
+        if unknown:
+            errors.append(f"Unknown quantum computers: {', '.join(unknown)}")
+        unknown = [metric_names[i] for i in np.flatnonzero(~known_metrics)[:MAX_REPORTED_ERRORS].tolist()]
+        if unknown:
+            errors.append(f"Unknown metrics: {', '.join(unknown)}")
+
+        accepted = np.flatnonzero(~rejected)
+        report = {
+            "accepted": len(accepted),
+            "rejected": columns.malformed + len(values) - len(accepted),
+            "rejected_by_reason": counts,
+            "errors": errors
+        }
+        if not len(accepted):
+            return None, report
+
+        if len(accepted) < len(values):
+            computer_ids, computer_index = _compact(computer_ids, computer_index[accepted], known_computers)
+            metric_names, metric_index = _compact(metric_names, metric_index[accepted], known_metrics)
+            values, timestamps = values[accepted], timestamps[accepted]
+        batch = MetricBatch.from_rows(computer_ids, metric_names, computer_index, metric_index, values, timestamps)
+        return batch, report
+
+    def _gunzip(self, body: bytes) -> bytes:
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            data = decompressor.decompress(body, self.max_body_bytes)
+        except zlib.error as e:
+            raise IngestError(f"Invalid gzip body: {e}")
+        if decompressor.unconsumed_tail:
+            raise IngestError(f"Request body is larger than {self.max_body_bytes} bytes once decompressed")
+        return data
+
+
+# Token bucket per source, in points. A request is admitted while the bucket is not empty and
+# may take it below zero, so a batch larger than the burst still goes through once and the
+# source then waits until the debt is paid off.
+class RateLimiter:
+    def __init__(self, rate_points_per_second: float, burst_points: float, max_sources: int = 10_000):
+        self.rate = rate_points_per_second
+        self.burst = burst_points
+        self.max_sources = max_sources
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def retry_after(self, source: str) -> float:
+        # Seconds until the source may send again, 0 if it may now
+        if self.rate <= 0:
+            return 0.0
+        tokens = self._refill(source)[0]
+        return 0.0 if tokens > 0 else (1 - tokens) / self.rate
+
+    def consume(self, source: str, points: int) -> None:
+        if self.rate > 0:
+            self._refill(source)[0] -= points
+
+    def _refill(self, source: str) -> List[float]:
+        now = time.monotonic()
+        bucket = self._buckets.get(source)
+        if bucket is None:
+            bucket = self._buckets[source] = [self.burst, now]
+            if len(self._buckets) > self.max_sources:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(source)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+
+def factorize(items: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+    # Distinct items in order of first appearance, and each item's index among them
+    positions: Dict[str, int] = {}
+    codes = [positions.setdefault(item, len(positions)) for item in items]
+    return list(positions), np.array(codes, dtype=np.int32)
+
+
+def _compact(items: List[str], codes: np.ndarray, kept: np.ndarray) -> Tuple[List[str], np.ndarray]:
+    # Drops the items that are not kept from a lookup table, codes only refer to kept ones
+    positions = np.cumsum(kept, dtype=np.int32) - 1
+    return [item for item, keep in zip(items, kept.tolist()) if keep], positions[codes]
+
+
+def to_float_array(values: list) -> np.ndarray:
+    # NaN where a value is missing or not a number
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([_float_or_nan(value) for value in values], dtype=np.float64)
+
+
+def to_timestamp_array(timestamps: list, scale: int, now_ns: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Nanoseconds, now_ns where a row had no timestamp; the mask is False where one was unreadable
+    missing = np.fromiter((timestamp is None for timestamp in timestamps), dtype=bool, count=len(timestamps))
+    if missing.all():
+        return np.full(len(timestamps), now_ns, dtype=np.int64), np.ones(len(timestamps), dtype=bool)
+
+    present = [0 if timestamp is None else timestamp for timestamp in timestamps]
+    try:
+        raw = np.array(present, dtype=np.int64)
+        readable = np.ones(len(raw), dtype=bool)
+    except (TypeError, ValueError, OverflowError):
+        parsed = [_timestamp_or_none(timestamp, scale) for timestamp in present]
+        readable = np.array([timestamp is not None for timestamp in parsed], dtype=bool)
+        raw = np.array([timestamp if timestamp is not None else 0 for timestamp in parsed], dtype=object)
+        # Out of range values stay Python ints until the range check below
+        too_large = np.array([abs(timestamp) > np.iinfo(np.int64).max for timestamp in raw.tolist()], dtype=bool)
+        readable &= ~too_large
+        raw[too_large] = 0
+        raw = raw.astype(np.int64)
+
+    readable &= (raw >= 0) & (raw <= np.iinfo(np.int64).max // scale)
+    stamped = np.where(readable, raw, 0) * scale
+    stamped[missing] = now_ns
+    return stamped, readable | missing
+
+
+def _float_or_nan(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _timestamp_or_none(timestamp, scale: int) -> Optional[int]:
+    # Integers (also as text) in the given precision, or ISO 8601 strings
+    if isinstance(timestamp, bool):
+        return None
+    if isinstance(timestamp, int):
+        return timestamp
+    if isinstance(timestamp, float):
+        return int(timestamp) if np.isfinite(timestamp) else None
+    if isinstance(timestamp, str):
+        try:
+            return int(timestamp)
+        except ValueError:
+            pass
+        try:
+            parsed = datetime.fromisoformat(timestamp)
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return to_timestamp_ns(parsed) // scale
+    return None
+
+
+def parse_line_protocol(body: bytes) -> _Columns:
+    # measurement,computer_id=<id>[,tags] value=<number>[,fields] [timestamp]
+    # The measurement is the metric name; fields other than value are ignored.
+    columns = _Columns()
+    computer_ids = columns.computer_ids
+    metric_names = columns.metric_names
+    values = columns.values
+    timestamps = columns.timestamps
+
+    try:
+        text = body.decode()
+    except UnicodeDecodeError as e:
+        raise IngestError(f"Line protocol is not valid UTF-8: {e}")
+
+    for number, line in enumerate(text.split("\n"), 1):
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        if "\\" in line:
+            parsed = _parse_escaped_line(line)
+        else:
+            key, _, rest = line.partition(" ")
+            fields, _, timestamp = rest.rpartition(" ")
+            if not fields or not timestamp.lstrip("-").isdigit():
+                fields, timestamp = rest, None
+            measurement, _, tags = key.partition(",")
+            computer_id = None
+            for tag in tags.split(","):
+                if tag.startswith("computer_id="):
+                    computer_id = tag[12:]
+            parsed = measurement, computer_id, _field_value(fields), timestamp
+
+        measurement, computer_id, value, timestamp = parsed
+        if not measurement or not computer_id or value is None:
+            columns.error(f"Line {number}: expected 'metric_name,computer_id=<id> value=<number> [timestamp]'")
+            continue
+        metric_names.append(measurement)
+        computer_ids.append(computer_id)
+        values.append(value)
+        timestamps.append(timestamp)
+    return columns
+
+
+def _field_value(fields: str) -> Optional[str]:
+    # Text of the value field, without an integer suffix
+    if fields.startswith("value="):
+        start = 6
+    else:
+        start = fields.find(",value=")
+        if start < 0:
+            return None
+        start += 7
+    end = fields.find(",", start)
+    value = fields[start:] if end < 0 else fields[start:end]
+    if value and value[-1] in "iu":
+        value = value[:-1]
+    return value or None
+
+
+def _parse_escaped_line(line: str):
+    # Slow path for lines with backslash escapes in the measurement, tags or fields
+    sections = [section for section in _split_unescaped(line, " ") if section]
+    if len(sections) < 2:
+        return None, None, None, None
+
+    key = _split_unescaped(sections[0], ",")
+    computer_id = None
+    for tag in key[1:]:
+        name, _, value = tag.partition("=")
+        if _unescape(name) == "computer_id":
+            computer_id = _unescape(value)
+
+    value = None
+    for field in _split_unescaped(sections[1], ","):
+        if field.startswith("value="):
+            value = _field_value(field)
+    timestamp = sections[2] if len(sections) > 2 else None
+    return _unescape(key[0]), computer_id, value, timestamp
+
+
+def _split_unescaped(text: str, separator: str) -> List[str]:
+    # Splits on separators that are neither escaped nor inside a double-quoted string
+    parts = []
+    start = 0
+    index = 0
+    quoted = False
+    while index < len(text):
+        char = text[index]
+        if char == "\\":
+            index += 2
+            continue
+        if char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted:
+            parts.append(text[start:index])
+            start = index + 1
+        index += 1
+    parts.append(text[start:])
+    return parts
+
+
+def _unescape(text: str) -> str:
+    return text.replace("\\,", ",").replace("\\=", "=").replace("\\ ", " ").replace("\\\\", "\\")
+
+
+def parse_ndjson(body: bytes) -> _Columns:
+    # One JSON object per line, see _add_record
+    columns = _Columns()
+    for number, line in enumerate(body.split(b"\n"), 1):
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            columns.error(f"Line {number}: invalid JSON ({e})")
+            continue
+        _add_record(columns, record, f"Line {number}")
+    return columns
+
+
+def parse_msgpack(body: bytes) -> _Columns:
+    # An array of records like the NDJSON ones, or a map of equally long arrays
+    # {"computer_id": [...], "metric_name": [...], "value": [...], "timestamp": [...]}
+    try:
+        data = msgpack.unpackb(body, raw=False, strict_map_key=False)
+    except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+        raise IngestError(f"Invalid msgpack body: {e}")
+
+    columns = _Columns()
+    if isinstance(data, dict):
+        computer_ids, metric_names, values = data.get("computer_id"), data.get("metric_name"), data.get("value")
+        timestamps = data.get("timestamp")
+        if not all(isinstance(column, list) for column in (computer_ids, metric_names, values)):
+            raise IngestError("Columnar msgpack needs computer_id, metric_name and value arrays")
+        if timestamps is None:
+            timestamps = [None] * len(values)
+        if not isinstance(timestamps, list) or not len(computer_ids) == len(metric_names) == len(values) == len(timestamps):
+            raise IngestError("Columnar msgpack arrays must all have the same length")
+        if not all(isinstance(item, str) for item in computer_ids) or not all(isinstance(item, str) for item in metric_names):
+            raise IngestError("computer_id and metric_name must be strings")
+        columns.computer_ids, columns.metric_names = computer_ids, metric_names
+        columns.values, columns.timestamps = values, timestamps
+        return columns
+
+    if not isinstance(data, list):
+        raise IngestError("msgpack body must be an array of records or a map of columns")
+    for number, record in enumerate(data):
+        _add_record(columns, record, f"Record {number}")
+    return columns
+
+
+def _add_record(columns: _Columns, record, where: str) -> None:
+    # {"computer_id": ..., "metric_name": ..., "value": ..., "timestamp": ...} or, for several
+    # metrics at one time, {"computer_id": ..., "timestamp": ..., "metrics": {"<name>": <value>}}.
+    # The timestamp is optional.
+    if not isinstance(record, dict) or not isinstance(record.get("computer_id"), str):
+        columns.error(f"{where}: expected an object with a computer_id string")
+        return
+
+    computer_id = record["computer_id"]
+    timestamp = record.get("timestamp")
+    readings = record.get("metrics")
+    if readings is None:
+        metric_name = record.get("metric_name")
+        if not isinstance(metric_name, str) or "value" not in record:
+            columns.error(f"{where}: expected metric_name and value, or metrics")
+            return
+        readings = {metric_name: record["value"]}
+    elif not isinstance(readings, dict):
+        columns.error(f"{where}: metrics must be an object of metric names to values")
+        return
+
+    for metric_name, value in readings.items():
+        columns.computer_ids.append(computer_id)
+        columns.metric_names.append(metric_name)
+        columns.values.append(value)
+        columns.timestamps.append(timestamp)
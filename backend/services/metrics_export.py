@@ -0,0 +1,281 @@
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from models.metric import METRIC_UNITS
+from services.influxdb_service import InfluxDBService, QueryRows
+from services.instrumentation import metrics
+
+NS_PER_SECOND = 10 ** 9
+
+# Media type and file extension per format
+EXPORT_FORMATS = {
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+    "parquet": ("application/vnd.apache.parquet", "parquet")
+}
+
+# The rows of a batch are only checked against cancellation this often
+CANCEL_CHECK_ROWS = 1024
+
+EXPORT_ROWS = metrics.counter("export_rows", "Rows written to metric exports", ("format",))
+EXPORT_BYTES = metrics.counter("export_bytes", "Bytes written to metric exports", ("format",))
+EXPORT_OUTCOMES = metrics.counter("exports", "Finished metric exports by outcome", ("format", "outcome"))
+
+SCHEMA = pa.schema(
+    [
+        pa.field("time", pa.timestamp("ns", tz="UTC"), nullable=False),
+        pa.field("computer_id", pa.dictionary(pa.int32(), pa.string()), nullable=False),
+        pa.field("metric_name", pa.dictionary(pa.int8(), pa.string()), nullable=False),
+        pa.field("value", pa.float64())
+    ],
+    metadata={f"unit.{name}": unit for name, unit in METRIC_UNITS.items()}
+)
+
+
+# Collects what the writers produce until the next chunk is handed to the client
+class _ChunkSink:
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+# Dictionary values in order of first appearance. Later batches reuse the earlier indices, so
+# the Arrow stream only carries the values that are new since the last batch.
+class _Dictionary:
+    def __init__(self):
+        self.values: List[str] = []
+        self._indices: Dict[str, int] = {}
+
+    def index(self, value: str) -> int:
+        index = self._indices.get(value)
+        if index is None:
+            index = self._indices[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+# One export, read and encoded one batch at a time by next_chunk, which blocks and is meant to
+# run in a worker thread. The range is queried in windows of window_ns, so InfluxDB never has to
+# hold more than one window per request either. cancel() may be called from the event loop at any
+# time; whichever side holds the lock last closes the open query.
+class MetricsExport:
+    def __init__(
+            self,
+            influxdb_service: InfluxDBService,
+            computer_ids: Optional[Sequence[str]],
+            metric_names: Sequence[str],
+            start_ns: int,
+            stop_ns: int,
+            export_format: str,
+            batch_rows: int,
+            window_ns: int,
+            session_id: Optional[str] = None
+    ):
+        self.influxdb_service = influxdb_service
+        self.computer_ids = computer_ids
+        self.metric_names = metric_names
+        self.session_id = session_id
+        self.stop_ns = stop_ns
+        self.format = export_format
+        self.batch_rows = batch_rows
+        self.window_ns = window_ns
+
+        self.rows = 0
+        self.bytes = 0
+        self._window_start_ns = start_ns
+        self._query: Optional[QueryRows] = None
+        self._computers = _Dictionary()
+        self._metrics = _Dictionary()
+        self._sink = _ChunkSink()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._finished = False
+
+    @property
+    def media_type(self) -> str:
+        return EXPORT_FORMATS[self.format][0]
+
+    def start(self) -> None:
+        # Sends the first query, so an unreachable InfluxDB fails before any response is sent
+        with self._lock:
+            try:
+                self._next_window()
+            except BaseException:
+                self._close("failed")
+                raise
+
+    def next_chunk(self) -> Optional[bytes]:
+        # The encoded bytes of the next batch, the closing bytes last, then None
+        try:
+            with self._lock:
+                if self._finished:
+                    return None
+                try:
+                    return self._encode_next()
+                except BaseException:
+                    self._close("failed")
+                    raise
+        finally:
+            if self._cancelled.is_set():
+                self._close_unless_busy()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        self._close_unless_busy()
+
+    def _encode_next(self) -> Optional[bytes]:
+        if self._writer is None:
+            if self.format == "parquet":
+                self._writer = pq.ParquetWriter(self._sink, SCHEMA, compression="zstd")
+            else:
+                options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+                self._writer = pa.ipc.new_stream(self._sink, SCHEMA, options=options)
+
+        batch = self._read_batch()
+        if self._cancelled.is_set():
+            self._close("cancelled")
+            return None
+        if batch is not None:
+            self._writer.write_batch(batch)
+        else:
+            self._writer.close()
+            self._close("completed")
+        return self._take()
+
+    def _read_batch(self) -> Optional[pa.RecordBatch]:
+        timestamps = []
+        computers = []
+        metric_names = []
+        values = []
+        computer_index = self._computers.index
+        metric_index = self._metrics.index
+
+        while len(values) < self.batch_rows and self._query is not None:
+            for timestamp_ns, computer_id, metric_name, value in self._query:
+                timestamps.append(timestamp_ns)
+                computers.append(computer_index(computer_id))
+                metric_names.append(metric_index(metric_name))
+                values.append(value)
+                if len(values) % CANCEL_CHECK_ROWS == 0 and self._cancelled.is_set():
+                    return None
+                if len(values) >= self.batch_rows:
+                    break
+            else:
+                self._next_window()
+
+        if not values:
+            return None
+        self.rows += len(values)
+        EXPORT_ROWS.labels(self.format).inc(len(values))
+        return pa.record_batch(
+            [
+                pa.array(timestamps, SCHEMA.field("time").type),
+                pa.DictionaryArray.from_arrays(pa.array(computers, pa.int32()), self._computers.values),
+                pa.DictionaryArray.from_arrays(pa.array(metric_names, pa.int8()), self._metrics.values),
+                pa.array(values, pa.float64())
+            ],
+            schema=SCHEMA
+        )
+
+    def _next_window(self) -> None:
+        # Closes the exhausted query and opens the next window, or leaves _query None at the end
+        if self._query is not None:
+            self._query.close()
+            self._query = None
+        if self._window_start_ns >= self.stop_ns:
+            return
+        window_stop_ns = min(self._window_start_ns + self.window_ns, self.stop_ns)
+        self._query = self.influxdb_service.query_rows(
+            self.computer_ids, self.metric_names, self._window_start_ns, window_stop_ns, self.session_id
+        )
+        self._window_start_ns = window_stop_ns
+
+    def _take(self) -> bytes:
+        chunk = self._sink.take()
+        self.bytes += len(chunk)
+        EXPORT_BYTES.labels(self.format).inc(len(chunk))
+        return chunk
+
+    def _close_unless_busy(self) -> None:
+        if self._lock.acquire(blocking=False):
+            try:
+                self._close("cancelled")
+            finally:
+                self._lock.release()
+
+    def _close(self, outcome: str) -> None:
+        # Called with the lock held; only the first call counts
+        if self._finished:
+            return
+        self._finished = True
+        EXPORT_OUTCOMES.labels(self.format, outcome).inc()
+        if self._query is not None:
+            try:
+                self._query.close()
+            except Exception as e:
+                print(f"Error closing export query: {e}")
+            self._query = None
+
+
+# Streams raw metric history out of InfluxDB as Arrow IPC or Parquet. Each export holds at most
+# one batch of batch_rows rows plus its encoded bytes, however long the range; at most
+# max_exports run at once since each one keeps a worker thread busy while it reads.
+class MetricsExportService:
+    def __init__(
+            self,
+            influxdb_service: InfluxDBService,
+            batch_rows: int = 100_000,
+            window_seconds: int = 6 * 3600,
+            max_exports: int = 4
+    ):
+        self.influxdb_service = influxdb_service
+        self.batch_rows = batch_rows
+        self.window_ns = window_seconds * NS_PER_SECOND
+        self.max_exports = max_exports
+        self.active = 0
+
+    def create(
+            self,
+            computer_ids: Optional[Sequence[str]],
+            metric_names: Sequence[str],
+            start_ns: int,
+            stop_ns: int,
+            export_format: str,
+            session_id: Optional[str] = None
+    ) -> MetricsExport:
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}', expected one of {tuple(EXPORT_FORMATS)}")
+        if self.active >= self.max_exports:
+            raise RuntimeError(f"Too many exports in progress ({self.max_exports}), try again later.")
+        self.active += 1
+        return MetricsExport(
+            self.influxdb_service, computer_ids, metric_names, start_ns, stop_ns,
+            export_format, self.batch_rows, self.window_ns, session_id
+        )
+
+    def release(self, export: MetricsExport) -> None:
+        export.cancel()
+        self.active -= 1
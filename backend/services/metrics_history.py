@@ -0,0 +1,240 @@
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from models.metric import METRIC_UNITS
+from models.metric_batch import to_timestamp_ns
+from services.downsampling import lttb
+from services.influxdb_service import InfluxDBService
+from services.rollups import ROLLUP_TIERS
+
+NS_PER_SECOND = 10 ** 9
+
+
+class _SeriesCache:
+    __slots__ = ("timestamps", "values", "start_ns", "stable_end_ns", "fetched_end_ns", "last_refresh", "version", "lock")
+
+    def __init__(self):
+        self.timestamps = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.float64)
+        self.start_ns: Optional[int] = None
+        self.stable_end_ns: Optional[int] = None
+        self.fetched_end_ns: Optional[int] = None
+        self.last_refresh = 0.0
+        # Renewed whenever the cached points change, which invalidates the results built from them
+        self.version = 0
+        self.lock = asyncio.Lock()
+
+
+# Serves downsampled metric history from InfluxDB. Raw points are cached per series over a
+# bucket-aligned range, so a sliding window only queries the tail that arrived since the last
+# request. Points newer than settle_seconds are treated as provisional and re-read on the next
+# tail query, which picks up anything the write pipeline flushed late. Wide ranges are read from
+# the coarsest rollup tier whose windows are still at least as fine as the requested resolution.
+# max_span_seconds bounds the raw cache; a rollup tier keeps as many of its windows as the raw
+# cache keeps seconds. A series is never trimmed below the range that was just requested.
+class MetricsHistoryService:
+    def __init__(
+            self,
+            influxdb_service: InfluxDBService,
+            bucket_seconds: int = 60,
+            settle_seconds: float = 10.0,
+            refresh_interval: float = 1.0,
+            max_span_seconds: int = 7 * 86400,
+            max_series: int = 1024,
+            max_results: int = 4096,
+            rollup_tiers: Optional[Dict[str, int]] = None,
+            rollup_grace_seconds: float = 30.0
+    ):
+        self.influxdb_service = influxdb_service
+        self.bucket_ns = bucket_seconds * NS_PER_SECOND
+        self.settle_ns = int(settle_seconds * NS_PER_SECOND)
+        self.refresh_interval = refresh_interval
+        self.max_span_ns = max_span_seconds * NS_PER_SECOND
+        self.max_series = max_series
+        self.max_results = max_results
+        # Finest first; none without a rollup bucket
+        tiers = ROLLUP_TIERS if rollup_tiers is None else rollup_tiers
+        self.rollup_tiers = sorted(tiers.items(), key=lambda tier: tier[1]) if influxdb_service.rollup_bucket else []
+        self.rollup_grace_ns = int(rollup_grace_seconds * NS_PER_SECOND)
+
+        self._series: "OrderedDict[Tuple[str, str], _SeriesCache]" = OrderedDict()
+        self._results: "OrderedDict[tuple, Tuple[int, dict]]" = OrderedDict()
+        # Shared by all series, so a series evicted and cached again never repeats a version
+        self._versions = itertools.count(1)
+
+        self.queried_points = 0
+        self.result_hits = 0
+        self.tier_reads: Dict[str, int] = {}
+
+    async def get_history(
+            self,
+            computer_id: str,
+            metric_name: str,
+            start: datetime,
+            end: datetime,
+            points: int
+    ) -> dict:
+        tier = self.select_tier(to_timestamp_ns(start), to_timestamp_ns(end), points)
+        result = await self._history(computer_id, metric_name, start, end, points, tier)
+        if tier is not None and result["raw_points"] == 0:
+            # Nothing rolled up over this range (e.g. written before rollups were enabled)
+            result = await self._history(computer_id, metric_name, start, end, points, None)
+        tier_name = result["tier"]
+        self.tier_reads[tier_name] = self.tier_reads.get(tier_name, 0) + 1
+        return result
+
+    def select_tier(self, start_ns: int, end_ns: int, points: int) -> Optional[str]:
+        resolution_ns = (end_ns - start_ns) / points
+        selected = None
+        for tier, seconds in self.rollup_tiers:
+            if seconds * NS_PER_SECOND <= resolution_ns:
+                selected = tier
+        return selected
+
+    async def _history(
+            self,
+            computer_id: str,
+            metric_name: str,
+            start: datetime,
+            end: datetime,
+            points: int,
+            tier: Optional[str]
+    ) -> dict:
+        bucket_ns = max(self.bucket_ns, self._window_ns(tier))
+        start_ns = to_timestamp_ns(start) // bucket_ns * bucket_ns
+        end_ns = -(-to_timestamp_ns(end) // bucket_ns) * bucket_ns
+
+        series = self._series_for(computer_id, metric_name, tier)
+        async with series.lock:
+            await self._ensure_range(series, computer_id, metric_name, tier, start_ns, end_ns)
+
+            key = (computer_id, metric_name, tier, start_ns, end_ns, points)
+            cached = self._results.get(key)
+            if cached is not None and cached[0] == series.version:
+                self._results.move_to_end(key)
+                self.result_hits += 1
+                return cached[1]
+
+            first, last = np.searchsorted(series.timestamps, [start_ns, end_ns])
+            timestamps, values = lttb(series.timestamps[first:last], series.values[first:last], points)
+            result = {
+                "computer_id": computer_id,
+                "metric_name": metric_name,
+                "unit": METRIC_UNITS.get(metric_name),
+                "start": _from_ns(start_ns),
+                "end": _from_ns(end_ns),
+                "tier": tier or "raw",
+                "raw_points": int(last - first),
+                "timestamps": (timestamps // 1_000_000).tolist(),
+                "values": values.tolist()
+            }
+
+            self._trim(series, tier, start_ns)
+            self._results[key] = (series.version, result)
+            if len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "cached_series": len(self._series),
+            "cached_points": sum(len(series.values) for series in self._series.values()),
+            "cached_results": len(self._results),
+            "result_hits": self.result_hits,
+            "queried_points": self.queried_points,
+            "tier_reads": self.tier_reads
+        }
+
+    def _window_ns(self, tier: Optional[str]) -> int:
+        return dict(self.rollup_tiers)[tier] * NS_PER_SECOND if tier is not None else 0
+
+    def _span_ns(self, tier: Optional[str]) -> int:
+        return self.max_span_ns * dict(self.rollup_tiers)[tier] if tier is not None else self.max_span_ns
+
+    def _series_for(self, computer_id: str, metric_name: str, tier: Optional[str]) -> _SeriesCache:
+        key = (computer_id, metric_name, tier)
+        series = self._series.get(key)
+        if series is None:
+            series = _SeriesCache()
+            self._series[key] = series
+            if len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+        else:
+            self._series.move_to_end(key)
+        return series
+
+    async def _ensure_range(
+            self,
+            series: _SeriesCache,
+            computer_id: str,
+            metric_name: str,
+            tier: Optional[str],
+            start_ns: int,
+            end_ns: int
+    ):
+        now_ns = time.time_ns()
+        fetch_end_ns = min(end_ns, now_ns)
+        # A rollup is written grace seconds after its window closed, stamped with the window start
+        settle_ns = self.settle_ns
+        if tier is not None:
+            settle_ns += self._window_ns(tier) + self.rollup_grace_ns
+
+        if series.start_ns is None or start_ns < series.start_ns - self._span_ns(tier) \
+                or start_ns > series.fetched_end_ns:
+            # Nothing cached, or the cached range is too far away to be worth extending
+            timestamps, values = await self._query(computer_id, metric_name, tier, start_ns, fetch_end_ns)
+            series.timestamps, series.values = timestamps, values
+            series.start_ns = start_ns
+            series.fetched_end_ns = fetch_end_ns
+            series.stable_end_ns = max(start_ns, fetch_end_ns - settle_ns)
+            series.last_refresh = time.monotonic()
+            series.version = next(self._versions)
+            return
+
+        if start_ns < series.start_ns:
+            timestamps, values = await self._query(computer_id, metric_name, tier, start_ns, series.start_ns)
+            series.timestamps = np.concatenate([timestamps, series.timestamps])
+            series.values = np.concatenate([values, series.values])
+            series.start_ns = start_ns
+            series.version = next(self._versions)
+
+        if fetch_end_ns > series.fetched_end_ns and \
+                time.monotonic() - series.last_refresh >= self.refresh_interval:
+            # Re-read everything after the stable mark and replace the provisional tail
+            timestamps, values = await self._query(computer_id, metric_name, tier, series.stable_end_ns, fetch_end_ns)
+            keep = np.searchsorted(series.timestamps, series.stable_end_ns)
+            series.timestamps = np.concatenate([series.timestamps[:keep], timestamps])
+            series.values = np.concatenate([series.values[:keep], values])
+            series.fetched_end_ns = fetch_end_ns
+            series.stable_end_ns = max(series.stable_end_ns, fetch_end_ns - settle_ns)
+            series.last_refresh = time.monotonic()
+            series.version = next(self._versions)
+
+    async def _query(self, computer_id: str, metric_name: str, tier: Optional[str], start_ns: int, stop_ns: int):
+        if stop_ns <= start_ns:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        timestamps, values = await asyncio.to_thread(
+            self.influxdb_service.query_series, computer_id, metric_name, start_ns, stop_ns, tier
+        )
+        self.queried_points += len(values)
+        return timestamps, values
+
+    def _trim(self, series: _SeriesCache, tier: Optional[str], start_ns: int) -> None:
+        trim_ns = min(start_ns, series.fetched_end_ns - self._span_ns(tier))
+        if trim_ns <= series.start_ns:
+            return
+        series.start_ns = trim_ns
+        keep = np.searchsorted(series.timestamps, series.start_ns)
+        series.timestamps = series.timestamps[keep:]
+        series.values = series.values[keep:]
+        series.version = next(self._versions)
+
+
+def _from_ns(timestamp_ns: int) -> datetime:
+    return datetime.fromtimestamp(timestamp_ns / NS_PER_SECOND, tz=timezone.utc)
@@ -1,8 +1,16 @@
-import os
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+import numpy as np
 import os
+from services.instrumentation import metrics
 
 load_dotenv()
 
@@ -12,12 +20,90 @@ POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "postgres_db")
 
-DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+# DATABASE_URL replaces the Postgres settings, e.g. sqlite:///./local.db for local runs
+DATABASE_URL = os.getenv("DATABASE_URL") or \
+    f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+
+# "async" runs queries on the event loop through asyncpg/aiosqlite, "sync" in worker threads
+DATABASE_MODE = os.getenv("DATABASE_MODE", "async")
+if DATABASE_MODE not in ("async", "sync"):
+    raise ValueError(f"Unknown DATABASE_MODE '{DATABASE_MODE}', expected 'async' or 'sync'")
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+ECHO = os.getenv("DATABASE_ECHO", "false").lower() == "true"
+
+
+def engine_options(url: str, asynchronous: bool) -> dict:
+    options = dict(echo=ECHO, pool_pre_ping=True, query_cache_size=STATEMENT_CACHE_SIZE)
+    if make_url(url).get_backend_name() == "sqlite":
+        # SQLite picks its own pool; the sizing below is for a database server
+        return options
+
+    options.update(
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE
+    )
+    if asynchronous:
+        # Prepared statements asyncpg keeps per connection
+        options["connect_args"] = {"prepared_statement_cache_size": STATEMENT_CACHE_SIZE}
+    return options
+
+
+def async_url(url: str) -> str:
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername)) \
+        .render_as_string(hide_password=False)
+
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, echo=True)
+POOL_WAIT_SECONDS = metrics.histogram("db_pool_wait_duration_seconds", "Time sessions waited for a pooled connection")
+
+# How long sessions waited for a pooled connection, over the most recent checkouts
+class PoolMetrics:
+    def __init__(self, window: int = 10_000):
+        self.waits = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.waits.append(seconds)
+        self.checkouts += 1
+        self.total_wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        POOL_WAIT_SECONDS.observe(seconds)
+
+    def stats(self) -> dict:
+        waits = np.array(self.waits) * 1000
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "mean_wait_ms": round(self.total_wait_seconds * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            "p99_wait_ms": round(float(np.percentile(waits, 99)), 3) if len(waits) else 0.0,
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 3)
+        }
+
+
+pool_metrics = PoolMetrics()
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL, False))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(async_url(DATABASE_URL), **engine_options(DATABASE_URL, True)) \
+    if DATABASE_MODE == "async" else None
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False) \
+    if async_engine is not None else None
+
 
 def get_db():
     db = SessionLocal()
@@ -27,6 +113,68 @@ def get_db():
         db.close()
 
 
+@contextmanager
+def session_scope():
+    # Sync session with its connection checked out up front, so the pool wait is measured
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        try:
+            db.connection()
+        except PoolTimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        pool_metrics.record(time.perf_counter() - started)
+        yield db
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def async_session_scope():
+    db: AsyncSession = AsyncSessionLocal()
+    try:
+        started = time.perf_counter()
+        try:
+            await db.connection()
+        except PoolTimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        pool_metrics.record(time.perf_counter() - started)
+        yield db
+    finally:
+        await db.close()
+
+
+def pool_stats() -> dict:
+    pool = (async_engine.sync_engine if async_engine is not None else engine).pool
+    stats = {"mode": DATABASE_MODE, "pool": pool.status()}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    stats.update(pool_metrics.stats())
+    return stats
+
+
+def _pool_connections() -> dict:
+    stats = pool_stats()
+    return {(state,): stats[state] for state in ("size", "checkedin", "checkedout", "overflow") if state in stats}
+
+
+metrics.gauge_callback("db_pool_connections", "Connections of the database pool by state", _pool_connections, ("state",))
+metrics.counter_callback("db_pool_timeouts", "Sessions that gave up waiting for a connection", lambda: pool_metrics.timeouts)
+
+
 def init_db():
     from models.user import Base
     Base.metadata.create_all(bind=engine)
+
+
+async def init_db_async():
+    if async_engine is None:
+        await asyncio.to_thread(init_db)
+        return
+
+    from models.user import Base
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
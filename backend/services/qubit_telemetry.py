@@ -0,0 +1,313 @@
+import base64
+import math
+from itertools import repeat
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.line_protocol import escape_measurement, escape_tag, format_float, value_texts
+from services.simulator import CALIBRATION_PERIOD, COMPUTER_PROFILES, DEFAULT_PROFILE_ID
+
+QUBIT_TELEMETRY_MODES = ("packed", "series")
+
+# One line per computer and tick, with summary fields and every per-qubit array packed into one
+# base64 field of little-endian float32 values (qubit order, couplers in coupling map order)
+PACKED_MEASUREMENT = "qubit_telemetry"
+
+QUBIT_FIELDS = ("t1", "t2", "readout_error")
+COUPLER_FIELDS = ("cx_error",)
+
+# Measurements of the per-qubit series, tagged with qubit (or coupler as "a-b")
+SERIES_MEASUREMENTS = {
+    "t1": "qubit_t1",
+    "t2": "qubit_t2",
+    "readout_error": "qubit_readout_error",
+    "cx_error": "coupler_cx_error"
+}
+
+FIELD_UNITS = {"t1": "μs", "t2": "μs", "readout_error": "%", "cx_error": "%"}
+
+FIELD_DECIMALS = {"t1": 1, "t2": 1, "readout_error": 4, "cx_error": 4}
+
+# Drifts are AR(1) processes in log space: each tick keeps DRIFT_RETENTION of the drift and adds
+# noise, with stationary standard deviations DRIFT_SIGMA. The noise of a qubit is mixed with that
+# of the qubits it is coupled to and with one draw per computer (fridge temperature, flux noise),
+# so neighbouring qubits drift together. Couplers share the noise of the qubits they join.
+DRIFT_RETENTION = np.float32(0.98)
+DRIFT_SIGMA = {"t1": 0.15, "t2": 0.2, "readout_error": 0.25, "cx_error": 0.25}
+NEIGHBOUR_WEIGHT = 0.5
+COMMON_WEIGHT = 0.3
+
+# Two-level-system defects: a qubit's T1 collapses to TLS_DEPTH of its value, then recovers by
+# TLS_RECOVERY of the remaining gap per tick
+TLS_PROBABILITY = 2e-4
+TLS_DEPTH = 0.4
+TLS_RECOVERY = np.float32(0.95)
+
+# Qubits and couplers whose error drifted past OUTLIER_FACTOR times their baseline are
+# recalibrated on their own, between the full calibrations every CALIBRATION_PERIOD ticks
+OUTLIER_FACTOR = 3.0
+
+
+def coupling_map(qubits: int) -> np.ndarray:
+    # Heavy-hex style lattice: rows of qubits coupled in a chain, and every fourth qubit of a row
+    # coupled to the one below it, offset by two between even and odd rows. Couplers as (a, b), a < b.
+    width = int(math.sqrt(qubits)) + 1
+    index = np.arange(qubits, dtype=np.int32)
+    column, row = index % width, index // width
+    horizontal = index[(column < width - 1) & (index + 1 < qubits)]
+    vertical = index[(column % 4 == np.where(row % 2 == 0, 0, 2)) & (index + width < qubits)]
+    return np.concatenate([
+        np.stack([horizontal, horizontal + 1], axis=1),
+        np.stack([vertical, vertical + width], axis=1)
+    ]).astype(np.int32)
+
+
+# Per-qubit T1/T2 and readout error, and per-coupler two-qubit gate (CX) error, for a set of
+# computers sized by their profiles' qubit counts. The state of all computers lives in flat float32
+# arrays, computer after computer (qubit_offsets and coupler_offsets mark where each one starts),
+# so a tick is a handful of vectorized operations however many computers and qubits there are.
+class QubitTelemetry:
+    def __init__(
+            self,
+            computer_ids: Sequence[str],
+            seed: Optional[int] = None,
+            profiles: Optional[List[dict]] = None,
+            mode: str = "packed"
+    ):
+        if mode not in QUBIT_TELEMETRY_MODES:
+            raise ValueError(f"Unknown qubit telemetry mode '{mode}', expected one of {QUBIT_TELEMETRY_MODES}")
+        self.computer_ids = tuple(computer_ids)
+        self._positions = {computer_id: position for position, computer_id in enumerate(self.computer_ids)}
+        self.mode = mode
+        self.rng = np.random.default_rng(seed)
+
+        if profiles is None:
+            profiles = [
+                COMPUTER_PROFILES.get(computer_id, COMPUTER_PROFILES[DEFAULT_PROFILE_ID])
+                for computer_id in self.computer_ids
+            ]
+        elif len(profiles) != len(self.computer_ids):
+            raise ValueError(f"Expected {len(self.computer_ids)} profiles, got {len(profiles)}")
+
+        qubits = np.array([p["qubits"] for p in profiles], dtype=np.int64)
+        maps = [coupling_map(int(count)) for count in qubits]
+        self.qubit_offsets = np.r_[0, np.cumsum(qubits)]
+        self.coupler_offsets = np.r_[0, np.cumsum([len(edges) for edges in maps])].astype(np.int64)
+        self.qubit_device = np.repeat(np.arange(len(qubits), dtype=np.int32), qubits)
+        self.coupler_device = np.repeat(np.arange(len(qubits), dtype=np.int32), np.diff(self.coupler_offsets))
+        self.couplers = np.concatenate(
+            [edges + offset for edges, offset in zip(maps, self.qubit_offsets[:-1].tolist())]
+        ).astype(np.int32) if maps else np.empty((0, 2), dtype=np.int32)
+        self.degree = np.maximum(np.bincount(self.couplers.ravel(), minlength=self.qubits), 1).astype(np.float32)
+
+        # Baselines: log-normal spread around the profile, worse for older computers
+        def spread(center, sigma, size):
+            return (center * np.exp(self.rng.normal(0.0, sigma, size))).astype(np.float32)
+
+        age = np.array([2.0 - p["age_factor"] for p in profiles])
+        coherence = np.array([p["base_coherence"] for p in profiles])
+        error = np.array([p["base_error"] for p in profiles])
+        self.baseline = {
+            "t1": spread((2.0 * coherence / age)[self.qubit_device], 0.3, self.qubits),
+            "t2": spread((1.5 * coherence / age)[self.qubit_device], 0.35, self.qubits),
+            "readout_error": spread((6.0 * error * age)[self.qubit_device], 0.5, self.qubits),
+            "cx_error": spread((3.0 * error * age)[self.coupler_device], 0.4, len(self.couplers))
+        }
+        self.drift = {name: np.zeros_like(values) for name, values in self.baseline.items()}
+        self.tls = np.ones(self.qubits, dtype=np.float32)
+        self.latest: Dict[str, np.ndarray] = {}
+
+        # Computers calibrate CALIBRATION_PERIOD ticks apart, not all on the same tick
+        self.calibration_phase = self.rng.integers(0, CALIBRATION_PERIOD, len(self.computer_ids))
+        self.iteration = 0
+        self.calibrations = 0
+        self.recalibrations = 0
+        self.tls_events = 0
+
+        self._packed_prefixes = [
+            f"{escape_measurement(PACKED_MEASUREMENT)},computer_id={escape_tag(computer_id)} "
+            f"qubits={count}i,couplers={len(edges)}i"
+            for computer_id, count, edges in zip(self.computer_ids, qubits.tolist(), maps)
+        ]
+        self._series_prefixes: Dict[str, List[str]] = {}
+
+    @property
+    def qubits(self) -> int:
+        return int(self.qubit_offsets[-1])
+
+    @property
+    def state_bytes(self) -> int:
+        arrays = [*self.baseline.values(), *self.drift.values(), self.tls, self.degree, self.couplers]
+        return sum(array.nbytes for array in arrays)
+
+    def step(self) -> Dict[str, np.ndarray]:
+        self.iteration += 1
+        common = self.rng.standard_normal((len(QUBIT_FIELDS) + 1, len(self.computer_ids)), dtype=np.float32)
+
+        qubit_noise = {}
+        for index, name in enumerate(QUBIT_FIELDS):
+            noise = self._correlated(self.rng.standard_normal(self.qubits, dtype=np.float32), common[index])
+            qubit_noise[name] = noise
+            self._advance(name, noise)
+
+        # A coupler's error moves with the decoherence of the qubits it joins
+        a, b = self.couplers[:, 0], self.couplers[:, 1]
+        joined = -(qubit_noise["t1"][a] + qubit_noise["t1"][b]) * np.float32(0.5)
+        noise = self.rng.standard_normal(len(self.couplers), dtype=np.float32)
+        noise += NEIGHBOUR_WEIGHT * joined + COMMON_WEIGHT * common[-1][self.coupler_device]
+        noise /= np.float32(math.sqrt(1.0 + NEIGHBOUR_WEIGHT ** 2 / 2 + COMMON_WEIGHT ** 2))
+        self._advance("cx_error", noise)
+
+        hits = self.rng.random(self.qubits, dtype=np.float32) < TLS_PROBABILITY
+        self.tls = 1 - (1 - self.tls) * TLS_RECOVERY
+        self.tls[hits] = TLS_DEPTH
+        self.tls_events += int(np.count_nonzero(hits))
+
+        self._calibrate()
+
+        t1 = self.baseline["t1"] * np.exp(-self.drift["t1"]) * self.tls
+        values = {
+            "t1": t1,
+            "t2": np.minimum(self.baseline["t2"] * np.exp(-self.drift["t2"]), 2 * t1),
+            "readout_error": np.minimum(self.baseline["readout_error"] * np.exp(self.drift["readout_error"]), 50.0),
+            "cx_error": np.minimum(self.baseline["cx_error"] * np.exp(self.drift["cx_error"]), 100.0)
+        }
+        self.latest = values
+        return values
+
+    def tick(self, timestamp_ns: int) -> Tuple[bytes, int]:
+        # Steps every computer and encodes the tick in the configured mode, with the number of
+        # points (lines) it holds
+        values = self.step()
+        if self.mode == "packed":
+            return self.encode_packed(values, timestamp_ns), len(self.computer_ids)
+        return self.encode_series(values, timestamp_ns), self.qubits * len(QUBIT_FIELDS) + len(self.couplers)
+
+    def encode_packed(self, values: Dict[str, np.ndarray], timestamp_ns: int) -> bytes:
+        fields = [[] for _ in self.computer_ids]
+        for name in QUBIT_FIELDS + COUPLER_FIELDS:
+            array = values[name]
+            offsets = self.qubit_offsets if name in QUBIT_FIELDS else self.coupler_offsets
+            starts, sizes = offsets[:-1], np.diff(offsets)
+            summaries = _summaries(array, starts, sizes)
+            packed = array.astype("<f4", copy=False)
+            for device, (start, stop) in enumerate(zip(starts.tolist(), offsets[1:].tolist())):
+                mean, low, high = summaries[device]
+                fields[device].append(
+                    f"{name}_mean={format_float(mean)},{name}_min={format_float(low)},{name}_max={format_float(high)},"
+                    f'{name}="{base64.b64encode(packed[start:stop].tobytes()).decode()}"'
+                )
+
+        return "\n".join(
+            f"{prefix},{','.join(device_fields)} {timestamp_ns}"
+            for prefix, device_fields in zip(self._packed_prefixes, fields)
+        ).encode()
+
+    def encode_series(self, values: Dict[str, np.ndarray], timestamp_ns: int) -> bytes:
+        suffix = " %d\n" % timestamp_ns
+        lines = []
+        for name in QUBIT_FIELDS + COUPLER_FIELDS:
+            texts = value_texts(np.round(values[name].astype(np.float64), FIELD_DECIMALS[name]))
+            lines.extend(map("".join, zip(self._series_prefix(name), texts, repeat(suffix))))
+        return "".join(lines)[:-1].encode()
+
+    def device(self, computer_id: str) -> Optional[dict]:
+        # Latest per-qubit values of one computer, with its coupling map
+        device = self._positions.get(computer_id)
+        if device is None or not self.latest:
+            return None
+        qubit_start, qubit_stop = self.qubit_offsets[device:device + 2].tolist()
+        coupler_start, coupler_stop = self.coupler_offsets[device:device + 2].tolist()
+        return {
+            "computer_id": computer_id,
+            "iteration": self.iteration,
+            "qubits": qubit_stop - qubit_start,
+            "units": FIELD_UNITS,
+            "couplers": (self.couplers[coupler_start:coupler_stop] - qubit_start).tolist(),
+            **{
+                name: np.round(self.latest[name][qubit_start:qubit_stop].astype(np.float64), FIELD_DECIMALS[name]).tolist()
+                for name in QUBIT_FIELDS
+            },
+            **{
+                name: np.round(self.latest[name][coupler_start:coupler_stop].astype(np.float64), FIELD_DECIMALS[name]).tolist()
+                for name in COUPLER_FIELDS
+            }
+        }
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "computers": len(self.computer_ids),
+            "qubits": self.qubits,
+            "couplers": len(self.couplers),
+            "iteration": self.iteration,
+            "calibrations": self.calibrations,
+            "recalibrations": self.recalibrations,
+            "tls_events": self.tls_events,
+            "state_bytes": self.state_bytes
+        }
+
+    def _correlated(self, noise: np.ndarray, common: np.ndarray) -> np.ndarray:
+        # Own noise plus the mean noise of the coupled qubits and the computer's draw, scaled back
+        # to unit variance for a qubit with the lattice's typical two or three neighbours
+        a, b = self.couplers[:, 0], self.couplers[:, 1]
+        neighbours = (
+            np.bincount(a, weights=noise[b], minlength=self.qubits)
+            + np.bincount(b, weights=noise[a], minlength=self.qubits)
+        ).astype(np.float32) / self.degree
+        mixed = noise + NEIGHBOUR_WEIGHT * neighbours + COMMON_WEIGHT * common[self.qubit_device]
+        mixed /= np.float32(math.sqrt(1.0 + NEIGHBOUR_WEIGHT ** 2 / 2.5 + COMMON_WEIGHT ** 2))
+        return mixed
+
+    def _advance(self, name: str, noise: np.ndarray) -> None:
+        drift = self.drift[name]
+        drift *= DRIFT_RETENTION
+        drift += np.float32(DRIFT_SIGMA[name] * math.sqrt(1.0 - float(DRIFT_RETENTION) ** 2)) * noise
+
+    def _calibrate(self) -> None:
+        # Full calibration resets the error drifts of every qubit and coupler of a computer;
+        # outliers are reset on their own. Decoherence drift is physical and is left alone.
+        due = (self.iteration + self.calibration_phase) % CALIBRATION_PERIOD == 0
+        for name, device_of in (("readout_error", self.qubit_device), ("cx_error", self.coupler_device)):
+            drift = self.drift[name]
+            outliers = drift > np.float32(math.log(OUTLIER_FACTOR))
+            self.recalibrations += int(np.count_nonzero(outliers))
+            reset = outliers | due[device_of] if due.any() else outliers
+            drift[reset] = 0.0
+        self.calibrations += int(np.count_nonzero(due))
+
+    def _series_prefix(self, name: str) -> List[str]:
+        prefixes = self._series_prefixes.get(name)
+        if prefixes is None:
+            measurement = escape_measurement(SERIES_MEASUREMENTS[name])
+            unit = f'unit="{FIELD_UNITS[name]}",value='
+            if name in QUBIT_FIELDS:
+                device_of = self.qubit_device
+                labels = [f"qubit={index}" for index in (np.arange(self.qubits) - self.qubit_offsets[device_of]).tolist()]
+            else:
+                device_of = self.coupler_device
+                local = self.couplers - self.qubit_offsets[device_of][:, None]
+                labels = [f"coupler={a}-{b}" for a, b in local.tolist()]
+            device_tags = [escape_tag(computer_id) for computer_id in self.computer_ids]
+            prefixes = [
+                f"{measurement},computer_id={device_tags[device]},{label} {unit}"
+                for device, label in zip(device_of.tolist(), labels)
+            ]
+            self._series_prefixes[name] = prefixes
+        return prefixes
+
+
+def _summaries(values: np.ndarray, starts: np.ndarray, sizes: np.ndarray) -> List[Tuple[float, float, float]]:
+    # Mean, min and max of every computer's slice, rounded like the series values
+    if not len(values):
+        return [(0.0, 0.0, 0.0)] * len(starts)
+    widened = values.astype(np.float64)
+    starts = np.minimum(starts, len(values) - 1)
+    empty = sizes == 0
+    means = np.where(empty, 0.0, np.add.reduceat(widened, starts) / np.maximum(sizes, 1))
+    lows = np.where(empty, 0.0, np.minimum.reduceat(widened, starts))
+    highs = np.where(empty, 0.0, np.maximum.reduceat(widened, starts))
+    return list(zip(
+        np.round(means, 4).tolist(), np.round(lows, 4).tolist(), np.round(highs, 4).tolist()
+    ))
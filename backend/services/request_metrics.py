@@ -0,0 +1,44 @@
+import time
+from services.instrumentation import metrics
+
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Time until the response headers were sent", ("method", "route", "status")
+)
+
+
+# Plain ASGI middleware, so streaming responses pass through untouched. Requests are labelled
+# with the route template rather than the path, which keeps one series per endpoint.
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        responded = False
+
+        async def send_with_metrics(message):
+            nonlocal responded
+            if message["type"] == "http.response.start":
+                responded = True
+                self.observe(scope, message["status"], started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            if not responded:
+                self.observe(scope, 500, started)
+            raise
+
+    @staticmethod
+    def observe(scope, status: int, started: float) -> None:
+        REQUEST_SECONDS.labels(scope["method"], route_template(scope), str(status)).observe(time.perf_counter() - started)
+
+
+def route_template(scope) -> str:
+    # The matched route's template (with the router prefix), not the path, to keep labels few
+    return getattr(scope.get("route"), "path_format", None) or "unmatched"
@@ -0,0 +1,74 @@
+import hashlib
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import orjson
+from fastapi import Request, Response
+
+MEDIA_TYPE = "application/json"
+
+
+def strong_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison, as If-None-Match calls for: a W/ prefix on the client's copy still matches
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+
+# Serialized JSON bodies of read endpoints, kept until the version they were built for changes.
+# A hit skips validation and serialization altogether, and a client that already holds the
+# body gets an empty 304. ETags hash the body, so a rebuild that produces the same bytes keeps
+# the client's copy valid.
+class ResponseCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Hashable, bytes, Dict[str, str]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def respond(
+            self,
+            request: Request,
+            key: Hashable,
+            version: Hashable,
+            build: Callable[[], Tuple[object, Dict[str, str]]]
+    ) -> Response:
+        # build returns the content and any extra headers; it only runs when version moved on
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _, body, headers = entry
+        else:
+            self.misses += 1
+            content, extra_headers = build()
+            body = orjson.dumps(content)
+            headers = {"ETag": strong_etag(body), "Cache-Control": "no-cache", **extra_headers}
+            self._entries[key] = (version, body, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type=MEDIA_TYPE, headers=headers)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified
+        }
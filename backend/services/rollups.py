@@ -0,0 +1,321 @@
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models.metric_batch import MetricBatch, ShapeCache, group_repeats
+from services.line_protocol import escape_measurement, escape_tag
+
+NS_PER_SECOND = 10 ** 9
+
+# Rollup tiers by name, coarsest last
+ROLLUP_TIERS: Dict[str, int] = {"1m": 60, "1h": 3600}
+
+# min, max, sum, count, last value, timestamp of the last value
+_FIELDS = 6
+
+EMPTY_AGGREGATE = np.array([np.inf, -np.inf, 0.0, 0.0, 0.0, float(np.iinfo(np.int64).min)])
+
+
+def aggregate_windows(timestamps_ns: np.ndarray, values: np.ndarray, window_ns: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Aggregates of one series with ascending timestamps per window, as (window starts, rows of
+    # min, max, sum, count, last, last timestamp). Non-finite values do not count.
+    finite = np.isfinite(values)
+    timestamps_ns, values = timestamps_ns[finite], values[finite]
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, _FIELDS))
+
+    windows = timestamps_ns - timestamps_ns % window_ns
+    starts = np.flatnonzero(np.r_[True, windows[1:] != windows[:-1]])
+    return windows[starts], reduce_groups(timestamps_ns, values, starts).T
+
+
+def reduce_groups(timestamps_ns: np.ndarray, values: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    # Aggregates of runs of rows, each starting at one of starts and ordered by timestamp, as
+    # columns of min, max, sum, count, last, last timestamp
+    ends = np.r_[starts[1:], len(values)] - 1
+    aggregates = np.empty((_FIELDS, len(starts)))
+    aggregates[0] = np.minimum.reduceat(values, starts)
+    aggregates[1] = np.maximum.reduceat(values, starts)
+    aggregates[2] = np.add.reduceat(values, starts)
+    aggregates[3] = np.diff(np.r_[starts, len(values)])
+    aggregates[4] = values[ends]
+    aggregates[5] = timestamps_ns[ends]
+    return aggregates
+
+
+def merge_aggregates(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    merged = np.empty(_FIELDS)
+    merged[0] = min(a[0], b[0])
+    merged[1] = max(a[1], b[1])
+    merged[2] = a[2] + b[2]
+    merged[3] = a[3] + b[3]
+    merged[4:6] = a[4:6] if a[5] >= b[5] else b[4:6]
+    return merged
+
+
+def encode_rollups(
+        computer_id: str,
+        metric_name: str,
+        tier: str,
+        window_starts: np.ndarray,
+        aggregates: np.ndarray
+) -> bytes:
+    # metric_name,computer_id=...,tier=1m count=12i,last=...,max=...,mean=...,min=... <window start>
+    prefix = f"{escape_measurement(metric_name)},computer_id={escape_tag(computer_id)},tier={tier} "
+    lines = []
+    for start_ns, (low, high, total, count, last, _) in zip(window_starts.tolist(), aggregates.tolist()):
+        if count <= 0:
+            continue
+        lines.append(
+            f"{prefix}count={int(count)}i,last={last!r},max={high!r},mean={total / count!r},min={low!r} {start_ns}\n"
+        )
+    return "".join(lines).encode()
+
+
+# Aggregates of one open window, as columns over all series, or only over the given series rows
+# (ascending) for windows that only ingested points have reached so far
+class _Window:
+    __slots__ = ("start_ns", "aggregates", "rows")
+
+    def __init__(self, start_ns: int, series: int, rows: Optional[np.ndarray] = None):
+        self.start_ns = start_ns
+        self.rows = rows
+        self.aggregates = np.repeat(EMPTY_AGGREGATE[:, None], series if rows is None else len(rows), axis=1)
+
+
+# Continuous min/max/mean/count/last rollups per (computer_id, metric_name), computed as points
+# are written. Each tier keeps its open windows as columns over all series; a window closes once
+# the watermark (newest timestamp seen, or the wall clock) is grace_seconds past its end, so
+# points arriving late within the grace period still land in their window. Points for windows
+# that already closed are counted as late and dropped. Batches with their own timestamps per row
+# (from the ingest API) move the watermark no further than the wall clock, so an agent sending
+# timestamps ahead of the server cannot close the current windows early. Their rows are
+# aggregated per series and window before they reach a window, rows of windows that batch closes
+# are late, and they open sparse windows, at most max_open_windows per tier; points of further
+# windows are rejected.
+class RollupEngine:
+    def __init__(
+            self,
+            tiers: Optional[Dict[str, int]] = None,
+            grace_seconds: float = 30.0,
+            max_series: int = 100_000,
+            max_open_windows: int = 4
+    ):
+        self.tiers = dict(tiers or ROLLUP_TIERS)
+        self.grace_ns = int(grace_seconds * NS_PER_SECOND)
+        self.max_series = max_series
+        self.max_open_windows = max_open_windows
+
+        self._series: Dict[Tuple[str, str], int] = {}
+        self._series_keys: List[Tuple[str, str]] = []
+        self._shapes = ShapeCache()
+        self._open: Dict[str, Dict[int, _Window]] = {tier: {} for tier in self.tiers}
+        self._closed_before: Dict[str, int] = {tier: np.iinfo(np.int64).min for tier in self.tiers}
+        self._prefixes: Dict[str, List[str]] = {tier: [] for tier in self.tiers}
+        self.watermark_ns = 0
+
+        self.observed_points = 0
+        self.late_points = 0
+        self.rejected_points = 0
+        self.emitted_rollups = 0
+
+    def observe(self, batch: MetricBatch) -> bytes:
+        # Returns line protocol for the windows this batch closed
+        rows, unique = batch.series_rows(self._row_for, self._shapes)
+        accepted = (rows >= 0) & np.isfinite(batch.values)
+        self.rejected_points += int((rows < 0).sum())
+        rows, values = rows[accepted], batch.values[accepted]
+        self.observed_points += len(values)
+
+        timestamp_ns = batch.timestamp_ns
+        if batch.timestamps_ns is None:
+            for tier, seconds in self.tiers.items():
+                window_ns = seconds * NS_PER_SECOND
+                self._add(tier, timestamp_ns - timestamp_ns % window_ns, rows, values, timestamp_ns, unique)
+            return self.advance(timestamp_ns)
+
+        # Rows with their own timestamps may fall into several windows of a tier
+        timestamps = batch.timestamps_ns[accepted]
+        watermark_ns = max(self.watermark_ns, min(timestamp_ns, time.time_ns()))
+        for tier, seconds in self.tiers.items():
+            self._add_rows(tier, seconds * NS_PER_SECOND, rows, values, timestamps, watermark_ns)
+        return self.advance(watermark_ns)
+
+    def _add(self, tier: str, start_ns: int, rows: np.ndarray, values: np.ndarray, timestamp_ns, unique: bool) -> None:
+        if start_ns < self._closed_before[tier]:
+            self.late_points += len(values)
+            return
+
+        window = self._open[tier].get(start_ns)
+        if window is None:
+            window = _Window(start_ns, self._capacity())
+            self._open[tier][start_ns] = window
+        self._update(window, rows, values, timestamp_ns, unique)
+
+    def _add_rows(
+            self,
+            tier: str,
+            window_ns: int,
+            rows: np.ndarray,
+            values: np.ndarray,
+            timestamps: np.ndarray,
+            watermark_ns: int
+    ) -> None:
+        # Rows with one timestamp each; windows that are closed, or that watermark_ns closes, do
+        # not take any, and no more windows than max_open_windows are opened
+        starts = timestamps - timestamps % window_ns
+        oldest_ns = max(self._closed_before[tier], watermark_ns - self.grace_ns - window_ns + 1)
+        late = starts < oldest_ns
+        self.late_points += int(late.sum())
+
+        open_windows = self._open[tier]
+        candidates = np.unique(starts[~late])
+        new = candidates[~np.isin(candidates, list(open_windows))]
+        refused = new[max(0, self.max_open_windows - len(open_windows)):]
+        kept = ~late
+        if len(refused):
+            refused_rows = kept & np.isin(starts, refused)
+            self.rejected_points += int(refused_rows.sum())
+            kept &= ~refused_rows
+        if not kept.any():
+            return
+
+        # One column of aggregates per window and series, windows in ascending order
+        rows, values, timestamps, starts = rows[kept], values[kept], timestamps[kept], starts[kept]
+        order = np.lexsort((timestamps, rows, starts))
+        rows, values, timestamps, starts = rows[order], values[order], timestamps[order], starts[order]
+        groups = np.flatnonzero(np.r_[True, (starts[1:] != starts[:-1]) | (rows[1:] != rows[:-1])])
+        aggregates = reduce_groups(timestamps, values, groups)
+        rows, starts = rows[groups], starts[groups]
+
+        bounds = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1], True])
+        for first, last in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            start_ns = int(starts[first])
+            window = open_windows.get(start_ns)
+            if window is None:
+                window = open_windows[start_ns] = _Window(start_ns, 0, rows[:0])
+            self._merge(window, rows[first:last], aggregates[:, first:last])
+
+    def _merge(self, window: _Window, rows: np.ndarray, aggregates: np.ndarray) -> None:
+        # Folds in aggregates with one column per series row, rows ascending and distinct
+        if window.rows is None:
+            self._grow(window)
+            columns = rows
+        else:
+            merged = np.union1d(window.rows, rows)
+            if len(merged) > len(window.rows):
+                grown = np.repeat(EMPTY_AGGREGATE[:, None], len(merged), axis=1)
+                grown[:, np.searchsorted(merged, window.rows)] = window.aggregates
+                window.rows, window.aggregates = merged, grown
+            columns = np.searchsorted(window.rows, rows)
+
+        target = window.aggregates
+        target[0, columns] = np.minimum(target[0, columns], aggregates[0])
+        target[1, columns] = np.maximum(target[1, columns], aggregates[1])
+        target[2, columns] += aggregates[2]
+        target[3, columns] += aggregates[3]
+        newer = target[5, columns] <= aggregates[5]
+        target[4:6, columns[newer]] = aggregates[4:6, newer]
+
+    def advance(self, now_ns: Optional[int] = None) -> bytes:
+        # Closes every window the watermark has moved grace_seconds past
+        self.watermark_ns = max(self.watermark_ns, now_ns if now_ns is not None else time.time_ns())
+        finished = []
+        for tier, seconds in self.tiers.items():
+            window_ns = seconds * NS_PER_SECOND
+            open_windows = self._open[tier]
+            for start_ns in sorted(open_windows):
+                if start_ns + window_ns + self.grace_ns > self.watermark_ns:
+                    break
+                finished.append(self._encode(tier, open_windows.pop(start_ns)))
+                self._closed_before[tier] = start_ns + window_ns
+        return b"".join(finished)
+
+    def flush(self) -> bytes:
+        # Emits the open windows as they are, for shutdown
+        finished = []
+        for tier, open_windows in self._open.items():
+            for start_ns in sorted(open_windows):
+                finished.append(self._encode(tier, open_windows.pop(start_ns)))
+        return b"".join(finished)
+
+    def stats(self) -> dict:
+        return {
+            "tiers": self.tiers,
+            "series": len(self._series),
+            "open_windows": {tier: len(windows) for tier, windows in self._open.items()},
+            "observed_points": self.observed_points,
+            "late_points": self.late_points,
+            "rejected_points": self.rejected_points,
+            "emitted_rollups": self.emitted_rollups
+        }
+
+    def _update(self, window: _Window, rows: np.ndarray, values: np.ndarray, timestamp_ns, unique: bool) -> None:
+        # timestamp_ns is one timestamp for all rows or an array with one per row
+        self._grow(window)
+        aggregates = window.aggregates
+        if unique:
+            aggregates[0, rows] = np.minimum(aggregates[0, rows], values)
+            aggregates[1, rows] = np.maximum(aggregates[1, rows], values)
+            aggregates[2, rows] += values
+            aggregates[3, rows] += 1
+            last_rows, last_values, last_timestamps = rows, values, timestamp_ns
+        else:
+            np.minimum.at(aggregates[0], rows, values)
+            np.maximum.at(aggregates[1], rows, values)
+            np.add.at(aggregates[2], rows, values)
+            np.add.at(aggregates[3], rows, 1)
+            # Only the newest row of each series can be its last value
+            order, position, size = group_repeats(rows, timestamp_ns)
+            newest = order[position == size - 1]
+            last_rows, last_values = rows[newest], values[newest]
+            last_timestamps = timestamp_ns[newest] if np.ndim(timestamp_ns) else timestamp_ns
+
+        newer = aggregates[5, last_rows] <= last_timestamps
+        aggregates[4, last_rows[newer]] = last_values[newer]
+        aggregates[5, last_rows[newer]] = last_timestamps[newer] if np.ndim(last_timestamps) else last_timestamps
+
+    def _grow(self, window: _Window) -> None:
+        # Makes the window hold a column for every known series
+        aggregates = window.aggregates
+        if window.rows is None and aggregates.shape[1] >= len(self._series):
+            return
+        grown = _Window(window.start_ns, self._capacity()).aggregates
+        if window.rows is None:
+            grown[:, :aggregates.shape[1]] = aggregates
+        else:
+            grown[:, window.rows] = aggregates
+        window.aggregates, window.rows = grown, None
+
+    def _encode(self, tier: str, window: _Window) -> bytes:
+        aggregates = window.aggregates
+        columns = np.flatnonzero(aggregates[3] > 0)
+        rows = columns if window.rows is None else window.rows[columns]
+        self.emitted_rollups += len(rows)
+
+        prefixes = self._prefixes[tier]
+        for row in range(len(prefixes), len(self._series_keys)):
+            computer_id, metric_name = self._series_keys[row]
+            prefixes.append(f"{escape_measurement(metric_name)},computer_id={escape_tag(computer_id)},tier={tier} ")
+
+        suffix = f" {window.start_ns}\n"
+        lows, highs, totals, counts, lasts = (aggregates[field, columns].tolist() for field in range(5))
+        return "".join(
+            f"{prefixes[row]}count={int(count)}i,last={last!r},max={high!r},mean={total / count!r},min={low!r}{suffix}"
+            for row, low, high, total, count, last in zip(rows.tolist(), lows, highs, totals, counts, lasts)
+        ).encode()
+
+    def _capacity(self) -> int:
+        # Open windows are sized for the series known so far, with headroom
+        return max(64, 2 * len(self._series))
+
+    def _row_for(self, computer_id: str, metric_name: str) -> int:
+        row = self._series.get((computer_id, metric_name))
+        if row is None:
+            if len(self._series) >= self.max_series:
+                return -1
+            row = len(self._series)
+            self._series[(computer_id, metric_name)] = row
+            self._series_keys.append((computer_id, metric_name))
+        return row
@@ -0,0 +1,229 @@
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta
+from functools import reduce
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from models import METRIC_NAMES, MetricBatch
+from models.metric import METRIC_UNITS
+from models.metric_batch import EPOCH, METRIC_NAME_UNITS, ShapeCache, column_indexes
+from services.fleet_simulator import FleetSimulator
+
+MIN_TICK_SECONDS = 0.01
+
+
+def parse_intervals(spec: Optional[str]) -> Dict[str, float]:
+    # "temperature=1,quantum_volume=60,qc-002=10,qc-003/temperature=2": a metric, a computer,
+    # or a computer/metric pair, each with its sampling interval in seconds
+    intervals = {}
+    for entry in (spec or "").split(","):
+        if not entry.strip():
+            continue
+        key, _, value = entry.partition("=")
+        interval = float(value)
+        if interval <= 0:
+            raise ValueError(f"Sampling interval for '{key.strip()}' must be positive")
+        intervals[key.strip()] = interval
+    return intervals
+
+
+def resolve_interval(computer_id: str, metric_name: str, intervals: Dict[str, float], default: float) -> float:
+    for key in (f"{computer_id}/{metric_name}", computer_id, metric_name):
+        if key in intervals:
+            return intervals[key]
+    return default
+
+
+# Hashed timer wheel over integer ticks. Entries for ticks more than one revolution ahead
+# wait in their slot until the wheel comes around to their tick.
+class TimerWheel:
+    def __init__(self, slots: int = 512):
+        self.slots: List[List[Tuple[int, object]]] = [[] for _ in range(slots)]
+        self.current_tick = -1
+
+    def schedule(self, tick: int, item) -> None:
+        tick = max(tick, self.current_tick + 1)
+        self.slots[tick % len(self.slots)].append((tick, item))
+
+    def advance(self, to_tick: int) -> List[Tuple[int, object]]:
+        due = []
+        # Far behind, every slot is visited once rather than once per missed tick
+        span = min(to_tick - self.current_tick, len(self.slots))
+        for tick in range(self.current_tick + 1, self.current_tick + span + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            ready = [entry for entry in slot if entry[0] <= to_tick]
+            if ready:
+                slot[:] = [entry for entry in slot if entry[0] > to_tick]
+                due.extend(ready)
+
+        self.current_tick = max(self.current_tick, to_tick)
+        due.sort(key=lambda entry: entry[0])
+        return due
+
+
+class _Schedule:
+    __slots__ = ("group", "metric_names", "interval_ticks")
+
+    def __init__(self, group: int, metric_names: Tuple[str, ...], interval_ticks: int):
+        self.group = group
+        self.metric_names = metric_names
+        self.interval_ticks = interval_ticks
+
+
+# Decides which metrics of which computers are due, against the monotonic clock. Computers
+# with identical intervals share one FleetSimulator, and every metric interval of that group
+# is a schedule on the timer wheel. Schedules are re-armed from their due tick rather than
+# from when they ran, so the cadence does not drift with the work done per tick; schedules
+# that fell a whole period behind skip the missed periods instead of catching up in a burst.
+# Whatever comes due at one tick goes out as one batch, however many groups it spans.
+class SimulationScheduler:
+    def __init__(
+            self,
+            computer_ids: List[str],
+            default_interval: float = 5.0,
+            intervals: Optional[Dict[str, float]] = None,
+            profiles: Optional[Dict[str, dict]] = None,
+            wheel_slots: int = 512
+    ):
+        intervals = intervals or {}
+        computer_intervals = {
+            computer_id: tuple(resolve_interval(computer_id, name, intervals, default_interval) for name in METRIC_NAMES)
+            for computer_id in computer_ids
+        }
+
+        milliseconds = {round(i * 1000) for row in computer_intervals.values() for i in row}
+        self.tick_seconds = max(MIN_TICK_SECONDS, reduce(math.gcd, milliseconds) / 1000.0)
+
+        grouped: Dict[Tuple[float, ...], List[str]] = {}
+        for computer_id, row in computer_intervals.items():
+            grouped.setdefault(row, []).append(computer_id)
+
+        self.groups: List[FleetSimulator] = []
+        self.wheel = TimerWheel(wheel_slots)
+        for row, members in grouped.items():
+            group = len(self.groups)
+            self.groups.append(FleetSimulator(members, profiles=[profiles[m] for m in members] if profiles else None))
+            by_interval: Dict[float, List[str]] = {}
+            for name, interval in zip(METRIC_NAMES, row):
+                by_interval.setdefault(interval, []).append(name)
+            for interval, names in by_interval.items():
+                ticks = max(1, round(interval / self.tick_seconds))
+                self.wheel.schedule(0, _Schedule(group, tuple(names), ticks))
+
+        self._start: Optional[float] = None
+        self._start_wall_ns = 0
+        self._layouts = ShapeCache()
+
+        self.batches = 0
+        self.late_ticks = 0
+        self.skipped_ticks = 0
+        self.max_lateness = 0.0
+        self.last_lateness = 0.0
+
+    def due_batches(self) -> Iterator[MetricBatch]:
+        if self._start is None:
+            self._start = time.monotonic()
+            self._start_wall_ns = time.time_ns()
+
+        now_tick = int((time.monotonic() - self._start) / self.tick_seconds)
+        due: Dict[Tuple[int, int], List[str]] = {}
+        for due_tick, schedule in self.wheel.advance(now_tick):
+            behind = now_tick - due_tick
+            missed = behind // schedule.interval_ticks
+            if behind > 0:
+                self.late_ticks += 1
+                self.skipped_ticks += missed
+                self.last_lateness = behind * self.tick_seconds
+                self.max_lateness = max(self.max_lateness, self.last_lateness)
+
+            # Sampled at the latest period that has come due
+            sample_tick = due_tick + missed * schedule.interval_ticks
+            due.setdefault((schedule.group, sample_tick), []).extend(schedule.metric_names)
+            self.wheel.schedule(sample_tick + schedule.interval_ticks, schedule)
+
+        ticks: Dict[int, List[MetricBatch]] = {}
+        for (group, sample_tick), metric_names in sorted(due.items(), key=lambda item: (item[0][1], item[0][0])):
+            batch = self.groups[group].generate_metrics(metric_names, self._timestamp(sample_tick))
+            ticks.setdefault(sample_tick, []).append(batch)
+
+        for batches in ticks.values():
+            self.batches += 1
+            yield batches[0] if len(batches) == 1 else self._merge(batches)
+
+    def next_tick_delay(self) -> float:
+        if self._start is None:
+            return 0.0
+        elapsed = time.monotonic() - self._start
+        next_tick = int(elapsed / self.tick_seconds) + 1
+        return max(0.0, next_tick * self.tick_seconds - elapsed)
+
+    async def wait_next_tick(self) -> None:
+        await asyncio.sleep(self.next_tick_delay())
+
+    def export_state(self) -> dict:
+        state = {}
+        for group in self.groups:
+            state.update(group.export_state())
+        return state
+
+    def restore_state(self, states: dict) -> None:
+        for group in self.groups:
+            group.restore_state(states)
+
+    def stats(self) -> dict:
+        return {
+            "tick_seconds": self.tick_seconds,
+            "groups": len(self.groups),
+            "batches": self.batches,
+            "late_ticks": self.late_ticks,
+            "skipped_ticks": self.skipped_ticks,
+            "last_lateness_ms": round(self.last_lateness * 1000.0, 3),
+            "max_lateness_ms": round(self.max_lateness * 1000.0, 3)
+        }
+
+    def _merge(self, batches: List[MetricBatch]) -> MetricBatch:
+        # The merged tables, and where each merged row is among the group batches' values, are
+        # built once per combination of group batch shapes
+        shape = tuple(part for batch in batches for part in batch.shape)
+        layout = self._layouts.get(shape)
+        if layout is None:
+            layout = self._layouts.put(shape, merged_layout(batches))
+        *tables, order = layout
+        return MetricBatch(batches[0].timestamp, *tables, np.concatenate([batch.values for batch in batches])[order])
+
+    def _timestamp(self, tick: int) -> datetime:
+        timestamp_ns = self._start_wall_ns + round(tick * self.tick_seconds * 1_000_000_000)
+        return EPOCH + timedelta(microseconds=timestamp_ns // 1000)
+
+
+def merged_layout(batches: List[MetricBatch]) -> tuple:
+    # Tables and index arrays for the rows of several FleetSimulator batches over different
+    # computers, metric by metric and within a metric batch by batch. Batches of the same metrics
+    # make the usual computer x metric grid. The last item is the order that takes the batches'
+    # concatenated values to the merged rows.
+    computer_ids = tuple(computer_id for batch in batches for computer_id in batch.computer_ids)
+    metric_names = tuple(name for name in METRIC_NAMES if any(name in batch.metric_names for batch in batches))
+    units = METRIC_NAME_UNITS if metric_names == METRIC_NAMES else tuple(METRIC_UNITS[name] for name in metric_names)
+
+    computers = [len(batch.computer_ids) for batch in batches]
+    offsets = np.cumsum([0] + computers[:-1]).tolist()
+    starts = np.cumsum([0] + [len(batch) for batch in batches[:-1]]).tolist()
+    parts = [
+        (position, offset, start + batch.metric_names.index(name) * count, count)
+        for position, name in enumerate(metric_names)
+        for batch, offset, start, count in zip(batches, offsets, starts, computers)
+        if name in batch.metric_names
+    ]
+    order = np.concatenate([np.arange(start, start + count) for _, _, start, count in parts])
+
+    if all(batch.metric_names == metric_names for batch in batches):
+        computer_index, metric_index = column_indexes(len(computer_ids), len(metric_names))
+    else:
+        computer_index = np.concatenate([np.arange(offset, offset + count, dtype=np.int32) for _, offset, _, count in parts])
+        metric_index = np.repeat(np.array([part[0] for part in parts], dtype=np.int32), [part[3] for part in parts])
+    return computer_ids, metric_names, units, computer_index, metric_index, order
@@ -0,0 +1,301 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from models import METRIC_NAMES, METRIC_UNITS, MetricBatch
+from models.metric_batch import METRIC_NAME_UNITS, column_indexes
+from services.scheduler import SimulationScheduler
+from services.influxdb_service import InfluxDBService
+from services.write_path import MetricsWritePath
+from services.write_pipeline import MetricWritePipeline
+
+ComputerState = Tuple[int, float, float]
+
+STOP_TIMEOUT = 30.0
+
+SHARD_SPOOL_PREFIX = "shard"
+
+
+def shard_computers(computer_ids: List[str], shards: int) -> List[List[str]]:
+    # Contiguous, near-equal slices, so a shard keeps most of its computers when the count changes
+    size, extra = divmod(len(computer_ids), shards)
+    slices = []
+    start = 0
+    for shard in range(shards):
+        end = start + size + (1 if shard < extra else 0)
+        slices.append(computer_ids[start:end])
+        start = end
+    return slices
+
+
+def shard_spool_dirs(spool_dir: Optional[str]) -> List[str]:
+    # Spool directories of shards, left in spool_dir by workers that have stopped
+    if not spool_dir or not os.path.isdir(spool_dir):
+        return []
+    return [
+        os.path.join(spool_dir, name) for name in sorted(os.listdir(spool_dir))
+        if name.startswith(SHARD_SPOOL_PREFIX) and name[len(SHARD_SPOOL_PREFIX):].isdigit()
+        and os.path.isdir(os.path.join(spool_dir, name))
+    ]
+
+
+def run_shard(
+        shard: int,
+        computer_ids: List[str],
+        states: Dict[str, ComputerState],
+        default_interval: float,
+        intervals: Dict[str, float],
+        profiles: Dict[str, dict],
+        influxdb_settings: dict,
+        pipeline_settings: dict,
+        stop_event,
+        outbox
+) -> None:
+    asyncio.run(_run_shard(
+        shard, computer_ids, states, default_interval, intervals, profiles, influxdb_settings, pipeline_settings,
+        stop_event, outbox
+    ))
+
+
+async def _run_shard(shard, computer_ids, states, default_interval, intervals, profiles, influxdb_settings,
+                     pipeline_settings, stop_event, outbox):
+    influxdb_service = InfluxDBService(**influxdb_settings)
+    write_pipeline = MetricWritePipeline(influxdb_service, **pipeline_settings)
+    write_pipeline.start()
+
+    scheduler = SimulationScheduler(computer_ids, default_interval, intervals, profiles)
+    scheduler.restore_state(states)
+    print(f"Simulation shard {shard} started with {len(computer_ids)} computers.")
+
+    try:
+        while not stop_event.is_set():
+            try:
+                for batch in scheduler.due_batches():
+                    await write_pipeline.submit(batch)
+                    # Index arrays only go along for ticks that are not a whole computer x metric grid
+                    grid = len(batch) == len(batch.computer_ids) * len(batch.metric_names)
+                    outbox.put((
+                        "tick", shard, batch.timestamp, batch.computer_ids, batch.metric_names, batch.values,
+                        None if grid else (batch.computer_index, batch.metric_index),
+                        write_pipeline.queue_depth, scheduler.stats()
+                    ))
+            except Exception as e:
+                print(f"Error in simulation shard {shard}: {e}")
+                outbox.put(("error", shard, str(e)))
+
+            if await asyncio.to_thread(stop_event.wait, scheduler.next_tick_delay()):
+                break
+    finally:
+        await write_pipeline.close()
+        influxdb_service.close()
+        outbox.put(("stopped", shard, scheduler.export_state()))
+        print(f"Simulation shard {shard} stopped.")
+
+
+class _Shard:
+    __slots__ = ("computer_ids", "layouts", "process", "stop_event", "stopped",
+                 "ticks", "last_tick_at", "queue_depth", "schedule", "error")
+
+    def __init__(self, computer_ids: List[str]):
+        self.computer_ids = tuple(computer_ids)
+        self.layouts: Dict[tuple, tuple] = {}
+        self.process = None
+        self.stop_event = None
+        self.stopped: Optional[asyncio.Future] = None
+        self.ticks = 0
+        self.last_tick_at: Optional[float] = None
+        self.queue_depth = 0
+        self.schedule: Optional[dict] = None
+        self.error: Optional[str] = None
+
+    def layout(self, computer_ids: tuple, metric_names: tuple, indexes: Optional[tuple] = None) -> tuple:
+        # Tick messages arrive as fresh objects; mapping them back to one set of tables per
+        # shape keeps the hot tier and stream caches warm
+        key = (computer_ids, metric_names)
+        if indexes is not None:
+            key += (indexes[0].tobytes(), indexes[1].tobytes())
+        layout = self.layouts.get(key)
+        if layout is None:
+            units = METRIC_NAME_UNITS if metric_names == METRIC_NAMES else \
+                tuple(METRIC_UNITS[name] for name in metric_names)
+            if indexes is None:
+                indexes = column_indexes(len(computer_ids), len(metric_names))
+            layout = (computer_ids, metric_names, units) + tuple(indexes)
+            self.layouts[key] = layout
+        return layout
+
+
+# Runs the simulation in worker processes, one shard of computers each. Workers simulate and
+# write their shard to InfluxDB on their own and send the tick values back, so the API process
+# only keeps the hot tier and live streams up to date. Changing the worker count stops every
+# worker, collects the computers' simulator state and hands it to the new shards. A shard's spool
+# lives as long as the shard: whatever the stopped workers left unreplayed is adopted by the API
+# process's write pipeline before new shards start, so no spool is left behind when there are
+# fewer workers than before.
+class ShardedSimulation:
+    def __init__(
+            self,
+            write_path: MetricsWritePath,
+            influxdb_settings: dict,
+            pipeline_settings: dict,
+            workers: int,
+            default_interval: float = 5.0,
+            intervals: Optional[Dict[str, float]] = None
+    ):
+        self.write_path = write_path
+        self.influxdb_settings = influxdb_settings
+        self.pipeline_settings = pipeline_settings
+        self.workers = workers
+        self.default_interval = default_interval
+        self.intervals = intervals or {}
+
+        # Spawned workers, forking a process that runs the event loop and client threads is not safe
+        self._context = multiprocessing.get_context("spawn")
+        self._outbox = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._shards: List[_Shard] = []
+        self._computer_ids: List[str] = []
+        self._profiles: Dict[str, dict] = {}
+        self._states: Dict[str, ComputerState] = {}
+        self.rebalances = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._shards)
+
+    async def start(self, computer_ids: List[str], profiles: Optional[Dict[str, dict]] = None) -> None:
+        if self.running:
+            raise RuntimeError("Sharded simulation already running.")
+
+        self._computer_ids = list(computer_ids)
+        self._profiles = profiles or {}
+        await self.write_path.write_pipeline.adopt_spools(shard_spool_dirs(self.pipeline_settings.get("spool_dir")))
+        self._outbox = self._context.Queue()
+        self._consumer = asyncio.create_task(self._consume())
+
+        loop = asyncio.get_running_loop()
+        shards = shard_computers(self._computer_ids, max(1, min(self.workers, len(self._computer_ids))))
+        try:
+            for shard_index, computers in enumerate(shards):
+                shard = _Shard(computers)
+                shard.stop_event = self._context.Event()
+                shard.stopped = loop.create_future()
+                shard.process = self._context.Process(
+                    target=run_shard,
+                    args=(
+                        shard_index,
+                        computers,
+                        {c: self._states[c] for c in computers if c in self._states},
+                        self.default_interval,
+                        self.intervals,
+                        {c: self._profiles[c] for c in computers if c in self._profiles},
+                        self.influxdb_settings,
+                        self._shard_pipeline_settings(shard_index),
+                        shard.stop_event,
+                        self._outbox
+                    ),
+                    daemon=True
+                )
+                shard.process.start()
+                self._shards.append(shard)
+        except Exception:
+            # Stops the workers that did start, so a failed start leaves nothing running
+            if self._shards:
+                await self.stop()
+            else:
+                self._consumer.cancel()
+                self._outbox.close()
+            raise
+
+        print(f"Sharded simulation started: {len(self._computer_ids)} computers on {self.workers} workers.")
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+
+        for shard in self._shards:
+            shard.stop_event.set()
+
+        for shard_index, shard in enumerate(self._shards):
+            try:
+                self._states.update(await asyncio.wait_for(asyncio.shield(shard.stopped), STOP_TIMEOUT))
+            except asyncio.TimeoutError:
+                print(f"Simulation shard {shard_index} did not stop in time, terminating it.")
+                shard.process.terminate()
+            await asyncio.to_thread(shard.process.join)
+
+        self._consumer.cancel()
+        try:
+            await self._consumer
+        except asyncio.CancelledError:
+            pass
+        self._outbox.close()
+        self._shards = []
+        print("Sharded simulation stopped.")
+
+    async def rebalance(self, workers: int) -> None:
+        if workers < 1:
+            raise ValueError("At least one simulation worker is required")
+        running = self.running
+        await self.stop()
+        self.workers = workers
+        self.rebalances += 1
+        if running:
+            await self.start(self._computer_ids, self._profiles)
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "running": self.running,
+            "workers": self.workers,
+            "computers": len(self._computer_ids),
+            "rebalances": self.rebalances,
+            "shards": [
+                {
+                    "computers": len(shard.computer_ids),
+                    "alive": shard.process is not None and shard.process.is_alive(),
+                    "ticks": shard.ticks,
+                    "seconds_since_tick": None if shard.last_tick_at is None else round(now - shard.last_tick_at, 3),
+                    "queue_depth": shard.queue_depth,
+                    "schedule": shard.schedule,
+                    "error": shard.error
+                }
+                for shard in self._shards
+            ]
+        }
+
+    def _shard_pipeline_settings(self, shard_index: int) -> dict:
+        settings = dict(self.pipeline_settings)
+        if settings.get("spool_dir"):
+            settings["spool_dir"] = os.path.join(settings["spool_dir"], f"{SHARD_SPOOL_PREFIX}{shard_index}")
+        return settings
+
+    async def _consume(self) -> None:
+        while True:
+            try:
+                message = await asyncio.to_thread(self._outbox.get, True, 0.5)
+            except queue.Empty:
+                continue
+
+            kind, shard_index = message[0], message[1]
+            shard = self._shards[shard_index]
+            if kind == "tick":
+                _, _, timestamp, computer_ids, metric_names, values, indexes, queue_depth, schedule = message
+                shard.ticks += 1
+                shard.last_tick_at = time.monotonic()
+                shard.queue_depth = queue_depth
+                shard.schedule = schedule
+                self.write_path.publish_local(MetricBatch(
+                    timestamp,
+                    *shard.layout(computer_ids, metric_names, indexes),
+                    np.asarray(values)
+                ))
+            elif kind == "error":
+                shard.error = message[2]
+            elif kind == "stopped" and not shard.stopped.done():
+                shard.stopped.set_result(message[2])
@@ -0,0 +1,322 @@
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from models import METRIC_NAMES
+from models.metric_batch import EPOCH
+from services.fleet_simulator import FleetSimulator
+from services.instrumentation import metrics
+from services.scheduler import MIN_TICK_SECONDS, TimerWheel
+from services.write_path import MetricsWritePath
+
+# Capacity left unused while no session is waiting is kept for at most this long
+BURST_SECONDS = 1.0
+
+SESSION_TICK_SECONDS = metrics.histogram(
+    "simulation_session_tick_duration_seconds", "Generating and writing the session batches due in one tick"
+)
+SESSION_POINTS = metrics.counter("simulation_session_points", "Points produced by simulation sessions")
+SESSION_DEFERRED = metrics.counter(
+    "simulation_session_deferred_ticks", "Session ticks held back because the shared capacity was used up"
+)
+
+
+class SessionLimitError(RuntimeError):
+    def __init__(self, message: str, per_user: bool):
+        super().__init__(message)
+        self.per_user = per_user
+
+
+# One user's scenario: its own computers, seed and sampling interval. Every metric of every
+# computer is sampled each interval, and written with the session id as the session tag.
+class SimulationSession:
+    def __init__(
+            self,
+            session_id: str,
+            owner: str,
+            name: str,
+            computer_ids: List[str],
+            seed: int,
+            interval_seconds: float,
+            interval_ticks: int,
+            profiles: Optional[List[dict]] = None
+    ):
+        self.id = session_id
+        self.owner = owner
+        self.name = name
+        self.seed = seed
+        self.interval_seconds = interval_seconds
+        self.interval_ticks = interval_ticks
+        self.simulator = FleetSimulator(computer_ids, seed, profiles)
+        self.cost = self.simulator.size * len(METRIC_NAMES)
+        self.created_at = datetime.now(timezone.utc)
+
+        self.active = True
+        self.due_tick = 0
+        self.credit = 0.0
+        self.ticks = 0
+        self.points = 0
+        self.deferred_ticks = 0
+        self.skipped_ticks = 0
+        self.last_sample: Optional[datetime] = None
+
+    @property
+    def points_per_second(self) -> float:
+        return self.cost / self.interval_seconds
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "owner": self.owner,
+            "name": self.name,
+            "computers": self.simulator.size,
+            "seed": self.seed,
+            "interval_seconds": self.interval_seconds,
+            "points_per_second": round(self.points_per_second, 3),
+            "created_at": self.created_at,
+            "ticks": self.ticks,
+            "points": self.points,
+            "deferred_ticks": self.deferred_ticks,
+            "skipped_ticks": self.skipped_ticks,
+            "last_sample": self.last_sample
+        }
+
+
+# Runs every simulation session on one timer wheel and one loop. Session ticks are aligned to a
+# shared grid, so sessions due at the same moment are generated and written in the same pass
+# rather than each waking up on its own. Sessions are admitted against per-user and global
+# limits, and at run time all of them share max_points_per_second, handed out max-min fairly:
+# each waiting session gets an equal share of a tick's capacity and what a small session does
+# not need goes to the others. A session whose batch is larger than its share keeps the credit
+# and runs once enough has built up, so under load a large session slows down (skipping the
+# periods it missed, like SimulationScheduler) while the small ones keep their rate.
+class SimulationSessions:
+    def __init__(
+            self,
+            write_path: MetricsWritePath,
+            tick_seconds: float = 0.1,
+            max_points_per_second: float = 500_000,
+            max_sessions: int = 100,
+            max_computers: int = 100_000,
+            max_sessions_per_user: int = 5,
+            max_computers_per_user: int = 10_000,
+            wheel_slots: int = 512
+    ):
+        self.write_path = write_path
+        self.tick_seconds = max(MIN_TICK_SECONDS, tick_seconds)
+        self.max_points_per_second = max_points_per_second
+        self.max_sessions = max_sessions
+        self.max_computers = max_computers
+        self.max_sessions_per_user = max_sessions_per_user
+        self.max_computers_per_user = max_computers_per_user
+
+        self._sessions: Dict[str, SimulationSession] = {}
+        self._waiting: List[SimulationSession] = []
+        self._wheel = TimerWheel(wheel_slots)
+        self._start = time.monotonic()
+        self._start_wall_ns = time.time_ns()
+        self._tokens = 0.0
+        self._refilled = self._start
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.ticks = 0
+        self.points = 0
+        self.deferred_ticks = 0
+        self.errors = 0
+        self.last_tick_ms = 0.0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def create(
+            self,
+            owner: str,
+            name: str,
+            computer_ids: List[str],
+            interval_seconds: float,
+            seed: Optional[int] = None,
+            profiles: Optional[List[dict]] = None
+    ) -> SimulationSession:
+        if not computer_ids:
+            raise ValueError("A session needs at least one computer.")
+        if interval_seconds < self.tick_seconds:
+            raise ValueError(f"The sampling interval must be at least {self.tick_seconds} seconds.")
+
+        owned = self.list(owner)
+        if len(owned) >= self.max_sessions_per_user:
+            raise SessionLimitError(f"At most {self.max_sessions_per_user} sessions per user.", True)
+        if sum(session.simulator.size for session in owned) + len(computer_ids) > self.max_computers_per_user:
+            raise SessionLimitError(f"At most {self.max_computers_per_user} simulated computers per user.", True)
+        if len(self._sessions) >= self.max_sessions:
+            raise SessionLimitError(f"At most {self.max_sessions} sessions can run at once, try again later.", False)
+        if self.computers + len(computer_ids) > self.max_computers:
+            raise SessionLimitError(f"At most {self.max_computers} simulated computers in all sessions, try again later.", False)
+
+        # A seed is always recorded, so that any session can be replayed
+        seed = seed if seed is not None else random.getrandbits(31)
+        interval_ticks = max(1, round(interval_seconds / self.tick_seconds))
+        session = SimulationSession(
+            uuid.uuid4().hex[:12], owner, name, computer_ids, seed, interval_seconds, interval_ticks, profiles
+        )
+        self._sessions[session.id] = session
+        self._wheel.schedule(self._now_tick() + 1, session)
+        self._wake.set()
+        print(f"Simulation session {session.id} started for {owner}: {len(computer_ids)} computers every {interval_seconds}s.")
+        return session
+
+    def remove(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        # Still on the wheel or waiting; it is dropped when it comes up
+        session.active = False
+        self.write_path.forget_session(session_id)
+        print(f"Simulation session {session_id} stopped.")
+        return True
+
+    def get(self, session_id: str) -> Optional[SimulationSession]:
+        return self._sessions.get(session_id)
+
+    def list(self, owner: Optional[str] = None) -> List[SimulationSession]:
+        return [session for session in self._sessions.values() if owner is None or session.owner == owner]
+
+    @property
+    def computers(self) -> int:
+        return sum(session.simulator.size for session in self._sessions.values())
+
+    async def run_tick(self) -> int:
+        started = time.perf_counter()
+        now = time.monotonic()
+        now_tick = self._now_tick(now)
+        self._tokens = min(
+            self._tokens + (now - self._refilled) * self.max_points_per_second,
+            self.max_points_per_second * BURST_SECONDS
+        )
+        self._refilled = now
+
+        for due_tick, session in self._wheel.advance(now_tick):
+            if session.active:
+                session.due_tick = due_tick
+                self._waiting.append(session)
+
+        # Every ready session is back on the wheel before any is generated, so one that fails
+        # to generate or write cannot leave the rest of them off the wheel for good
+        ready = []
+        for session in self._share():
+            # Sampled at the latest period that has come due
+            missed = (now_tick - session.due_tick) // session.interval_ticks
+            sample_tick = session.due_tick + missed * session.interval_ticks
+            session.skipped_ticks += missed
+            self._wheel.schedule(sample_tick + session.interval_ticks, session)
+            ready.append((session, sample_tick))
+
+        points = 0
+        for session, sample_tick in ready:
+            batch = session.simulator.generate_all_metrics(self._timestamp(sample_tick))
+            batch.session_id = session.id
+            await self.write_path.publish_session(batch)
+            session.last_sample = batch.timestamp
+            session.ticks += 1
+            session.points += len(batch)
+            points += len(batch)
+
+        self.ticks += 1
+        self.points += points
+        SESSION_POINTS.inc(points)
+        self.last_tick_ms = (time.perf_counter() - started) * 1000.0
+        SESSION_TICK_SECONDS.observe(self.last_tick_ms / 1000.0)
+        return points
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "computers": self.computers,
+            "waiting": len(self._waiting),
+            "tick_seconds": self.tick_seconds,
+            "max_points_per_second": self.max_points_per_second,
+            "demand_points_per_second": round(sum(session.points_per_second for session in self._sessions.values()), 3),
+            "ticks": self.ticks,
+            "points": self.points,
+            "deferred_ticks": self.deferred_ticks,
+            "errors": self.errors,
+            "last_tick_ms": round(self.last_tick_ms, 3),
+            "limits": {
+                "max_sessions": self.max_sessions,
+                "max_computers": self.max_computers,
+                "max_sessions_per_user": self.max_sessions_per_user,
+                "max_computers_per_user": self.max_computers_per_user
+            }
+        }
+
+    def _share(self) -> List[SimulationSession]:
+        # Water-filling over the sessions that are due: while capacity is left, split it evenly,
+        # fill up every session whose remaining need fits in its share and split the rest again.
+        # Once no remaining need fits, every session banks its share as credit.
+        self._waiting = [session for session in self._waiting if session.active]
+        pending = [session for session in self._waiting if session.credit < session.cost]
+        while pending and self._tokens > 0:
+            share = self._tokens / len(pending)
+            filled = [session for session in pending if session.cost - session.credit <= share]
+            if not filled:
+                for session in pending:
+                    session.credit += share
+                self._tokens = 0.0
+                break
+            for session in filled:
+                self._tokens -= session.cost - session.credit
+                session.credit = session.cost
+            pending = [session for session in pending if session.credit < session.cost]
+
+        ready = []
+        waiting = []
+        for session in self._waiting:
+            if session.credit >= session.cost:
+                session.credit -= session.cost
+                ready.append(session)
+            else:
+                session.deferred_ticks += 1
+                waiting.append(session)
+        self._waiting = waiting
+        self.deferred_ticks += len(waiting)
+        SESSION_DEFERRED.inc(len(waiting))
+        return ready
+
+    async def _run(self) -> None:
+        while True:
+            if not self._sessions:
+                self._wake.clear()
+                await self._wake.wait()
+            try:
+                await self.run_tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # As in the fleet simulation, a bad tick is reported and the sessions keep running
+                print(f"Error in simulation session loop: {e}")
+                self.errors += 1
+            await asyncio.sleep(self._next_tick_delay())
+
+    def _now_tick(self, now: Optional[float] = None) -> int:
+        return int(((now if now is not None else time.monotonic()) - self._start) / self.tick_seconds)
+
+    def _next_tick_delay(self) -> float:
+        elapsed = time.monotonic() - self._start
+        return max(0.0, (int(elapsed / self.tick_seconds) + 1) * self.tick_seconds - elapsed)
+
+    def _timestamp(self, tick: int) -> datetime:
+        timestamp_ns = self._start_wall_ns + round(tick * self.tick_seconds * 1_000_000_000)
+        return EPOCH + timedelta(microseconds=timestamp_ns // 1000)
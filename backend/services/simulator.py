@@ -1,53 +1,92 @@
 import random
 import math
 from datetime import datetime, timezone
-from models import Metric
+from typing import Dict, Iterable, Optional, Tuple
+from models import Metric, MetricBatch, METRIC_NAMES, METRIC_UNITS
+
+DEFAULT_PROFILE_ID = "qc-001"
+
+# A computer recalibrates once more than 120 iterations have passed since the last
+# calibration, which always happens exactly every 121 iterations
+CALIBRATION_PERIOD = 121
+
+# Metrics each metric is derived from. When only some metrics are due, the others are
+# taken from their latest values instead of being generated again.
+METRIC_DEPENDENCIES = {
+    "temperature": (),
+    "qubit_fidelity": ("temperature",),
+    "gate_error_rate": ("temperature", "qubit_fidelity"),
+    "coherence_time": ("temperature", "qubit_fidelity"),
+    "quantum_volume": ("gate_error_rate", "qubit_fidelity"),
+    "performance_score": ("qubit_fidelity", "gate_error_rate", "temperature", "coherence_time", "quantum_volume")
+}
+
+
+def metrics_to_generate(requested: Iterable[str], available: Iterable[str]) -> Tuple[str, ...]:
+    # The requested metrics plus any dependency that has never been generated, in generation order
+    needed = set(requested)
+    unknown = needed - set(METRIC_NAMES)
+    if unknown:
+        raise ValueError(f"Unknown metrics: {sorted(unknown)}")
+
+    available = set(available)
+    pending = list(needed)
+    while pending:
+        for dependency in METRIC_DEPENDENCIES[pending.pop()]:
+            if dependency not in available and dependency not in needed:
+                needed.add(dependency)
+                pending.append(dependency)
+
+    return tuple(name for name in METRIC_NAMES if name in needed)
+
+# Profiles the fleet registry seeds its table with; computers it creates beyond these get the
+# default profile
+COMPUTER_PROFILES = {
+    "qc-001": {
+        "qubits": 127,
+        "age_factor": 0.85,
+        "base_temp": 15.3,
+        "temp_stability": 0.8,
+        "base_fidelity": 99.1,
+        "base_error": 0.25,
+        "base_coherence": 120.0,
+        "base_qv": 64
+    },
+    "qc-002": {
+        "qubits": 433,
+        "age_factor": 0.95,
+        "base_temp": 12.8,
+        "temp_stability": 0.95,
+        "base_fidelity": 98.8,
+        "base_error": 0.35,
+        "base_coherence": 95.0,
+        "base_qv": 128
+    },
+    "qc-003": {
+        "qubits": 1000,
+        "age_factor": 0.70,
+        "base_temp": 18.0,
+        "temp_stability": 0.60,
+        "base_fidelity": 97.5,
+        "base_error": 0.50,
+        "base_coherence": 75.0,
+        "base_qv": 256
+    }
+}
+
 
 class QuantumSimulator:
-    def __init__(self, computer_id: str):
+    def __init__(self, computer_id: str, rng: Optional[random.Random] = None, profile: Optional[dict] = None):
         self.computer_id = computer_id
+        self.rng = rng if rng is not None else random
         self.iteration_count = 0
-        self.last_calibration = 0
-
-        computer_profiles = {
-            "qc-001": {
-                "qubits": 127,
-                "age_factor": 0.85,
-                "base_temp": 15.3,
-                "temp_stability": 0.8,
-                "base_fidelity": 99.1,
-                "base_error": 0.25,
-                "base_coherence": 120.0,
-                "base_qv": 64
-            },
-            "qc-002": {
-                "qubits": 433,
-                "age_factor": 0.95,
-                "base_temp": 12.8,
-                "temp_stability": 0.95,
-                "base_fidelity": 98.8,
-                "base_error": 0.35,
-                "base_coherence": 95.0,
-                "base_qv": 128
-            },
-            "qc-003": {
-                "qubits": 1000,
-                "age_factor": 0.70,
-                "base_temp": 18.0,
-                "temp_stability": 0.60,
-                "base_fidelity": 97.5,
-                "base_error": 0.50,
-                "base_coherence": 75.0,
-                "base_qv": 256
-            }
-        }
-
-        self.profile = computer_profiles.get(computer_id, computer_profiles["qc-001"])
-
-        self.temp_offset = random.uniform(-2, 2)
-        self.fidelity_drift = random.uniform(-0.3, 0.1)
+        self.latest: Dict[str, float] = {}
+        self.profile = profile or COMPUTER_PROFILES.get(computer_id, COMPUTER_PROFILES[DEFAULT_PROFILE_ID])
 
-    def generate_temperature(self) -> Metric:
+        self.temp_offset = self.rng.uniform(-2, 2)
+        self.fidelity_drift = self.rng.uniform(-0.3, 0.1)
+
+    def _temperature(self) -> float:
         self.iteration_count += 1
 
         base_temp = self.profile["base_temp"]
@@ -57,50 +96,37 @@ class QuantumSimulator:
 
         workload_spike = 0
         if self.iteration_count % 80 == 0:
-            workload_spike = random.uniform(3, 8)
+            workload_spike = self.rng.uniform(3, 8)
 
         drift = (self.iteration_count * 0.01) * (1 - stability)
 
-        noise = random.uniform(-0.5, 0.5) * (2 - stability)
+        noise = self.rng.uniform(-0.5, 0.5) * (2 - stability)
 
         temp = base_temp + self.temp_offset + daily_cycle + workload_spike + drift + noise
         temp = max(10.0, min(30.0, temp))
 
-        return Metric(
-            timestamp=datetime.now(timezone.utc),
-            computer_id=self.computer_id,
-            metric_name="temperature",
-            value=round(temp, 1),
-            unit="mK"
-        )
+        return round(temp, 1)
 
-    def generate_qubit_fidelity(self, current_temp: float) -> Metric:
+    def _qubit_fidelity(self, current_temp: float) -> float:
         base_fidelity = self.profile["base_fidelity"]
         age_factor = self.profile["age_factor"]
 
         temp_penalty = (current_temp - self.profile["base_temp"]) * 0.15
 
-        time_since_calibration = self.iteration_count - self.last_calibration
+        time_since_calibration = self.iteration_count - CALIBRATION_PERIOD * ((self.iteration_count - 1) // CALIBRATION_PERIOD)
         drift_penalty = (time_since_calibration / 100.0) * (1 - age_factor)
 
         if time_since_calibration > 120:
-            self.last_calibration = self.iteration_count
             drift_penalty = 0
 
-        noise = random.uniform(-0.1, 0.1)
+        noise = self.rng.uniform(-0.1, 0.1)
 
         fidelity = base_fidelity - temp_penalty - drift_penalty + self.fidelity_drift + noise
         fidelity = max(95.0, min(99.9, fidelity))
 
-        return Metric(
-            timestamp=datetime.now(timezone.utc),
-            computer_id=self.computer_id,
-            metric_name="qubit_fidelity",
-            value=round(fidelity, 2),
-            unit="%"
-        )
+        return round(fidelity, 2)
 
-    def generate_gate_error_rate(self, current_temp: float, fidelity: float) -> Metric:
+    def _gate_error_rate(self, current_temp: float, fidelity: float) -> float:
         base_error = self.profile["base_error"]
 
         temp_impact = (current_temp - self.profile["base_temp"]) * 0.02
@@ -114,20 +140,14 @@ class QuantumSimulator:
         else:
             calibration_improvement = 0
 
-        noise = random.uniform(-0.05, 0.05)
+        noise = self.rng.uniform(-0.05, 0.05)
 
         gate_error_rate = base_error + temp_impact + fidelity_correlation + age_degradation + calibration_improvement + noise
         gate_error_rate = max(0.1, min(1.5, gate_error_rate))
 
-        return Metric(
-            timestamp=datetime.now(timezone.utc),
-            computer_id=self.computer_id,
-            metric_name="gate_error_rate",
-            value=round(gate_error_rate, 3),
-            unit="%"
-        )
+        return round(gate_error_rate, 3)
 
-    def generate_coherence_time(self, current_temp: float, fidelity: float) -> Metric:
+    def _coherence_time(self, current_temp: float, fidelity: float) -> float:
         base_coherence = self.profile["base_coherence"]
 
         temp_factor = 1 - ((current_temp - self.profile["base_temp"]) * 0.03)
@@ -141,20 +161,14 @@ class QuantumSimulator:
 
         decay_factor = 1 - ((self.iteration_count % 100) * 0.001)
 
-        noise = random.uniform(0.95, 1.05)
+        noise = self.rng.uniform(0.95, 1.05)
 
         coherence_time = base_coherence * temp_factor * fidelity_factor * recalibration_boost * decay_factor * noise
         coherence_time = max(30.0, min(200.0, coherence_time))
 
-        return Metric(
-            timestamp=datetime.now(timezone.utc),
-            computer_id=self.computer_id,
-            metric_name="coherence_time",
-            value=round(coherence_time, 1),
-            unit="μs"
-        )
+        return round(coherence_time, 1)
 
-    def generate_quantum_volume(self, gate_error: float, fidelity: float) -> Metric:
+    def _quantum_volume(self, gate_error: float, fidelity: float) -> float:
         base_qv = self.profile["base_qv"]
 
         error_penalty = (gate_error - self.profile["base_error"]) * 30
@@ -171,27 +185,21 @@ class QuantumSimulator:
 
         trend = (self.iteration_count * 0.05) * self.profile["age_factor"]
 
-        noise = random.uniform(-5, 5)
+        noise = self.rng.uniform(-5, 5)
 
         qv = base_qv - error_penalty + fidelity_boost + trend + maintenance_penalty + noise
         qv = max(16, min(theoretical_max, qv))
 
-        return Metric(
-            timestamp=datetime.now(timezone.utc),
-            computer_id=self.computer_id,
-            metric_name="quantum_volume",
-            value=round(qv, 0),
-            unit="QV"
-        )
+        return round(qv, 0)
 
-    def calculate_performance_score(
+    def _performance_score(
             self,
             fidelity: float,
             gate_error: float,
             temperature: float,
             coherence: float,
             quantum_volume: float
-    ) -> Metric:
+    ) -> float:
         fidelity_score = (fidelity / 100.0) * 30
 
         normalized_error = max(0, 1 - (gate_error / 2.0))
@@ -211,33 +219,78 @@ class QuantumSimulator:
 
         total_score = max(0, min(100, total_score))
 
+        return round(total_score, 1)
+
+    def _metric(self, metric_name: str, value: float) -> Metric:
         return Metric(
             timestamp=datetime.now(timezone.utc),
             computer_id=self.computer_id,
-            metric_name="performance_score",
-            value=round(total_score, 1),
-            unit="score"
+            metric_name=metric_name,
+            value=value,
+            unit=METRIC_UNITS[metric_name]
         )
 
-    def generate_all_metrics(self) -> list[Metric]:
-        temp_metric = self.generate_temperature()
-        fidelity_metric = self.generate_qubit_fidelity(temp_metric.value)
-        gate_error_metric = self.generate_gate_error_rate(temp_metric.value, fidelity_metric.value)
-        coherence_metric = self.generate_coherence_time(temp_metric.value, fidelity_metric.value)
-        qv_metric = self.generate_quantum_volume(gate_error_metric.value, fidelity_metric.value)
-        performance_metric = self.calculate_performance_score(
-            fidelity_metric.value,
-            gate_error_metric.value,
-            temp_metric.value,
-            coherence_metric.value,
-            qv_metric.value
+    def generate_temperature(self) -> Metric:
+        return self._metric("temperature", self._temperature())
+
+    def generate_qubit_fidelity(self, current_temp: float) -> Metric:
+        return self._metric("qubit_fidelity", self._qubit_fidelity(current_temp))
+
+    def generate_gate_error_rate(self, current_temp: float, fidelity: float) -> Metric:
+        return self._metric("gate_error_rate", self._gate_error_rate(current_temp, fidelity))
+
+    def generate_coherence_time(self, current_temp: float, fidelity: float) -> Metric:
+        return self._metric("coherence_time", self._coherence_time(current_temp, fidelity))
+
+    def generate_quantum_volume(self, gate_error: float, fidelity: float) -> Metric:
+        return self._metric("quantum_volume", self._quantum_volume(gate_error, fidelity))
+
+    def calculate_performance_score(
+            self,
+            fidelity: float,
+            gate_error: float,
+            temperature: float,
+            coherence: float,
+            quantum_volume: float
+    ) -> Metric:
+        return self._metric(
+            "performance_score",
+            self._performance_score(fidelity, gate_error, temperature, coherence, quantum_volume)
         )
 
-        return [
-            temp_metric,
-            fidelity_metric,
-            gate_error_metric,
-            coherence_metric,
-            qv_metric,
-            performance_metric
-        ]
\ No newline at end of file
+    def generate_all_metrics(self, timestamp: Optional[datetime] = None) -> MetricBatch:
+        return self.generate_metrics(METRIC_NAMES, timestamp)
+
+    def generate_metrics(self, metric_names: Iterable[str], timestamp: Optional[datetime] = None) -> MetricBatch:
+        if timestamp is None:
+            timestamp = datetime.now(timezone.utc)
+
+        requested = set(metric_names)
+        latest = self.latest
+        for name in metrics_to_generate(requested, latest):
+            if name == "temperature":
+                latest[name] = self._temperature()
+            elif name == "qubit_fidelity":
+                latest[name] = self._qubit_fidelity(latest["temperature"])
+            elif name == "gate_error_rate":
+                latest[name] = self._gate_error_rate(latest["temperature"], latest["qubit_fidelity"])
+            elif name == "coherence_time":
+                latest[name] = self._coherence_time(latest["temperature"], latest["qubit_fidelity"])
+            elif name == "quantum_volume":
+                latest[name] = self._quantum_volume(latest["gate_error_rate"], latest["qubit_fidelity"])
+            else:
+                latest[name] = self._performance_score(
+                    latest["qubit_fidelity"],
+                    latest["gate_error_rate"],
+                    latest["temperature"],
+                    latest["coherence_time"],
+                    latest["quantum_volume"]
+                )
+
+        names = tuple(name for name in METRIC_NAMES if name in requested)
+        return MetricBatch.from_columns(
+            timestamp,
+            [self.computer_id],
+            [[latest[name]] for name in names],
+            names if len(names) < len(METRIC_NAMES) else METRIC_NAMES
+        )
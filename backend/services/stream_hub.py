@@ -0,0 +1,206 @@
+import asyncio
+import json
+import math
+from collections import OrderedDict
+from itertools import repeat
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+import numpy as np
+
+from models.metric_batch import MetricBatch, ShapeCache
+
+Topic = Tuple[str, str]
+
+
+# The points of one tick for one subscription group, as comma-separated JSON objects. Frames
+# with the same key hold the same topics, so a newer one replaces an older one nobody has read.
+class StreamFrame:
+    __slots__ = ("key", "points", "data")
+
+    def __init__(self, key, points: int, data: bytes):
+        self.key = key
+        self.points = points
+        self.data = data
+
+
+class StreamSubscriber:
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.pending: "OrderedDict[object, StreamFrame]" = OrderedDict()
+        self.pending_points = 0
+        self.ready = asyncio.Event()
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def offer(self, frame: StreamFrame) -> None:
+        # A slow client holds at most one frame per key, newest points win, and beyond
+        # max_pending points the oldest frames are dropped (the newest is always kept)
+        older = self.pending.pop(frame.key, None)
+        if older is not None:
+            self.coalesced += older.points
+            self.pending_points -= older.points
+        self.pending[frame.key] = frame
+        self.pending_points += frame.points
+        while self.pending_points > self.max_pending and len(self.pending) > 1:
+            dropped = self.pending.popitem(last=False)[1]
+            self.pending_points -= dropped.points
+            self.dropped += dropped.points
+        self.ready.set()
+
+    async def next_frame(self) -> bytes:
+        await self.ready.wait()
+        self.ready.clear()
+        frames = list(self.pending.values())
+        self.pending.clear()
+        self.delivered += self.pending_points
+        self.pending_points = 0
+        return b"data: [" + b",".join(frame.data for frame in frames) + b"]\n\n"
+
+
+class _SubscriptionGroup:
+    __slots__ = ("computers", "metrics", "subscribers", "rows")
+
+    def __init__(self, computers: Optional[FrozenSet[str]], metrics: Optional[FrozenSet[str]]):
+        self.computers = computers
+        self.metrics = metrics
+        self.subscribers: Set[StreamSubscriber] = set()
+        # Per batch shape: the rows the group wants, and the key of its frames
+        self.rows = ShapeCache()
+
+
+# Fans freshly written metrics out to live subscribers. Subscribers with the same
+# computer/metric selection share a group, each (computer_id, metric_name) point is encoded
+# to JSON once per tick, and each group's points are joined into one frame that is handed to
+# every subscriber of the group.
+class StreamHub:
+    def __init__(self, max_subscribers: int = 10_000, max_pending_per_subscriber: int = 4096):
+        self.max_subscribers = max_subscribers
+        self.max_pending_per_subscriber = max_pending_per_subscriber
+
+        self._groups: Dict[Tuple[Optional[FrozenSet[str]], Optional[FrozenSet[str]]], _SubscriptionGroup] = {}
+        self._subscriber_groups: Dict[StreamSubscriber, _SubscriptionGroup] = {}
+        self._payload_prefixes: Dict[Topic, str] = {}
+
+        self._shapes = ShapeCache()
+
+        self.published_points = 0
+        self.encoded_payloads = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriber_groups)
+
+    def subscribe(self, computers: Optional[List[str]], metrics: Optional[List[str]]) -> StreamSubscriber:
+        if self.subscriber_count >= self.max_subscribers:
+            raise RuntimeError("Too many stream subscribers.")
+
+        key = (frozenset(computers) if computers else None, frozenset(metrics) if metrics else None)
+        group = self._groups.get(key)
+        if group is None:
+            group = _SubscriptionGroup(*key)
+            self._groups[key] = group
+
+        subscriber = StreamSubscriber(self.max_pending_per_subscriber)
+        group.subscribers.add(subscriber)
+        self._subscriber_groups[subscriber] = group
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber) -> None:
+        group = self._subscriber_groups.pop(subscriber, None)
+        if group is None:
+            return
+        group.subscribers.discard(subscriber)
+        if not group.subscribers:
+            del self._groups[(group.computers, group.metrics)]
+
+    def publish(self, batch: MetricBatch) -> None:
+        if not self._groups:
+            return
+
+        if batch.one_off:
+            # Matched without caching anything for the batch's shape
+            positions = self._positions(batch)
+            group_rows = [(group, self._match(group, batch, *positions), object()) for group in self._groups.values()]
+        else:
+            group_rows = [(group, *self._rows_for(group, batch)) for group in self._groups.values()]
+        rows = np.unique(np.concatenate([group_row[1] for group_row in group_rows]))
+        if len(rows) == 0:
+            return
+
+        computer_index = batch.computer_index[rows].tolist()
+        metric_index = batch.metric_index[rows].tolist()
+        values = batch.values[rows].tolist()
+        if batch.timestamps_ns is None:
+            timestamps = repeat(batch.timestamp_ns // 1_000_000)
+        else:
+            timestamps = (batch.timestamps_ns[rows] // 1_000_000).tolist()
+
+        payloads: List[bytes] = []
+        for computer, metric, value, timestamp in zip(computer_index, metric_index, values, timestamps):
+            topic = (batch.computer_ids[computer], batch.metric_names[metric])
+            prefix = self._payload_prefixes.get(topic)
+            if prefix is None:
+                prefix = '{"computer_id":%s,"metric_name":%s,"unit":%s,"timestamp":' % (
+                    json.dumps(topic[0]), json.dumps(topic[1]), json.dumps(batch.units[metric])
+                )
+                self._payload_prefixes[topic] = prefix
+            value_text = repr(value) if math.isfinite(value) else "null"
+            payloads.append(f'{prefix}{timestamp},"value":{value_text}}}'.encode())
+
+        self.encoded_payloads += len(payloads)
+        self.published_points += len(batch)
+
+        for group, rows_for_group, key in group_rows:
+            if len(rows_for_group) == 0:
+                continue
+            positions = np.searchsorted(rows, rows_for_group).tolist()
+            frame = StreamFrame(key, len(positions), b",".join(map(payloads.__getitem__, positions)))
+            for subscriber in group.subscribers:
+                subscriber.offer(frame)
+
+    def stats(self) -> dict:
+        subscribers = self._subscriber_groups.keys()
+        return {
+            "subscribers": self.subscriber_count,
+            "subscription_groups": len(self._groups),
+            "published_points": self.published_points,
+            "encoded_payloads": self.encoded_payloads,
+            "delivered_payloads": sum(subscriber.delivered for subscriber in subscribers),
+            "coalesced_payloads": sum(subscriber.coalesced for subscriber in subscribers),
+            "dropped_payloads": sum(subscriber.dropped for subscriber in subscribers)
+        }
+
+    @staticmethod
+    def _positions(batch: MetricBatch) -> Tuple[Dict[str, int], Dict[str, int]]:
+        return (
+            {computer_id: i for i, computer_id in enumerate(batch.computer_ids)},
+            {metric_name: i for i, metric_name in enumerate(batch.metric_names)}
+        )
+
+    def _rows_for(self, group: _SubscriptionGroup, batch: MetricBatch) -> Tuple[np.ndarray, object]:
+        cached = group.rows.get(batch.shape)
+        if cached is not None:
+            return cached
+        positions = self._shapes.get(batch.shape)
+        if positions is None:
+            positions = self._shapes.put(batch.shape, self._positions(batch))
+        return group.rows.put(batch.shape, (self._match(group, batch, *positions), object()))
+
+    @staticmethod
+    def _match(
+            group: _SubscriptionGroup,
+            batch: MetricBatch,
+            computer_positions: Dict[str, int],
+            metric_positions: Dict[str, int]
+    ) -> np.ndarray:
+        mask = np.ones(len(batch), dtype=bool)
+        if group.computers is not None:
+            wanted = np.zeros(len(batch.computer_ids), dtype=bool)
+            wanted[[computer_positions[c] for c in group.computers if c in computer_positions]] = True
+            mask &= wanted[batch.computer_index]
+        if group.metrics is not None:
+            wanted = np.zeros(len(batch.metric_names), dtype=bool)
+            wanted[[metric_positions[m] for m in group.metrics if m in metric_positions]] = True
+            mask &= wanted[batch.metric_index]
+        return np.flatnonzero(mask)
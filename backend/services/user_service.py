@@ -1,7 +1,11 @@
+import asyncio
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from models.user import User
-from schemas.user_schemas import UserCreate
-from services.auth_service import get_password_hash, verify_password
+from schemas.user_schemas import UserCreate, UserResponse
+from services.auth_service import get_password_hash, verify_password, password_hasher, token_cache
+from services.postgres_db import DATABASE_MODE, async_session_scope, session_scope
 from typing import Optional
 
 
@@ -13,7 +17,7 @@ def get_user_by_email(db: Session, email: str) -> Optional[User]:
     return db.query(User).filter(User.email == email).first()
 
 
-def create_user(db: Session, user: UserCreate) -> User:
+def create_user(db: Session, user: UserCreate, hashed_password: Optional[str] = None) -> User:
     if get_user_by_username(db, user.username):
         raise ValueError(f"Username '{user.username}' already exists")
 
@@ -23,7 +27,7 @@ def create_user(db: Session, user: UserCreate) -> User:
     db_user = User(
         email=user.email,
         username=user.username,
-        hashed_password=get_password_hash(user.password),
+        hashed_password=hashed_password or get_password_hash(user.password),
         full_name=user.full_name,
         is_active=True,
         is_superuser=False
@@ -48,4 +52,93 @@ def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
     if not user.is_active:
         return None
 
-    return user
\ No newline at end of file
+    return user
+
+
+# Async variants for the event loop. Queries run on the async engine, or in a worker thread
+# with DATABASE_MODE=sync; bcrypt runs in the password pool either way.
+
+async def get_user_by_username_async(db: AsyncSession, username: str) -> Optional[User]:
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+
+async def get_user_by_email_async(db: AsyncSession, email: str) -> Optional[User]:
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+
+async def create_user_async(user: UserCreate) -> UserResponse:
+    hashed_password = await password_hasher.hash(user.password)
+
+    if DATABASE_MODE == "sync":
+        def create():
+            with session_scope() as db:
+                return UserResponse.model_validate(create_user(db, user, hashed_password))
+
+        return await asyncio.to_thread(create)
+
+    async with async_session_scope() as db:
+        if await get_user_by_username_async(db, user.username):
+            raise ValueError(f"Username '{user.username}' already exists")
+
+        if await get_user_by_email_async(db, user.email):
+            raise ValueError(f"Email '{user.email}' already exists")
+
+        db_user = User(
+            email=user.email,
+            username=user.username,
+            hashed_password=hashed_password,
+            full_name=user.full_name,
+            is_active=True,
+            is_superuser=False
+        )
+
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+
+        return UserResponse.model_validate(db_user)
+
+
+async def authenticate_user_async(email: str, password: str) -> Optional[UserResponse]:
+    if DATABASE_MODE == "sync":
+        def load():
+            with session_scope() as db:
+                return get_user_by_email(db, email)
+
+        user = await asyncio.to_thread(load)
+    else:
+        async with async_session_scope() as db:
+            user = await get_user_by_email_async(db, email)
+
+    if not user:
+        return None
+
+    if not await password_hasher.verify(password, user.hashed_password):
+        return None
+
+    if not user.is_active:
+        return None
+
+    return UserResponse.model_validate(user)
+
+
+async def get_user_snapshot_async(username: str) -> Optional[UserResponse]:
+    if DATABASE_MODE == "sync":
+        def load():
+            with session_scope() as db:
+                user = get_user_by_username(db, username)
+                return UserResponse.model_validate(user) if user else None
+
+        return await asyncio.to_thread(load)
+
+    async with async_session_scope() as db:
+        user = await get_user_by_username_async(db, username)
+        return UserResponse.model_validate(user) if user else None
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_tokens(mapper, connection, target: User) -> None:
+    token_cache.invalidate_user(target.id)
@@ -0,0 +1,150 @@
+import asyncio
+from typing import Optional, Set
+
+from models.metric_batch import MetricBatch
+from services.alert_engine import AlertEngine
+from services.anomaly_detector import AnomalyDetector
+from services.fleet_summary import FleetSummary
+from services.hot_tier import HotTierStore
+from services.qubit_telemetry import QubitTelemetry
+from services.rollups import RollupEngine
+from services.stream_hub import StreamHub
+from services.write_pipeline import MetricWritePipeline
+
+ROLLUP_ADVANCE_SECONDS = 5.0
+
+
+# Single entry point for freshly produced metrics. Every batch is made visible to the
+# in-process consumers first and then queued for InfluxDB.
+class MetricsWritePath:
+    def __init__(
+            self,
+            write_pipeline: MetricWritePipeline,
+            hot_tier: HotTierStore,
+            stream_hub: Optional[StreamHub] = None,
+            anomaly_detector: Optional[AnomalyDetector] = None,
+            rollup_engine: Optional[RollupEngine] = None,
+            fleet_summary: Optional[FleetSummary] = None,
+            alert_engine: Optional[AlertEngine] = None,
+            max_qubit_writes: int = 2
+    ):
+        self.write_pipeline = write_pipeline
+        self.hot_tier = hot_tier
+        self.stream_hub = stream_hub
+        self.anomaly_detector = anomaly_detector
+        self.rollup_engine = rollup_engine
+        self.fleet_summary = fleet_summary
+        self.alert_engine = alert_engine
+        self._background_writes: Set[asyncio.Task] = set()
+        self._rollup_task: Optional[asyncio.Task] = None
+        self.failed_rollups = 0
+        self.max_qubit_writes = max_qubit_writes
+        self.qubit_writes = 0
+        self.skipped_qubit_ticks = 0
+
+    def start(self) -> None:
+        if self.rollup_engine is not None and self._rollup_task is None:
+            self._rollup_task = asyncio.create_task(self._advance_rollups())
+
+    async def publish(self, batch: MetricBatch) -> None:
+        self.publish_local(batch)
+        await self.write_pipeline.submit(batch)
+
+    async def publish_session(self, batch: MetricBatch) -> None:
+        # Simulation sessions are scenarios rather than the fleet, so their batches (tagged with
+        # the session) only go to InfluxDB and stay out of the fleet's live views and alerts
+        await self.write_pipeline.submit(batch)
+
+    def forget_session(self, session_id: str) -> None:
+        self.write_pipeline.influxdb_service.encoder.forget_session(session_id)
+
+    async def publish_qubits(self, telemetry: QubitTelemetry, timestamp_ns: int) -> Optional[int]:
+        # Moves per-qubit telemetry on by one tick and writes it, encoded, with no per-metric
+        # consumers. At most max_qubit_writes ticks are written at once; a tick beyond that is
+        # skipped: the state still moves on, but nothing is encoded or queued. Returns the bytes
+        # of the tick, None if it was skipped. Large fleets take a while to step and encode,
+        # which is left to a worker thread.
+        if self.qubit_writes >= self.max_qubit_writes:
+            await asyncio.to_thread(telemetry.step)
+            self.skipped_qubit_ticks += 1
+            return None
+        data, points = await asyncio.to_thread(telemetry.tick, timestamp_ns)
+        self.qubit_writes += 1
+        self._in_background(self._write_qubits(data, points))
+        return len(data)
+
+    def publish_local(self, batch: MetricBatch) -> None:
+        # For batches another process already writes to InfluxDB
+        self.hot_tier.append(batch)
+        if self.stream_hub is not None:
+            self.stream_hub.publish(batch)
+        if self.anomaly_detector is not None:
+            anomalies = self.anomaly_detector.observe(batch)
+            if anomalies:
+                data = self.anomaly_detector.encode(anomalies)
+                self._in_background(self._write_line_protocol(data, len(anomalies), "anomalies"))
+        if self.rollup_engine is not None:
+            rollups = self.rollup_engine.observe(batch)
+            if rollups:
+                self._in_background(self._write_rollups(rollups))
+        if self.fleet_summary is not None:
+            self.fleet_summary.observe(batch)
+        if self.alert_engine is not None:
+            events = self.alert_engine.observe(batch)
+            if events:
+                data = self.alert_engine.encode(events)
+                self._in_background(self._write_line_protocol(data, len(events), "alert events"))
+
+    async def close(self) -> None:
+        if self._rollup_task is not None:
+            self._rollup_task.cancel()
+            try:
+                await self._rollup_task
+            except asyncio.CancelledError:
+                pass
+            self._rollup_task = None
+        if self.rollup_engine is not None:
+            # Open windows are written with what they have so far
+            rollups = self.rollup_engine.flush()
+            if rollups:
+                self._in_background(self._write_rollups(rollups))
+        if self._background_writes:
+            await asyncio.gather(*self._background_writes, return_exceptions=True)
+
+    def _in_background(self, coroutine) -> None:
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._background_writes.add(task)
+        task.add_done_callback(self._background_writes.discard)
+
+    async def _advance_rollups(self) -> None:
+        # Closes windows by the wall clock when no new points arrive, e.g. after the simulation stopped
+        while True:
+            await asyncio.sleep(ROLLUP_ADVANCE_SECONDS)
+            rollups = self.rollup_engine.advance()
+            if rollups:
+                self._in_background(self._write_rollups(rollups))
+
+    async def _write_line_protocol(self, data: bytes, points: int, what: str) -> None:
+        # Anomalies, alert events and qubit telemetry bypass the batch queue; a failed write is
+        # spooled like the pipeline's own
+        try:
+            await asyncio.to_thread(self.write_pipeline.influxdb_service.write_line_protocol, data)
+        except Exception as e:
+            if self.write_pipeline.spool is not None:
+                await asyncio.to_thread(self.write_pipeline.spool.append, data, points)
+            else:
+                print(f"Dropped {points} {what}, write failed: {e}")
+
+    async def _write_qubits(self, data: bytes, points: int) -> None:
+        try:
+            await self._write_line_protocol(data, points, "qubit telemetry points")
+        finally:
+            self.qubit_writes -= 1
+
+    async def _write_rollups(self, data: bytes) -> None:
+        try:
+            await asyncio.to_thread(self.write_pipeline.influxdb_service.write_rollups, data)
+        except Exception as e:
+            rollups = data.count(b"\n")
+            self.failed_rollups += rollups
+            print(f"Dropped {rollups} rollups, write failed: {e}")
@@ -0,0 +1,281 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from models.metric_batch import MetricBatch
+from services.influxdb_service import InfluxDBService
+from services.write_spool import SpoolRecord, WriteAheadSpool
+
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "spill")
+
+REPLAY_IDLE_INTERVAL = 1.0
+REPLAY_BACKOFF_MIN = 1.0
+REPLAY_BACKOFF_MAX = 60.0
+
+
+# Decouples metric producers from InfluxDB. Producers submit chunks into a bounded queue,
+# a single background task flushes them in batches of up to batch_size points (or whatever
+# has arrived after linger_ms) from a worker thread, so the event loop never waits on HTTP.
+class MetricWritePipeline:
+    def __init__(
+            self,
+            influxdb_service: InfluxDBService,
+            max_queue_points: int = 100_000,
+            batch_size: int = 5_000,
+            linger_ms: float = 200,
+            backpressure: str = "block",
+            spool_dir: Optional[str] = None,
+            spool_max_bytes: int = 1024 * 1024 * 1024,
+            spool_retention_seconds: float = 7 * 86400,
+            spool_segment_bytes: int = 64 * 1024 * 1024,
+            replay_concurrency: int = 4
+    ):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{backpressure}', expected one of {BACKPRESSURE_POLICIES}")
+        if backpressure == "spill" and not spool_dir:
+            raise ValueError("The 'spill' backpressure policy requires a spool_dir")
+
+        self.influxdb_service = influxdb_service
+        self.max_queue_points = max_queue_points
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000.0
+        self.backpressure = backpressure
+        self.replay_concurrency = replay_concurrency
+        self.spool: Optional[WriteAheadSpool] = None
+        if spool_dir:
+            self.spool = WriteAheadSpool(
+                spool_dir,
+                segment_bytes=spool_segment_bytes,
+                max_bytes=spool_max_bytes,
+                retention_seconds=spool_retention_seconds
+            )
+
+        self._chunks: Deque[Tuple[float, MetricBatch]] = deque()
+        self._queued_points = 0
+        self._data_available: Optional[asyncio.Event] = None
+        self._space_available: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.replay_backoff = 0.0
+
+        self.flushed_points = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.dropped_points = 0
+        self.spilled_points = 0
+        self.replayed_points = 0
+        self.replay_failures = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self._avg_flush_latency = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued_points
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._data_available = asyncio.Event()
+        self._space_available = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.create_task(self._flush_loop())
+        if self.spool is not None:
+            self._replay_task = asyncio.create_task(self._replay_loop())
+        print("Write pipeline started.")
+
+    async def adopt_spools(self, directories: List[str]) -> None:
+        # Takes over the spools other processes left behind, to be replayed with this one's
+        for directory in directories:
+            if self.spool is None:
+                print(f"Not replaying the spool in {directory}, this write pipeline has no spool")
+                return
+            points = await asyncio.to_thread(self.spool.adopt, directory)
+            print(f"Adopted {points} spooled points from {directory}")
+
+    async def submit(self, batch: MetricBatch) -> None:
+        if self._task is None or self._closing:
+            raise RuntimeError("Write pipeline is not running.")
+
+        size = len(batch)
+        if size == 0:
+            return
+
+        # A chunk larger than the whole queue is still admitted once the queue is empty
+        while self._chunks and self._queued_points + size > self.max_queue_points:
+            if self.backpressure == "block":
+                self._space_available.clear()
+                await self._space_available.wait()
+                if self._closing:
+                    raise RuntimeError("Write pipeline is closing.")
+            elif self.backpressure == "drop_oldest":
+                _, dropped = self._chunks.popleft()
+                self._queued_points -= len(dropped)
+                self.dropped_points += len(dropped)
+            else:
+                await asyncio.to_thread(self._spill, [batch])
+                return
+
+        self._chunks.append((time.monotonic(), batch))
+        self._queued_points += size
+        self._data_available.set()
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        print(f"Draining write pipeline ({self._queued_points} points queued)...")
+        self._closing = True
+        self._data_available.set()
+        self._space_available.set()
+        await self._task
+        self._task = None
+
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+            self._replay_task = None
+            # One last pass while InfluxDB is reachable, whatever is left stays on disk
+            while not self.spool.empty and await self._replay_once():
+                pass
+            self.spool.close()
+        print("Write pipeline closed.")
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None and not self._closing,
+            "backpressure": self.backpressure,
+            "queue_depth": self._queued_points,
+            "queue_chunks": len(self._chunks),
+            "max_queue_points": self.max_queue_points,
+            "batch_size": self.batch_size,
+            "linger_ms": self.linger * 1000.0,
+            "flushed_points": self.flushed_points,
+            "flushed_batches": self.flushed_batches,
+            "failed_batches": self.failed_batches,
+            "dropped_points": self.dropped_points,
+            "spilled_points": self.spilled_points,
+            "replayed_points": self.replayed_points,
+            "replay_failures": self.replay_failures,
+            "replay_backoff_seconds": self.replay_backoff,
+            "spool": self.spool.stats() if self.spool is not None else None,
+            "last_flush_latency_ms": self.last_flush_latency * 1000.0,
+            "avg_flush_latency_ms": self._avg_flush_latency * 1000.0,
+            "max_flush_latency_ms": self.max_flush_latency * 1000.0
+        }
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._wait_for_batch()
+
+            if not self._chunks:
+                if self._closing:
+                    break
+                continue
+
+            batches = self._take_batch()
+            self._space_available.set()
+            await self._flush(batches)
+
+    async def _wait_for_batch(self) -> None:
+        while not self._chunks and not self._closing:
+            self._data_available.clear()
+            await self._data_available.wait()
+
+        while self._queued_points < self.batch_size and not self._closing:
+            remaining = self._chunks[0][0] + self.linger - time.monotonic()
+            if remaining <= 0:
+                return
+            self._data_available.clear()
+            try:
+                await asyncio.wait_for(self._data_available.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+
+    def _take_batch(self) -> List[MetricBatch]:
+        batches: List[MetricBatch] = []
+        points = 0
+        while self._chunks and points < self.batch_size:
+            _, chunk = self._chunks.popleft()
+            batches.append(chunk)
+            points += len(chunk)
+        self._queued_points -= points
+        return batches
+
+    async def _flush(self, batches: List[MetricBatch]) -> None:
+        points = sum(len(batch) for batch in batches)
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.influxdb_service.write_batches, batches)
+        except Exception as e:
+            self.failed_batches += 1
+            if self.spool is not None:
+                print(f"Error writing batch of {points} points, spooling to disk: {e}")
+                await asyncio.to_thread(self._spill, batches)
+            else:
+                print(f"Error writing batch of {points} points, dropping it: {e}")
+                self.dropped_points += points
+            return
+
+        latency = time.perf_counter() - started
+        self.flushed_points += points
+        self.flushed_batches += 1
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        if self.flushed_batches == 1:
+            self._avg_flush_latency = latency
+        else:
+            self._avg_flush_latency += 0.1 * (latency - self._avg_flush_latency)
+
+    def _spill(self, batches: List[MetricBatch]) -> None:
+        points = sum(len(batch) for batch in batches)
+        self.spool.append(self.influxdb_service.encoder.encode_batches(batches), points)
+        self.spilled_points += points
+
+    async def _replay_loop(self) -> None:
+        # Drains the spool in order while live writes keep going, backing off exponentially
+        # while InfluxDB keeps refusing writes
+        backoff = REPLAY_BACKOFF_MIN
+        while True:
+            if self.spool.empty:
+                await asyncio.sleep(REPLAY_IDLE_INTERVAL)
+                continue
+
+            if await self._replay_once():
+                backoff = REPLAY_BACKOFF_MIN
+                self.replay_backoff = 0.0
+                continue
+
+            self.replay_failures += 1
+            self.replay_backoff = backoff
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, REPLAY_BACKOFF_MAX)
+
+    async def _replay_once(self) -> bool:
+        # Writes up to replay_concurrency records at once and commits the longest prefix that
+        # made it; everything after a failed record is read again on the next attempt.
+        # Rewriting a point InfluxDB already has just overwrites it with the same value.
+        records = await asyncio.to_thread(self.spool.read, self.replay_concurrency)
+        if not records:
+            return True
+
+        results = await asyncio.gather(
+            *(asyncio.to_thread(self.influxdb_service.write_line_protocol, record.payload) for record in records),
+            return_exceptions=True
+        )
+
+        for record, result in zip(records, results):
+            if isinstance(result, Exception):
+                print(f"Error replaying spooled points, backing off: {result}")
+                self.spool.rewind()
+                return False
+            await asyncio.to_thread(self._commit, record)
+        return True
+
+    def _commit(self, record: SpoolRecord) -> None:
+        self.spool.commit(record)
+        self.replayed_points += record.points
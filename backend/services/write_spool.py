@@ -0,0 +1,294 @@
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# payload length, points, crc32 of the payload, append time (unix ns)
+RECORD_HEADER = struct.Struct("<IIIq")
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+# Records moved at a time by WriteAheadSpool.adopt
+ADOPT_RECORDS = 64
+
+
+class SpoolRecord:
+    __slots__ = ("sequence", "offset", "end", "points", "payload", "created_ns")
+
+    def __init__(self, sequence: int, offset: int, end: int, points: int, payload: bytes, created_ns: int = 0):
+        self.sequence = sequence
+        self.offset = offset
+        self.end = end
+        self.points = points
+        self.payload = payload
+        self.created_ns = created_ns
+
+
+class _Segment:
+    __slots__ = ("sequence", "path", "file", "map", "size", "write_offset", "points", "newest_ns")
+
+    def __init__(self, sequence: int, path: str, size: int):
+        self.sequence = sequence
+        self.path = path
+        self.size = size
+        self.write_offset = 0
+        self.points = 0
+        self.newest_ns = 0
+
+        existed = os.path.exists(path)
+        self.file = open(path, "r+b" if existed else "w+b")
+        if not existed or os.path.getsize(path) < size:
+            self.file.truncate(size)
+        self.size = os.path.getsize(path)
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+
+    def records(self, offset: int = 0):
+        # Stops at the first empty or torn record, which marks the end of what was durably written
+        while offset + RECORD_HEADER.size <= self.size:
+            length, points, checksum, created_ns = RECORD_HEADER.unpack_from(self.map, offset)
+            end = offset + RECORD_HEADER.size + length
+            if length == 0 or end > self.size:
+                return
+            payload = self.map[offset + RECORD_HEADER.size:end]
+            if zlib.crc32(payload) != checksum:
+                return
+            yield offset, end, points, created_ns, payload
+            offset = end
+
+    def close(self) -> None:
+        self.map.close()
+        self.file.close()
+
+
+# Durable, append-only log of encoded line protocol for writes InfluxDB did not take. Records go
+# into fixed-size, memory-mapped segment files; a cursor file remembers how far the replayer has
+# committed, so a restart resumes where it stopped. Total size is capped at max_bytes and
+# segments older than retention_seconds are dropped, oldest first.
+class WriteAheadSpool:
+    def __init__(
+            self,
+            directory: str,
+            segment_bytes: int = 64 * 1024 * 1024,
+            max_bytes: int = 1024 * 1024 * 1024,
+            retention_seconds: float = 7 * 86400
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.retention_ns = int(retention_seconds * 1_000_000_000)
+
+        self._lock = threading.Lock()
+        self._segments: Dict[int, _Segment] = {}
+        self._cursor: Tuple[int, int] = (0, 0)
+        self._read_position: Tuple[int, int] = (0, 0)
+
+        self.pending_points = 0
+        self.appended_points = 0
+        self.committed_points = 0
+        self.expired_points = 0
+        self.evicted_points = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    @property
+    def empty(self) -> bool:
+        return self.pending_points == 0
+
+    def append(self, payload: bytes, points: int, created_ns: Optional[int] = None) -> None:
+        # created_ns keeps the age of records moved over from another spool
+        record_size = RECORD_HEADER.size + len(payload)
+        with self._lock:
+            segment = self._active_segment()
+            if segment is None or segment.write_offset + record_size > segment.size:
+                segment = self._new_segment(record_size)
+
+            created_ns = time.time_ns() if created_ns is None else created_ns
+            offset = segment.write_offset
+            RECORD_HEADER.pack_into(segment.map, offset, len(payload), points, zlib.crc32(payload), created_ns)
+            segment.map[offset + RECORD_HEADER.size:offset + record_size] = payload
+
+            # msync only works on page boundaries
+            page_start = offset - offset % mmap.PAGESIZE
+            segment.map.flush(page_start, offset + record_size - page_start)
+
+            segment.write_offset += record_size
+            segment.points += points
+            segment.newest_ns = max(segment.newest_ns, created_ns)
+            self.pending_points += points
+            self.appended_points += points
+
+            self._enforce_limits()
+
+    def read(self, max_records: int) -> List[SpoolRecord]:
+        # Hands out records after the read position without committing them; rewind() moves
+        # the read position back to the last commit after a failed replay
+        records = []
+        with self._lock:
+            self._expire()
+            sequence, offset = self._read_position
+            for segment_sequence in sorted(self._segments):
+                if segment_sequence < sequence:
+                    continue
+                segment = self._segments[segment_sequence]
+                start = offset if segment_sequence == sequence else 0
+                for record_offset, end, points, created_ns, payload in segment.records(start):
+                    if end > segment.write_offset:
+                        break
+                    records.append(SpoolRecord(segment_sequence, record_offset, end, points, payload, created_ns))
+                    self._read_position = (segment_sequence, end)
+                    if len(records) >= max_records:
+                        return records
+        return records
+
+    def commit(self, record: SpoolRecord) -> None:
+        with self._lock:
+            if (record.sequence, record.end) <= self._cursor:
+                return
+            self._cursor = (record.sequence, record.end)
+            self.pending_points -= record.points
+            self.committed_points += record.points
+
+            # Segments entirely behind the cursor are done
+            active = self._active_segment()
+            for sequence in sorted(self._segments):
+                segment = self._segments[sequence]
+                finished = sequence < record.sequence or \
+                    (sequence == record.sequence and record.end >= segment.write_offset)
+                if not finished or segment is active:
+                    break
+                self._remove_segment(segment)
+            self._save_cursor()
+
+    def adopt(self, directory: str) -> int:
+        # Moves what the spool in another directory has not replayed yet into this one, oldest
+        # first, and deletes that directory; returns the points moved. Nothing else may have the
+        # other spool open. Should this stop halfway, the directory stays and is adopted again,
+        # so some records are written twice, which InfluxDB takes as overwrites of the same points.
+        other = WriteAheadSpool(directory, max_bytes=self.max_bytes, retention_seconds=self.retention_ns / 1_000_000_000)
+        moved = 0
+        try:
+            while True:
+                records = other.read(ADOPT_RECORDS)
+                if not records:
+                    break
+                for record in records:
+                    self.append(record.payload, record.points, record.created_ns)
+                    moved += record.points
+        finally:
+            other.close()
+        shutil.rmtree(directory)
+        return moved
+
+    def rewind(self) -> None:
+        with self._lock:
+            self._read_position = self._cursor
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "segments": len(self._segments),
+                "bytes": sum(segment.size for segment in self._segments.values()),
+                "max_bytes": self.max_bytes,
+                "pending_points": self.pending_points,
+                "appended_points": self.appended_points,
+                "committed_points": self.committed_points,
+                "expired_points": self.expired_points,
+                "evicted_points": self.evicted_points
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+    def _recover(self) -> None:
+        cursor_path = os.path.join(self.directory, CURSOR_FILE)
+        if os.path.exists(cursor_path):
+            with open(cursor_path) as cursor_file:
+                sequence, offset = cursor_file.read().split()
+                self._cursor = (int(sequence), int(offset))
+
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            sequence = int(name[:-len(SEGMENT_SUFFIX)])
+            path = os.path.join(self.directory, name)
+            if os.path.getsize(path) < RECORD_HEADER.size:
+                # Created but never sized: the process stopped before it could hold a record
+                os.remove(path)
+                continue
+            segment = _Segment(sequence, path, 0)
+            if sequence < self._cursor[0]:
+                self._remove_segment(segment)
+                continue
+
+            for _, end, points, created_ns, _ in segment.records():
+                segment.write_offset = end
+                segment.points += points
+                segment.newest_ns = max(segment.newest_ns, created_ns)
+                if (sequence, end) > self._cursor:
+                    self.pending_points += points
+            self._segments[sequence] = segment
+
+        self._read_position = self._cursor
+        if self.pending_points:
+            print(f"Recovered {self.pending_points} spooled points from {self.directory}")
+
+    def _active_segment(self) -> Optional[_Segment]:
+        if not self._segments:
+            return None
+        return self._segments[max(self._segments)]
+
+    def _new_segment(self, record_size: int) -> _Segment:
+        sequence = max(self._segments) + 1 if self._segments else self._cursor[0] + 1
+        path = os.path.join(self.directory, f"{sequence:012d}{SEGMENT_SUFFIX}")
+        segment = _Segment(sequence, path, max(self.segment_bytes, record_size))
+        self._segments[sequence] = segment
+        return segment
+
+    def _remove_segment(self, segment: _Segment) -> None:
+        segment.close()
+        os.remove(segment.path)
+        self._segments.pop(segment.sequence, None)
+
+    def _drop_oldest(self) -> int:
+        # Drops the oldest segment holding unreplayed data and returns how many of its points were pending
+        sequence = min(self._segments)
+        segment = self._segments[sequence]
+        if sequence == self._cursor[0]:
+            dropped = sum(points for offset, _, points, _, _ in segment.records() if offset >= self._cursor[1])
+        else:
+            dropped = segment.points
+        self._remove_segment(segment)
+
+        self.pending_points -= dropped
+        if self._cursor[0] <= sequence:
+            self._cursor = (sequence + 1, 0)
+        if self._read_position[0] <= sequence:
+            self._read_position = (sequence + 1, 0)
+        self._save_cursor()
+        return dropped
+
+    def _expire(self) -> None:
+        cutoff = time.time_ns() - self.retention_ns
+        while len(self._segments) > 1 and self._segments[min(self._segments)].newest_ns < cutoff:
+            self.expired_points += self._drop_oldest()
+
+    def _enforce_limits(self) -> None:
+        self._expire()
+        while len(self._segments) > 1 and \
+                sum(segment.size for segment in self._segments.values()) > self.max_bytes:
+            self.evicted_points += self._drop_oldest()
+
+    def _save_cursor(self) -> None:
+        cursor_path = os.path.join(self.directory, CURSOR_FILE)
+        with open(cursor_path + ".tmp", "w") as cursor_file:
+            cursor_file.write(f"{self._cursor[0]} {self._cursor[1]}")
+        os.replace(cursor_path + ".tmp", cursor_path)
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+from typing import Optional
+
+import pytest
+
+# Modules import each other relative to backend/, as when the app runs from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The database settings are read on import: tests get a SQLite file of their own on the async
+# engine, never the database of the environment
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ["DATABASE_MODE"] = "async"
+
+
+@pytest.fixture(scope="session")
+def run():
+    from services.postgres_db import async_engine
+
+    def run(coroutine):
+        # Each call runs on a loop of its own, so pooled aiosqlite connections must not outlive it
+        async def scoped():
+            try:
+                return await coroutine
+            finally:
+                await async_engine.dispose()
+
+        return asyncio.run(scoped())
+
+    return run
+
+
+@pytest.fixture
+def signed_in():
+    from fastapi.testclient import TestClient
+    from routers.auth import get_current_user
+
+    def signed_in(app, superuser: bool = False, username: Optional[str] = None):
+        # A client of app whose requests are all made by one user
+        user = SimpleNamespace(username=username or ("operator" if superuser else "viewer"), is_superuser=superuser)
+        app.dependency_overrides[get_current_user] = lambda: {"user": user}
+        return TestClient(app)
+
+    return signed_in
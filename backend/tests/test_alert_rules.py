@@ -0,0 +1,147 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+from models.alert_rule import AlertRule, AlertRuleRecord
+from models.metric_batch import MetricBatch
+from routers import alerts
+from services.alert_engine import MAX_FOR_SECONDS, STREAK_LIMIT, AlertEngine, compile_rule
+from services.alert_rules import AlertRuleStore
+from services.postgres_db import async_session_scope, init_db_async
+
+RULE = {"name": "hot", "metric_name": "temperature", "operator": ">", "threshold": 20.0}
+
+
+@pytest.fixture(autouse=True)
+def tables(run):
+    async def empty():
+        await init_db_async()
+        async with async_session_scope() as db:
+            await db.run_sync(lambda session: session.query(AlertRuleRecord).delete())
+            await db.commit()
+
+    run(empty())
+
+
+def stored_rules(run) -> int:
+    async def count():
+        async with async_session_scope() as db:
+            return (await db.execute(select(func.count()).select_from(AlertRuleRecord))).scalar_one()
+
+    return run(count())
+
+
+def temperatures(*values) -> MetricBatch:
+    timestamp = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return MetricBatch.from_columns(timestamp, ["qc-001"], [[value] for value in values], metric_names=("temperature",))
+
+
+@pytest.mark.parametrize("fields", [
+    {"for_samples": 2 ** 31},
+    {"for_samples": 0},
+    {"for_seconds": float("inf")},
+    {"for_seconds": 1e300},
+    {"for_seconds": MAX_FOR_SECONDS + 1},
+    {"threshold": float("nan")},
+    {"hysteresis": float("inf")},
+    {"operator": "=="}
+])
+def test_compile_rule_refuses_what_the_engine_cannot_evaluate(fields):
+    with pytest.raises(ValueError):
+        compile_rule(AlertRule(id=1, **{**RULE, **fields}))
+
+
+def test_upsert_of_a_refused_rule_leaves_the_engine_as_it_was():
+    engine = AlertEngine()
+    engine.upsert(AlertRule(id=1, **RULE))
+    version = engine.version
+
+    with pytest.raises(ValueError):
+        engine.upsert(AlertRule(id=1, **RULE, for_samples=2 ** 31))
+    with pytest.raises(ValueError):
+        engine.upsert(AlertRule(id=2, **RULE, for_seconds=float("inf")))
+
+    assert engine.rules == 1
+    assert engine.version == version
+    assert len(engine.observe(temperatures(25.0))) == 1
+
+    # The rules can still be removed and replaced
+    engine.remove(2)
+    engine.replace([AlertRule(id=3, **RULE, for_samples=STREAK_LIMIT, for_seconds=MAX_FOR_SECONDS)])
+    assert engine.rules == 1
+    engine.remove(3)
+    assert engine.rules == 0
+
+
+def test_store_checks_rules_before_writing_them(run):
+    store = AlertRuleStore(AlertEngine())
+    rule = run(store.create(dict(RULE)))
+
+    with pytest.raises(ValueError):
+        run(store.create({**RULE, "for_samples": 2 ** 31}))
+    with pytest.raises(ValueError):
+        run(store.update(rule.id, {**RULE, "for_seconds": float("inf")}))
+
+    assert stored_rules(run) == 1
+    assert store.get(rule.id) == rule
+    assert store.engine.rules == 1
+    assert run(store.delete(rule.id))
+    assert store.engine.rules == 0
+
+
+def test_load_skips_stored_rules_the_engine_cannot_evaluate(run):
+    async def insert():
+        async with async_session_scope() as db:
+            db.add(AlertRuleRecord(**RULE))
+            db.add(AlertRuleRecord(**{**RULE, "name": "never", "for_samples": 2 ** 40}))
+            await db.commit()
+
+    run(insert())
+    store = AlertRuleStore(AlertEngine())
+    run(store.load())
+
+    assert [rule.name for rule in store.list()] == ["hot"]
+    assert store.engine.rules == 1
+
+
+def alerts_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(alerts.router)
+    alerts.set_alert_rule_store(AlertRuleStore(AlertEngine()))
+    alerts.set_fleet_registry(None)
+    return app
+
+
+def assert_refused(client: TestClient, rule_id: int, status_code: int):
+    assert client.post("/alerts/rules", json=RULE).status_code == status_code
+    assert client.put(f"/alerts/rules/{rule_id}", json={**RULE, "threshold": 99.0}).status_code == status_code
+    assert client.delete(f"/alerts/rules/{rule_id}").status_code == status_code
+
+
+def test_changing_rules_needs_a_superuser(run, signed_in):
+    app = alerts_app()
+    rule_id = signed_in(app, superuser=True).post("/alerts/rules", json=RULE).json()["id"]
+
+    app.dependency_overrides.clear()
+    assert_refused(TestClient(app), rule_id, 401)
+    assert_refused(signed_in(app, superuser=False), rule_id, 403)
+
+    assert stored_rules(run) == 1
+    assert TestClient(app).get(f"/alerts/rules/{rule_id}").json()["threshold"] == 20.0
+
+
+def test_api_rejects_out_of_range_rules(run, signed_in):
+    with signed_in(alerts_app(), superuser=True) as client:
+        for fields in ({"for_samples": 2 ** 31}, {"for_seconds": MAX_FOR_SECONDS + 1}, {"for_seconds": "inf"}):
+            assert client.post("/alerts/rules", json={**RULE, **fields}).status_code == 422
+
+        assert stored_rules(run) == 0
+
+        created = client.post("/alerts/rules", json={**RULE, "for_samples": STREAK_LIMIT})
+        assert created.status_code == 201
+        rule_id = created.json()["id"]
+        assert client.put(f"/alerts/rules/{rule_id}", json={**RULE, "for_samples": 2 ** 31}).status_code == 422
+        assert client.delete(f"/alerts/rules/{rule_id}").status_code == 204
@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, text
+
+from models.user import User
+from schemas.user_schemas import UserCreate, UserResponse
+from services import postgres_db
+from services.auth_service import token_cache
+from services.postgres_db import async_engine, async_session_scope, async_url, engine_options, init_db_async, pool_stats
+from services.user_service import authenticate_user_async, create_user_async, get_user_snapshot_async
+
+PASSWORD = "correct horse battery"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def tables(run):
+    run(init_db_async())
+
+
+def new_user(username: str, **fields) -> UserCreate:
+    return UserCreate(email=f"{username}@example.com", username=username, password=PASSWORD, **fields)
+
+
+def test_database_is_sqlite_on_the_async_engine():
+    assert postgres_db.DATABASE_MODE == "async"
+    assert async_engine.url.drivername == "sqlite+aiosqlite"
+
+
+def test_create_user(run):
+    user = run(create_user_async(new_user("alice", full_name="Alice Liddell")))
+
+    assert isinstance(user, UserResponse)
+    assert user.id > 0
+    assert (user.username, user.email, user.full_name) == ("alice", "alice@example.com", "Alice Liddell")
+    assert user.is_active and not user.is_superuser
+    assert user.created_at is not None
+
+
+def test_create_user_rejects_duplicates(run):
+    run(create_user_async(new_user("bob")))
+
+    with pytest.raises(ValueError, match="Username 'bob' already exists"):
+        run(create_user_async(UserCreate(email="other@example.com", username="bob", password=PASSWORD)))
+    with pytest.raises(ValueError, match="Email 'bob@example.com' already exists"):
+        run(create_user_async(UserCreate(email="bob@example.com", username="bobby", password=PASSWORD)))
+
+
+def test_create_user_stores_a_password_hash(run):
+    run(create_user_async(new_user("carol")))
+
+    async def stored_hash():
+        async with async_session_scope() as db:
+            return (await db.execute(select(User.hashed_password).where(User.username == "carol"))).scalar_one()
+
+    hashed_password = run(stored_hash())
+    assert hashed_password != PASSWORD
+    assert hashed_password.startswith("$2")
+
+
+def test_authenticate_user(run):
+    created = run(create_user_async(new_user("dave")))
+
+    user = run(authenticate_user_async("dave@example.com", PASSWORD))
+    assert user == created
+    assert run(authenticate_user_async("dave@example.com", "wrong password")) is None
+    assert run(authenticate_user_async("nobody@example.com", PASSWORD)) is None
+
+
+def test_authenticate_inactive_user(run):
+    user = run(create_user_async(new_user("erin")))
+
+    async def deactivate():
+        async with async_session_scope() as db:
+            db_user = await db.get(User, user.id)
+            db_user.is_active = False
+            await db.commit()
+
+    run(deactivate())
+    assert run(authenticate_user_async("erin@example.com", PASSWORD)) is None
+
+
+def test_user_snapshot(run):
+    created = run(create_user_async(new_user("frank")))
+
+    assert run(get_user_snapshot_async("frank")) == created
+    assert run(get_user_snapshot_async("nobody")) is None
+
+
+def test_updating_a_user_drops_its_cached_tokens(run):
+    user = run(create_user_async(new_user("grace")))
+    token_cache.put("token-of-grace", user.id, user, datetime.now(timezone.utc) + timedelta(hours=1))
+    assert token_cache.get("token-of-grace") == user
+
+    async def promote():
+        async with async_session_scope() as db:
+            db_user = await db.get(User, user.id)
+            db_user.is_superuser = True
+            await db.commit()
+
+    run(promote())
+    assert token_cache.get("token-of-grace") is None
+    assert run(get_user_snapshot_async("grace")).is_superuser
+
+
+def test_async_session_scope_records_the_pool_wait(run):
+    checkouts = pool_stats()["checkouts"]
+
+    async def select_one():
+        async with async_session_scope() as db:
+            return (await db.execute(text("SELECT 1"))).scalar_one()
+
+    assert run(select_one()) == 1
+    assert pool_stats()["checkouts"] == checkouts + 1
+
+
+def test_async_session_scope_returns_the_connection_on_error(run):
+    async def failing():
+        async with async_session_scope() as db:
+            await db.execute(text("SELECT 1"))
+            assert pool_stats().get("checkedout") == 1
+            raise RuntimeError("boom")
+
+    async def checked_out_after():
+        with pytest.raises(RuntimeError, match="boom"):
+            await failing()
+        return pool_stats().get("checkedout")
+
+    assert run(checked_out_after()) == 0
+
+
+def test_pool_stats():
+    stats = pool_stats()
+
+    assert stats["mode"] == "async"
+    assert isinstance(stats["pool"], str)
+    for name in ("checkouts", "timeouts", "mean_wait_ms", "p99_wait_ms", "max_wait_ms"):
+        assert stats[name] >= 0
+
+
+def test_async_url():
+    assert async_url("sqlite:///./local.db") == "sqlite+aiosqlite:///./local.db"
+    assert async_url("postgresql://user:secret@db:5432/app") == "postgresql+asyncpg://user:secret@db:5432/app"
+    assert async_url("postgresql+asyncpg://user:secret@db/app") == "postgresql+asyncpg://user:secret@db/app"
+
+
+def test_engine_options():
+    sqlite = engine_options("sqlite:///./local.db", True)
+    assert "pool_size" not in sqlite and "connect_args" not in sqlite
+
+    server = engine_options("postgresql://user:secret@db/app", True)
+    assert server["pool_size"] == postgres_db.POOL_SIZE
+    assert server["max_overflow"] == postgres_db.MAX_OVERFLOW
+    assert server["connect_args"] == {"prepared_statement_cache_size": postgres_db.STATEMENT_CACHE_SIZE}
+    assert "connect_args" not in engine_options("postgresql://user:secret@db/app", False)
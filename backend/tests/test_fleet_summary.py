@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from models.metric_batch import MetricBatch
+from services.fleet_summary import QUANTILES, FleetSummary
+from services.fleet_simulator import fleet_computer_ids
+
+METRICS = ("qubit_fidelity", "temperature")
+COMPUTERS = fleet_computer_ids(300)
+K = 5
+RELATIVE_ACCURACY = 0.01
+
+
+class BruteForce:
+    # The latest value of every series, kept the slow way: per point, newest timestamp wins
+    def __init__(self):
+        self.latest = {}
+
+    def observe(self, computer_index, metric_index, values, timestamps_ns):
+        for computer, metric, value, timestamp_ns in zip(computer_index, metric_index, values, timestamps_ns):
+            key = (COMPUTERS[computer], METRICS[metric])
+            if key not in self.latest or timestamp_ns >= self.latest[key][0]:
+                self.latest[key] = (int(timestamp_ns), float(value))
+
+    def values(self, metric_name: str) -> dict:
+        return {computer_id: value for (computer_id, name), (_, value) in self.latest.items() if name == metric_name}
+
+
+def batch(computer_index, metric_index, values, timestamps_ns) -> MetricBatch:
+    return MetricBatch.from_rows(
+        COMPUTERS, METRICS,
+        np.asarray(computer_index, dtype=np.int32), np.asarray(metric_index, dtype=np.int32),
+        np.asarray(values, dtype=np.float64), np.asarray(timestamps_ns, dtype=np.int64)
+    )
+
+
+def assert_matches(summary: FleetSummary, expected: BruteForce):
+    metrics = summary.summary(k=K)["metrics"]
+    for metric_name in METRICS:
+        values = expected.values(metric_name)
+        found = metrics[metric_name]
+        assert found["computers"] == len(values)
+        if not values:
+            continue
+
+        ranked = sorted(values, key=values.get)
+        highest = [{"computer_id": computer_id, "value": values[computer_id]} for computer_id in ranked[::-1][:K]]
+        lowest = [{"computer_id": computer_id, "value": values[computer_id]} for computer_id in ranked[:K]]
+        worst, best = (lowest, highest) if found["higher_is_better"] else (highest, lowest)
+        assert [{key: leader[key] for key in ("computer_id", "value")} for leader in found["worst"]] == worst
+        assert [{key: leader[key] for key in ("computer_id", "value")} for leader in found["best"]] == best
+        assert found["min"] == values[ranked[0]] and found["max"] == values[ranked[-1]]
+        assert found["mean"] == pytest.approx(np.mean(list(values.values())))
+
+        exact = np.sort(list(values.values()))
+        for quantile in QUANTILES:
+            value = exact[int(quantile * (len(exact) - 1))]
+            assert found[f"p{round(quantile * 100)}"] == pytest.approx(value, rel=RELATIVE_ACCURACY)
+
+
+def test_summary_matches_a_brute_force_ranking():
+    rng = np.random.default_rng(7)
+    summary = FleetSummary(METRICS, max_computers=len(COMPUTERS), max_k=K, relative_accuracy=RELATIVE_ACCURACY)
+    expected = BruteForce()
+    now_ns = 1_700_000_000_000_000_000
+
+    def observe(computer_index, metric_index, values, timestamps_ns):
+        summary.observe(batch(computer_index, metric_index, values, timestamps_ns))
+        expected.observe(computer_index, metric_index, values, timestamps_ns)
+        assert_matches(summary, expected)
+
+    for round_index in range(60):
+        now_ns += 10 ** 9
+        size = int(rng.integers(1, 200))
+        computer_index = rng.integers(0, len(COMPUTERS), size)
+        metric_index = rng.integers(0, len(METRICS), size)
+        values = rng.uniform(0.5, 100.0, size)
+        # Distinct timestamps, some of them before the latest of their series
+        timestamps_ns = now_ns - rng.permutation(size) * 1000 - (rng.random(size) < 0.2) * 5 * 10 ** 9
+
+        if round_index % 3 == 0:
+            # Repeated series in one batch: only the newest point counts
+            computer_index = np.concatenate([computer_index, computer_index[:10]])
+            metric_index = np.concatenate([metric_index, metric_index[:10]])
+            values = np.concatenate([values, rng.uniform(0.5, 100.0, len(values[:10]))])
+            timestamps_ns = np.concatenate([timestamps_ns, timestamps_ns[:10] + 500])
+        observe(computer_index, metric_index, values, timestamps_ns)
+
+        if round_index % 10 == 9:
+            # Every current leader of both ends falls back to the middle
+            now_ns += 10 ** 9
+            for metric_index_value, metric_name in enumerate(METRICS):
+                values = expected.values(metric_name)
+                ranked = sorted(values, key=values.get)
+                demoted = ranked[:2 * K] + ranked[-2 * K:]
+                computer_index = [COMPUTERS.index(computer_id) for computer_id in demoted]
+                observe(
+                    computer_index, [metric_index_value] * len(demoted),
+                    rng.uniform(45.0, 55.0, len(demoted)), [now_ns + i for i in range(len(demoted))]
+                )
+
+    assert summary.stale_points > 0
+    assert summary.rebuilds > 0
+
+
+def test_stale_and_unknown_points_are_counted_and_ignored():
+    summary = FleetSummary(METRICS, max_computers=2, max_k=K)
+    summary.observe(batch([0, 1], [1, 1], [20.0, 30.0], [2000, 2000]))
+    summary.observe(batch([0, 1, 2], [1, 1, 1], [99.0, 31.0, 50.0], [1000, 3000, 3000]))
+
+    temperature = summary.summary(k=K)["metrics"]["temperature"]
+    assert [leader["value"] for leader in temperature["worst"]] == [31.0, 20.0]
+    assert temperature["mean"] == pytest.approx(25.5)
+    assert summary.stale_points == 1
+    # The third computer does not fit max_computers
+    assert summary.rejected_points == 1
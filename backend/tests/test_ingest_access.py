@@ -0,0 +1,45 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import ingest
+from services.fleet_registry import FleetRegistry, seed_record
+from services.hot_tier import HotTierStore
+from services.influxdb_service import InfluxDBService
+from services.metric_ingest import MetricIngestService
+from services.write_path import MetricsWritePath
+from services.write_pipeline import MetricWritePipeline
+
+LINE = b"qubit_fidelity,computer_id=qc-001 value=0.991"
+
+
+@pytest.fixture
+def app():
+    registry = FleetRegistry()
+    registry.replace([seed_record("qc-001")])
+    ingest.set_metric_ingest_service(MetricIngestService(registry, rate_points_per_second=1.0, burst_points=10.0))
+    # Nothing reaches InfluxDB: every request here is refused before its points are published
+    influxdb_service = InfluxDBService("http://127.0.0.1:9", "token", "bucket", "org")
+    ingest.set_write_path(MetricsWritePath(MetricWritePipeline(influxdb_service), HotTierStore()))
+
+    app = FastAPI()
+    app.include_router(ingest.router)
+    return app
+
+
+def test_ingest_needs_a_signed_in_user(app):
+    client = TestClient(app)
+    response = client.post("/metrics/ingest", content=LINE, headers={"Content-Type": "text/plain"})
+    assert response.status_code == 401
+
+
+def test_ingest_is_rate_limited_per_user(app, signed_in):
+    ingest.metric_ingest_service.rate_limiter.consume("agent-a", 100)
+
+    response = signed_in(app, username="agent-a").post("/metrics/ingest", content=LINE, headers={"Content-Type": "text/plain"})
+    assert response.status_code == 429
+    assert "agent-a" in response.json()["detail"]
+
+    # Same address, different user: a budget of its own; the empty body is then refused
+    response = signed_in(app, username="agent-b").post("/metrics/ingest", content=b"", headers={"Content-Type": "text/plain"})
+    assert response.status_code == 400
@@ -0,0 +1,129 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from influxdb_client import Point
+
+from models.metric import Metric
+from models.metric_batch import MetricBatch, to_timestamp_ns
+from services.influxdb_service import InfluxDBService
+from services.line_protocol import LineProtocolEncoder
+
+TIMESTAMP = datetime(2025, 1, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+VALUES = [
+    0.0, -0.0, 1.0, -1.5, 0.1, 1 / 3, 99.95, 1e15, 1e16, 1.5e16, 1e-7, 123456789.125,
+    float("nan"), float("inf"), float("-inf")
+]
+
+COMPUTER_IDS = ["qc-001", "qc 002", "qc,003", "qc=004", "qc\\005", "qc\"006", ""]
+
+METRICS = [
+    ("temperature", "mK"),
+    ("qubit fidelity", "%"),
+    ("gate,error=rate", 'say "hi"'),
+    ("coherence_time", "back\\slash"),
+    ("quantum_volume", "")
+]
+
+
+def reference(metrics) -> bytes:
+    # What the encoder replaces: one influxdb_client.Point per metric
+    return "\n".join(InfluxDBService.to_point(metric).to_line_protocol() for metric in metrics).encode()
+
+
+def metrics_for(values, computer_ids=COMPUTER_IDS, metrics=METRICS, timestamp=TIMESTAMP):
+    return [
+        Metric(timestamp=timestamp, computer_id=computer_id, metric_name=name, value=value, unit=unit)
+        for name, unit in metrics
+        for computer_id in computer_ids
+        for value in values
+    ]
+
+
+@pytest.mark.parametrize("value", VALUES)
+def test_encode_matches_point(value):
+    metrics = metrics_for([value])
+    assert LineProtocolEncoder().encode(metrics) == reference(metrics)
+
+
+def test_encode_reuses_cached_prefixes_and_timestamps():
+    encoder = LineProtocolEncoder()
+    metrics = metrics_for(VALUES)
+    assert encoder.encode(metrics) == reference(metrics)
+    assert encoder.encode(metrics) == reference(metrics)
+
+    later = metrics_for(VALUES, timestamp=datetime(2025, 1, 1, 12, 30, 16, tzinfo=timezone.utc))
+    assert encoder.encode(later) == reference(later)
+
+
+def test_encode_empty():
+    assert LineProtocolEncoder().encode([]) == b""
+    assert LineProtocolEncoder().encode_batches([]) == b""
+
+
+def test_encode_batches_matches_point():
+    names = [name for name, _ in METRICS]
+    units = [unit for _, unit in METRICS]
+    columns = np.resize(np.array(VALUES), (len(names), len(COMPUTER_IDS)))
+    batch = MetricBatch.from_columns(TIMESTAMP, COMPUTER_IDS, columns, names, units)
+
+    encoder = LineProtocolEncoder()
+    # Twice, the second time from the cached shape
+    for _ in range(2):
+        assert encoder.encode_batches([batch, batch]) == reference(batch.to_metrics() * 2)
+
+
+def test_encode_batches_with_row_timestamps_matches_point():
+    computer_ids = ["qc-001", "qc 002"]
+    metric_names = ["temperature", "qubit_fidelity"]
+    rows = len(VALUES)
+    computer_index = np.arange(rows, dtype=np.int32) % 2
+    metric_index = (np.arange(rows, dtype=np.int32) // 2) % 2
+    timestamps_ns = to_timestamp_ns(TIMESTAMP) + np.arange(rows, dtype=np.int64) * 1_000_000_007
+    batch = MetricBatch.from_rows(computer_ids, metric_names, computer_index, metric_index, np.array(VALUES), timestamps_ns)
+
+    expected = "\n".join(
+        Point(batch.metric_names[metric])
+        .tag("computer_id", batch.computer_ids[computer])
+        .field("value", value)
+        .field("unit", batch.units[metric])
+        .time(int(timestamp))
+        .to_line_protocol()
+        for computer, metric, value, timestamp in zip(computer_index, metric_index, VALUES, timestamps_ns)
+    ).encode()
+    assert LineProtocolEncoder().encode_batches([batch]) == expected
+
+
+def test_encode_series_matches_point():
+    values = np.array(VALUES)
+    timestamps_ns = to_timestamp_ns(TIMESTAMP) + np.arange(len(values), dtype=np.int64) * 1_000
+    data = LineProtocolEncoder().encode_series("qc,003", "gate,error=rate", 'say "hi"', timestamps_ns, values)
+
+    expected = "".join(
+        Point("gate,error=rate")
+        .tag("computer_id", "qc,003")
+        .field("value", value)
+        .field("unit", 'say "hi"')
+        .time(int(timestamp))
+        .to_line_protocol() + "\n"
+        for value, timestamp in zip(VALUES, timestamps_ns)
+    ).encode()
+    assert data == expected
+
+
+def test_encode_session_batches_matches_point():
+    batch = MetricBatch.from_columns(TIMESTAMP, ["qc-001", "qc 002"], [[1.5, float("nan")]], ["temperature"])
+    batch.session_id = "run 1,a=b"
+
+    expected = "\n".join(
+        InfluxDBService.to_point(metric).tag("session", batch.session_id).to_line_protocol()
+        for metric in batch.to_metrics()
+    ).encode()
+    encoder = LineProtocolEncoder()
+    assert encoder.encode_batches([batch]) == expected
+
+    # Forgetting the session drops its cached prefixes, and the fleet's lines stay untagged
+    encoder.forget_session(batch.session_id)
+    batch.session_id = None
+    assert encoder.encode_batches([batch]) == reference(batch.to_metrics())
@@ -0,0 +1,185 @@
+import gzip
+
+import msgpack
+import numpy as np
+import pytest
+
+from services.fleet_registry import FleetRegistry, seed_record
+from services.metric_ingest import (
+    IngestError,
+    MetricIngestService,
+    parse_line_protocol,
+    parse_msgpack,
+    parse_ndjson,
+    to_timestamp_array
+)
+
+NOW_NS = 1_735_689_600_000_000_000
+NOW_MS = NOW_NS // 1_000_000
+
+
+@pytest.fixture
+def service():
+    registry = FleetRegistry()
+    registry.replace([seed_record(computer_id) for computer_id in ("qc-001", "qc-002")])
+    return MetricIngestService(registry, max_future_seconds=60)
+
+
+def parsed(columns) -> list:
+    return list(zip(columns.computer_ids, columns.metric_names, columns.values, columns.timestamps))
+
+
+def test_parse_line_protocol():
+    columns = parse_line_protocol(
+        b"# comment\n"
+        b"qubit_fidelity,computer_id=qc-001 value=0.99 1735689600000\n"
+        b"temperature,site=lab,computer_id=qc-002 reading=1,value=15i\n"
+        b"\n"
+        b"gate_error_rate,computer_id=qc\\ 003 value=0.002,note=\"a b\" 1735689600000\n"
+        b"quantum_volume value=64\n"
+        b"coherence_time,computer_id=qc-001 t1=100\n"
+    )
+    assert parsed(columns) == [
+        ("qc-001", "qubit_fidelity", "0.99", "1735689600000"),
+        ("qc-002", "temperature", "15", None),
+        ("qc 003", "gate_error_rate", "0.002", "1735689600000")
+    ]
+    assert columns.malformed == 2
+    assert [error.split(":")[0] for error in columns.errors] == ["Line 6", "Line 7"]
+
+
+def test_parse_line_protocol_refuses_invalid_utf8():
+    with pytest.raises(IngestError):
+        parse_line_protocol(b"temperature,computer_id=\xff value=1")
+
+
+def test_parse_ndjson():
+    columns = parse_ndjson(
+        b'{"computer_id": "qc-001", "metric_name": "temperature", "value": 15.2, "timestamp": 1}\n'
+        b'{"computer_id": "qc-002", "timestamp": "2025-01-01T00:00:00Z", "metrics": {"qubit_fidelity": 0.99, "quantum_volume": 64}}\n'
+        b'not json\n'
+        b'{"metric_name": "temperature", "value": 1}\n'
+        b'{"computer_id": "qc-001", "metric_name": "temperature"}\n'
+        b'{"computer_id": "qc-001", "metrics": [1, 2]}\n'
+    )
+    assert parsed(columns) == [
+        ("qc-001", "temperature", 15.2, 1),
+        ("qc-002", "qubit_fidelity", 0.99, "2025-01-01T00:00:00Z"),
+        ("qc-002", "quantum_volume", 64, "2025-01-01T00:00:00Z")
+    ]
+    assert columns.malformed == 4
+
+
+def test_parse_msgpack_records_and_columns():
+    records = parse_msgpack(msgpack.packb([
+        {"computer_id": "qc-001", "metric_name": "temperature", "value": 15.0},
+        {"computer_id": "qc-002", "timestamp": 2, "metrics": {"qubit_fidelity": 0.98}},
+        "not a record"
+    ]))
+    assert parsed(records) == [("qc-001", "temperature", 15.0, None), ("qc-002", "qubit_fidelity", 0.98, 2)]
+    assert records.malformed == 1
+
+    columns = parse_msgpack(msgpack.packb({
+        "computer_id": ["qc-001", "qc-002"],
+        "metric_name": ["temperature", "temperature"],
+        "value": [15.0, 16.0]
+    }))
+    assert parsed(columns) == [("qc-001", "temperature", 15.0, None), ("qc-002", "temperature", 16.0, None)]
+
+
+@pytest.mark.parametrize("body", [
+    b"\xc1",
+    msgpack.packb("records"),
+    msgpack.packb({"computer_id": ["qc-001"], "metric_name": ["temperature"]}),
+    msgpack.packb({"computer_id": ["qc-001"], "metric_name": ["temperature"], "value": [1.0, 2.0]}),
+    msgpack.packb({"computer_id": ["qc-001"], "metric_name": ["temperature"], "value": [1.0], "timestamp": [1, 2]}),
+    msgpack.packb({"computer_id": [1], "metric_name": ["temperature"], "value": [1.0]})
+])
+def test_parse_msgpack_refuses_malformed_bodies(body):
+    with pytest.raises(IngestError):
+        parse_msgpack(body)
+
+
+def test_to_timestamp_array_scales_by_precision():
+    timestamps, readable = to_timestamp_array([1, None, 3], 1_000_000, NOW_NS)
+    assert timestamps.tolist() == [1_000_000, NOW_NS, 3_000_000]
+    assert readable.all()
+
+    timestamps, readable = to_timestamp_array([None, None], 1, NOW_NS)
+    assert timestamps.tolist() == [NOW_NS, NOW_NS]
+    assert readable.all()
+
+
+def test_to_timestamp_array_reads_text_and_iso_timestamps():
+    timestamps, readable = to_timestamp_array(
+        ["1735689600", "2025-01-01T00:00:00", "2025-01-01T01:00:00+01:00", 1735689600.0], 1_000_000_000, NOW_NS
+    )
+    assert timestamps.tolist() == [NOW_NS] * 4
+    assert readable.all()
+
+
+def test_to_timestamp_array_marks_unreadable_timestamps():
+    timestamps, readable = to_timestamp_array(
+        [-1, "yesterday", True, float("nan"), 2 ** 80, 2 ** 62, 5], 1_000, NOW_NS
+    )
+    assert readable.tolist() == [False, False, False, False, False, False, True]
+    assert timestamps[-1] == 5_000
+
+
+def test_validate_counts_each_rejected_point_once(service):
+    body = (
+        f"temperature,computer_id=qc-001 value=15 {NOW_MS}\n"
+        f"qubit_fidelity,computer_id=qc-002 value=0.99 {NOW_MS - 1000}\n"
+        f"temperature,computer_id=qc-999 value=nan {NOW_MS}\n"
+        f"humidity,computer_id=qc-001 value=40 {NOW_MS}\n"
+        f"temperature,computer_id=qc-001 value=inf {NOW_MS}\n"
+        f"temperature,computer_id=qc-001 value=abc {NOW_MS}\n"
+        f"temperature,computer_id=qc-002 value=15 {NOW_MS + 61_000}\n"
+        f"temperature,computer_id=qc-002 value=15 -5\n"
+        f"temperature,computer_id=qc-002\n"
+    ).encode()
+    batch, report = service.parse(body, "line_protocol", "ms", now_ns=NOW_NS)
+
+    assert report["accepted"] == 2
+    assert report["rejected"] == 7
+    assert report["rejected_by_reason"] == {
+        "malformed": 1,
+        "unknown_computer": 1,
+        "unknown_metric": 1,
+        "invalid_value": 2,
+        "invalid_timestamp": 2
+    }
+    assert "Unknown quantum computers: qc-999" in report["errors"]
+    assert "Unknown metrics: humidity" in report["errors"]
+
+    assert list(batch.computer_ids) == ["qc-001", "qc-002"]
+    assert list(batch.metric_names) == ["temperature", "qubit_fidelity"]
+    assert [batch.computer_ids[i] for i in batch.computer_index] == ["qc-001", "qc-002"]
+    assert [batch.metric_names[i] for i in batch.metric_index] == ["temperature", "qubit_fidelity"]
+    assert batch.values.tolist() == [15.0, 0.99]
+    assert batch.timestamps_ns.tolist() == [NOW_NS, NOW_NS - 1_000_000_000]
+
+
+def test_parse_with_nothing_accepted_returns_no_batch(service):
+    batch, report = service.parse(b'{"computer_id": "qc-404", "metric_name": "temperature", "value": 1}', "ndjson")
+    assert batch is None
+    assert report["accepted"] == 0
+    assert report["rejected_by_reason"] == {"unknown_computer": 1}
+
+
+def test_parse_gzipped_body(service):
+    body = gzip.compress(msgpack.packb([{"computer_id": "qc-001", "metric_name": "temperature", "value": 15}]))
+    batch, report = service.parse(body, "msgpack", content_encoding="gzip", now_ns=NOW_NS)
+    assert report["accepted"] == 1
+    assert batch.timestamps_ns.tolist() == [NOW_NS]
+
+    with pytest.raises(IngestError):
+        service.parse(b"not gzip", "msgpack", content_encoding="gzip")
+    with pytest.raises(IngestError):
+        service.parse(body, "msgpack", content_encoding="br")
+
+
+def test_parse_refuses_a_body_larger_than_the_limit_once_decompressed():
+    service = MetricIngestService(FleetRegistry(), max_body_bytes=1024)
+    with pytest.raises(IngestError):
+        service.parse(gzip.compress(np.zeros(4096, dtype=np.uint8).tobytes()), "line_protocol", content_encoding="gzip")
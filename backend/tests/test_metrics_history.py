@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from services.metrics_history import NS_PER_SECOND, MetricsHistoryService
+
+
+class StubInfluxDB:
+    # One point per step_seconds in every range asked for, up to written_ns if set, recording each query
+    def __init__(self, rollup_bucket=None, step_seconds: int = 60):
+        self.rollup_bucket = rollup_bucket
+        self.step_ns = step_seconds * NS_PER_SECOND
+        self.queries = []
+        self.value = 1.0
+        self.written_ns = None
+
+    def query_series(self, computer_id, metric_name, start_ns, stop_ns, tier=None):
+        self.queries.append((start_ns, stop_ns, tier))
+        step_ns = 3600 * NS_PER_SECOND if tier == "1h" else self.step_ns
+        if self.written_ns is not None:
+            stop_ns = min(stop_ns, self.written_ns)
+        timestamps = np.arange(-(-start_ns // step_ns) * step_ns, stop_ns, step_ns, dtype=np.int64)
+        return timestamps, np.full(len(timestamps), self.value)
+
+
+def repeat_30_day_request(influxdb: StubInfluxDB, points: int):
+    history = MetricsHistoryService(influxdb, refresh_interval=0.0)
+
+    async def run():
+        results = []
+        for _ in range(3):
+            end = datetime.now(timezone.utc)
+            results.append(await history.get_history("qc-0", "fidelity", end - timedelta(days=30), end, points))
+        return results
+
+    return asyncio.run(run())
+
+
+def assert_only_tails_refetched(influxdb: StubInfluxDB):
+    first_start, first_stop, _ = influxdb.queries[0]
+    assert first_stop - first_start >= 30 * 86400 * NS_PER_SECOND
+    for start_ns, stop_ns, _ in influxdb.queries[1:]:
+        assert stop_ns - start_ns < 2 * 3600 * NS_PER_SECOND
+
+
+def test_repeated_30_day_rollup_request_only_fetches_the_tail():
+    influxdb = StubInfluxDB(rollup_bucket="rollups")
+    results = repeat_30_day_request(influxdb, points=500)
+
+    assert [result["tier"] for result in results] == ["1h"] * 3
+    assert all(result["raw_points"] >= 720 for result in results)
+    assert_only_tails_refetched(influxdb)
+
+
+def test_repeated_30_day_raw_request_is_not_trimmed_below_the_requested_range():
+    influxdb = StubInfluxDB()
+    results = repeat_30_day_request(influxdb, points=500)
+
+    assert [result["tier"] for result in results] == ["raw"] * 3
+    assert all(result["raw_points"] >= 30 * 1440 for result in results)
+    assert_only_tails_refetched(influxdb)
+
+
+def test_result_is_rebuilt_when_a_refresh_rewrites_points_it_covers():
+    influxdb = StubInfluxDB(step_seconds=1)
+    history = MetricsHistoryService(influxdb, bucket_seconds=1, refresh_interval=0.0)
+    end = datetime.now(timezone.utc) - timedelta(seconds=2)
+    start = end - timedelta(minutes=1)
+
+    async def run():
+        influxdb.written_ns = int(end.timestamp()) * NS_PER_SECOND
+        first = await history.get_history("qc-0", "fidelity", start, end, 1000)
+        # A later request re-reads the provisional points: no more of them, but with new values
+        influxdb.value = 2.0
+        await history.get_history("qc-0", "fidelity", start, datetime.now(timezone.utc), 1000)
+        again = await history.get_history("qc-0", "fidelity", start, end, 1000)
+        return first, again
+
+    first, again = asyncio.run(run())
+    assert first["raw_points"] == again["raw_points"]
+    assert set(first["values"]) == {1.0}
+    assert again["values"][-1] == 2.0
@@ -0,0 +1,152 @@
+import time
+import tracemalloc
+from datetime import timezone
+
+import numpy as np
+
+from models.metric import METRIC_NAMES
+from models.metric_batch import MetricBatch, from_timestamp_ns
+from services.fleet_simulator import fleet_computer_ids
+from services.rollups import NS_PER_SECOND, RollupEngine
+
+MINUTE_NS = 60 * NS_PER_SECOND
+
+# The start of an hour, in the past
+START_NS = 1_700_002_800 * NS_PER_SECOND
+
+
+def live_batch(computer_ids, timestamp_ns: int, value: float = 1.0) -> MetricBatch:
+    # All metrics of all computers at one timestamp, as the simulation writes them
+    columns = np.full((len(METRIC_NAMES), len(computer_ids)), value)
+    return MetricBatch.from_columns(from_timestamp_ns(timestamp_ns).astimezone(timezone.utc), computer_ids, columns)
+
+
+def ingest_batch(computer_ids, computer_index, metric_index, values, timestamps_ns) -> MetricBatch:
+    return MetricBatch.from_rows(
+        computer_ids,
+        list(METRIC_NAMES),
+        np.asarray(computer_index, dtype=np.int32),
+        np.asarray(metric_index, dtype=np.int32),
+        np.asarray(values, dtype=np.float64),
+        np.asarray(timestamps_ns, dtype=np.int64)
+    )
+
+
+def rollups(data: bytes) -> dict:
+    # (metric, computer_id, tier, window start) -> fields
+    parsed = {}
+    for line in data.decode().splitlines():
+        key, fields, start_ns = line.split(" ")
+        metric_name, computer_tag, tier_tag = key.split(",")
+        values = dict(field.split("=") for field in fields.split(","))
+        parsed[(metric_name, computer_tag[12:], tier_tag[5:], int(start_ns))] = {
+            "count": int(values["count"][:-1]),
+            "last": float(values["last"]),
+            "max": float(values["max"]),
+            "mean": float(values["mean"]),
+            "min": float(values["min"])
+        }
+    return parsed
+
+
+def test_backdated_ingest_is_late_without_opening_windows():
+    computer_ids = fleet_computer_ids(10_000)
+    now_ns = START_NS + 13 * MINUTE_NS
+    engine = RollupEngine()
+    engine.observe(live_batch(computer_ids, now_ns))
+    open_windows = engine.stats()["open_windows"]
+
+    # 5000 points, each in a minute window of its own that closed, up to three and a half days back
+    points = 5000
+    rng = np.random.default_rng(0)
+    batch = ingest_batch(
+        computer_ids,
+        rng.integers(0, len(computer_ids), points),
+        rng.integers(0, len(METRIC_NAMES), points),
+        rng.random(points),
+        now_ns - (np.arange(points, dtype=np.int64) + 2) * MINUTE_NS
+    )
+
+    tracemalloc.start()
+    try:
+        engine.observe(batch)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert peak < 4 * 1024 * 1024
+    stats = engine.stats()
+    assert stats["open_windows"] == open_windows
+    # Late in the 1m tier, and in the 1h tier for all but the points of the current hour
+    assert stats["late_points"] == points + int((batch.timestamps_ns < START_NS).sum())
+    assert stats["rejected_points"] == 0
+
+
+def test_backdated_ingest_into_a_fresh_engine_keeps_only_the_newest_windows():
+    computer_ids = fleet_computer_ids(10)
+    timestamps = START_NS - np.arange(600, dtype=np.int64) * MINUTE_NS
+    engine = RollupEngine(tiers={"1m": 60})
+
+    engine.observe(ingest_batch(computer_ids, np.arange(600) % 10, np.zeros(600), np.ones(600), timestamps))
+
+    # The newest point's window is open, and the one before it is still within the grace period
+    stats = engine.stats()
+    assert stats["open_windows"] == {"1m": 2}
+    assert stats["late_points"] == 598
+    assert set(start for *_, start in rollups(engine.flush())) == {START_NS - MINUTE_NS, START_NS}
+
+
+def test_ingest_opens_at_most_max_open_windows():
+    computer_ids = fleet_computer_ids(4)
+    now_ns = time.time_ns() // MINUTE_NS * MINUTE_NS
+    engine = RollupEngine(tiers={"1m": 60}, max_open_windows=2)
+    engine.observe(live_batch(computer_ids, now_ns))
+
+    # Timestamps ahead of the server in the next five minutes
+    timestamps = now_ns + np.arange(5, dtype=np.int64) * MINUTE_NS + NS_PER_SECOND
+    engine.observe(ingest_batch(computer_ids, [0] * 5, [0] * 5, [2.0] * 5, timestamps))
+
+    stats = engine.stats()
+    assert stats["open_windows"] == {"1m": 2}
+    assert stats["rejected_points"] == 3
+    assert stats["late_points"] == 0
+    assert set(start for *_, start in rollups(engine.flush())) == {now_ns, now_ns + MINUTE_NS}
+
+
+def test_ingest_aggregates_per_series_and_window():
+    computer_ids = fleet_computer_ids(3)
+    now_ns = time.time_ns() // MINUTE_NS * MINUTE_NS
+    engine = RollupEngine(tiers={"1m": 60}, max_open_windows=4)
+    engine.observe(live_batch(computer_ids, now_ns, value=5.0))
+
+    # Out of order, with repeats of one series in one window
+    timestamps = now_ns + np.array([30, 10, 20, 40, 70, 65], dtype=np.int64) * NS_PER_SECOND
+    engine.observe(ingest_batch(computer_ids, [0, 0, 0, 1, 0, 2], [0] * 6, [3.0, 9.0, 1.0, 7.0, 4.0, 6.0], timestamps))
+
+    # A later simulation tick fills the sparse window of the next minute for every series
+    engine.observe(live_batch(computer_ids, now_ns + 80 * NS_PER_SECOND, value=8.0))
+    rolled_up = rollups(engine.flush())
+
+    first, second = now_ns, now_ns + MINUTE_NS
+    assert rolled_up[("temperature", "qc-001", "1m", first)] == {"count": 4, "last": 3.0, "max": 9.0, "mean": 4.5, "min": 1.0}
+    assert rolled_up[("temperature", "qc-002", "1m", first)] == {"count": 2, "last": 7.0, "max": 7.0, "mean": 6.0, "min": 5.0}
+    assert rolled_up[("temperature", "qc-001", "1m", second)] == {"count": 2, "last": 8.0, "max": 8.0, "mean": 6.0, "min": 4.0}
+    assert rolled_up[("temperature", "qc-003", "1m", second)] == {"count": 2, "last": 8.0, "max": 8.0, "mean": 7.0, "min": 6.0}
+    assert rolled_up[("qubit_fidelity", "qc-002", "1m", second)] == {"count": 1, "last": 8.0, "max": 8.0, "mean": 8.0, "min": 8.0}
+    assert len(rolled_up) == 2 * len(computer_ids) * len(METRIC_NAMES)
+
+
+def test_live_batches_roll_up_and_close_windows():
+    computer_ids = fleet_computer_ids(2)
+    engine = RollupEngine(tiers={"1m": 60}, grace_seconds=10)
+
+    assert engine.observe(live_batch(computer_ids, START_NS, 1.0)) == b""
+    assert engine.observe(live_batch(computer_ids, START_NS + 30 * NS_PER_SECOND, 3.0)) == b""
+    closed = rollups(engine.observe(live_batch(computer_ids, START_NS + 75 * NS_PER_SECOND, 2.0)))
+
+    assert len(closed) == len(computer_ids) * len(METRIC_NAMES)
+    assert closed[("coherence_time", "qc-002", "1m", START_NS)] == {"count": 2, "last": 3.0, "max": 3.0, "mean": 2.0, "min": 1.0}
+
+    # Points of the closed window are late from now on
+    engine.observe(ingest_batch(computer_ids, [0], [0], [1.0], [START_NS + NS_PER_SECOND]))
+    assert engine.stats()["late_points"] == 1
@@ -0,0 +1,97 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import simulation
+from services.hot_tier import HotTierStore
+from services.backfill import BackfillService
+from services.fleet_registry import FleetRegistry, seed_record
+from services.influxdb_service import InfluxDBService
+from services.sharded_simulation import ShardedSimulation
+from services.write_path import MetricsWritePath
+from services.write_pipeline import MetricWritePipeline
+
+BACKFILL = {"start": "2025-01-01T00:00:00Z", "end": "2025-01-01T02:00:00Z", "interval_seconds": 60, "fleet_size": 2}
+
+
+@pytest.fixture
+def app():
+    registry = FleetRegistry()
+    registry.replace([seed_record(computer_id) for computer_id in ("qc-001", "qc-002")])
+    simulation.set_fleet_registry(registry)
+    # Nothing reaches InfluxDB: every backfill here is refused before it starts, and the sharded
+    # simulation is not running, so changing its worker count starts no worker
+    influxdb_settings = dict(url="http://127.0.0.1:9", token="token", bucket="bucket", org="org")
+    influxdb_service = InfluxDBService(**influxdb_settings)
+    simulation.set_backfill_service(BackfillService(influxdb_service, workers=1, max_points=1000))
+    write_path = MetricsWritePath(MetricWritePipeline(influxdb_service), HotTierStore())
+    simulation.set_sharded_simulation(ShardedSimulation(write_path, influxdb_settings, {}, workers=1))
+
+    app = FastAPI()
+    app.include_router(simulation.router)
+    yield app
+    simulation.set_backfill_service(None)
+    simulation.set_sharded_simulation(None)
+
+
+def test_backfill_needs_a_superuser(app, signed_in):
+    client = TestClient(app)
+    assert client.post("/simulation/backfill", json=BACKFILL).status_code == 401
+    assert client.post("/simulation/backfill/cancel").status_code == 401
+
+    client = signed_in(app, superuser=False)
+    assert client.post("/simulation/backfill", json=BACKFILL).status_code == 403
+    assert client.post("/simulation/backfill/cancel").status_code == 403
+
+
+def test_backfill_larger_than_the_limit_is_refused(app, signed_in):
+    client = signed_in(app, superuser=True)
+
+    # 2 computers x 6 metrics x 120 samples
+    response = client.post("/simulation/backfill", json=BACKFILL)
+    assert response.status_code == 422
+    assert "larger than the limit of 1000 points" in response.json()["detail"]
+    assert client.get("/simulation/backfill").status_code == 404
+    assert client.post("/simulation/backfill/cancel").status_code == 400
+
+
+def test_changing_the_worker_count_needs_a_superuser(app, signed_in):
+    client = TestClient(app)
+    assert client.post("/simulation/workers", json={"workers": 1}).status_code == 401
+
+    client = signed_in(app, superuser=False)
+    assert client.post("/simulation/workers", json={"workers": 1}).status_code == 403
+    assert client.get("/simulation/workers").json()["rebalances"] == 0
+
+
+def test_worker_count_is_capped_at_the_cpu_count(app, signed_in):
+    client = signed_in(app, superuser=True)
+
+    assert client.post("/simulation/workers", json={"workers": simulation.MAX_SIMULATION_WORKERS + 1}).status_code == 422
+    assert client.post("/simulation/workers", json={"workers": 0}).status_code == 422
+
+    response = client.post("/simulation/workers", json={"workers": simulation.MAX_SIMULATION_WORKERS})
+    assert response.status_code == 200
+    assert response.json()["workers"] == simulation.MAX_SIMULATION_WORKERS
+    assert response.json()["rebalances"] == 1
+
+
+def test_failed_worker_start_leaves_the_simulation_stopped(app, signed_in, monkeypatch):
+    sharded_simulation = simulation.sharded_simulation
+    simulation.set_write_path(sharded_simulation.write_path)
+    monkeypatch.setenv("QUBIT_TELEMETRY", "packed")
+
+    def no_process(*args, **kwargs):
+        raise OSError("cannot start a process")
+
+    monkeypatch.setattr(sharded_simulation._context, "Process", no_process)
+
+    with signed_in(app, superuser=True) as client:
+        response = client.post("/simulation/start")
+        assert response.status_code == 500
+        assert "cannot start a process" in response.json()["detail"]
+
+    assert not simulation.simulation_state["running"]
+    assert simulation.simulation_state["qubit_task"] is None
+    assert not sharded_simulation.running
+    assert sharded_simulation._consumer.cancelled()
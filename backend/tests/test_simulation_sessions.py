@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+from models import METRIC_NAMES
+from services.fleet_simulator import fleet_computer_ids
+from services.simulation_sessions import SessionLimitError, SimulationSessions
+
+
+class StubWritePath:
+    # Records the session of every batch written; fails the first fail_writes of them
+    def __init__(self, fail_writes: int = 0):
+        self.fail_writes = fail_writes
+        self.written = []
+
+    async def publish_session(self, batch):
+        if self.fail_writes > 0:
+            self.fail_writes -= 1
+            raise RuntimeError("write failed")
+        self.written.append(batch.session_id)
+
+    def forget_session(self, session_id: str) -> None:
+        pass
+
+
+def elapse(sessions: SimulationSessions, seconds: float) -> None:
+    # Moves the scheduler's clock on without waiting
+    sessions._start -= seconds
+    sessions._refilled -= seconds
+
+
+def test_create_enforces_per_user_and_global_limits():
+    sessions = SimulationSessions(
+        StubWritePath(), max_sessions=3, max_computers=15, max_sessions_per_user=2, max_computers_per_user=10
+    )
+    sessions.create("alice", "a", fleet_computer_ids(4), 1.0)
+    sessions.create("alice", "b", fleet_computer_ids(4), 1.0)
+
+    with pytest.raises(SessionLimitError) as error:
+        sessions.create("alice", "c", fleet_computer_ids(1), 1.0)
+    assert error.value.per_user
+
+    with pytest.raises(SessionLimitError) as error:
+        sessions.create("bob", "a", fleet_computer_ids(11), 1.0)
+    assert error.value.per_user
+
+    with pytest.raises(SessionLimitError) as error:
+        sessions.create("bob", "a", fleet_computer_ids(10), 1.0)
+    assert not error.value.per_user
+
+    sessions.create("bob", "a", fleet_computer_ids(2), 1.0)
+    with pytest.raises(SessionLimitError) as error:
+        sessions.create("carol", "a", fleet_computer_ids(1), 1.0)
+    assert not error.value.per_user
+    assert sessions.computers == 10
+
+    with pytest.raises(ValueError):
+        sessions.create("carol", "a", [], 1.0)
+    with pytest.raises(ValueError):
+        sessions.create("carol", "a", fleet_computer_ids(1), sessions.tick_seconds / 2)
+
+
+def test_share_fills_small_sessions_and_banks_credit_for_large_ones():
+    sessions = SimulationSessions(StubWritePath())
+    small = sessions.create("alice", "small", fleet_computer_ids(1), 1.0)
+    medium = sessions.create("bob", "medium", fleet_computer_ids(50), 1.0)
+    large = sessions.create("carol", "large", fleet_computer_ids(100), 1.0)
+    assert (small.cost, medium.cost, large.cost) == (len(METRIC_NAMES), 50 * len(METRIC_NAMES), 100 * len(METRIC_NAMES))
+
+    # Only small fits an even share of 100; what is left is split between medium and large
+    sessions._waiting = [small, medium, large]
+    sessions._tokens = 300.0
+    assert sessions._share() == [small]
+    assert medium.credit == large.credit == pytest.approx((300 - small.cost) / 2)
+    assert sessions._tokens == 0.0
+    assert sessions._waiting == [medium, large]
+    assert sessions.deferred_ticks == 2
+
+    # The credit medium banked is enough now; large still waits for the rest
+    sessions._tokens = 400.0
+    assert sessions._share() == [medium]
+    assert medium.credit == 0.0
+    assert large.credit == pytest.approx(147 + 400 - (medium.cost - 147))
+    assert sessions._waiting == [large]
+
+    # Removed sessions are dropped rather than served
+    sessions.remove(large.id)
+    sessions._tokens = 1000.0
+    assert sessions._share() == []
+    assert sessions._waiting == []
+
+
+def test_deferred_session_skips_the_periods_it_missed():
+    write_path = StubWritePath()
+    sessions = SimulationSessions(write_path, tick_seconds=0.1, max_points_per_second=3000)
+    small = sessions.create("alice", "small", fleet_computer_ids(1), 0.1)
+    large = sessions.create("bob", "large", fleet_computer_ids(100), 0.1)
+
+    async def run():
+        elapse(sessions, 0.15)
+        await sessions.run_tick()
+        elapse(sessions, 0.1)
+        await sessions.run_tick()
+
+    asyncio.run(run())
+
+    # About 450 points of capacity, then 300 more: large runs once its credit covers a batch
+    assert small.ticks == 2 and small.deferred_ticks == 0
+    assert large.ticks == 1 and large.deferred_ticks == 1
+    assert large.skipped_ticks == 1
+    assert sorted(write_path.written) == sorted([small.id, small.id, large.id])
+
+
+def test_failed_write_leaves_every_ready_session_scheduled():
+    write_path = StubWritePath(fail_writes=1)
+    sessions = SimulationSessions(write_path, tick_seconds=0.1)
+    first = sessions.create("alice", "a", fleet_computer_ids(1), 0.1)
+    second = sessions.create("bob", "b", fleet_computer_ids(1), 0.1)
+
+    async def run():
+        elapse(sessions, 0.15)
+        with pytest.raises(RuntimeError):
+            await sessions.run_tick()
+        elapse(sessions, 0.1)
+        await sessions.run_tick()
+
+    asyncio.run(run())
+
+    assert sorted(write_path.written) == sorted([first.id, second.id])
+    assert first.ticks == second.ticks == 1
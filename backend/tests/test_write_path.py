@@ -0,0 +1,40 @@
+import asyncio
+
+from benchmarks.fake_influxdb import FakeInfluxDB
+from services.hot_tier import HotTierStore
+from services.influxdb_service import InfluxDBService
+from services.qubit_telemetry import QubitTelemetry
+from services.simulator import COMPUTER_PROFILES
+from services.write_path import MetricsWritePath
+from services.write_pipeline import MetricWritePipeline
+
+
+def test_qubit_ticks_beyond_max_qubit_writes_are_skipped():
+    computer_ids = list(COMPUTER_PROFILES)
+    telemetry = QubitTelemetry(computer_ids, seed=0, profiles=list(COMPUTER_PROFILES.values()))
+
+    async def run(influxdb_url: str):
+        influxdb_service = InfluxDBService(influxdb_url, "token", "bucket", "org")
+        write_path = MetricsWritePath(MetricWritePipeline(influxdb_service), HotTierStore(), max_qubit_writes=1)
+        try:
+            written = await write_path.publish_qubits(telemetry, 1_700_000_000_000_000_000)
+            # The first tick is still being written
+            skipped = await write_path.publish_qubits(telemetry, 1_700_000_001_000_000_000)
+            in_flight = write_path.qubit_writes
+            await write_path.close()
+            return written, skipped, in_flight, write_path
+        finally:
+            influxdb_service.close()
+
+    with FakeInfluxDB(latency_ms=200) as influxdb:
+        written, skipped, in_flight, write_path = asyncio.run(run(influxdb.url))
+        lines = influxdb.stats()["lines"]
+
+    assert written > 0
+    assert skipped is None
+    assert in_flight == 1
+    assert write_path.qubit_writes == 0
+    assert write_path.skipped_qubit_ticks == 1
+    # The skipped tick still moved the state on
+    assert telemetry.iteration == 2
+    assert lines == len(computer_ids)
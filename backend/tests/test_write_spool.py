@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+
+from benchmarks.fake_influxdb import FakeInfluxDB
+from services.fleet_simulator import fleet_computer_ids
+from services.hot_tier import HotTierStore
+from services.influxdb_service import InfluxDBService
+from services.sharded_simulation import ShardedSimulation, shard_spool_dirs
+from services.write_path import MetricsWritePath
+from services.write_pipeline import MetricWritePipeline
+from services.write_spool import WriteAheadSpool
+
+
+def spool_with(directory: str, *payloads: bytes) -> None:
+    # Leaves a spool behind as a stopped process would, one point per record
+    spool = WriteAheadSpool(directory, segment_bytes=4096)
+    for payload in payloads:
+        spool.append(payload, 1)
+    spool.close()
+
+
+def pending(spool: WriteAheadSpool) -> list:
+    return [record.payload for record in spool.read(1000)]
+
+
+def test_adopt_moves_what_was_not_replayed(tmp_path):
+    left = str(tmp_path / "shard1")
+    spool_with(left, b"m v=1 1", b"m v=2 2", b"m v=3 3")
+    replayed = WriteAheadSpool(left)
+    replayed.commit(replayed.read(1)[0])
+    replayed.close()
+
+    spool = WriteAheadSpool(str(tmp_path), segment_bytes=4096)
+    spool.append(b"m v=0 0", 1)
+    assert spool.adopt(left) == 2
+
+    assert not os.path.exists(left)
+    assert spool.pending_points == 3
+    assert pending(spool) == [b"m v=0 0", b"m v=2 2", b"m v=3 3"]
+
+
+def test_segment_left_empty_by_a_crash_is_dropped_on_recovery(tmp_path):
+    directory = str(tmp_path)
+    spool_with(directory, b"m v=1 1", b"m v=2 2")
+    # Created, but the process stopped before the file was sized
+    newest = max(name for name in os.listdir(directory) if name.endswith(".seg"))
+    empty = os.path.join(directory, f"{int(newest[:-4]) + 1:012d}.seg")
+    open(empty, "wb").close()
+
+    spool = WriteAheadSpool(directory, segment_bytes=4096)
+    assert spool.pending_points == 2
+    spool.append(b"m v=3 3", 1)
+    assert pending(spool) == [b"m v=1 1", b"m v=2 2", b"m v=3 3"]
+    spool.close()
+
+
+def test_adopted_records_keep_their_age(tmp_path):
+    left = str(tmp_path / "shard0")
+    spool = WriteAheadSpool(left)
+    spool.append(b"m v=1 1", 1, created_ns=time.time_ns() - 10 * 86400 * 10 ** 9)
+    spool.close()
+
+    spool = WriteAheadSpool(str(tmp_path), segment_bytes=4096, retention_seconds=86400)
+    spool.adopt(left)
+    spool.append(b"m v=2 2", 1, created_ns=time.time_ns())
+    assert pending(spool) == [b"m v=1 1", b"m v=2 2"]
+
+
+def test_shard_spool_dirs(tmp_path):
+    for name in ("shard0", "shard12", "sharding", "other"):
+        os.makedirs(tmp_path / name)
+    (tmp_path / "shard3").write_bytes(b"")
+
+    assert shard_spool_dirs(str(tmp_path)) == [str(tmp_path / "shard0"), str(tmp_path / "shard12")]
+    assert shard_spool_dirs(str(tmp_path / "missing")) == []
+    assert shard_spool_dirs(None) == []
+
+
+def test_shrinking_the_worker_count_replays_the_spools_of_removed_shards(tmp_path):
+    # Three workers spooled while InfluxDB was down; the simulation now restarts with one
+    spool_dir = str(tmp_path)
+    for shard in range(3):
+        spool_with(os.path.join(spool_dir, f"shard{shard}"), *(b"m,shard=%d v=%d %d" % (shard, i, i) for i in range(5)))
+
+    async def run(influxdb: FakeInfluxDB) -> dict:
+        influxdb_settings = dict(url=influxdb.url, token="token", org="org", bucket="bucket", rollup_bucket=None)
+        pipeline_settings = dict(spool_dir=spool_dir, linger_ms=10)
+        influxdb_service = InfluxDBService(**influxdb_settings)
+        write_pipeline = MetricWritePipeline(influxdb_service, **pipeline_settings)
+        write_pipeline.start()
+        simulation = ShardedSimulation(
+            MetricsWritePath(write_pipeline, HotTierStore()), influxdb_settings, pipeline_settings, workers=1, default_interval=0.5
+        )
+        try:
+            await simulation.start(fleet_computer_ids(4))
+            assert write_pipeline.spool.appended_points == 15
+            # A spawned worker may take a while to import before its first points arrive
+            deadline = time.monotonic() + 30.0
+            while influxdb.stats()["lines"] <= 15 and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            await simulation.stop()
+        finally:
+            await write_pipeline.close()
+            influxdb_service.close()
+        return write_pipeline.spool.stats()
+
+    with FakeInfluxDB() as influxdb:
+        stats = asyncio.run(run(influxdb))
+        lines = influxdb.stats()["lines"]
+
+    assert stats["appended_points"] == stats["committed_points"] == 15
+    assert stats["pending_points"] == 0
+    assert shard_spool_dirs(spool_dir) == [os.path.join(spool_dir, "shard0")]
+    # The adopted points and what the one worker simulated
+    assert lines > 15
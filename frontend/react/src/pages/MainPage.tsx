@@ -9,7 +9,7 @@ function MainPage() {
     const [isSimulationRunning, setIsSimulationRunning] = useState<boolean>(false);
     const [loading, setLoading] = useState<boolean>(true);
     const [error, setError] = useState<string | null>(null);
-    const { user, logout } = useAuth();
+    const { user, token, logout } = useAuth();
 
     useEffect(() => {
         fetchData();
@@ -34,12 +34,13 @@ function MainPage() {
     };
 
     const toggleSimulation = async (): Promise<void> => {
+        if (!token) return;
         try {
             if (isSimulationRunning) {
-                await simulationAPI.stop();
+                await simulationAPI.stop(token);
                 setIsSimulationRunning(false);
             } else {
-                await simulationAPI.start();
+                await simulationAPI.start(token);
                 setIsSimulationRunning(true);
             }
         } catch (err) {
@@ -99,16 +100,19 @@ function MainPage() {
                 </header>
 
                 <div className="flex justify-center items-center gap-6 mb-12">
-                    <button
-                        onClick={toggleSimulation}
-                        className={`px-8 py-3 text-lg font-semibold rounded-xl shadow-lg transition-all duration-300 hover:scale-105 ${
-                            isSimulationRunning
-                                ? 'bg-red-500 hover:bg-red-600 text-white'
-                                : 'bg-green-500 hover:bg-green-600 text-white'
-                        }`}
-                    >
-                        {isSimulationRunning ? '⏸ Stop Simulation' : '▶ Start Simulation'}
-                    </button>
+                    {/* The shared simulation is started and stopped by superusers only */}
+                    {user?.is_superuser && (
+                        <button
+                            onClick={toggleSimulation}
+                            className={`px-8 py-3 text-lg font-semibold rounded-xl shadow-lg transition-all duration-300 hover:scale-105 ${
+                                isSimulationRunning
+                                    ? 'bg-red-500 hover:bg-red-600 text-white'
+                                    : 'bg-green-500 hover:bg-green-600 text-white'
+                            }`}
+                        >
+                            {isSimulationRunning ? '⏸ Stop Simulation' : '▶ Start Simulation'}
+                        </button>
+                    )}
 
                     <div className="flex items-center gap-2 px-6 py-3 bg-dark-bgSecondary rounded-xl text-text-secondary">
                         <span
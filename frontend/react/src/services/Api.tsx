@@ -22,14 +22,16 @@ export const quantumComputerAPI = {
     }
 };
 
+const authorized = (token: string) => ({headers: {'Authorization': `Bearer ${token}`}});
+
 export const simulationAPI = {
-    start: async (): Promise<{ status: string; message: string }> => {
-        const response = await api.post('/api/simulation/start');
+    start: async (token: string): Promise<{ status: string; message: string }> => {
+        const response = await api.post('/api/simulation/start', null, authorized(token));
         return response.data;
     },
 
-    stop: async (): Promise<{ status: string; message: string }> => {
-        const response = await api.post('/api/simulation/stop');
+    stop: async (token: string): Promise<{ status: string; message: string }> => {
+        const response = await api.post('/api/simulation/stop', null, authorized(token));
         return response.data;
     },
 
@@ -5,6 +5,7 @@ export interface QuantumComputer {
     location: string;
     status: 'online' | 'offline' | 'maintenance';
     temperature_mk: number | null;
+    performance_score?: number | null;
 }
 
 export interface Metric {